@@ -0,0 +1,191 @@
+"""
+[NEW] 事件写入的准入控制 (令牌桶 + 过载时丢弃低优先级事件)
+
+- 每个摄像头、每个客户端 (按客户端 IP；请求头中未经验证的标识不作为限流依据) 各有一个令牌桶，速率和突发量可配置
+- 批量请求 (POST /api/events/batch) 整个请求只消耗一个令牌 (涉及的每个摄像头桶和客户端桶各一个)
+- 令牌桶中为 abnormal 事件保留一部分容量: normal 事件只有在剩余令牌超过保留量时才被接受
+  (批量请求中的 normal 事件也一样，与同一批中的 abnormal 事件分别判断)
+- 数据库连接池或写入队列的负载超过 INGEST_SHED_LOAD 时直接拒绝 normal 事件 (shed)，abnormal 事件只受令牌桶限制
+- 被拒绝的请求返回 429 和 Retry-After
+
+令牌桶保存在各 worker 进程内，实际总速率约为 "配置速率 x worker 数"。
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+ADMISSION_ENABLED = os.environ.get('INGEST_ADMISSION_ENABLED', '1') not in ('0', 'false')
+CAMERA_RATE = float(os.environ.get('INGEST_CAMERA_RATE', 5.0)) # 每个摄像头每秒事件数
+CAMERA_BURST = float(os.environ.get('INGEST_CAMERA_BURST', 20))
+KEY_RATE = float(os.environ.get('INGEST_KEY_RATE', 50.0)) # 每个客户端 (IP) 每秒请求数
+KEY_BURST = float(os.environ.get('INGEST_KEY_BURST', 200))
+ABNORMAL_RESERVE = float(os.environ.get('INGEST_ABNORMAL_RESERVE', 0.25)) # 令牌桶中只给 abnormal 使用的比例
+SHED_LOAD = float(os.environ.get('INGEST_SHED_LOAD', 0.9)) # 负载 (0~1) 达到该值时拒绝 normal 事件
+MAX_BUCKETS = 10000 # 每种令牌桶最多保留的数量 (最久未使用的先淘汰)
+
+PRIORITY_HIGH = 'abnormal'
+
+admission_decisions = metrics.registry.register(metrics.Counter(
+    "ingest_admission_total", "Ingest admission decisions", ("decision", "risk_type")))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, reserve=0.0):
+        """还需要等待多少秒才能取出 amount 个令牌 (0 表示现在就可以)"""
+        missing = amount + reserve - self.tokens
+        if missing <= 0:
+            return 0.0
+        if self.rate <= 0 or amount + reserve > self.burst:
+            return math.inf
+        return missing / self.rate
+
+
+class Decision:
+    def __init__(self, admitted, reason=None, retry_after=0.0):
+        self.admitted = admitted
+        self.reason = reason # None / "throttled" / "shed"
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(min(self.retry_after, 3600))))
+
+
+class AdmissionController:
+    """
+    [PERF] 令牌桶准入控制。check() 一次检查摄像头和客户端两个令牌桶，
+    所有桶都有足够令牌时才同时扣除，被拒绝的请求不消耗令牌。
+    """
+    def __init__(self, load=None, camera_rate=CAMERA_RATE, camera_burst=CAMERA_BURST,
+                 key_rate=KEY_RATE, key_burst=KEY_BURST, abnormal_reserve=ABNORMAL_RESERVE, shed_load=SHED_LOAD):
+        self.load = load # fn() -> 0~1，当前负载 (连接池 / 写入队列)
+        self.limits = {"camera": (camera_rate, camera_burst), "key": (key_rate, key_burst)}
+        self.abnormal_reserve = abnormal_reserve
+        self.shed_load = shed_load
+        self._buckets = {"camera": OrderedDict(), "key": OrderedDict()}
+        self._lock = threading.Lock()
+        self._stats = {"accepted": 0, "throttled": 0, "shed": 0, "accepted_abnormal": 0,
+                       "throttled_abnormal": 0, "last_load": 0.0}
+
+    def _bucket(self, kind, key, now):
+        buckets = self._buckets[kind]
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*self.limits[kind], now)
+            if len(buckets) > MAX_BUCKETS:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def _record(self, decision, risk_type):
+        label = decision.reason or "accepted"
+        with self._lock:
+            self._stats[label] += 1
+            if risk_type == PRIORITY_HIGH and label in ("accepted", "throttled"):
+                self._stats[f"{label}_abnormal"] += 1
+        admission_decisions.inc(decision=label, risk_type=risk_type or "unknown")
+
+    def current_load(self):
+        if self.load is None:
+            return 0.0
+        try:
+            value = float(self.load())
+        except Exception as error:
+            print(f"负载计算失败 (Admission): {error}")
+            return 0.0
+        with self._lock:
+            self._stats["last_load"] = value
+        return value
+
+    def _take(self, groups, client_key, amount=1):
+        """
+        groups 为 [(camera_ids, high_priority)]，返回与之对应的 Decision 列表。
+        每组分别检查其涉及的桶 (normal 组需要在保留量之外有足够令牌)；
+        被接受的组涉及的每个桶只扣除一次 amount 个令牌
+        """
+        now = time.monotonic()
+        with self._lock:
+            key_bucket = self._bucket("key", client_key, now)
+            decisions = []
+            charged = {id(key_bucket): key_bucket}
+            for camera_ids, high_priority in groups:
+                buckets = [self._bucket("camera", camera_id, now) for camera_id in camera_ids] + [key_bucket]
+                wait = 0.0
+                for bucket in buckets:
+                    reserve = 0.0 if high_priority else bucket.burst * self.abnormal_reserve
+                    wait = max(wait, bucket.wait_time(amount, reserve))
+                if wait == 0.0:
+                    charged.update((id(bucket), bucket) for bucket in buckets)
+                    decisions.append(Decision(True))
+                else:
+                    decisions.append(Decision(False, "throttled", wait))
+            if any(decision.admitted for decision in decisions):
+                for bucket in charged.values():
+                    bucket.tokens -= amount
+        return decisions
+
+    def check(self, camera_id, client_key, risk_type, amount=1):
+        """检查并扣除令牌；返回 Decision"""
+        high_priority = risk_type == PRIORITY_HIGH
+        if not high_priority and self.current_load() >= self.shed_load:
+            decision = Decision(False, "shed", 1.0)
+        else:
+            decision = self._take([([camera_id], high_priority)], client_key, amount)[0]
+        self._record(decision, risk_type)
+        return decision
+
+    def check_batch(self, events, client_key):
+        """
+        批量请求: events 为 [(camera_id, risk_type)]，返回与之对应的 Decision 列表。
+        过载时 normal 事件逐条被丢弃 (不消耗令牌)；其余事件按优先级分为 abnormal 和 normal 两组，
+        abnormal 组可以使用保留量，normal 组只能使用保留量之外的令牌 (不因为同一批中有 abnormal 事件而使用保留量)。
+        每组作为一个请求，被限流时整组一起拒绝；两组都涉及的桶只消耗一个令牌
+        """
+        decisions = [None] * len(events)
+        shed = any(risk_type != PRIORITY_HIGH for _, risk_type in events) and self.current_load() >= self.shed_load
+        pending = {True: [], False: []} # high_priority -> [index]
+        for index, (_, risk_type) in enumerate(events):
+            if shed and risk_type != PRIORITY_HIGH:
+                decisions[index] = Decision(False, "shed", 1.0)
+            else:
+                pending[risk_type == PRIORITY_HIGH].append(index)
+        groups = [(high_priority, indexes) for high_priority, indexes in pending.items() if indexes]
+        if groups:
+            results = self._take(
+                [(list(dict.fromkeys(events[i][0] for i in indexes)), high_priority) for high_priority, indexes in groups],
+                client_key)
+            for (_, indexes), decision in zip(groups, results):
+                for index in indexes:
+                    decisions[index] = decision
+        for decision, (_, risk_type) in zip(decisions, events):
+            self._record(decision, risk_type)
+        return decisions
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["camera_buckets"] = len(self._buckets["camera"])
+            data["key_buckets"] = len(self._buckets["key"])
+        data["camera_rate"], data["camera_burst"] = self.limits["camera"]
+        data["key_rate"], data["key_burst"] = self.limits["key"]
+        data["shed_load"] = self.shed_load
+        return data
@@ -1,38 +1,645 @@
 import os
+import atexit
+import threading
+import time
+IMPORT_STARTED = time.monotonic() # [NEW] 冷启动计时: 开始导入本模块的时刻
+import uuid
 import psycopg2
+import psycopg2.errors
 import json
-from flask import Flask, jsonify, request
+from flask import (
+    Blueprint, Flask, Response, current_app, g, has_app_context, has_request_context, jsonify, request, send_file,
+    stream_with_context
+)
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta # [MODIFIED] 导入 timedelta
 from flask_bcrypt import Bcrypt # [SECURITY] 导入 Bcrypt
 from psycopg2.extras import RealDictCursor # [IMPROVEMENT] 导入 RealDictCursor
 import decimal # [FIX] 用于处理 Decimal 类型
 import jwt # [SECURITY] 导入 JWT 用于 Token
 from functools import wraps # [SECURITY] 导入 wraps 用于装饰器
+import hashlib
+import hmac
+from db_pool import PoolTimeoutError, get_pool, pool_stats, reset_pool # [PERF] 进程级数据库连接池
+from replica_router import READ_AFTER_WRITE_WINDOW, get_replica_router, replica_stats # [PERF] 只读副本路由
+from event_ingest import ( # [REFACTOR] 事件校验与写入逻辑 (单条/批量共用)
+    BATCH_MAX_EVENTS, EventValidationError, insert_event, insert_events_batch, parse_event_payload, parse_event_time
+)
+from sql_json import ( # [PERF] 在 SQL 中生成与 CustomJSONEncoder 相同格式的 JSON
+    ascii_json, iso_z_sql, json_datetime_sql, json_float_sql, json_int_sql, json_object_sql, json_string_sql,
+    unsupported_float_columns
+)
+from pagination import InvalidCursorError, decode_cursor, decode_position, encode_cursor, estimate_count # [PERF] 游标分页
+from event_export import EXPORT_FETCH_SIZE, EXPORT_FORMATS, build_export_query, stream_export # [NEW] 流式导出
+from ttl_cache import TTLCache # [PERF] 进程内 TTL 缓存
+from token_cache import VerifiedTokenCache # [PERF] 已验证 token 缓存
+from password_hasher import HashPoolBusyError, get_hasher, hasher_stats # [PERF] bcrypt 进程池
+from report_engine import ( # [NEW] 定期报告引擎 (增量汇总表)
+    REPORT_ROLLUP_INTERVAL, ROLLUPS_ENABLED, RollupRefresher, build_summary, deduction_vocabulary
+)
+from event_stream import ( # [NEW] SSE 推送
+    SSE_HEARTBEAT, EventBroadcaster, TooManySubscribersError, format_sse, notify_control
+)
+from ingest_queue import INGEST_ASYNC_DEFAULT, IngestQueue, QueueFullError # [PERF] 异步写入队列
+import metrics # [METRICS] 请求/查询指标
+from admission import ADMISSION_ENABLED, AdmissionController # [PERF] 写入准入控制 (令牌桶)
+import prepared_statements # [PERF] 服务器端预编译语句
+from live_stats import LIVE_STATS_ENABLED, LIVE_STATS_TOP_DEDUCTIONS, LiveStats # [NEW] 实时滑动窗口统计
+from partitions import PARTITION_MAINTENANCE_INTERVAL, PartitionMaintainer # [PERF] 按月分区维护
+from warmup import Warmup, WarmupStep # [NEW] worker 启动预热与就绪状态
+from camera_status import ( # [NEW] 摄像头心跳
+    CAMERA_OFFLINE_TIMEOUT, HEARTBEAT_BATCH_LIMIT, CameraStatusTable, HeartbeatError, parse_heartbeat
+)
+from image_store import ( # [NEW] 按内容哈希存储的图片
+    IMAGE_CACHE_MAX_AGE, ImageStoreError, UploadStream, get_image_store, image_url, parse_uploads_to_store, thumbnail_url
+)
 
 # --- 配置 ---
-app = Flask(__name__)
+# [REFACTOR] 路由注册在蓝图上，Flask 应用由 create_app() 创建 (见文件末尾)。
+# 导入本模块不会建立数据库连接或启动线程，因此可以在 gunicorn master 中 preload；
+# 连接池、后台线程等都按 PID 懒加载，在 worker 的 post_fork 钩子 (init_worker) 中预热
+api_blueprint = Blueprint('api', __name__)
+IMPORT_PID = os.getpid()
+
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+
+# [FIX] 应用前面的反向代理层数 (Render 为 1)。request.remote_addr 取自 X-Forwarded-For 中倒数第 N 个地址，
+# 否则所有请求的 remote_addr 都是代理地址，按 IP 限流的调用方会共用一个令牌桶。
+# 直接对外提供服务时必须为 0，否则客户端可以伪造 X-Forwarded-For
+PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 1 if 'RENDER' in os.environ else 0))
 
 # [SECURITY] 设置一个安全的密钥，用于 JWT 签名。请在环境变量中替换它！
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'my_dev_secret_key_please_change_me')
+SECRET_KEY = os.environ.get('SECRET_KEY', 'my_dev_secret_key_please_change_me')
 
 # 从 Render 提供的环境变量获取数据库连接 URL
 DATABASE_URL = os.environ.get('DATABASE_URL')
 # DATABASE_URL = "postgresql://..." # 本地测试时取消注释
 
-bcrypt = Bcrypt(app) # [SECURITY] 初始化 Bcrypt
+bcrypt = Bcrypt() # [SECURITY] 在 create_app() 中初始化 Bcrypt
 
 # --- 数据库辅助函数 ---
-def get_db_connection():
-    """建立数据库连接"""
+def get_db_connection(readonly=False):
+    """
+    [PERF] 从连接池借出数据库连接。
+    调用方仍然在 finally 中执行 conn.close()，该连接会被归还到连接池而不是真正关闭。
+    readonly=True: 配置了只读副本时从副本借连接 (延迟过大、副本不可用或当前用户 / 客户端刚写入过时使用主库)
+    """
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL 环境变量未设置。")
+    started = time.perf_counter()
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        router = get_replica_router() if readonly else None
+        if router is not None:
+            conn = router.getconn(sticky_key=g.get('current_user_id') if has_app_context() else None,
+                                  force_primary=has_request_context() and read_primary_requested())
+        else:
+            conn = None
+        if conn is None:
+            conn = get_pool(DATABASE_URL).getconn()
+        metrics.db_acquire_duration.observe(time.perf_counter() - started)
         return conn
     except psycopg2.OperationalError as e:
         print(f"数据库连接失败: {e}")
         raise
 
+def mark_user_write(user_id):
+    """[PERF] 用户写入主库后，一段时间内该用户的只读请求也走主库 (避免读不到自己刚写入的数据)"""
+    router = get_replica_router()
+    if router is not None:
+        router.mark_write(user_id)
+
+# [FIX] 写入后读主库的标记同时通过 cookie 和响应头交给客户端 (值为截止时间，epoch 秒)。
+# 进程内的记录只对处理写入的 worker 有效；客户端带回标记后，任何 worker 都会让该请求读主库。
+# 标记只会让读请求走主库，伪造它没有安全影响
+READ_PRIMARY_COOKIE = 'read_primary_until'
+READ_PRIMARY_HEADER = 'X-Read-Primary-Until'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+def read_primary_requested():
+    value = request.cookies.get(READ_PRIMARY_COOKIE) or request.headers.get(READ_PRIMARY_HEADER)
+    try:
+        return float(value) > time.time()
+    except (TypeError, ValueError):
+        return False
+
+def write_user_id():
+    """写入请求的用户: 登录 Token (token_required) 或写入接口使用的用户 Token (ingest_auth_required)"""
+    user_id = g.get('current_user_id')
+    identity = g.get('ingest_identity')
+    if user_id is None and identity and identity.startswith('user:'):
+        user_id = int(identity[5:])
+    return user_id
+
+@api_blueprint.after_app_request
+def mark_read_after_write(response):
+    """所有成功的写入请求: 之后 READ_AFTER_WRITE_WINDOW 秒内该用户 / 客户端的读请求走主库"""
+    if request.method not in WRITE_METHODS or response.status_code >= 400 or get_replica_router() is None:
+        return response
+    mark_user_write(write_user_id())
+    until = str(int(time.time() + READ_AFTER_WRITE_WINDOW) + 1)
+    response.set_cookie(READ_PRIMARY_COOKIE, until, max_age=int(READ_AFTER_WRITE_WINDOW) + 1,
+                        httponly=True, samesite='Lax', secure=request.is_secure)
+    response.headers[READ_PRIMARY_HEADER] = until
+    return response
+
+def hash_busy_response():
+    """[PERF] 密码哈希槽位已满时返回 503，避免登录高峰拖慢其他接口"""
+    return jsonify({"success": False, "message": "登录请求过多，请稍后重试"}), 503, {"Retry-After": "2"}
+
+def db_busy_response():
+    """[PERF] 连接池耗尽时快速失败，返回 503 让客户端稍后重试"""
+    return jsonify({"success": False, "message": "服务器繁忙，请稍后重试"}), 503, {"Retry-After": "1"}
+
+# 报告引擎支持的报告类型
+REPORT_TYPES = ('monthly', 'weekly')
+
+# --- 事件总数缓存 ---
+# `count=cached` 时按筛选条件缓存 COUNT(*) 结果
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+events_count_cache = TTLCache(ttl=float(os.environ.get('EVENTS_COUNT_CACHE_TTL', 30)), max_size=256)
+
+# --- 幂等键缓存 ---
+# 最近处理过的幂等键 -> 原来的响应，重试请求直接返回而不访问数据库
+# (缓存只在当前 worker 进程内有效；其他进程收到的重试由唯一索引 + ON CONFLICT 保证不重复写入)
+idempotency_cache = TTLCache(
+    ttl=float(os.environ.get('IDEMPOTENCY_CACHE_TTL', 3600)),
+    max_size=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 50000))
+)
+
+def idempotency_cache_key(event):
+    key = event.get("idempotency_key")
+    return (key, event["event_time"]) if key else None
+
+def remember_idempotent(event, entry):
+    cache_key = idempotency_cache_key(event)
+    if cache_key:
+        idempotency_cache.set(cache_key, entry)
+
+def replay_response(entry):
+    """重试请求: 返回与第一次相同的 event_id (或临时 id) 和状态码"""
+    if "event_id" in entry:
+        body = {"success": True, "message": "事件成功添加", "event_id": entry["event_id"], "replayed": True}
+    else:
+        body = {"success": True, "message": "事件已接收，等待写入",
+                "provisional_id": entry["provisional_id"], "replayed": True}
+    return jsonify(body), entry["status"], {"Idempotent-Replayed": "true"}
+
+# --- 扣分项词表缓存 ---
+# `/api/deductions` 的结果按参数缓存 (数据来自汇总表，短时间内变化不大)
+deduction_vocabulary_cache = TTLCache(ttl=float(os.environ.get('DEDUCTION_VOCABULARY_CACHE_TTL', 60)), max_size=64)
+
+# --- 摄像头缓存 ---
+# `cameras` 表很少变化，列表和串流地址按 TTL 缓存，只有未命中时才访问数据库
+camera_cache = TTLCache(
+    ttl=float(os.environ.get('CAMERA_CACHE_TTL', 300)),
+    max_size=int(os.environ.get('CAMERA_CACHE_SIZE', 1024))
+)
+
+def invalidate_camera_cache(camera_id=None):
+    """清除摄像头缓存；指定 camera_id 时只清除该摄像头和列表"""
+    if camera_id is None:
+        camera_cache.invalidate()
+    else:
+        camera_cache.invalidate(('stream', camera_id))
+        camera_cache.invalidate('list')
+
+# [FIX] 清除缓存通过 NOTIFY 控制消息通知所有 worker 进程 (见 event_stream.CONTROL_CHANNEL)
+CAMERA_CACHE_CONTROL = 'camera_cache'
+
+def on_camera_cache_message(message):
+    """收到清除缓存的控制消息；message 为 None (监听连接重连，可能丢失了消息) 时清除全部"""
+    invalidate_camera_cache(message.get('camera_id') if message else None)
+
+def listen_camera_cache_invalidations():
+    get_broadcaster().add_control_listener(CAMERA_CACHE_CONTROL, on_camera_cache_message)
+
+def cache_payload(body, status=200, raw=None):
+    """缓存条目: 响应体、状态码和基于内容的 ETag；raw 为数据库端渲染的响应体 (bytes，可选)"""
+    digest = hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return {"body": body, "status": status, "etag": digest, "raw": raw}
+
+def cached_response(entry, stored_at):
+    """根据 If-None-Match / If-Modified-Since 返回 304 (无响应体) 或完整响应"""
+    if entry.get("raw") is not None and use_db_json():
+        response = current_app.response_class(entry["raw"], mimetype=current_app.json.mimetype) # [PERF] 不再重新序列化
+    else:
+        response = jsonify(entry["body"])
+    response.status_code = entry["status"]
+    if entry["status"] != 200:
+        return response
+    response.set_etag(entry["etag"])
+    response.last_modified = datetime.utcfromtimestamp(int(stored_at))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+# --- 图片上传 ---
+def store_uploaded_images():
+    """保存请求中所有上传的文件，返回 [(表单字段名, 原始文件名, StoredImage)]"""
+    store = get_image_store()
+    stored = []
+    for field, upload in request.files.items(multi=True):
+        if isinstance(upload.stream, UploadStream):
+            image = store.commit(upload.stream)
+        else:
+            image = store.put_file(upload.stream)
+        stored.append((field, upload.filename, image))
+    return stored
+
+def attach_stored_images(event, uploads=None):
+    """
+    把事件图片关联到图片存储:
+    - images_data[].image 为 POST /api/images 返回的 "<sha256>.<ext>"
+    - multipart 上传时 images_data[].file (表单字段名) 或 filename 对应上传的文件；
+      没有 images_data 时每个上传的文件作为一张图片
+    客户端传入的 url 字段会被忽略，image_url 只指向图片存储或旧的文件名前缀。
+    """
+    uploads = uploads or []
+    by_ref = {}
+    for field, filename, image in uploads:
+        by_ref.setdefault(field, image)
+        by_ref.setdefault(image.name, image)
+        if filename:
+            by_ref.setdefault(filename, image)
+    images = [dict(img) for img in event["images"]]
+    if not images:
+        images = [{"image": image.name} for _, _, image in uploads]
+    store = get_image_store()
+    first = None
+    for img in images:
+        img.pop("url", None)
+        name = None
+        stored = by_ref.get(img.get("file")) or by_ref.get(img.get("filename")) or by_ref.get(img.get("image"))
+        if stored is not None:
+            name = stored.name
+        elif img.get("image"):
+            if store.find(img["image"]) is None:
+                raise EventValidationError(f"图片不存在: {img['image']}")
+            name = img["image"]
+        if name:
+            img["url"] = image_url(name)
+            img.setdefault("filename", name)
+            first = first or name
+    event["images"] = images
+    if first and not event["image_filename"]:
+        event["image_filename"] = thumbnail_url(first)
+    return event
+
+def read_event_request():
+    """
+    读取 add_event 的请求: JSON，或 multipart/form-data (event 字段为事件 JSON，其余为图片文件)。
+    返回 (data, uploads)；数据无效时抛出 EventValidationError。
+    """
+    if request.mimetype != 'multipart/form-data':
+        return request.get_json(), None
+    parse_uploads_to_store(request)
+    try:
+        data = json.loads(request.form.get('event') or 'null')
+    except ValueError:
+        raise EventValidationError("无效的 event 字段 (应为 JSON)")
+    try:
+        return data, store_uploaded_images()
+    except ImageStoreError as e:
+        raise EventValidationError(str(e))
+
+# --- 异步事件写入队列 ---
+# 与连接池一样按 PID 懒加载，确保后台写线程在 gunicorn fork 之后才启动
+_ingest_queue = None
+_ingest_queue_lock = threading.Lock()
+
+def get_ingest_queue():
+    global _ingest_queue
+    with _ingest_queue_lock:
+        if _ingest_queue is None or _ingest_queue.pid != os.getpid():
+            _ingest_queue = IngestQueue(
+                get_db_connection,
+                on_commit=lambda committed: record_live_events([e for e, _ in committed], [i for _, i in committed])
+            )
+        return _ingest_queue
+
+def current_ingest_queue():
+    """返回当前进程已创建的队列 (不会触发创建)"""
+    if _ingest_queue is not None and _ingest_queue.pid == os.getpid():
+        return _ingest_queue
+    return None
+
+@atexit.register
+def drain_ingest_queue():
+    """进程退出前把队列中剩余的事件写入数据库"""
+    ingest_queue = current_ingest_queue()
+    if ingest_queue is not None:
+        remaining = ingest_queue.drain()
+        if remaining:
+            print(f"警告: 退出时仍有 {remaining} 个事件未写入")
+
+def wants_async_ingest():
+    """?async=1 或 `Prefer: respond-async` 时使用异步写入；也可通过 EVENT_INGEST_ASYNC=1 默认开启"""
+    flag = request.args.get('async')
+    if flag is not None:
+        return flag in ('1', 'true')
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return INGEST_ASYNC_DEFAULT
+
+# --- 写入准入控制 ---
+def ingest_load():
+    """当前写入负载 (0~1): 连接池占用率和异步写入队列深度中较大的一个"""
+    load = 0.0
+    stats = pool_stats()
+    if stats and stats["max_size"]:
+        load = stats["in_use"] / stats["max_size"]
+    ingest_queue = current_ingest_queue()
+    if ingest_queue is not None:
+        queue_stats = ingest_queue.stats()
+        if queue_stats["queue_capacity"]:
+            load = max(load, queue_stats["queue_depth"] / queue_stats["queue_capacity"])
+    return load
+
+admission = AdmissionController(load=ingest_load)
+
+def ingest_client_key():
+    """
+    令牌桶的调用方标识: 经过验证的 API key / 用户 (ingest_auth_required)，未认证时使用客户端 IP。
+    未经验证的请求头可以每次更换，不能用于限流；经过代理时客户端 IP 由 ProxyFix 还原 (PROXY_FIX_HOPS)
+    """
+    return g.get('ingest_identity') or f"ip:{request.remote_addr}"
+
+def admit_event(event):
+    """返回 None (接受) 或被拒绝时的 Decision"""
+    if not ADMISSION_ENABLED:
+        return None
+    decision = admission.check(event["camera_id"], ingest_client_key(), event["risk_type"])
+    return None if decision.admitted else decision
+
+def admit_batch(events):
+    """[PERF] 批量请求整体只消耗一个令牌；返回与 events 对应的 None (接受) 或 Decision 列表"""
+    if not ADMISSION_ENABLED:
+        return [None] * len(events)
+    decisions = admission.check_batch([(e["camera_id"], e["risk_type"]) for e in events], ingest_client_key())
+    return [None if d.admitted else d for d in decisions]
+
+def admission_message(decision):
+    if decision.reason == "shed":
+        return "服务器负载过高，暂不接收 normal 事件，请稍后重试"
+    return "事件提交过于频繁，请稍后重试"
+
+def rejected_response(decision):
+    """[PERF] 准入控制拒绝: 429 + Retry-After"""
+    return jsonify({
+        "success": False,
+        "message": admission_message(decision),
+        "reason": decision.reason
+    }), 429, {"Retry-After": decision.retry_after_header}
+
+# --- 新事件推送 (SSE) ---
+# 每个进程一个 LISTEN 连接，在第一个订阅者到来时启动
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+SQL_EVENTS_SINCE = """
+    SELECT id, camera_id, equipment_type, event_time, risk_type, score, image_filename AS thumbnail_url, status,
+           deductions::jsonb AS deductions
+    FROM events
+    WHERE id > %s
+    ORDER BY id ASC
+    LIMIT %s
+"""
+
+def load_events_since(last_event_id, limit):
+    """
+    断线续传: 从数据库读取 id 大于 last_event_id 的事件 (格式与 NOTIFY payload 相同，包括只在进程之间使用的扣分项)
+    按 id 查询无法裁剪分区 (分区键为 event_time): 每个分区在主键 (id, event_time) 上做一次范围查找，
+    再按 id 归并 (bench/partition_lookup.py)；只在缓冲区无法覆盖时执行
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(SQL_EVENTS_SINCE, (last_event_id, limit))
+        messages = []
+        for row in cursor.fetchall():
+            row['event_time'] = row['event_time'].isoformat() + 'Z'
+            row['score'] = float(row['score']) if isinstance(row['score'], decimal.Decimal) else row['score']
+            messages.append(dict(row))
+        return messages
+    finally:
+        if conn:
+            if cursor: cursor.close()
+            conn.close()
+
+def get_broadcaster():
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None or _broadcaster.pid != os.getpid():
+            if not DATABASE_URL:
+                raise ValueError("DATABASE_URL 环境变量未设置。")
+            _broadcaster = EventBroadcaster(DATABASE_URL, load_since=load_events_since)
+        return _broadcaster
+
+def current_broadcaster():
+    """返回当前进程已创建的推送监听 (不会触发创建)"""
+    if _broadcaster is not None and _broadcaster.pid == os.getpid():
+        return _broadcaster
+    return None
+
+# --- 实时统计 ---
+# 每个进程一份，第一次请求时创建并在后台从数据库重建；其他进程写入的事件通过 NOTIFY 收到
+_live_stats = None
+_live_stats_lock = threading.Lock()
+
+def rehydrate_live_stats(live_stats):
+    conn = None
+    cursor = None
+    try:
+        # 先注册监听再读取快照，快照之后提交的事件不会丢失
+        get_broadcaster().add_listener(live_stats.on_notify)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        live_stats.rehydrate(cursor)
+        print(f"实时统计已重建 ({live_stats.stats()['rehydrated']} 个事件)")
+    except Exception as error:
+        print(f"实时统计重建失败，从空统计开始: {error}")
+        live_stats.mark_ready()
+    finally:
+        if conn:
+            if cursor: cursor.close()
+            conn.close()
+
+def get_live_stats():
+    """未启用或未配置数据库时返回 None"""
+    global _live_stats
+    if not LIVE_STATS_ENABLED or not DATABASE_URL:
+        return None
+    if _live_stats is not None and _live_stats.pid == os.getpid():
+        return _live_stats
+    with _live_stats_lock:
+        if _live_stats is None or _live_stats.pid != os.getpid():
+            _live_stats = LiveStats()
+            threading.Thread(target=rehydrate_live_stats, args=(_live_stats,),
+                             name="live-stats-rehydrate", daemon=True).start()
+        return _live_stats
+
+def current_live_stats():
+    """返回当前进程已创建的实时统计 (不会触发创建)"""
+    if _live_stats is not None and _live_stats.pid == os.getpid():
+        return _live_stats
+    return None
+
+def record_live_events(events, event_ids):
+    """事件提交后累加到实时统计"""
+    live_stats = get_live_stats()
+    if live_stats is not None:
+        live_stats.record_events(events, event_ids)
+
+@api_blueprint.before_app_request
+def start_live_stats():
+    get_live_stats()
+
+# --- 摄像头心跳 ---
+# 每个进程一个状态表和批量写入线程，在预热时 (或第一次收到心跳 / 查询摄像头列表时) 创建。
+# 没有收到过心跳的 worker 也通过它定期读取数据库中的共享状态，因此所有 worker 返回的状态一致
+_camera_status = None
+_camera_status_lock = threading.Lock()
+
+def get_camera_status():
+    """未配置数据库时返回 None"""
+    global _camera_status
+    if not DATABASE_URL:
+        return None
+    if _camera_status is not None and _camera_status.pid == os.getpid():
+        return _camera_status
+    with _camera_status_lock:
+        if _camera_status is None or _camera_status.pid != os.getpid():
+            _camera_status = CameraStatusTable(get_db_connection)
+        return _camera_status
+
+def current_camera_status():
+    """返回当前进程已创建的状态表 (不会触发创建)"""
+    if _camera_status is not None and _camera_status.pid == os.getpid():
+        return _camera_status
+    return None
+
+@atexit.register
+def flush_camera_status():
+    """进程退出前写入最后一次状态变化"""
+    camera_status = current_camera_status()
+    if camera_status is not None:
+        camera_status.stop()
+
+# --- 分区维护 ---
+# 每个进程一个后台线程定期创建未来的月度分区 (advisory lock 保证同一时间只有一个进程执行)
+_partition_maintainer = None
+_partition_maintainer_lock = threading.Lock()
+
+@api_blueprint.before_app_request
+def start_partition_maintainer():
+    global _partition_maintainer
+    if PARTITION_MAINTENANCE_INTERVAL <= 0 or not DATABASE_URL:
+        return
+    if _partition_maintainer is None or _partition_maintainer.pid != os.getpid():
+        with _partition_maintainer_lock:
+            if _partition_maintainer is None or _partition_maintainer.pid != os.getpid():
+                _partition_maintainer = PartitionMaintainer(get_db_connection)
+
+# --- 汇总表合并 ---
+# 每个进程一个后台线程定期把增量表合并到报告汇总表 (advisory lock 保证同一时间只有一个进程执行)
+_rollup_refresher = None
+_rollup_refresher_lock = threading.Lock()
+
+@api_blueprint.before_app_request
+def start_rollup_refresher():
+    global _rollup_refresher
+    if REPORT_ROLLUP_INTERVAL <= 0 or not ROLLUPS_ENABLED or not DATABASE_URL:
+        return
+    if _rollup_refresher is None or _rollup_refresher.pid != os.getpid():
+        with _rollup_refresher_lock:
+            if _rollup_refresher is None or _rollup_refresher.pid != os.getpid():
+                _rollup_refresher = RollupRefresher(get_db_connection)
+
+# --- 启动预热 ---
+# [NEW] 每个 worker 进程一份预热状态: gunicorn 的 post_fork 钩子调用 init_worker() 启动，
+# 没有钩子时 (Flask 开发服务器等) 在第一个请求时启动。就绪状态见 GET /api/system/ready
+_warmup = None
+_warmup_lock = threading.Lock()
+
+def warm_db_pool():
+    """建立主库连接池的 min_size 个连接，并在每个连接上预编译所有语句"""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL 环境变量未设置。")
+    get_pool(DATABASE_URL).prime(setup=prepared_statements.prepare_all)
+
+def warm_replica_pools():
+    router = get_replica_router()
+    if router is not None:
+        for replica in router.replicas:
+            replica.pool.prime(setup=prepared_statements.prepare_all)
+
+def warm_camera_status():
+    """创建摄像头状态表并立即读取一次共享状态 (之后由后台线程定期读取)"""
+    camera_status = get_camera_status()
+    if camera_status is not None:
+        camera_status.flush()
+
+def warmup_steps(app):
+    def in_app_context(fn):
+        def run():
+            with app.app_context():
+                fn()
+        return run
+    return [
+        WarmupStep("db_pool", warm_db_pool), # 必需: 数据库不可用时保持未就绪并重试
+        WarmupStep("db_replicas", warm_replica_pools, required=False),
+        WarmupStep("db_json_types", check_db_json_types, required=False),
+        WarmupStep("camera_cache_listener", listen_camera_cache_invalidations, required=False),
+        WarmupStep("camera_cache",
+                   in_app_context(lambda: camera_cache.get_or_load('list', load_active_cameras)), required=False),
+        WarmupStep("live_stats", get_live_stats, required=False), # 只启动后台重建，不等待完成
+        WarmupStep("camera_status", warm_camera_status, required=False),
+        WarmupStep("partition_maintainer", start_partition_maintainer, required=False),
+        WarmupStep("rollup_refresher", start_rollup_refresher, required=False),
+    ]
+
+def get_warmup(app=None, started=None):
+    """返回当前进程的预热状态 (第一次调用时启动预热线程)"""
+    global _warmup
+    if _warmup is not None and _warmup.pid == os.getpid():
+        return _warmup
+    with _warmup_lock:
+        if _warmup is None or _warmup.pid != os.getpid():
+            if started is None:
+                # 在导入本模块的进程中: 冷启动包括导入时间
+                started = IMPORT_STARTED if os.getpid() == IMPORT_PID else time.monotonic()
+            _warmup = Warmup(warmup_steps(app or current_app._get_current_object()), started=started)
+            _warmup.start()
+        return _warmup
+
+def current_warmup():
+    """返回当前进程已创建的预热状态 (不会触发创建)"""
+    if _warmup is not None and _warmup.pid == os.getpid():
+        return _warmup
+    return None
+
+@api_blueprint.before_app_request
+def start_warmup():
+    get_warmup()
+
+def init_worker(app, started=None):
+    """
+    [NEW] gunicorn post_fork 钩子 (见 gunicorn.conf.py): worker 进程开始计时并在后台预热。
+    连接、线程都在 fork 之后的 worker 中创建
+    """
+    return get_warmup(app, started=started if started is not None else time.monotonic())
+
+def shutdown_worker():
+    """gunicorn worker_exit 钩子: 停止预热，写入队列和心跳状态，关闭连接池"""
+    warmup = current_warmup()
+    if warmup is not None:
+        warmup.stop()
+    drain_ingest_queue()
+    flush_camera_status()
+    reset_pool()
+
 # [FIX] 自定义 JSON 编码器，用于处理 datetime 和 decimal
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -41,14 +648,115 @@ class CustomJSONEncoder(json.JSONEncoder):
         if isinstance(obj, decimal.Decimal):
             return float(obj) # 转换为 float
         return super(CustomJSONEncoder, self).default(obj)
-app.json_encoder = CustomJSONEncoder
+
+class CustomJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(obj):
+        return CustomJSONEncoder().default(obj)
+
+# [PERF] 数据库端 JSON 渲染: 列表接口的 data 由 Postgres 直接生成 JSON 文本 (见 sql_json.py)，
+# 不经过 RealDictCursor 和 jsonify；输出与 Python 渲染逐字节一致。
+# 默认由 DB_JSON_RENDERING 决定，单个请求可用 ?render=db|python 指定 (用于对比测试)
+DB_JSON_RENDERING = os.environ.get('DB_JSON_RENDERING', '0') in ('1', 'true')
+RAW_JSON_MARKER = "\x00raw-json\x00" # 响应体中待替换为数据库生成的 JSON 的占位值
+RAW_JSON_MARKER_TEXT = json.dumps(RAW_JSON_MARKER).encode('ascii')
+
+# json_float_sql() 渲染的列: 预热时检查列类型，检查通过之前 (或不通过时) 使用 Python 渲染
+DB_JSON_FLOAT_COLUMNS = (("events", "score"),)
+_db_json_types_ok = False
+
+def check_db_json_types():
+    global _db_json_types_ok
+    conn = get_db_connection(readonly=True)
+    try:
+        unsupported = unsupported_float_columns(conn.cursor(), DB_JSON_FLOAT_COLUMNS)
+    finally:
+        conn.close()
+    _db_json_types_ok = not unsupported
+    if unsupported:
+        raise ValueError(f"数据库端 JSON 渲染不支持这些列的类型，改用 Python 渲染: {', '.join(unsupported)}")
+
+def use_db_json():
+    """
+    当前请求是否使用数据库端 JSON 渲染
+    (JSON provider 不是紧凑 / 排序键 / ASCII 输出时，或列类型检查未通过时不可用)
+    """
+    if not _db_json_types_ok:
+        return False
+    render = request.args.get('render') if has_request_context() else None
+    enabled = render == 'db' if render in ('db', 'python') else DB_JSON_RENDERING
+    provider = current_app.json
+    indented = provider.compact is False or (provider.compact is None and current_app.debug)
+    return enabled and provider.sort_keys and provider.ensure_ascii and not indented
+
+def raw_json_body(body, raw):
+    """与 jsonify(body) 相同的响应体 (bytes)，其中值为 RAW_JSON_MARKER 的字段替换为 JSON 文本 raw"""
+    data = current_app.json.response(body).get_data()
+    return data.replace(RAW_JSON_MARKER_TEXT, raw.encode('ascii'), 1)
+
+def raw_json_response(body, raw):
+    return current_app.response_class(raw_json_body(body, raw), mimetype=current_app.json.mimetype)
+
+
+# --- [METRICS] 请求指标 ---
+# 流式响应 (SSE / 导出) 只统计到响应头返回为止
+if metrics.METRICS_ENABLED:
+    @api_blueprint.before_app_request
+    def start_request_metrics():
+        metrics.begin_request()
+
+    @api_blueprint.after_app_request
+    def record_request_metrics(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.end_request(request.method, route, response.status_code)
+        return response
+
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("db_pool", pool_stats()))
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("ingest_admission", admission.stats()))
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("db_replicas", replica_stats()))
+    metrics.registry.add_collector(
+        lambda: metrics.flatten_stats("db_prepared_statements", prepared_statements.registry.totals()))
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("camera_cache", camera_cache.stats()))
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("token_cache", token_cache.stats()))
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("password_hasher", hasher_stats()))
+    metrics.registry.add_collector(lambda: metrics.flatten_stats("image_store", get_image_store().stats()))
+    metrics.registry.add_collector(
+        lambda: metrics.flatten_stats("event_stream", current_broadcaster() and current_broadcaster().stats()))
+    metrics.registry.add_collector(
+        lambda: metrics.flatten_stats("ingest_queue", current_ingest_queue() and current_ingest_queue().stats()))
+    metrics.registry.add_collector(
+        lambda: metrics.flatten_stats("camera_status", current_camera_status() and current_camera_status().stats()))
+    metrics.registry.add_collector(
+        lambda: metrics.flatten_stats("live_stats", current_live_stats() and current_live_stats().stats()))
+    metrics.registry.add_collector(
+        lambda: metrics.flatten_stats("startup", current_warmup() and current_warmup().stats()))
 
 
 # --- 认证装饰器 ---
-def token_required(f):
+# [PERF] 已验证 token 的缓存，同一个 24 小时 token 的重复请求无需再次计算 HMAC
+token_cache = VerifiedTokenCache(max_size=int(os.environ.get('TOKEN_CACHE_SIZE', 10000)))
+
+class TokenRevokedError(jwt.InvalidTokenError):
+    """token 签名有效，但用户已登出或修改密码"""
+
+def verify_token(token):
+    """验证 JWT 并返回 claims；缓存命中时跳过签名验证，但仍检查过期时间和吊销列表"""
+    data = token_cache.get(token)
+    if data is None:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+        token_cache.put(token, data)
+    if token_cache.is_revoked(data):
+        raise TokenRevokedError("Token 已被吊销")
+    return data
+
+def token_required(f=None, allow_query_token=False):
     """
     [SECURITY] 检查请求 Header 中是否包含有效 Token 的装饰器
+    allow_query_token=True 时也接受 ?token=... (浏览器的 EventSource 无法设置 Header)
     """
+    if f is None:
+        return lambda func: token_required(func, allow_query_token=allow_query_token)
+
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
@@ -60,27 +768,107 @@ def token_required(f):
             except IndexError:
                 return jsonify({"success": False, "message": "无效的认证 Token 格式"}), 401
         
+        if not token and allow_query_token:
+            token = request.args.get('token')
+
         if not token:
             return jsonify({"success": False, "message": "未提供认证 Token"}), 401
 
         try:
             # 验证 JWT Token
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            data = verify_token(token)
             current_user_id = data['user_id']
         except jwt.ExpiredSignatureError:
             return jsonify({"success": False, "message": "Token 已过期"}), 401
+        except TokenRevokedError:
+            return jsonify({"success": False, "message": "Token 已失效，请重新登录"}), 401
         except jwt.InvalidTokenError:
             return jsonify({"success": False, "message": "无效的 Token"}), 401
         
         # 将用户信息传递给被装饰的函数
+        g.current_user_id = current_user_id # [PERF] 只读副本路由: 写入后的读请求走主库
         return f(current_user_id, *args, **kwargs)
 
     return decorated
 
+# --- 写入接口认证 ---
+# 分析脚本 / 摄像头使用 X-API-Key (INGEST_API_KEYS，逗号分隔)，App 用户也可以使用登录 Token。
+# 配置了 INGEST_API_KEYS 时所有写入接口都需要认证；未配置时 (兼容旧的分析脚本) 只有会把文件写入磁盘的
+# 图片上传 (always=True 或 multipart 请求) 需要认证
+INGEST_API_KEYS = tuple(key.strip() for key in os.environ.get('INGEST_API_KEYS', '').split(',') if key.strip())
+
+def ingest_identity():
+    """返回经过验证的调用方标识 ("key:<哈希前缀>" / "user:<id>")，未认证或凭据无效时返回 None"""
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        for key in INGEST_API_KEYS:
+            if hmac.compare_digest(api_key.encode('utf-8'), key.encode('utf-8')):
+                return "key:" + hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+        return None
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        try:
+            return f"user:{verify_token(auth_header[7:])['user_id']}"
+        except (jwt.InvalidTokenError, TokenRevokedError):
+            return None
+    return None
+
+ADMIN_ROLE = 'admin'
+SQL_USER_ROLE = "SELECT role FROM users WHERE id = %s"
+
+def is_admin_user(user_id):
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection(readonly=True)
+        cursor = conn.cursor()
+        cursor.execute(SQL_USER_ROLE, (user_id,))
+        row = cursor.fetchone()
+        return row is not None and row[0] == ADMIN_ROLE
+    finally:
+        if conn:
+            if cursor: cursor.close()
+            conn.close()
+
+def admin_required(f):
+    """[SECURITY] 运维接口的认证装饰器: 需要有效的 X-API-Key (INGEST_API_KEYS) 或 role 为 admin 的用户 Token"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        identity = ingest_identity()
+        if identity is None:
+            return jsonify({"success": False, "message": "需要有效的 X-API-Key 或认证 Token"}), 401
+        if identity.startswith('user:'):
+            try:
+                admin = is_admin_user(int(identity[5:]))
+            except PoolTimeoutError as error:
+                print(f"数据库连接池繁忙 (Admin Check): {error}")
+                return db_busy_response()
+            if not admin:
+                return jsonify({"success": False, "message": "需要管理员权限"}), 403
+        g.ingest_identity = identity
+        return f(*args, **kwargs)
+
+    return decorated
+
+def ingest_auth_required(f=None, always=False):
+    """[SECURITY] 写入接口的认证装饰器；always=True 时即使未配置 INGEST_API_KEYS 也需要认证"""
+    if f is None:
+        return lambda func: ingest_auth_required(func, always=always)
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.ingest_identity = ingest_identity()
+        required = always or INGEST_API_KEYS or request.mimetype == 'multipart/form-data'
+        if g.ingest_identity is None and required:
+            return jsonify({"success": False, "message": "需要有效的 X-API-Key 或认证 Token"}), 401
+        return f(*args, **kwargs)
+
+    return decorated
+
 
 # --- API Endpoints ---
 
-@app.route('/', methods=['GET'])
+@api_blueprint.route('/', methods=['GET'])
 def home():
     """根路径，返回欢迎信息"""
     return jsonify({
@@ -88,9 +876,54 @@ def home():
         "status": "运行中"
     })
 
+# --- 运维 (System) Endpoints ---
+
+@api_blueprint.route('/api/system/stats', methods=['GET'])
+def get_system_stats():
+    """
+    [NEW ENDPOINT] 返回当前 worker 进程的运行统计 (用于调整连接池大小等)
+    """
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "db_pool": pool_stats(),
+        "db_replicas": replica_stats(),
+        "prepared_statements": prepared_statements.statement_stats(),
+        "camera_cache": camera_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "idempotency_cache": idempotency_cache.stats(),
+        "password_hasher": hasher_stats(),
+        "image_store": get_image_store().stats(),
+        "event_stream": current_broadcaster().stats() if current_broadcaster() else None,
+        "ingest_queue": current_ingest_queue().stats() if current_ingest_queue() else None,
+        "camera_status": current_camera_status().stats() if current_camera_status() else None,
+        "live_stats": current_live_stats().stats() if current_live_stats() else None,
+        "admission": admission.stats() if ADMISSION_ENABLED else None,
+        "startup": current_warmup().stats() if current_warmup() else None
+    })
+
+@api_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    [NEW ENDPOINT] Prometheus 文本格式的指标 (当前 worker 进程)
+    """
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"success": False, "message": "指标未启用"}), 404
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@api_blueprint.route('/api/system/ready', methods=['GET'])
+def get_readiness():
+    """
+    [NEW ENDPOINT] 就绪检查 (负载均衡 / 部署用): 当前 worker 预热完成后返回 200，之前返回 503
+    响应中包含冷启动时间和各预热步骤的耗时
+    """
+    startup = get_warmup().stats()
+    status = 200 if startup["ready"] else 503
+    return jsonify({"success": startup["ready"], "startup": startup}), status
+
 # --- 认证 Endpoints ---
 
-@app.route('/api/auth/register', methods=['POST'])
+@api_blueprint.route('/api/auth/register', methods=['POST'])
 def register_user():
     """
     [SECURITY UPGRADE] 使用 Bcrypt 哈希密码的用户注册
@@ -106,7 +939,12 @@ def register_user():
         return jsonify({"success": False, "message": "缺少必需字段"}), 400
 
     # [SECURITY] 生成密码哈希值
-    password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+    # [PERF] 在独立的哈希进程池中计算，繁忙时快速返回 503
+    try:
+        password_hash = get_hasher().hash_password(password, current_app.config.get('BCRYPT_LOG_ROUNDS', 12))
+    except HashPoolBusyError as error:
+        print(f"密码哈希繁忙 (Register): {error}")
+        return hash_busy_response()
 
     conn = None
     try:
@@ -127,6 +965,9 @@ def register_user():
 
         return jsonify({"success": True, "message": "注册成功", "user_id": user_id}), 201
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Register): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         if conn: conn.rollback()
         print(f"数据库错误 (Register): {error}")
@@ -137,7 +978,10 @@ def register_user():
                 cursor.close()
             conn.close()
 
-@app.route('/api/auth/login', methods=['POST'])
+SELECT_LOGIN_USER = prepared_statements.prepare(
+    "select_login_user", "SELECT id, username, password_hash, full_name, email, role FROM users WHERE username = %s")
+
+@api_blueprint.route('/api/auth/login', methods=['POST'])
 def login_user():
     """
     [SECURITY UPGRADE] 使用 Bcrypt 校验密码并返回 JWT Token
@@ -155,18 +999,24 @@ def login_user():
         # [IMPROVEMENT] 使用 RealDictCursor 以字典形式返回结果
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        sql = "SELECT id, username, password_hash, full_name, email, role FROM users WHERE username = %s"
-        cursor.execute(sql, (username,))
+        prepared_statements.execute(cursor, SELECT_LOGIN_USER, (username,))
         user = cursor.fetchone()
 
-        if user and bcrypt.check_password_hash(user['password_hash'], password):
+        # [PERF] 先归还数据库连接，再在哈希进程池中校验密码，避免计算期间占用连接
+        cursor.close()
+        cursor = None
+        conn.close()
+        conn = None
+
+        if user and get_hasher().check_password(user['password_hash'], password):
             # 密码正确
             # [SECURITY] 生成 JWT Token
             token = jwt.encode({
                 'user_id': user['id'],
                 'username': user['username'],
+                'iat': time.time(), # 签发时间，用于吊销检查
                 'exp': datetime.utcnow() + timedelta(hours=24) # 24小时后过期
-            }, app.config['SECRET_KEY'], algorithm="HS256")
+            }, current_app.config['SECRET_KEY'], algorithm="HS256")
             
             # 从返回的 user 字典中移除密码哈希
             user.pop('password_hash')
@@ -181,6 +1031,12 @@ def login_user():
             # 用户名或密码错误
             return jsonify({"success": False, "message": "用户名或密码错误"}), 401
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Login): {error}")
+        return db_busy_response()
+    except HashPoolBusyError as error:
+        print(f"密码哈希繁忙 (Login): {error}")
+        return hash_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"数据库错误 (Login): {error}")
         return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
@@ -190,116 +1046,257 @@ def login_user():
                 cursor.close()
             conn.close()
 
-# --- 摄像头 Endpoints ---
-
-@app.route('/api/cameras', methods=['GET'])
+@api_blueprint.route('/api/auth/logout', methods=['POST'])
 @token_required
-def get_cameras(current_user_id):
+def logout_user(current_user_id):
     """
-    [MODIFIED] 获取摄像头列表 (已移除占位逻辑)
+    [NEW ENDPOINT] 登出: 吊销该用户此前签发的所有 token
+    (吊销列表保存在进程内，对同一 worker 进程的所有线程立即生效)
     """
+    token_cache.revoke_user(current_user_id)
+    return jsonify({"success": True, "message": "已登出"})
+
+# --- 摄像头 Endpoints ---
+
+# [FIX] 超过 CAMERA_OFFLINE_TIMEOUT 没有心跳 (last_seen_at，UTC) 的摄像头显示为 offline，
+# 即使最后收到心跳的 worker 已经退出、没有写入 offline
+SQL_CAMERA_STATUS = (
+    "CASE WHEN status <> 'offline' AND last_seen_at < (now() AT TIME ZONE 'utc')"
+    f" - interval '{CAMERA_OFFLINE_TIMEOUT:g} seconds' THEN 'offline' ELSE status END"
+)
+SQL_ACTIVE_CAMERAS = f"""
+    SELECT id, name, {SQL_CAMERA_STATUS} AS status
+    FROM cameras WHERE is_active = true ORDER BY name ASC
+"""
+SQL_ACTIVE_CAMERAS_JSON = f"""
+    SELECT id, name, {SQL_CAMERA_STATUS} AS status, {json_object_sql({
+        "id": json_int_sql("id"), "name": json_string_sql("name"), "status": json_string_sql(SQL_CAMERA_STATUS)
+    })} AS row_json
+    FROM cameras WHERE is_active = true ORDER BY name ASC
+"""
+
+def load_active_cameras():
+    """从数据库读取启用中的摄像头列表 (仅在缓存未命中时调用)"""
     conn = None
+    cursor = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
+        if use_db_json():
+            # [PERF] 同时缓存数据库生成的响应体，缓存命中时直接返回
+            cursor = conn.cursor()
+            cursor.execute(SQL_ACTIVE_CAMERAS_JSON)
+            rows = cursor.fetchall()
+            body = {"success": True, "data": [{"id": r[0], "name": r[1], "status": r[2]} for r in rows]}
+            raw = ascii_json("[" + ",".join(r[3] for r in rows) + "]")
+            return cache_payload(body, raw=raw_json_body(dict(body, data=RAW_JSON_MARKER), raw))
+
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
+
         # [MODIFIED] 真实的数据库查询。
         # 假设 `cameras` 表中已添加 `status` 列
-        cursor.execute("SELECT id, name, status FROM cameras WHERE is_active = true ORDER BY name ASC")
-        cameras = cursor.fetchall()
-        
-        return jsonify({"success": True, "data": cameras})
-        
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(f"数据库错误 (Get Cameras): {error}")
-        return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+        cursor.execute(SQL_ACTIVE_CAMERAS)
+        return cache_payload({"success": True, "data": cursor.fetchall()})
     finally:
         if conn:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
+            if cursor: cursor.close()
             conn.close()
 
-@app.route('/api/cameras/<int:camera_id>/stream', methods=['GET'])
-@token_required
-def get_camera_stream(current_user_id, camera_id):
-    """
-    [NEW ENDPOINT] 获取单个摄像头的视频流 URL (根据计划书)
-    """
+def load_camera_stream(camera_id):
+    """从数据库读取单个摄像头的串流地址 (仅在缓存未命中时调用，未找到的结果同样会被缓存)"""
     conn = None
+    cursor = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
+
         cursor.execute("SELECT stream_url FROM cameras WHERE id = %s AND is_active = true", (camera_id,))
         camera = cursor.fetchone()
-        
+
         if camera and camera['stream_url']:
-            return jsonify({"success": True, "stream_url": camera['stream_url']})
+            return cache_payload({"success": True, "stream_url": camera['stream_url']})
         elif camera:
-            return jsonify({"success": False, "message": "该摄像头未配置串流地址"}), 404
+            return cache_payload({"success": False, "message": "该摄像头未配置串流地址"}, 404)
         else:
-            return jsonify({"success": False, "message": "未找到指定的摄像头"}), 404
-        
+            return cache_payload({"success": False, "message": "未找到指定的摄像头"}, 404)
+    finally:
+        if conn:
+            if cursor: cursor.close()
+            conn.close()
+
+def overlay_live_status(entry, stored_at):
+    """
+    用心跳状态覆盖缓存列表中的 status (没有变化时原样返回，ETag 不变)。
+    状态取本进程的心跳和后台线程读取的共享状态 (cameras.last_seen_at) 中较新的一方，不同 worker 的结果一致
+    """
+    camera_status = get_camera_status()
+    if camera_status is None or entry["status"] != 200:
+        return entry, stored_at
+    live = camera_status.statuses()
+    rows = entry["body"]["data"]
+    if all(live.get(row['id'], row['status']) == row['status'] for row in rows):
+        return entry, stored_at
+    data = [dict(row, status=live.get(row['id'], row['status'])) for row in rows]
+    return cache_payload(dict(entry["body"], data=data)), max(stored_at, camera_status.changed_at)
+
+@api_blueprint.route('/api/cameras', methods=['GET'])
+@token_required
+def get_cameras(current_user_id):
+    """
+    [MODIFIED] 获取摄像头列表 (已移除占位逻辑)
+    [PERF] 读穿透缓存 + ETag/Last-Modified，客户端缓存有效时返回 304
+    [NEW] status 使用心跳的实时状态 (内存)，不需要等待缓存过期或访问数据库
+    [PERF] render=db (或 DB_JSON_RENDERING=1): 缓存数据库生成的响应体，命中时不再序列化
+    """
+    try:
+        entry, stored_at = camera_cache.get_or_load('list', load_active_cameras)
+        return cached_response(*overlay_live_status(entry, stored_at))
+
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Get Cameras): {error}")
+        return db_busy_response()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"数据库错误 (Get Cameras): {error}")
+        return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+
+@api_blueprint.route('/api/cameras/<int:camera_id>/stream', methods=['GET'])
+@token_required
+def get_camera_stream(current_user_id, camera_id):
+    """
+    [NEW ENDPOINT] 获取单个摄像头的视频流 URL (根据计划书)
+    [PERF] 与摄像头列表共用缓存
+    """
+    try:
+        entry, stored_at = camera_cache.get_or_load(('stream', camera_id), lambda: load_camera_stream(camera_id))
+        return cached_response(entry, stored_at)
+
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Get Stream): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"数据库错误 (Get Stream): {error}")
         return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+
+@api_blueprint.route('/api/cameras/heartbeat', methods=['POST'])
+@ingest_auth_required
+def camera_heartbeat():
+    """
+    [NEW ENDPOINT] 摄像头 / 分析盒心跳 (只更新内存，状态变化由后台线程批量写入数据库)
+    JSON: {"camera_id": 3, "fps": 14.8, "health": "ok"}
+      或 {"cameras": [{"camera_id": 3, ...}, ...]} (一个分析盒上报多个摄像头)
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "message": "未提供输入数据"}), 400
+    items = data.get('cameras') if isinstance(data, dict) and 'cameras' in data else [data]
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "cameras 必须是非空数组"}), 400
+    if len(items) > HEARTBEAT_BATCH_LIMIT:
+        return jsonify({"success": False, "message": f"一次最多上报 {HEARTBEAT_BATCH_LIMIT} 个摄像头"}), 400
+
+    try:
+        heartbeats = [parse_heartbeat(item) for item in items]
+    except HeartbeatError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    camera_status = get_camera_status()
+    for heartbeat in heartbeats:
+        camera_status.heartbeat(heartbeat["camera_id"], heartbeat["fps"], heartbeat["health"])
+    return jsonify({
+        "success": True,
+        "accepted": len(heartbeats),
+        "offline_timeout": camera_status.offline_timeout
+    })
+
+@api_blueprint.route('/api/cameras/status', methods=['GET'])
+@token_required
+def get_cameras_status(current_user_id):
+    """
+    [NEW ENDPOINT] 本进程收到的心跳详情: 最近心跳时间、帧率和健康状态 (不访问数据库，不包含其他进程收到的心跳)
+    """
+    camera_status = current_camera_status()
+    snapshot = camera_status.snapshot() if camera_status else {}
+    data = [dict(state, camera_id=camera_id) for camera_id, state in sorted(snapshot.items())]
+    return jsonify({"success": True, "pid": os.getpid(), "data": data})
+
+@api_blueprint.route('/api/cameras/cache/invalidate', methods=['POST'])
+@admin_required
+def invalidate_cameras_cache():
+    """
+    [NEW ENDPOINT] 修改 `cameras` 表后手动清除缓存 (需要 X-API-Key 或管理员 Token)
+    可选 JSON: {"camera_id": 3} 只清除该摄像头的串流地址和摄像头列表
+    [FIX] 本进程立即清除，并通过 NOTIFY 通知所有 worker 进程清除
+    """
+    data = request.get_json(silent=True) or {}
+    camera_id = data.get('camera_id') if isinstance(data, dict) else None
+    if camera_id is not None and (isinstance(camera_id, bool) or not isinstance(camera_id, int)):
+        return jsonify({"success": False, "message": "camera_id 必须是整数"}), 400
+    invalidate_camera_cache(camera_id)
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        notify_control(cursor, CAMERA_CACHE_CONTROL, camera_id=camera_id)
+        conn.commit()
+        return jsonify({"success": True, "message": "摄像头缓存已清除"})
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Invalidate Cameras Cache): {error}")
+        return db_busy_response()
+    except (Exception, psycopg2.DatabaseError) as error:
+        if conn: conn.rollback()
+        print(f"数据库错误 (Invalidate Cameras Cache): {error}")
+        return jsonify({"success": False, "message": f"只清除了当前进程的缓存，通知其他进程失败: {str(error)}"}), 500
     finally:
         if conn:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
+            if cursor: cursor.close()
             conn.close()
 
 
 # --- 事件 (Events) Endpoints ---
 
-@app.route('/api/events', methods=['POST'])
+@api_blueprint.route('/api/events', methods=['POST'])
+@ingest_auth_required
 def add_event():
     """
     接收来自本地分析脚本的危险事件数据 (来自用户提供的 api.py)
     """
-    # TODO: 考虑为这个端点添加一个 API 密钥或 IP 白名单，防止公网滥用
-    data = request.get_json()
+    try:
+        data, uploads = read_event_request()
+    except EventValidationError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     if not data:
         return jsonify({"success": False, "message": "未提供输入数据"}), 400
 
-    # --- 从 AI 脚本获取数据 ---
-    camera_id = data.get('camera_id', 0)
-    equipment_type = data.get('equipment_type')
-    timestamp_str = data.get('timestamp')
-    risk_type = data.get('risk_type') # "abnormal" 或 "normal"
-    score = data.get('score') # 整个事件的（例如最低）分数
-    image_filename = data.get('image_filename') # 缩略图
-    deductions_list = data.get('deductions', []) # 整个事件的扣分项
-    
-    # [IMPORTANT] AI 脚本必须提供每张图片的详细信息
-    # 这是支持App详情页功能的关键
-    # 计划书 1.1 节提到了 "5枚"，但JSON示例中没有
-    # 我们假设 AI 脚本会发送一个 `images_data` 列表
-    # 格式: [ { "filename": "img_01.jpg", "score": 40, "deductions": ["..."] }, ... ]
-    images_data_list = data.get('images_data', [])
-    
-    # 兼容旧格式：如果只提供了 image_filename
-    if image_filename and not images_data_list:
-        images_data_list = [{
-            "filename": image_filename,
-            "score": score,
-            "deductions": deductions_list
-        }]
-
-    if not all([equipment_type, timestamp_str, risk_type, score is not None]):
-        missing = [f for f in ['equipment_type', 'timestamp', 'risk_type', 'score'] if not data.get(f)]
-        return jsonify({"success": False, "message": f"缺少必需字段: {', '.join(missing)}"}), 400
-    
-    if risk_type not in ["normal", "abnormal"]:
-        return jsonify({"success": False, "message": "无效的 risk_type 值"}), 400
-
     try:
-        event_time = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-    except ValueError:
+        event = attach_stored_images(parse_event_payload(data, request.headers.get('Idempotency-Key')), uploads)
+    except EventValidationError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # [NEW] 幂等键命中最近的缓存时直接返回原来的结果
+    cache_key = idempotency_cache_key(event)
+    if cache_key:
+        cached = idempotency_cache.get(cache_key)
+        if cached:
+            return replay_response(cached)
+
+    # [PERF] 准入控制: 令牌桶用完或服务器过载 (只丢弃 normal 事件) 时返回 429
+    decision = admit_event(event)
+    if decision:
+        return rejected_response(decision)
+
+    # [PERF] 异步模式: 入队后立即返回 202，由后台线程合并提交
+    if wants_async_ingest():
         try:
-             event_time = datetime.strptime(timestamp_str.split('.')[0], "%Y-%m-%dT%H:%M:%S")
-        except ValueError:
-            return jsonify({"success": False, "message": "无效的时间戳格式"}), 400
+            provisional_id = get_ingest_queue().submit(event)
+        except QueueFullError as e:
+            return jsonify({"success": False, "message": str(e)}), 429, {"Retry-After": "1"}
+        remember_idempotent(event, {"provisional_id": provisional_id, "status": 202})
+        return jsonify({
+            "success": True,
+            "message": "事件已接收，等待写入",
+            "provisional_id": provisional_id
+        }), 202
 
     conn = None
     cursor = None
@@ -307,53 +1304,26 @@ def add_event():
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        deductions_json = json.dumps(deductions_list)
-        image_count = len(images_data_list)
-        
-        # 步骤 1: 插入主 event 记录
-        sql_event = """
-        INSERT INTO events (camera_id, equipment_type, event_time, risk_type, score, image_filename, image_count, status, deductions)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;
-        """
-        cursor.execute(sql_event, (
-            camera_id, equipment_type, event_time, risk_type, score,
-            image_filename, image_count, 'new', deductions_json
-        ))
-        event_id = cursor.fetchone()[0]
-        
-        # 步骤 2: 插入关联的图片 (根据计划书的 `event_images` 表)
-        if image_count > 0:
-            # TODO: 这里的 `image_url_prefix` 应根据您的文件存储策略修改
-            image_url_prefix = "https://storage.example.com/full/" 
-            
-            image_records = []
-            for i, img_data in enumerate(images_data_list):
-                img_time = event_time + timedelta(seconds=i - int(image_count / 2)) # 模拟时间
-                img_url = image_url_prefix + img_data.get("filename", f"event_{event_id}_{i}.jpg")
-                img_score = img_data.get("score", score) # 使用单张图片分数，否则回退到事件分数
-                img_deductions = json.dumps(img_data.get("deductions", [])) # 使用单张图片扣分项
-
-                # 假设 event_images 表结构 (event_id, image_url, timestamp, score, deduction_items)
-                # [MODIFIED] 插入我们建议的新字段 score 和 deductions
-                image_records.append((event_id, img_url, img_time, img_score, img_deductions))
-
-            sql_images = """
-            INSERT INTO event_images (event_id, image_url, "timestamp", score, deduction_items)
-            VALUES (%s, %s, %s, %s, %s);
-            """
-            # [IMPROVEMENT] 使用 executemany 进行批量插入
-            from psycopg2.extras import execute_batch
-            execute_batch(cursor, sql_images, image_records)
-
+        event_id = insert_event(cursor, event)
         conn.commit()
+        record_live_events([event], [event_id])
+
+        entry = {"event_id": event_id, "status": 201}
+        remember_idempotent(event, entry)
+        if event.get("replayed"):
+            print(f"事件 {event_id} 为重试请求 (幂等键 {event['idempotency_key']})，未重复写入")
+            return replay_response(entry)
 
-        if risk_type == "abnormal":
-            print(f"事件 {event_id} ({equipment_type}) 已记录为 abnormal，可以触发警报。")
+        if event["risk_type"] == "abnormal":
+            print(f"事件 {event_id} ({event['equipment_type']}) 已记录为 abnormal，可以触发警报。")
         else:
-            print(f"事件 {event_id} ({equipment_type}) 已记录为 normal。")
+            print(f"事件 {event_id} ({event['equipment_type']}) 已记录为 normal。")
 
         return jsonify({"success": True, "message": "事件成功添加", "event_id": event_id}), 201
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Add Event): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         if conn: conn.rollback()
         print(f"数据库错误 (Add Event): {error}")
@@ -363,11 +1333,205 @@ def add_event():
             if cursor: cursor.close()
             conn.close()
 
-@app.route('/api/events', methods=['GET'])
+@api_blueprint.route('/api/events/batch', methods=['POST'])
+@ingest_auth_required
+def add_events_batch():
+    """
+    [NEW ENDPOINT] 批量接收事件 (与 add_event 相同的数据格式组成的数组)
+    所有有效事件在同一个事务中通过 COPY 写入；
+    每个事件单独返回结果，单个无效事件不会导致整批失败。
+    """
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get('events')
+    if not data or not isinstance(data, list):
+        return jsonify({"success": False, "message": "未提供事件数组"}), 400
+    if len(data) > BATCH_MAX_EVENTS:
+        return jsonify({"success": False, "message": f"单次最多提交 {BATCH_MAX_EVENTS} 个事件"}), 413
+
+    # 步骤 1: 逐条校验
+    # 幂等键: 每个事件自己的 client_event_id / sequence，或 Idempotency-Key 请求头加上数组下标
+    batch_key = request.headers.get('Idempotency-Key')
+    results = [None] * len(data)
+    candidates = [] # (下标, 事件)
+    replayed = 0
+    for index, item in enumerate(data):
+        try:
+            event = attach_stored_images(parse_event_payload(
+                item, f"{batch_key}:{index}" if batch_key else None))
+        except EventValidationError as e:
+            results[index] = {"index": index, "success": False, "message": str(e)}
+            continue
+        cache_key = idempotency_cache_key(event)
+        cached = idempotency_cache.get(cache_key) if cache_key else None
+        if cached and "event_id" in cached:
+            results[index] = {"index": index, "success": True, "event_id": cached["event_id"], "replayed": True}
+            replayed += 1
+            continue
+        candidates.append((index, event))
+
+    # [PERF] 准入控制: 整个批量请求只消耗一个令牌，过载时只丢弃其中的 normal 事件
+    valid_events = []
+    valid_indexes = []
+    rejections = [] # 准入控制拒绝的事件
+    decisions = admit_batch([event for _, event in candidates])
+    for (index, event), decision in zip(candidates, decisions):
+        if decision:
+            results[index] = {"index": index, "success": False, "message": admission_message(decision),
+                              "reason": decision.reason}
+            rejections.append(decision)
+            continue
+        valid_events.append(event)
+        valid_indexes.append(index)
+
+    # 步骤 2: 在一个事务中写入所有有效事件
+    inserted = []
+    conn = None
+    cursor = None
+    if valid_events:
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            inserted = insert_events_batch(cursor, valid_events)
+            conn.commit()
+            committed = [(event, event_id) for event, (event_id, error) in zip(valid_events, inserted) if error is None]
+            record_live_events([e for e, _ in committed], [i for _, i in committed])
+        except PoolTimeoutError as error:
+            print(f"数据库连接池繁忙 (Add Events Batch): {error}")
+            return db_busy_response()
+        except (Exception, psycopg2.DatabaseError) as error:
+            if conn: conn.rollback()
+            print(f"数据库错误 (Add Events Batch): {error}")
+            return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+        finally:
+            if conn:
+                if cursor: cursor.close()
+                conn.close()
+
+    accepted = replayed
+    abnormal = 0
+    for index, event, (event_id, error) in zip(valid_indexes, valid_events, inserted):
+        if error is None:
+            results[index] = {"index": index, "success": True, "event_id": event_id}
+            remember_idempotent(event, {"event_id": event_id, "status": 201})
+            accepted += 1
+            if event.get("replayed"):
+                results[index]["replayed"] = True
+                replayed += 1
+            elif event["risk_type"] == "abnormal":
+                abnormal += 1
+        else:
+            results[index] = {"index": index, "success": False, "message": f"数据库错误: {str(error)}"}
+
+    print(f"批量事件: {accepted}/{len(data)} 条已记录 (abnormal {abnormal} 条, 重试 {replayed} 条)")
+
+    headers = {}
+    if rejections:
+        headers["Retry-After"] = max(rejections, key=lambda d: d.retry_after).retry_after_header
+    if accepted == len(data):
+        status_code = 201
+    elif accepted > 0:
+        status_code = 207 # 部分成功
+    elif len(rejections) == len(data):
+        status_code = 429 # 全部被准入控制拒绝
+    else:
+        status_code = 400
+    return jsonify({
+        "success": accepted > 0,
+        "accepted": accepted,
+        "rejected": len(data) - accepted,
+        "throttled": len(rejections),
+        "results": results
+    }), status_code, headers
+
+@api_blueprint.route('/api/events/ingest/<provisional_id>', methods=['GET'])
+def get_ingest_status(provisional_id):
+    """
+    [NEW ENDPOINT] 查询异步写入的事件状态 (pending / committed / failed)
+    临时 id 只在接收该事件的 worker 进程中有效
+    """
+    ingest_queue = current_ingest_queue()
+    result = ingest_queue.result(provisional_id) if ingest_queue else None
+    if result is None:
+        return jsonify({"success": False, "message": "未找到该临时 id"}), 404
+    return jsonify(dict(result, success=True, provisional_id=provisional_id))
+
+# [PERF] get_events 的预编译语句: 未指定的日期范围使用 -infinity / infinity，
+# 因此任意筛选条件组合都只对应 (分页 / 游标 / 总数) x (是否按扣分项筛选) 六条固定的语句
+SQL_EVENT_LIST_COLUMNS = """
+    SELECT id, camera_id, equipment_type, event_time, risk_type, score, image_filename AS thumbnail_url, status
+"""
+SQL_EVENT_LIST_FROM = "FROM events WHERE risk_type = 'abnormal' AND event_time >= %s AND event_time <= %s"
+SQL_DEDUCTION_FILTER = " AND deductions @> %s::jsonb" # [NEW] 扣分项筛选 (GIN 索引 events_deductions_gin_idx)
+
+# [PERF] 数据库端 JSON 渲染: 一页事件在数据库中拼接为 JSON 数组文本 (与 jsonify 输出逐字节一致)，
+# 同时返回 hasMore 和下一页游标所需的最后一行 (event_time, id)。第一个参数为每页条数 (limit)
+SQL_EVENT_LIST_ROW_JSON = json_object_sql({
+    "id": json_int_sql("id"),
+    "camera_id": json_int_sql("camera_id"),
+    "equipment_type": json_string_sql("equipment_type"),
+    "event_time": json_datetime_sql("event_time"),
+    "risk_type": json_string_sql("risk_type"),
+    "score": json_float_sql("score"),
+    "thumbnail_url": json_string_sql("thumbnail_url"),
+    "status": json_string_sql("status"),
+})
+
+def event_page_json_sql(page_sql):
+    return f"""
+    WITH page_size AS (SELECT %s::integer AS n),
+    page AS (
+        SELECT row_number() OVER (ORDER BY event_time DESC, id DESC) AS n, id, event_time,
+               {SQL_EVENT_LIST_ROW_JSON} AS row_json
+        FROM ({page_sql}) p
+    )
+    SELECT '[' || COALESCE(string_agg(page.row_json, ',' ORDER BY page.n) FILTER (WHERE page.n <= s.n), '') || ']' AS data,
+           count(page.n) > s.n AS has_more,
+           max(page.event_time) FILTER (WHERE page.n = s.n) AS last_event_time,
+           max(page.id) FILTER (WHERE page.n = s.n) AS last_id
+    FROM page_size s LEFT JOIN page ON true
+    GROUP BY s.n
+"""
+
+EVENT_LIST_STATEMENTS = {}
+for _filtered in (False, True):
+    _from = SQL_EVENT_LIST_FROM + (SQL_DEDUCTION_FILTER if _filtered else "")
+    _suffix = "_deduction" if _filtered else ""
+    _pages = {
+        "page": SQL_EVENT_LIST_COLUMNS + _from + " ORDER BY event_time DESC, id DESC LIMIT %s OFFSET %s",
+        "keyset": SQL_EVENT_LIST_COLUMNS + _from
+            + " AND (event_time, id) < (%s, %s) ORDER BY event_time DESC, id DESC LIMIT %s",
+    }
+    for _kind, _sql in _pages.items():
+        EVENT_LIST_STATEMENTS[_kind, _filtered] = prepared_statements.prepare(
+            f"select_events_{_kind}{_suffix}", _sql)
+        EVENT_LIST_STATEMENTS[_kind + "_json", _filtered] = prepared_statements.prepare(
+            f"select_events_{_kind}{_suffix}_json", event_page_json_sql(_sql))
+    EVENT_LIST_STATEMENTS["count", _filtered] = prepared_statements.prepare(
+        "count_events" + _suffix, "SELECT COUNT(*) " + _from)
+
+DEDUCTION_FILTER_MAX = 10 # 一次最多筛选的扣分项数
+
+def parse_deduction_filter():
+    """
+    [NEW] ?deduction=no helmet&deduction=... (同时包含所有扣分项)，返回用于 @> 的 JSON 数组文本；未指定时返回 None
+    """
+    names = [name.strip() for name in request.args.getlist('deduction') if name.strip()]
+    if not names:
+        return None
+    if len(names) > DEDUCTION_FILTER_MAX or any(len(name) > 200 for name in names):
+        raise ValueError(f"最多筛选 {DEDUCTION_FILTER_MAX} 个扣分项")
+    return json.dumps(sorted(set(names)), ensure_ascii=False)
+
+@api_blueprint.route('/api/events', methods=['GET'])
 @token_required
 def get_events(current_user_id):
     """
     [MODIFIED] 获取事件历史记录，增加了日期筛选功能 (已连接DB)
+    [PERF] 支持游标分页 (`after`) 和总数模式 (`count=exact|cached|estimate|none`)
+    [NEW] deduction=... 只返回包含该扣分项的事件 (可重复指定，需同时包含)
+    [PERF] render=db (或 DB_JSON_RENDERING=1): data 由数据库直接生成 JSON，输出不变
+    旧版 App 使用的 page/limit/start_date/end_date 保持不变
     """
     try:
         page = int(request.args.get('page', 1))
@@ -375,63 +1539,98 @@ def get_events(current_user_id):
         start_date_str = request.args.get('start_date') # YYYY-MM-DD
         end_date_str = request.args.get('end_date') # YYYY-MM-DD
         offset = (page - 1) * limit
+        after = request.args.get('after') # 游标分页: 上一页返回的 nextCursor
+        after_key = decode_cursor(after) if after else None
+    except InvalidCursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except ValueError:
         return jsonify({"success": False, "message": "无效的分页参数"}), 400
+    try:
+        deduction_filter = parse_deduction_filter()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    count_mode = request.args.get('count', 'exact')
+    if count_mode not in COUNT_MODES:
+        return jsonify({"success": False, "message": "无效的 count 参数"}), 400
 
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor) # 使用 RealDictCursor
 
-        # 构建基础查询
-        # [MODIFIED] 字段名 `image_filename` 映射为 `thumbnail_url` 以匹配App需求
-        sql_data = """
-        SELECT id, camera_id, equipment_type, event_time, risk_type, score, image_filename AS thumbnail_url, status
-        FROM events
-        """
-        sql_count = "SELECT COUNT(*) FROM events"
-        
-        # 添加筛选条件
-        conditions = ["risk_type = 'abnormal'"] # 默认只显示 "abnormal"
-        params = []
-        
-        if start_date_str:
-            conditions.append("event_time >= %s")
-            params.append(start_date_str)
-        
-        if end_date_str:
-            # 包含当天，所以查询到 23:59:59
-            conditions.append("event_time <= %s")
-            params.append(end_date_str + " 23:59:59")
-        
-        if conditions:
-            sql_data += " WHERE " + " AND ".join(conditions)
-            sql_count += " WHERE " + " AND ".join(conditions)
-        
-        # 添加排序和分页
-        sql_data += " ORDER BY event_time DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        
-        # 执行数据查询
-        cursor.execute(sql_data, tuple(params))
-        events = cursor.fetchall()
-
-        # 执行总数查询 (移除分页参数)
-        cursor.execute(sql_count, tuple(params[:-2])) # 移除 limit 和 offset
-        total_events = cursor.fetchone()['count']
-
-        return jsonify({
+        # 日期范围 (包含结束日当天，所以查询到 23:59:59)
+        filter_params = (
+            start_date_str or '-infinity',
+            end_date_str + " 23:59:59" if end_date_str else 'infinity'
+        ) + ((deduction_filter,) if deduction_filter else ())
+        filtered = deduction_filter is not None
+
+        # [PERF] 游标分页: 从上一页最后一行 (event_time, id) 之后继续，无需扫描并丢弃 OFFSET 行
+        # id 作为同一时间戳下的稳定排序；多取一行用于判断是否还有下一页
+        if after_key:
+            page_kind, page_params = "keyset", filter_params + tuple(after_key) + (limit + 1,)
+        else:
+            page_kind, page_params = "page", filter_params + (limit + 1, offset)
+
+        render_db = use_db_json()
+        if render_db:
+            prepared_statements.execute(cursor, EVENT_LIST_STATEMENTS[page_kind + "_json", filtered],
+                                        (limit,) + page_params)
+            page_row = cursor.fetchone()
+            events = RAW_JSON_MARKER
+            events_json = ascii_json(page_row['data'])
+            has_more = page_row['has_more']
+            last_key = (page_row['last_event_time'], page_row['last_id']) if page_row['last_id'] is not None else None
+        else:
+            prepared_statements.execute(cursor, EVENT_LIST_STATEMENTS[page_kind, filtered], page_params)
+            events = cursor.fetchall()
+            has_more = len(events) > limit
+            events = events[:limit]
+            last_key = (events[-1]['event_time'], events[-1]['id']) if events else None
+        next_cursor = encode_cursor(*last_key) if has_more and last_key else None
+
+        # 执行总数查询
+        total_events = None
+        if count_mode == 'exact':
+            prepared_statements.execute(cursor, EVENT_LIST_STATEMENTS["count", filtered], filter_params)
+            total_events = cursor.fetchone()['count']
+        elif count_mode == 'cached':
+            cache_key = (start_date_str, end_date_str, deduction_filter)
+            total_events = events_count_cache.get(cache_key)
+            if total_events is None:
+                prepared_statements.execute(cursor, EVENT_LIST_STATEMENTS["count", filtered], filter_params)
+                total_events = cursor.fetchone()['count']
+                events_count_cache.set(cache_key, total_events)
+        elif count_mode == 'estimate':
+            total_events = estimate_count(
+                cursor, SQL_EVENT_LIST_FROM + (SQL_DEDUCTION_FILTER if filtered else ""), filter_params)
+
+        total_pages = None
+        if total_events is not None:
+            total_pages = (total_events + limit - 1) // limit if limit > 0 else 0
+
+        pagination = {
+            "pageSize": limit,
+            "totalItems": total_events,
+            "totalPages": total_pages,
+            "hasMore": has_more,
+            "nextCursor": next_cursor
+        }
+        if not after_key:
+            pagination["currentPage"] = page
+
+        body = {
             "success": True,
             "data": events,
-            "pagination": {
-                "currentPage": page,
-                "pageSize": limit,
-                "totalItems": total_events,
-                "totalPages": (total_events + limit - 1) // limit if limit > 0 else 0
-            }
-        })
+            "pagination": pagination
+        }
+        return raw_json_response(body, events_json) if render_db else jsonify(body)
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Get Events): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"数据库错误 (Get Events): {error}")
         return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
@@ -440,65 +1639,222 @@ def get_events(current_user_id):
             if cursor: cursor.close()
             conn.close()
 
-@app.route('/api/events/<int:event_id>', methods=['GET'])
+# [PERF] 事件及其所有图片在一条 SQL 中取回：图片在数据库端聚合为 JSON 数组，
+# 按 (event_id, event_time) 关联，event_images 只访问事件所在月份的分区；
+# `deduction_items` 在数据库端转换为 jsonb，无需再在 Python 中逐条 json.loads
+# 图片时间戳在 SQL 中格式化为与 CustomJSONEncoder 相同的 ISO-8601 + 'Z'
+def event_detail_sql(image_filter=False):
+    """image_filter=True: 只聚合 deduction_items 包含指定扣分项的图片 (第一个参数)"""
+    image_where = "i.event_id = e.id AND i.event_time = e.event_time" + (
+        " AND i.deduction_items @> %s::jsonb" if image_filter else "")
+    return f"""
+SELECT
+    e.id, e.camera_id, e.equipment_type AS category, e.score, e.event_time AS "timestamp", e.status,
+    COALESCE(img.images, '[]'::json) AS images
+FROM events e
+LEFT JOIN LATERAL (
+    SELECT json_agg(json_build_object(
+        'image_id', i.id,
+        'image_url', i.image_url,
+        'timestamp', {iso_z_sql('i."timestamp"')},
+        'score', i.score,
+        'deduction_items', COALESCE(i.deduction_items::jsonb, '[]'::jsonb)
+    ) ORDER BY i."timestamp" ASC) AS images
+    FROM event_images i
+    WHERE {image_where}
+) img ON true
+"""
+
+SQL_EVENT_DETAIL = event_detail_sql()
+
+# (单个 / 单个且带分区键 / 多个, 是否按扣分项筛选图片) -> 预编译语句
+# 只有 id 时每个分区都要在主键上查找一次；带上 event_time 时只访问一个分区
+EVENT_DETAIL_STATEMENTS = {}
+for _filtered in (False, True):
+    _suffix = "_deduction" if _filtered else ""
+    EVENT_DETAIL_STATEMENTS["one", _filtered] = prepared_statements.prepare(
+        "select_event_detail" + _suffix, event_detail_sql(_filtered) + " WHERE e.id = %s")
+    EVENT_DETAIL_STATEMENTS["one_at", _filtered] = prepared_statements.prepare(
+        "select_event_detail_at" + _suffix, event_detail_sql(_filtered) + " WHERE e.id = %s AND e.event_time = %s")
+    EVENT_DETAIL_STATEMENTS["many", _filtered] = prepared_statements.prepare(
+        "select_event_details" + _suffix, event_detail_sql(_filtered) + " WHERE e.id = ANY(%s::int[])")
+
+# 批量详情接口一次最多查询的事件数
+EVENT_DETAILS_MAX_IDS = 100
+
+def finish_event_detail(event_detail):
+    """修正 image_count 以匹配实际查询到的图片数量"""
+    event_detail['image_count'] = len(event_detail['images'])
+    return event_detail
+
+@api_blueprint.route('/api/events/stream', methods=['GET'])
+@token_required(allow_query_token=True)
+def stream_events(current_user_id):
+    """
+    [NEW ENDPOINT] 以 Server-Sent Events 推送新的事件，替代轮询 get_events
+    - 认证: Authorization Header 或 ?token=
+    - 断线续传: Last-Event-ID Header 或 ?last_event_id=
+    - risk_type=abnormal (默认) | normal | all
+    注意: 每个连接会长期占用一个 worker 线程，每个进程最多 SSE_MAX_SUBSCRIBERS 个 (远小于线程数，见 gunicorn.conf.py)
+    """
+    risk_type = request.args.get('risk_type', 'abnormal')
+    if risk_type not in ('abnormal', 'normal', 'all'):
+        return jsonify({"success": False, "message": "无效的 risk_type 值"}), 400
+    try:
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"success": False, "message": "无效的 Last-Event-ID"}), 400
+
+    try:
+        subscription = get_broadcaster().subscribe(last_event_id, None if risk_type == 'all' else risk_type)
+    except TooManySubscribersError as error:
+        return jsonify({"success": False, "message": str(error)}), 503, {"Retry-After": "10"}
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Event Stream): {error}")
+        return db_busy_response()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"数据库错误 (Event Stream): {error}")
+        return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+
+    def generate():
+        try:
+            # 建议客户端的重连间隔 (毫秒)
+            yield "retry: 3000\n\n"
+            while not subscription.closed:
+                message = subscription.get(timeout=SSE_HEARTBEAT)
+                if message is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield format_sse(message)
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # 关闭 nginx 缓冲
+    })
+
+@api_blueprint.route('/api/events/export', methods=['GET'])
+@token_required
+def export_events(current_user_id):
+    """
+    [NEW ENDPOINT] 流式导出事件及其图片 (每张图片一行)，用于安全审计
+    参数:
+    - format=ndjson (默认) | csv, gzip=1 (Content-Encoding: gzip)
+    - start_date / end_date (YYYY-MM-DD), risk_type=abnormal|normal|all (默认 all), camera_id
+    - after: 上次导出最后一行的 position，从该位置之后继续
+    """
+    export_format = request.args.get('format', 'ndjson')
+    risk_type = request.args.get('risk_type', 'all')
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "无效的 format 参数"}), 400
+    if risk_type not in ('abnormal', 'normal', 'all'):
+        return jsonify({"success": False, "message": "无效的 risk_type 值"}), 400
+    try:
+        start_date_str = request.args.get('start_date') # YYYY-MM-DD
+        end_date_str = request.args.get('end_date') # YYYY-MM-DD
+        for date_str in (start_date_str, end_date_str):
+            if date_str:
+                datetime.strptime(date_str, "%Y-%m-%d")
+        camera_id = request.args.get('camera_id')
+        camera_id = int(camera_id) if camera_id else None
+        after = request.args.get('after')
+        after_key = decode_position(after) if after else None
+    except InvalidCursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except ValueError:
+        return jsonify({"success": False, "message": "无效的筛选参数"}), 400
+
+    sql, params = build_export_query(
+        start_date_str, end_date_str, None if risk_type == 'all' else risk_type, camera_id, after_key
+    )
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection(readonly=True)
+        # [PERF] 命名游标 = 服务器端游标，每次只取回 EXPORT_FETCH_SIZE 行
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = EXPORT_FETCH_SIZE
+        cursor.execute(sql, params)
+    except PoolTimeoutError as error:
+        if conn: conn.close()
+        print(f"数据库连接池繁忙 (Export Events): {error}")
+        return db_busy_response()
+    except (Exception, psycopg2.DatabaseError) as error:
+        if conn: conn.close()
+        print(f"数据库错误 (Export Events): {error}")
+        return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+
+    def generate():
+        try:
+            encoder = CustomJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+            yield from stream_export(cursor, export_format, encoder, use_gzip)
+        except (Exception, psycopg2.DatabaseError) as error:
+            # 响应头已发送，只能中断输出；客户端可使用最后一行的 position 续传
+            print(f"数据库错误 (Export Events): {error}")
+
+    def release():
+        # 连接在整个导出期间被占用；WSGI 服务器关闭响应时 (正常结束、客户端断开，
+        # 或生成器从未开始迭代) 关闭游标并归还连接池
+        try:
+            cursor.close()
+        except psycopg2.Error:
+            pass
+        conn.close()
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="events.{export_format}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    }
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+    response = Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+    response.call_on_close(release)
+    return response
+
+@api_blueprint.route('/api/events/<int:event_id>', methods=['GET'])
 @token_required
 def get_event_detail(current_user_id, event_id):
     """
     [UPGRADED ENDPOINT] 获取单个事件的详细信息，并包含所有关联的图片 (已连接DB)
+    [PERF] 单次往返
+    [NEW] deduction=... 只返回 deduction_items 包含该扣分项的图片
+    [PERF] timestamp=... (可选，列表接口返回的 timestamp) 事件时间，只查询该月份的分区
     """
+    try:
+        deduction_filter = parse_deduction_filter()
+        timestamp_str = request.args.get('timestamp')
+        event_time = parse_event_time(timestamp_str) if timestamp_str else None
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        # 步骤 1: 获取主事件信息
-        sql_event = """
-        SELECT id, camera_id, equipment_type AS category, score, event_time AS "timestamp", image_count, status
-        FROM events
-        WHERE id = %s;
-        """
-        cursor.execute(sql_event, (event_id,))
+        key = "one" if event_time is None else "one_at"
+        params = (event_id,) if event_time is None else (event_id, event_time)
+        if deduction_filter:
+            prepared_statements.execute(cursor, EVENT_DETAIL_STATEMENTS[key, True], (deduction_filter,) + params)
+        else:
+            prepared_statements.execute(cursor, EVENT_DETAIL_STATEMENTS[key, False], params)
         event_detail = cursor.fetchone()
 
         if not event_detail:
             return jsonify({"success": False, "message": "未找到指定 ID 的事件"}), 404
 
-        # 步骤 2: 获取所有关联的图片信息
-        # [MODIFIED] 假设 event_images 表已添加 `score` 和 `deduction_items`
-        sql_images = """
-        SELECT 
-            id AS image_id, 
-            image_url, 
-            "timestamp", 
-            score, 
-            deduction_items
-        FROM event_images
-        WHERE event_id = %s
-        ORDER BY "timestamp" ASC;
-        """
-        cursor.execute(sql_images, (event_id,))
-        images = cursor.fetchall()
-
-        # [FIX] 将 `deduction_items` 从 JSON 字符串转换回列表 (如果 DB 类型是 TEXT)
-        # 如果 DB 类型是 JSONB, psycopg2 会自动处理
-        for img in images:
-            deductions_data = img.get('deduction_items')
-            if isinstance(deductions_data, str):
-                try:
-                    img['deduction_items'] = json.loads(deductions_data)
-                except json.JSONDecodeError:
-                    img['deduction_items'] = []
-            elif deductions_data is None:
-                img['deduction_items'] = []
-        
-        # 步骤 3: 组合 JSON 响应
-        event_detail['images'] = images
-        # 修正 image_count 以匹配实际查询到的数量
-        event_detail['image_count'] = len(images) 
-
-        return jsonify({"success": True, "data": event_detail})
+        return jsonify({"success": True, "data": finish_event_detail(event_detail)})
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Event Detail): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"数据库错误 (Event Detail): {error}")
         return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
@@ -507,9 +1863,121 @@ def get_event_detail(current_user_id, event_id):
             if cursor: cursor.close()
             conn.close()
 
+@api_blueprint.route('/api/events/details', methods=['GET'])
+@token_required
+def get_event_details(current_user_id):
+    """
+    [NEW ENDPOINT] 一次请求、一条 SQL 获取多个事件的详细信息
+    参数: ids=1,2,3 (最多 EVENT_DETAILS_MAX_IDS 个)，结果按请求顺序返回
+    (只有 id: 每个 id 在每个分区的主键上查找一次，图片按 event_time 只访问对应分区)
+    [NEW] deduction=... 只返回 deduction_items 包含该扣分项的图片
+    """
+    try:
+        event_ids = [int(x) for x in request.args.get('ids', '').split(',') if x.strip()]
+    except ValueError:
+        return jsonify({"success": False, "message": "无效的 ids 参数"}), 400
+    try:
+        deduction_filter = parse_deduction_filter()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    if not event_ids:
+        return jsonify({"success": False, "message": "缺少 ids 参数"}), 400
+    if len(event_ids) > EVENT_DETAILS_MAX_IDS:
+        return jsonify({"success": False, "message": f"一次最多查询 {EVENT_DETAILS_MAX_IDS} 个事件"}), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection(readonly=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        if deduction_filter:
+            prepared_statements.execute(cursor, EVENT_DETAIL_STATEMENTS["many", True], (deduction_filter, event_ids))
+        else:
+            prepared_statements.execute(cursor, EVENT_DETAIL_STATEMENTS["many", False], (event_ids,))
+        found = {row['id']: finish_event_detail(row) for row in cursor.fetchall()}
+
+        # 去重并保持请求中的顺序
+        ordered_ids = list(dict.fromkeys(event_ids))
+        return jsonify({
+            "success": True,
+            "data": [found[event_id] for event_id in ordered_ids if event_id in found],
+            "missing": [event_id for event_id in ordered_ids if event_id not in found]
+        })
+
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Event Details): {error}")
+        return db_busy_response()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"数据库错误 (Event Details): {error}")
+        return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+    finally:
+        if conn:
+            if cursor: cursor.close()
+            conn.close()
+
+# --- 图片 (Images) Endpoints ---
+
+@api_blueprint.route('/api/images', methods=['POST'])
+@ingest_auth_required(always=True)
+def upload_images():
+    """
+    [NEW ENDPOINT] 上传图片 (multipart/form-data，可包含多个文件)，需要 X-API-Key 或认证 Token
+    返回每个文件的 image ("<sha256>.<ext>")，可在 add_event 的 images_data[].image 中引用。
+    相同内容的图片只保存一份；客户端可以先用 HEAD /api/images/<image> 检查是否已存在。
+    """
+    if request.mimetype != 'multipart/form-data':
+        return jsonify({"success": False, "message": "未上传任何文件"}), 400
+    try:
+        parse_uploads_to_store(request)
+        if not request.files:
+            return jsonify({"success": False, "message": "未上传任何文件"}), 400
+        stored = store_uploaded_images()
+    except ImageStoreError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({
+        "success": True,
+        "images": [dict(image.to_dict(), field=field, filename=filename) for field, filename, image in stored]
+    }), 201
+
+def image_file_response(found, etag):
+    """图片文件响应: 支持 Range / If-None-Match，内容不变所以可以长期缓存"""
+    if found is None:
+        return jsonify({"success": False, "message": "图片不存在"}), 404
+    path, mimetype = found
+    # send_file 返回文件句柄，gunicorn 等服务器通过 wsgi.file_wrapper 使用 sendfile() 发送
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=etag, max_age=IMAGE_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'private, max-age={IMAGE_CACHE_MAX_AGE}, immutable'
+    return response
+
+@api_blueprint.route('/api/images/<image_name>', methods=['GET'])
+@token_required(allow_query_token=True)
+def get_image(current_user_id, image_name):
+    """
+    [NEW ENDPOINT] 获取原图 (GET / HEAD)
+    """
+    return image_file_response(get_image_store().find(image_name), image_name.split('.')[0])
+
+@api_blueprint.route('/api/images/<image_name>/thumb', methods=['GET'])
+@token_required(allow_query_token=True)
+def get_image_thumbnail(current_user_id, image_name):
+    """
+    [NEW ENDPOINT] 获取缩略图 (首次请求时生成)
+    """
+    try:
+        found = get_image_store().thumbnail(image_name)
+    except OSError as error:
+        print(f"生成缩略图失败 ({image_name}): {error}")
+        return jsonify({"success": False, "message": "无法生成缩略图"}), 500
+    return image_file_response(found, image_name.split('.')[0] + '-thumb')
+
+
 # --- 反馈 (Feedback) Endpoints ---
 
-@app.route('/api/feedback', methods=['POST'])
+SQL_FEEDBACK_EVENT_TIME = "SELECT event_time FROM events WHERE id = %s"
+SQL_FEEDBACK_MARK_IMAGE = "UPDATE event_images SET has_feedback = true WHERE id = %s AND event_id = %s AND event_time = %s"
+
+@api_blueprint.route('/api/feedback', methods=['POST'])
 @token_required
 def add_feedback(current_user_id):
     """
@@ -540,13 +2008,22 @@ def add_feedback(current_user_id):
         ))
         feedback_id = cursor.fetchone()[0]
         
-        # (可选) 更新 event_images 表中的状态
-        cursor.execute("UPDATE event_images SET has_feedback = true WHERE id = %s", (image_id,))
-        
+        # 更新 event_images 表中的状态；先取得事件的 event_time (分区键)，同时确认图片属于该事件
+        cursor.execute(SQL_FEEDBACK_EVENT_TIME, (event_id,))
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute(SQL_FEEDBACK_MARK_IMAGE, (image_id, event_id, row[0]))
+        if row is None or cursor.rowcount == 0:
+            conn.rollback()
+            return jsonify({"success": False, "message": "未找到指定的事件或图片"}), 404
+
         conn.commit()
 
         return jsonify({"success": True, "message": "フィードバックが正常に送信されました。", "feedback_id": feedback_id}), 201
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Feedback): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         if conn: conn.rollback()
         print(f"数据库错误 (Feedback): {error}")
@@ -556,44 +2033,134 @@ def add_feedback(current_user_id):
             if cursor: cursor.close()
             conn.close()
 
+# --- 实时统计 (Live Stats) Endpoints ---
+
+@api_blueprint.route('/api/stats/live', methods=['GET'])
+@token_required
+def get_live_statistics(current_user_id):
+    """
+    [NEW ENDPOINT] 最近 5 分钟 / 1 小时 / 24 小时的事件统计 (内存中的滚动合计，不访问数据库)
+    参数 (可选): camera_id=3 或 equipment_type=helmet 只返回该维度；top=5 扣分项个数
+    """
+    try:
+        camera_id = int(request.args['camera_id']) if request.args.get('camera_id') else None
+        top = min(int(request.args.get('top', LIVE_STATS_TOP_DEDUCTIONS)), 50)
+    except ValueError:
+        return jsonify({"success": False, "message": "无效的参数"}), 400
+    live_stats = get_live_stats()
+    if live_stats is None:
+        return jsonify({"success": False, "message": "实时统计未启用"}), 404
+    return jsonify({
+        "success": True,
+        "ready": live_stats.ready, # false: 仍在从数据库重建，结果可能不完整
+        "windows": live_stats.query(camera_id, request.args.get('equipment_type'), top)
+    })
+
+@api_blueprint.route('/api/deductions', methods=['GET'])
+@token_required
+def get_deductions(current_user_id):
+    """
+    [NEW ENDPOINT] 扣分项词表及出现次数，按次数降序 (用于 GET /api/events?deduction=... 的筛选选项)
+    [PERF] 从天级汇总表 deduction_rollup_daily 读取并缓存，不扫描 events 表
+    参数 (可选): days=30 最近天数, risk_type=abnormal|normal, limit=100
+    """
+    risk_type = request.args.get('risk_type')
+    if risk_type not in (None, 'abnormal', 'normal'):
+        return jsonify({"success": False, "message": "无效的 risk_type 值"}), 400
+    try:
+        days = int(request.args.get('days', 30))
+        limit = int(request.args.get('limit', 100))
+        if not (1 <= days <= 366 and 1 <= limit <= 1000):
+            raise ValueError
+    except ValueError:
+        return jsonify({"success": False, "message": "无效的参数"}), 400
+
+    cache_key = (days, risk_type, limit)
+    deductions = deduction_vocabulary_cache.get(cache_key)
+    if deductions is not None:
+        return jsonify({"success": True, "days": days, "deductions": deductions})
+
+    conn = None
+    try:
+        conn = get_db_connection(readonly=True)
+        cursor = conn.cursor()
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        deductions = deduction_vocabulary(cursor, since, risk_type, limit)
+        deduction_vocabulary_cache.set(cache_key, deductions)
+        return jsonify({"success": True, "days": days, "deductions": deductions})
+
+    except psycopg2.errors.UndefinedTable:
+        return jsonify({"success": False, "message": "汇总表尚未创建"}), 404
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Get Deductions): {error}")
+        return db_busy_response()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"数据库错误 (Get Deductions): {error}")
+        return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
+    finally:
+        if conn:
+            if 'cursor' in locals() and cursor:
+                cursor.close()
+            conn.close()
+
 # --- 定期报告 (Reports) Endpoints ---
 
-@app.route('/api/reports', methods=['GET'])
+SQL_LATEST_REPORT = """
+    SELECT summary_data
+    FROM reports
+    WHERE report_type = %s
+    ORDER BY "year" DESC, "month" DESC, created_at DESC
+    LIMIT 1
+"""
+
+@api_blueprint.route('/api/reports', methods=['GET'])
 @token_required
 def get_periodic_report(current_user_id):
     """
     [MODIFIED] 获取定期报告数据 (已连接DB)
+    返回 `reports` 表中预先保存的最新报告 (`summary_data`，结构见 `api_specification.md`)。
+    [NEW] monthly/weekly 报告附加 `rollup_summary`: 报告引擎从天级汇总表实时生成的当前周期汇总 (见 report_engine.py)，
+    汇总表中没有该周期的数据时为 null
+    参数: type=monthly|weekly, date=YYYY-MM-DD (rollup_summary 的周期内的任意一天，默认今天)
     """
     report_type = request.args.get('type', 'monthly')
+    try:
+        date_str = request.args.get('date')
+        report_day = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str else None
+    except ValueError:
+        return jsonify({"success": False, "message": "无效的日期格式"}), 400
     
     conn = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # [MODIFIED] 真实的数据库查询
+
+        rollup_summary = None
+        if report_type in REPORT_TYPES:
+            try:
+                rollup_summary = build_summary(cursor, report_type, report_day)
+            except psycopg2.errors.UndefinedTable:
+                # 汇总表尚未创建 (未执行 `python migrate.py up`)
+                conn.rollback()
+
         # 假设 `reports` 表由一个单独的脚本预先计算并填充
         # 我们只获取 App 需要的最新一份报告
         # `summary_data` 列必须存储 `api_specification.md` 中定义的完整 JSON 结构
-        sql = """
-        SELECT summary_data 
-        FROM reports
-        WHERE report_type = %s
-        ORDER BY "year" DESC, "month" DESC, created_at DESC
-        LIMIT 1;
-        """
-        cursor.execute(sql, (report_type,))
+        report_data = None
+        cursor.execute(SQL_LATEST_REPORT, (report_type,))
         report = cursor.fetchone()
-        
         if report and report['summary_data']:
             # `summary_data` 已经是 JSON (或 psycopg2 自动转换的 dict)
-            # 我们需要确保它符合App所需的完整结构
             report_data = report['summary_data']
-            
-            # 确保 `success` 和 `report_type` 字段存在
             if not isinstance(report_data, dict):
                  report_data = json.loads(report_data)
-                 
+        elif rollup_summary is not None:
+            report_data = {}
+        if report_data is not None and report_type in REPORT_TYPES:
+            report_data["rollup_summary"] = rollup_summary
+        
+        if report_data is not None:
+            # 确保 `success` 和 `report_type` 字段存在
             report_data["success"] = True
             report_data["report_type"] = report_type
             
@@ -602,6 +2169,9 @@ def get_periodic_report(current_user_id):
             # 如果数据库中没有，返回一个空的或默认的结构
             return jsonify({"success": False, "message": "未找到可用的定期报告"}), 404
 
+    except PoolTimeoutError as error:
+        print(f"数据库连接池繁忙 (Get Report): {error}")
+        return db_busy_response()
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"数据库错误 (Get Report): {error}")
         return jsonify({"success": False, "message": f"数据库错误: {str(error)}"}), 500
@@ -612,20 +2182,45 @@ def get_periodic_report(current_user_id):
             conn.close()
 
 
+# --- 应用工厂 ---
+def create_app():
+    """
+    [NEW] 创建 Flask 应用并注册路由。不访问数据库、不启动线程，可在 gunicorn master 中 preload；
+    worker 的初始化和预热由 init_worker() 完成
+    """
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    app.config['SECRET_KEY'] = SECRET_KEY
+    # [FIX] Flask >= 2.3 不再读取 app.json_encoder，通过 JSON provider 使用同样的规则
+    app.json = CustomJSONProvider(app)
+    bcrypt.init_app(app)
+    app.register_blueprint(api_blueprint)
+    if PROXY_FIX_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
+    return app
+
+# `gunicorn api:app` 及现有脚本使用的模块级应用
+app = create_app()
+IMPORT_SECONDS = time.monotonic() - IMPORT_STARTED
+
+
 # --- 启动服务器 ---
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    print(f"--- Flask API サーバーをポート {port} で起動します ---")
+    print(f"--- Flask API サーバーをポート {port} で起動します (import {IMPORT_SECONDS:.2f}s) ---")
     
     # 检查是否在 Render.com 环境中 (Render 会设置 RENDER 环境变量)
     is_production = 'RENDER' in os.environ
     
     if is_production:
-        print("--- Waitress サーバー (Production) を使用します ---")
-        from waitress import serve
-        serve(app, host='0.0.0.0', port=port)
+        # [MODIFIED] 使用 gunicorn.conf.py (preload + post_fork 预热)，与 `gunicorn -c gunicorn.conf.py` 相同
+        print("--- gunicorn サーバー (Production) を使用します ---")
+        import sys
+        from gunicorn.app.wsgiapp import run
+        sys.argv = [sys.argv[0], "-c", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py"),
+                    "-b", f"0.0.0.0:{port}", "api:app"]
+        run()
     else:
         print("--- Flask 開発サーバー (Debug) を使用します ---")
         # 本地开发时，debug=True 可以提供热重载和更详细的错误
         app.run(host='0.0.0.0', port=port, debug=True)
-
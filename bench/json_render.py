@@ -0,0 +1,100 @@
+"""
+[BENCH] 对比列表接口的两种 JSON 渲染方式 (Python jsonify / 数据库端渲染)
+
+    python bench/json_render.py --limits 20,100,500 --repeat 200
+
+在进程内通过 Flask test client 调用 GET /api/events 和 GET /api/cameras，
+分别使用 ?render=python 和 ?render=db，先确认两者的响应体逐字节一致，再比较耗时。
+需要先用 bench/seed.py 生成数据。
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from seed import BENCH_PASSWORD, BENCH_USERNAME # noqa: E402
+
+
+RENDER_MODES = ("db", "python") # db 在前: 摄像头列表缓存由 render=db 的请求加载，同时保存数据库生成的响应体
+
+
+def login(client):
+    response = client.post("/api/auth/login", json={"username": BENCH_USERNAME, "password": BENCH_PASSWORD})
+    if response.status_code != 200:
+        raise SystemExit(f"登录失败 ({response.status_code})，请先执行 bench/seed.py")
+    return response.get_json()["token"]
+
+
+def fetch(client, token, path, render):
+    separator = "&" if "?" in path else "?"
+    response = client.get(f"{path}{separator}render={render}", headers={"Authorization": f"Bearer {token}"})
+    if response.status_code != 200:
+        raise SystemExit(f"{path} 返回 {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response.get_data()
+
+
+def measure(client, token, path, repeat, warmup):
+    """返回 {render: [秒, ...]}；两种方式交替执行，减少缓存和负载变化的影响"""
+    bodies = {render: fetch(client, token, path, render) for render in RENDER_MODES}
+    if bodies["python"] != bodies["db"]:
+        for i, (a, b) in enumerate(zip(bodies["python"], bodies["db"])):
+            if a != b:
+                break
+        else:
+            i = min(len(bodies["python"]), len(bodies["db"]))
+        raise SystemExit(f"{path}: 响应体不一致 (第 {i} 字节)\n"
+                         f"  python: {bodies['python'][max(0, i - 60):i + 60]!r}\n"
+                         f"  db:     {bodies['db'][max(0, i - 60):i + 60]!r}")
+
+    samples = {render: [] for render in RENDER_MODES}
+    for n in range(warmup + repeat):
+        for render in RENDER_MODES:
+            started = time.perf_counter()
+            fetch(client, token, path, render)
+            if n >= warmup:
+                samples[render].append(time.perf_counter() - started)
+    return samples, len(bodies["db"])
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON 渲染方式对比")
+    parser.add_argument("--database-url", default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument("--limits", default="20,100,500", help="GET /api/events 的每页条数")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        raise SystemExit("请通过 --database-url 或 BENCH_DATABASE_URL 指定基准测试数据库")
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('CAMERA_CACHE_TTL', '86400') # 测试期间摄像头列表缓存不过期
+    import api # noqa: E402  (DATABASE_URL 在导入时读取)
+
+    client = api.app.test_client()
+    token = login(client)
+    api.invalidate_camera_cache()
+    paths = [f"/api/events?limit={int(limit)}&count=none" for limit in args.limits.split(",")]
+    paths.append("/api/cameras")
+
+    print(f"{'path':<40} {'bytes':>9} {'render':>7} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for path in paths:
+        samples, size = measure(client, token, path, args.repeat, args.warmup)
+        for render in RENDER_MODES:
+            values = samples[render]
+            print(f"{path:<40} {size:>9} {render:>7} {percentile(values, 0.5) * 1000:>9.2f} "
+                  f"{percentile(values, 0.95) * 1000:>9.2f} {statistics.mean(values) * 1000:>9.2f}")
+        speedup = statistics.mean(samples["python"]) / statistics.mean(samples["db"])
+        print(f"{'':<40} {'':>9} {'x':>7} {speedup:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+[BENCH] API 负载测试
+
+    # 启动 gunicorn 并按默认流量配比压测 60 秒，保存为基线
+    python bench/loadgen.py --spawn-server --duration 60 --save bench/baseline.json
+
+    # 修改代码后用相同参数再跑一次，与基线对比 (退化超过阈值时退出码为 1)
+    python bench/loadgen.py --spawn-server --duration 60 --compare bench/baseline.json
+
+流量配比 (--mix) 的可选项: ingest, list, list_keyset, detail, details, login, report, cameras
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+from seed import BENCH_PASSWORD, BENCH_USERNAME, EQUIPMENT_TYPES # noqa: E402
+
+
+DEFAULT_MIX = "ingest=40,list=25,detail=20,login=2,report=5,cameras=8"
+
+
+# --- 单个请求 ---
+
+class Client:
+    """每个压测线程一个持久 HTTP 连接"""
+    def __init__(self, base_url, token=None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.token = token
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body=payload, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 1:
+                    raise
+
+
+class Scenario:
+    """各类请求的生成方式"""
+    def __init__(self, max_event_id, camera_ids):
+        self.max_event_id = max(max_event_id, 1)
+        self.camera_ids = camera_ids or [1]
+        self.cursors = {}
+
+    def ingest(self, client, rng):
+        now = datetime.utcnow()
+        body = {
+            "camera_id": rng.choice(self.camera_ids),
+            "equipment_type": rng.choice(EQUIPMENT_TYPES),
+            "timestamp": now.isoformat() + "Z",
+            "risk_type": "abnormal" if rng.random() < 0.3 else "normal",
+            "score": round(rng.uniform(0, 100), 2),
+            "deductions": ["no helmet"] if rng.random() < 0.5 else [],
+            "images_data": [
+                {"filename": f"bench_{now.timestamp()}_{i}.jpg", "score": round(rng.uniform(0, 100), 2),
+                 "deductions": ["no helmet"]}
+                for i in range(3)
+            ],
+        }
+        return client.request("POST", "/api/events", body)
+
+    def list(self, client, rng):
+        page = rng.randint(1, 50)
+        return client.request("GET", f"/api/events?page={page}&limit=20")
+
+    def list_keyset(self, client, rng):
+        # 模拟客户端连续翻页: 每个线程沿着 nextCursor 向后翻，翻到 50 页后从头开始
+        key = threading.get_ident()
+        cursor, pages = self.cursors.get(key, (None, 0))
+        path = "/api/events?limit=20&count=none"
+        if cursor and pages < 50:
+            path += f"&after={cursor}"
+        else:
+            pages = 0
+        status, data = client.request("GET", path)
+        try:
+            cursor = json.loads(data)["pagination"].get("nextCursor")
+        except (ValueError, KeyError):
+            cursor = None
+        self.cursors[key] = (cursor, pages + 1)
+        return status, data
+
+    def detail(self, client, rng):
+        return client.request("GET", f"/api/events/{rng.randint(1, self.max_event_id)}")
+
+    def details(self, client, rng):
+        ids = ",".join(str(rng.randint(1, self.max_event_id)) for _ in range(20))
+        return client.request("GET", f"/api/events/details?ids={ids}")
+
+    def login(self, client, rng):
+        return client.request("POST", "/api/auth/login", {"username": BENCH_USERNAME, "password": BENCH_PASSWORD})
+
+    def report(self, client, rng):
+        return client.request("GET", f"/api/reports?type={rng.choice(['monthly', 'weekly'])}")
+
+    def cameras(self, client, rng):
+        return client.request("GET", "/api/cameras")
+
+
+# --- 统计 ---
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name, records in sorted(samples.items()):
+        latencies = sorted(latency for latency, ok in records)
+        errors = sum(1 for _, ok in records if not ok)
+        endpoints[name] = {
+            "count": len(records),
+            "errors": errors,
+            "throughput": round(len(records) / elapsed, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {"elapsed": round(elapsed, 2), "total_requests": total,
+            "throughput": round(total / elapsed, 2) if elapsed else 0, "endpoints": endpoints}
+
+
+def print_summary(result):
+    print(f"\n总计 {result['total_requests']} 个请求, {result['elapsed']}s, {result['throughput']} req/s")
+    print(f"{'endpoint':<12} {'count':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:<12} {e['count']:>8} {e['errors']:>7} {e['throughput']:>9} "
+              f"{e['p50_ms']:>9} {e['p95_ms']:>9} {e['p99_ms']:>9}")
+
+
+def compare(result, baseline, tolerance):
+    """与基线对比，返回退化项列表 (p95 变慢或吞吐量下降超过 tolerance)"""
+    regressions = []
+    print(f"\n与基线对比 (允许偏差 {tolerance:.0%}):")
+    for name, current in result["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if not base or not base.get("p95_ms") or not current.get("p95_ms"):
+            continue
+        p95_change = current["p95_ms"] / base["p95_ms"] - 1
+        tput_change = current["throughput"] / base["throughput"] - 1 if base["throughput"] else 0
+        flag = ""
+        if p95_change > tolerance or tput_change < -tolerance:
+            regressions.append(name)
+            flag = "  <-- 退化"
+        print(f"{name:<12} p95 {base['p95_ms']:>9} -> {current['p95_ms']:>9} ({p95_change:+.1%})  "
+              f"req/s {base['throughput']:>8} -> {current['throughput']:>8} ({tput_change:+.1%}){flag}")
+    return regressions
+
+
+# --- 运行 ---
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(Scenario, name.strip()):
+            raise SystemExit(f"未知的请求类型: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def spawn_server(args):
+    # 压测单个客户端 IP 的吞吐量: 关闭准入控制，避免快速返回的 429 混入延迟统计
+    env = dict(os.environ, DATABASE_URL=args.database_url, INGEST_ADMISSION_ENABLED='0')
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+               "-w", str(args.workers), "--threads", str(args.threads), "-b", f"127.0.0.1:{args.port}", "api:app"]
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=1)
+            conn.request("GET", "/api/system/ready") # 预热完成后才开始压测
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("gunicorn 启动超时")
+
+
+def prepare(base_url):
+    """登录获取 token，并读取事件 id 范围和摄像头列表"""
+    client = Client(base_url)
+    status, data = client.request("POST", "/api/auth/login", {"username": BENCH_USERNAME, "password": BENCH_PASSWORD})
+    if status != 200:
+        raise SystemExit(f"基准用户登录失败 ({status})，请先运行 bench/seed.py")
+    client.token = json.loads(data)["token"]
+    _, data = client.request("GET", "/api/events?limit=1&count=none")
+    events = json.loads(data).get("data") or [{"id": 1}]
+    _, data = client.request("GET", "/api/cameras")
+    cameras = [c["id"] for c in json.loads(data).get("data", [])]
+    return client.token, events[0]["id"], cameras
+
+
+def run(base_url, token, scenario, mix, concurrency, duration, warmup, seed):
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = Client(base_url, token)
+        local = defaultdict(list)
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status, _ = getattr(scenario, name)(client, rng)
+                ok = status < 400
+            except (http.client.HTTPException, OSError):
+                ok = False
+            latency = time.perf_counter() - started
+            if now >= start_at: # 预热阶段的请求不计入结果
+                local[name].append((latency, ok))
+        with lock:
+            for name, records in local.items():
+                samples[name].extend(records)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, duration)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API 负载测试")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--database-url", default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"请求配比, 默认 {DEFAULT_MIX}")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--spawn-server", action="store_true", help="启动 gunicorn 运行 api:app")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--save", help="把结果保存为基线 JSON")
+    parser.add_argument("--compare", help="与基线 JSON 对比")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    process = None
+    if args.spawn_server:
+        if not args.database_url:
+            raise SystemExit("--spawn-server 需要 --database-url 或 BENCH_DATABASE_URL")
+        process = spawn_server(args)
+        args.url = f"http://127.0.0.1:{args.port}"
+    try:
+        token, max_event_id, cameras = prepare(args.url)
+        scenario = Scenario(max_event_id, cameras)
+        result = run(args.url, token, scenario, mix, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+
+    result["config"] = {
+        "mix": mix, "concurrency": args.concurrency, "duration": args.duration,
+        "workers": args.workers if args.spawn_server else None,
+        "threads": args.threads if args.spawn_server else None,
+        "python": platform.python_version(), "machine": platform.machine(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+    }
+    print_summary(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n性能退化: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
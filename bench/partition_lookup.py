@@ -0,0 +1,106 @@
+"""
+[BENCH] 分区表上按 id 查询 (不带分区键) 与带 event_time 查询的代价对比
+
+    python bench/partition_lookup.py --samples 200
+
+events / event_images 按 event_time 分区，只有 id 的查询无法裁剪分区，每个分区都要在主键上查找一次。
+对 api.py 中的查询分别执行 EXPLAIN (ANALYZE, FORMAT JSON)，输出实际访问的分区数和耗时。
+需要先用 bench/seed.py 生成数据。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def scanned_partitions(plan):
+    """计划中实际执行过 (loops > 0) 的分区扫描数"""
+    count = 0
+    if plan.get("Relation Name", "").startswith(("events_", "event_images_")) and plan.get("Actual Loops", 0) > 0:
+        count += 1
+    for child in plan.get("Plans", []):
+        count += scanned_partitions(child)
+    return count
+
+
+def measure(cursor, sql, params_list):
+    """返回 (平均访问分区数, 每次执行的耗时列表)"""
+    partitions = []
+    samples = []
+    for params in params_list:
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+        plan = plan if isinstance(plan, list) else json.loads(plan)
+        partitions.append(scanned_partitions(plan[0]["Plan"]))
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        samples.append(time.perf_counter() - started)
+    return statistics.mean(partitions), samples
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分区表按 id 查询的代价")
+    parser.add_argument("--database-url", default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument("--samples", type=int, default=200, help="随机抽取的事件数")
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        raise SystemExit("请通过 --database-url 或 BENCH_DATABASE_URL 指定基准测试数据库")
+    os.environ['DATABASE_URL'] = args.database_url
+    import psycopg2 # noqa: E402
+    import api # noqa: E402  (DATABASE_URL 在导入时读取)
+    from event_stream import SSE_REPLAY_LIMIT # noqa: E402
+
+    conn = psycopg2.connect(args.database_url)
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = 'events'::regclass")
+    partition_count = cursor.fetchone()[0]
+    cursor.execute("SELECT id, event_time FROM events TABLESAMPLE SYSTEM (1) LIMIT %s", (args.samples,))
+    keys = cursor.fetchall()
+    if not keys:
+        raise SystemExit("events 表为空，请先执行 bench/seed.py")
+    image_keys = []
+    for event_id, event_time in keys:
+        cursor.execute("SELECT id FROM event_images WHERE event_id = %s AND event_time = %s LIMIT 1",
+                       (event_id, event_time))
+        row = cursor.fetchone()
+        if row:
+            image_keys.append((row[0], event_id, event_time))
+
+    detail_sql = api.event_detail_sql()
+    cases = [
+        ("detail (id)", detail_sql + " WHERE e.id = %s", [(k[0],) for k in keys]),
+        ("detail (id, event_time)", detail_sql + " WHERE e.id = %s AND e.event_time = %s", keys),
+        ("details (10 ids)", detail_sql + " WHERE e.id = ANY(%s::int[])",
+         [([k[0] for k in keys[i:i + 10]],) for i in range(0, len(keys), 10)]),
+        ("feedback event_time (id)", "SELECT event_time FROM events WHERE id = %s", [(k[0],) for k in keys]),
+        ("feedback image (id, event_time)",
+         "SELECT id FROM event_images WHERE id = %s AND event_id = %s AND event_time = %s", image_keys),
+        ("load_events_since", api.SQL_EVENTS_SINCE, [(k[0], SSE_REPLAY_LIMIT) for k in keys[:20]]),
+    ]
+
+    print(f"events 分区数: {partition_count}")
+    print(f"{'query':<34} {'partitions':>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, sql, params_list in cases:
+        if not params_list:
+            continue
+        scanned, samples = measure(cursor, sql, params_list)
+        print(f"{name:<34} {scanned:>10.1f} {percentile(samples, 0.5) * 1000:>9.2f} "
+              f"{percentile(samples, 0.95) * 1000:>9.2f}")
+    conn.rollback()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+[BENCH] 在本地 PostgreSQL 中执行数据库迁移并生成基准测试数据
+
+    python bench/seed.py --events 2000000 --images-per-event 3
+
+数据在数据库端用 generate_series 生成 (setseed 固定随机数，结果可复现)，
+完成后回填报告汇总表并执行 ANALYZE。
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import migrate # noqa: E402
+import partitions # noqa: E402
+import report_engine # noqa: E402
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench-password'
+EQUIPMENT_TYPES = ['helmet', 'harness', 'vest', 'gloves', 'goggles']
+DEDUCTION_SETS = [
+    '[]',
+    '["no helmet"]',
+    '["no harness"]',
+    '["no helmet", "no vest"]',
+    '["no gloves", "no goggles"]',
+]
+
+
+def seed(cursor, events, images_per_event, cameras, days, abnormal_ratio):
+    timings = {}
+
+    # 历史数据所在月份的分区 (迁移只创建了本月及以后的分区)
+    started = time.monotonic()
+    partitions.ensure_partitions(cursor, since=datetime.utcnow() - timedelta(days=days + 1))
+    timings["partitions"] = time.monotonic() - started
+
+    started = time.monotonic()
+    cursor.execute("SELECT setseed(0.42)")
+    cursor.execute("""
+        INSERT INTO cameras (name, status, stream_url, is_active)
+        SELECT 'camera-' || lpad(g::text, 3, '0'), 'online', 'rtsp://127.0.0.1:8554/camera' || g, g %% 10 <> 0
+        FROM generate_series(1, %s) AS g
+    """, (cameras,))
+    timings["cameras"] = time.monotonic() - started
+
+    started = time.monotonic()
+    cursor.execute("""
+        INSERT INTO events (camera_id, equipment_type, event_time, risk_type, score, image_filename, image_count, status, deductions)
+        SELECT
+            1 + (g %% %(cameras)s),
+            (%(equipment)s::text[])[1 + (g %% array_length(%(equipment)s::text[], 1))],
+            date_trunc('second', now()::timestamp) - (%(days)s * interval '1 day') * (g::float8 / %(events)s),
+            CASE WHEN random() < %(abnormal_ratio)s THEN 'abnormal' ELSE 'normal' END,
+            round((random() * 100)::numeric, 2),
+            'event_' || g || '.jpg',
+            %(images)s,
+            'new',
+            ((%(deductions)s::text[])[1 + (g %% array_length(%(deductions)s::text[], 1))])::jsonb
+        FROM generate_series(1, %(events)s) AS g
+    """, {
+        "cameras": cameras, "equipment": EQUIPMENT_TYPES, "days": days, "events": events,
+        "abnormal_ratio": abnormal_ratio, "images": images_per_event, "deductions": DEDUCTION_SETS,
+    })
+    timings["events"] = time.monotonic() - started
+
+    started = time.monotonic()
+    cursor.execute("""
+        INSERT INTO event_images (event_id, event_time, image_url, "timestamp", score, deduction_items)
+        SELECT e.id, e.event_time, 'https://storage.example.com/full/event_' || e.id || '_' || k || '.jpg',
+               e.event_time + k * interval '1 second', e.score, e.deductions
+        FROM events e
+        CROSS JOIN generate_series(0, %s - 1) AS k
+    """, (images_per_event,))
+    timings["event_images"] = time.monotonic() - started
+
+    started = time.monotonic()
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=12)).decode('utf-8')
+    cursor.execute("""
+        INSERT INTO users (username, password_hash, email, full_name, role)
+        VALUES (%s, %s, %s, %s, 'teacher')
+        ON CONFLICT (username) DO NOTHING
+    """, (BENCH_USERNAME, password_hash, 'bench@example.com', 'Benchmark User'))
+    timings["users"] = time.monotonic() - started
+
+    started = time.monotonic()
+    report_engine.backfill(cursor)
+    timings["rollups"] = time.monotonic() - started
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成基准测试数据")
+    parser.add_argument("--database-url", default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--images-per-event", type=int, default=3)
+    parser.add_argument("--cameras", type=int, default=50)
+    parser.add_argument("--days", type=int, default=180, help="事件分布的天数 (截止到现在)")
+    parser.add_argument("--abnormal-ratio", type=float, default=0.3)
+    parser.add_argument("--reset", action="store_true", help="先删除已有的表")
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        raise SystemExit("请通过 --database-url 或 BENCH_DATABASE_URL 指定基准测试数据库")
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        cursor = conn.cursor()
+        if args.reset:
+            cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+            conn.commit()
+        migrate.migrate(conn)
+        timings = seed(cursor, args.events, args.images_per_event, args.cameras, args.days, args.abnormal_ratio)
+        conn.commit()
+
+        conn.autocommit = True
+        started = time.monotonic()
+        cursor.execute("VACUUM ANALYZE")
+        timings["vacuum_analyze"] = time.monotonic() - started
+    finally:
+        conn.close()
+
+    for step, seconds in timings.items():
+        print(f"{step:>16}: {seconds:8.2f}s")
+    print(f"基准用户: {BENCH_USERNAME} / {BENCH_PASSWORD}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+[NEW] 摄像头在线状态 (心跳)
+
+- 摄像头 / 分析盒定期调用 POST /api/cameras/heartbeat，上报帧率和健康状态
+- 每个 worker 进程在内存中维护最近一次心跳的时间、帧率和健康状态，GET /api/cameras 直接读取，不访问数据库
+- 后台线程定期把状态变化批量写入 `cameras.status` / `cameras.last_seen_at` (一条 UPDATE)
+- 超过 CAMERA_OFFLINE_TIMEOUT 秒没有心跳的摄像头视为 offline
+
+多个 worker 时心跳会分散到不同进程: 写入 offline 前会比较数据库中的 last_seen_at，
+其他进程刚收到过心跳的摄像头不会被标记为 offline。
+后台线程每次写入后同时读取数据库中各摄像头的 status / last_seen_at (其他进程写入的共享状态)，
+statuses() 对每个摄像头使用 last_seen 较新的一方，因此不同 worker 返回的状态一致，不会因为心跳落在其他进程而显示为 offline。
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+
+CAMERA_OFFLINE_TIMEOUT = float(os.environ.get('CAMERA_OFFLINE_TIMEOUT', 60)) # 秒
+CAMERA_STATUS_FLUSH_INTERVAL = float(os.environ.get('CAMERA_STATUS_FLUSH_INTERVAL', 5)) # 秒
+HEARTBEAT_BATCH_LIMIT = 500 # 一次请求最多上报的摄像头数
+
+STATUS_ONLINE = 'online'
+STATUS_DEGRADED = 'degraded'
+STATUS_OFFLINE = 'offline'
+HEALTH_VALUES = ('ok', 'degraded', 'error')
+
+FLUSH_SQL = """
+    UPDATE cameras AS c
+    SET status = v.status,
+        last_seen_at = GREATEST(c.last_seen_at, v.last_seen_at)
+    FROM unnest(%s::int[], %s::text[], %s::timestamp[]) AS v(id, status, last_seen_at)
+    WHERE c.id = v.id
+      AND (v.status <> 'offline' OR c.last_seen_at IS NULL OR c.last_seen_at <= v.last_seen_at)
+"""
+SHARED_STATE_SQL = "SELECT id, status, last_seen_at FROM cameras WHERE last_seen_at IS NOT NULL"
+
+
+class HeartbeatError(ValueError):
+    """心跳数据无效，message 可以直接返回给客户端"""
+
+
+def parse_heartbeat(data):
+    """校验一条心跳: {"camera_id": 3, "fps": 14.8, "health": "ok"}，fps / health 可省略"""
+    if not isinstance(data, dict):
+        raise HeartbeatError("心跳数据必须是 JSON 对象")
+    camera_id = data.get('camera_id')
+    if isinstance(camera_id, bool) or not isinstance(camera_id, int) or camera_id <= 0:
+        raise HeartbeatError("camera_id 必须是正整数")
+
+    fps = data.get('fps')
+    if fps is not None:
+        if isinstance(fps, bool) or not isinstance(fps, (int, float)) or not math.isfinite(fps) or fps < 0:
+            raise HeartbeatError("fps 必须是非负数")
+        fps = round(float(fps), 2)
+
+    health = data.get('health', 'ok')
+    if health not in HEALTH_VALUES:
+        raise HeartbeatError(f"health 必须是 {', '.join(HEALTH_VALUES)} 之一")
+    return {"camera_id": camera_id, "fps": fps, "health": health}
+
+
+class CameraStatusTable:
+    """
+    [PERF] 进程内的摄像头状态表 + 后台批量写入线程。
+    心跳只修改内存；数据库只在状态变化，或 last_seen_at 落后超过 offline_timeout 的一半时更新。
+    """
+    def __init__(self, get_connection, offline_timeout=CAMERA_OFFLINE_TIMEOUT,
+                 flush_interval=CAMERA_STATUS_FLUSH_INTERVAL):
+        self.get_connection = get_connection
+        self.offline_timeout = offline_timeout
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.changed_at = time.time() # 最近一次状态变化的时间 (用于 Last-Modified)
+
+        self._lock = threading.Lock()
+        # camera_id -> {"seen": monotonic, "last_seen": utc datetime, "fps", "health",
+        #               "flushed_status", "flushed_seen": 已写入数据库的状态和 last_seen_at}
+        self._cameras = {}
+        self._statuses = {} # camera_id -> 最近一次计算出的状态 (检测变化)
+        self._shared = {} # camera_id -> (status, last_seen_at): 最近一次从数据库读取的共享状态
+        self._stop = threading.Event()
+        self._stats = {"heartbeats": 0, "flushes": 0, "flushed_rows": 0, "flush_errors": 0, "went_offline": 0}
+        self._thread = threading.Thread(target=self._run, name="camera-status-flusher", daemon=True)
+        self._thread.start()
+
+    def _status_of(self, entry, now):
+        if now - entry["seen"] > self.offline_timeout:
+            return STATUS_OFFLINE
+        return STATUS_ONLINE if entry["health"] == 'ok' else STATUS_DEGRADED
+
+    def _resolve(self, camera_id, now, now_utc):
+        """调用方持有 self._lock；本进程的心跳不比数据库中的 last_seen_at 新时使用共享状态"""
+        entry = self._cameras.get(camera_id)
+        shared = self._shared.get(camera_id)
+        if entry is not None and (shared is None or entry["last_seen"] >= shared[1]):
+            return self._status_of(entry, now)
+        status, last_seen = shared
+        if (now_utc - last_seen).total_seconds() > self.offline_timeout:
+            return STATUS_OFFLINE
+        return status
+
+    def _update_status(self, camera_id, status):
+        """调用方持有 self._lock"""
+        previous = self._statuses.get(camera_id)
+        if previous != status:
+            self._statuses[camera_id] = status
+            self.changed_at = time.time()
+            if status == STATUS_OFFLINE:
+                self._stats["went_offline"] += 1
+
+    # --- 请求线程 ---
+    def heartbeat(self, camera_id, fps=None, health='ok'):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cameras.get(camera_id)
+            if entry is None:
+                entry = self._cameras[camera_id] = {"flushed_status": None, "flushed_seen": None}
+            entry.update(seen=now, last_seen=datetime.utcfromtimestamp(time.time()), fps=fps, health=health)
+            self._update_status(camera_id, self._resolve(camera_id, now, entry["last_seen"]))
+            self._stats["heartbeats"] += 1
+
+    def statuses(self):
+        """{camera_id: status}，包含本进程收到过心跳或数据库中有 last_seen_at 的摄像头"""
+        now = time.monotonic()
+        now_utc = datetime.utcfromtimestamp(time.time())
+        with self._lock:
+            for camera_id in self._cameras.keys() | self._shared.keys():
+                self._update_status(camera_id, self._resolve(camera_id, now, now_utc))
+            return dict(self._statuses)
+
+    def snapshot(self):
+        """{camera_id: {"status", "last_seen", "fps", "health"}}，只包含本进程收到的心跳"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                camera_id: {
+                    "status": self._status_of(entry, now),
+                    "last_seen": entry["last_seen"],
+                    "fps": entry["fps"],
+                    "health": entry["health"],
+                }
+                for camera_id, entry in self._cameras.items()
+            }
+
+    # --- 后台写入线程 ---
+    def _pending_updates(self):
+        now = time.monotonic()
+        refresh_after = self.offline_timeout / 2
+        updates = []
+        with self._lock:
+            for camera_id, entry in self._cameras.items():
+                status = self._status_of(entry, now)
+                stale = (
+                    status != STATUS_OFFLINE
+                    and (entry["flushed_seen"] is None
+                         or (entry["last_seen"] - entry["flushed_seen"]).total_seconds() >= refresh_after)
+                )
+                if status != entry["flushed_status"] or stale:
+                    updates.append((camera_id, status, entry["last_seen"]))
+        return updates
+
+    def flush(self):
+        """把状态变化写入数据库并读取共享状态，返回写入的摄像头数"""
+        updates = self._pending_updates()
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            if updates:
+                cursor.execute(FLUSH_SQL, ([u[0] for u in updates], [u[1] for u in updates], [u[2] for u in updates]))
+            cursor.execute(SHARED_STATE_SQL)
+            shared = {camera_id: (status, last_seen) for camera_id, status, last_seen in cursor.fetchall()}
+            conn.commit()
+        except Exception as error:
+            if conn: conn.rollback()
+            with self._lock:
+                self._stats["flush_errors"] += 1
+            print(f"数据库错误 (Camera Status): {error}")
+            return 0
+        finally:
+            if conn:
+                if cursor: cursor.close()
+                conn.close()
+
+        with self._lock:
+            self._shared = shared
+            for camera_id, status, last_seen in updates:
+                entry = self._cameras[camera_id]
+                entry["flushed_status"] = status
+                entry["flushed_seen"] = last_seen
+            if updates:
+                self._stats["flushes"] += 1
+                self._stats["flushed_rows"] += len(updates)
+        return len(updates)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as error:
+                print(f"状态写入线程异常 (Camera Status): {error}")
+
+    # --- 生命周期 ---
+    def stop(self):
+        """停止后台线程并写入最后一次状态变化"""
+        self._stop.set()
+        self._thread.join(self.flush_interval + 5)
+        return self.flush()
+
+    def stats(self):
+        counts = {}
+        for status in self.statuses().values():
+            counts[status] = counts.get(status, 0) + 1
+        with self._lock:
+            data = dict(self._stats)
+            data["tracked"] = len(self._cameras)
+            data["shared"] = len(self._shared)
+        data["online"] = counts.get(STATUS_ONLINE, 0)
+        data["degraded"] = counts.get(STATUS_DEGRADED, 0)
+        data["offline"] = counts.get(STATUS_OFFLINE, 0)
+        data["offline_timeout"] = self.offline_timeout
+        data["flush_interval"] = self.flush_interval
+        return data
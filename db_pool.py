@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+
+
+# --- 连接池配置 (可通过环境变量覆盖) ---
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+POOL_BORROW_TIMEOUT = float(os.environ.get('DB_POOL_BORROW_TIMEOUT', 3.0)) # 借出连接的最长等待秒数
+# 空闲超过该秒数的连接在借出前执行 SELECT 1。默认 0: 每次借出都校验，数据库重启后不会把失效连接交给请求；
+# 设为正数可以省去刚归还的连接的一次往返，但数据库重启后这段时间内用过的连接会在第一次查询时失败
+POOL_VALIDATE_IDLE = float(os.environ.get('DB_POOL_VALIDATE_IDLE', 0.0))
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 600.0)) # 超过 min_size 的空闲连接在此时间后关闭
+
+
+class PoolTimeoutError(Exception):
+    """在 borrow_timeout 内没有可用连接 (handler 应返回 503)"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    [PERF] 由连接池管理的 psycopg2 连接。
+    handler 仍然在 finally 中调用 conn.close()，这里将其改为归还连接池，
+    因此现有的 try/finally 写法无需修改。
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._checked_out = False
+        self._idle_since = time.monotonic()
+        self.prepared_statements = set() # [PERF] 本连接上已 PREPARE 的语句名 (见 prepared_statements.py)
+        self.stale_statements = set() # 计划已失效、需要 DEALLOCATE 后重新 PREPARE 的语句名
+
+    def close(self):
+        if self._pool is not None and self._checked_out:
+            self._pool.putconn(self)
+        else:
+            self.discard()
+
+    def cursor(self, *args, **kwargs):
+        """[METRICS] 返回带计时的游标 (保持调用方指定的 cursor_factory，如 RealDictCursor)"""
+        if metrics.METRICS_ENABLED:
+            factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = metrics.instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+    def discard(self):
+        """真正关闭底层连接"""
+        self._pool = None
+        if not self.closed:
+            psycopg2.extensions.connection.close(self)
+
+
+class ConnectionPool:
+    """
+    [PERF] 线程安全的 PostgreSQL 连接池。
+    - 借出时校验连接 (SELECT 1，失效的连接会被替换；validate_idle > 0 时只校验空闲较久的连接)
+    - 数据库重启后，失效的连接会在借出/归还时被丢弃并重建
+    - 超过 borrow_timeout 仍无可用连接时抛出 PoolTimeoutError
+    """
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 borrow_timeout=POOL_BORROW_TIMEOUT, validate_idle=POOL_VALIDATE_IDLE,
+                 max_idle=POOL_MAX_IDLE, connect_timeout=None):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("无效的连接池大小配置")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.borrow_timeout = borrow_timeout
+        self.validate_idle = validate_idle
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout # 建立连接的超时秒数 (libpq connect_timeout)；None 使用 DSN 中的设置
+        self.pid = os.getpid()
+
+        self._idle = deque()
+        self._size = 0 # 已打开 (含正在建立) 的连接数
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "validation_failures": 0,
+        }
+
+    # --- 内部辅助函数 ---
+    def _connect(self):
+        kwargs = {} if self.connect_timeout is None else {"connect_timeout": self.connect_timeout}
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection, **kwargs)
+        conn._pool = self
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _release_slot(self, discarded=True):
+        with self._cond:
+            self._size -= 1
+            if discarded:
+                self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def _is_usable(self, conn):
+        """检查连接是否仍然可用；空闲时间不短于 validate_idle 的连接发送一次 SELECT 1"""
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - conn._idle_since < self.validate_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _prune_idle(self):
+        """关闭超过 min_size 且空闲过久的连接 (需持有锁)"""
+        now = time.monotonic()
+        stale = []
+        while self._idle and self._size > self.min_size and now - self._idle[0]._idle_since > self.max_idle:
+            stale.append(self._idle.popleft())
+            self._size -= 1
+            self._stats["discarded"] += 1
+        return stale
+
+    # --- 公共接口 ---
+    def getconn(self):
+        """借出一个连接；超时抛出 PoolTimeoutError"""
+        deadline = time.monotonic() + self.borrow_timeout
+        waited = False
+        wait_start = None
+
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.InterfaceError("连接池已关闭")
+                while not self._idle and self._size >= self.max_size:
+                    if not waited:
+                        waited = True
+                        wait_start = time.monotonic()
+                        self._stats["waits"] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"等待数据库连接超时 ({self.borrow_timeout}s, max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_time = time.monotonic() - wait_start
+                    self._stats["wait_time_total"] += wait_time
+                    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+                    waited = False
+                if self._idle:
+                    conn = self._idle.pop() # LIFO: 优先复用最近使用过的连接
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._release_slot(discarded=False)
+                    raise
+            elif not self._is_usable(conn):
+                # 数据库重启或网络中断后，丢弃失效连接并重试
+                with self._cond:
+                    self._stats["validation_failures"] += 1
+                conn.discard()
+                self._release_slot()
+                continue
+
+            conn._checked_out = True
+            with self._cond:
+                self._stats["checkouts"] += 1
+            return conn
+
+    def putconn(self, conn):
+        """归还连接；未结束的事务会被回滚，已损坏的连接会被丢弃"""
+        conn._checked_out = False
+        broken = bool(conn.closed) or self._closed or os.getpid() != self.pid
+        if not broken:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+        if broken:
+            conn.discard()
+            self._release_slot()
+            return
+
+        conn._idle_since = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            stale = self._prune_idle()
+            self._cond.notify()
+        for old in stale:
+            old.discard()
+
+    def prime(self, setup=None):
+        """预先建立 min_size 个连接 (用于启动预热)；setup(conn) 对每个连接执行一次 (如预编译语句)"""
+        conns = []
+        try:
+            for _ in range(self.min_size):
+                conns.append(self.getconn())
+                if setup is not None:
+                    setup(conns[-1])
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.discard()
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        return data
+
+
+# --- 进程级连接池 ---
+# gunicorn 在 fork 之后，子进程不能复用父进程的 socket，
+# 因此连接池按 PID 懒加载：每个 worker 进程在第一次借连接时创建自己的连接池。
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(dsn):
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            # 父进程遗留的连接属于父进程，不在子进程中关闭，直接丢弃引用
+            _pool = ConnectionPool(dsn)
+        return _pool
+
+
+def reset_pool():
+    """关闭当前进程的连接池 (例如 gunicorn worker 退出时)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+def pool_stats():
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        return None
+    return pool.stats()
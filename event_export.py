@@ -0,0 +1,128 @@
+"""
+[NEW] 事件导出 (NDJSON / CSV，可选 gzip)
+
+使用 psycopg2 的命名游标 (服务器端游标) 分批读取，
+边读边写入响应，内存占用与导出范围大小无关。
+"""
+import csv
+import decimal
+import io
+import json
+import zlib
+from datetime import datetime
+
+from pagination import encode_position
+
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_FETCH_SIZE = 2000 # 服务器端游标每次取回的行数
+EXPORT_CHUNK_BYTES = 64 * 1024 # 累积到该大小后再写出，减少小块写入的开销
+
+EXPORT_COLUMNS = (
+    "event_id", "camera_id", "equipment_type", "event_time", "risk_type", "event_score", "event_status",
+    "event_deductions", "image_id", "image_url", "image_timestamp", "image_score", "deduction_items", "position",
+)
+
+# 每张图片一行；没有图片的事件输出一行，图片字段为 null
+# 按 (event_time, event_id, image_id) 排序，position 为该排序键，可用于断点续传
+# 图片按 (event_id, event_time) 关联；时间范围同时加在 event_images 上，两张表都只扫描范围内的分区
+SQL_EXPORT = """
+SELECT
+    e.id AS event_id, e.camera_id, e.equipment_type, e.event_time, e.risk_type,
+    e.score AS event_score, e.status AS event_status, e.deductions::jsonb AS event_deductions,
+    i.id AS image_id, i.image_url, i."timestamp" AS image_timestamp, i.score AS image_score,
+    i.deduction_items::jsonb AS deduction_items
+FROM events e
+LEFT JOIN event_images i ON i.event_id = e.id AND i.event_time = e.event_time{join}
+{where}
+ORDER BY e.event_time ASC, e.id ASC, COALESCE(i.id, 0) ASC
+"""
+
+
+def build_export_query(start_date=None, end_date=None, risk_type=None, camera_id=None, after=None):
+    conditions = []
+    params = []
+    time_conditions = []
+    time_params = []
+    if start_date:
+        time_conditions.append("{}.event_time >= %s")
+        time_params.append(start_date)
+    if end_date:
+        # 包含当天，所以查询到 23:59:59
+        time_conditions.append("{}.event_time <= %s")
+        time_params.append(end_date + " 23:59:59")
+    conditions.extend(c.format("e") for c in time_conditions)
+    params.extend(time_params)
+    if risk_type:
+        conditions.append("e.risk_type = %s")
+        params.append(risk_type)
+    if camera_id is not None:
+        conditions.append("e.camera_id = %s")
+        params.append(camera_id)
+    if after:
+        conditions.append("(e.event_time, e.id, COALESCE(i.id, 0)) > (%s, %s, %s)")
+        params.extend(after)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    join = "".join(" AND " + c.format("i") for c in time_conditions)
+    return SQL_EXPORT.format(join=join, where=where), time_params + params
+
+
+def _with_position(row):
+    row = dict(row)
+    row["position"] = encode_position(row["event_time"], row["event_id"], row["image_id"] or 0)
+    return row
+
+
+def _ndjson_lines(rows, encoder):
+    for row in rows:
+        yield encoder.encode(_with_position(row)) + "\n"
+
+
+def _csv_lines(rows, encoder):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        row = _with_position(row)
+        values = []
+        for column in EXPORT_COLUMNS:
+            value = row[column]
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value, ensure_ascii=False)
+            elif isinstance(value, (datetime, decimal.Decimal)):
+                value = encoder.default(value)
+            values.append(value)
+        writer.writerow(values)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def stream_export(rows, export_format, encoder, use_gzip=False):
+    """
+    把行迭代器编码为响应块 (bytes)。
+    encoder 为 JSONEncoder 实例 (datetime/Decimal 与 API 其他接口的格式一致)。
+    """
+    lines = _ndjson_lines(rows, encoder) if export_format == 'ndjson' else _csv_lines(rows, encoder)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None # wbits=31: gzip 格式
+
+    pending = []
+    pending_size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(pending)
+            pending = []
+            pending_size = 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b"".join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,363 @@
+import io
+import json
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+import prepared_statements
+from event_stream import notify_events
+from report_engine import record_events
+
+
+# 只提供文件名 (未上传到图片存储) 的旧格式图片使用的 URL 前缀
+# 上传到图片存储的图片使用 image_store.image_url()，见 images_data[].url
+IMAGE_URL_PREFIX = os.environ.get('LEGACY_IMAGE_URL_PREFIX', "https://storage.example.com/full/")
+
+EVENT_COLUMNS = ("id", "camera_id", "equipment_type", "event_time", "risk_type", "score",
+                 "image_filename", "image_count", "status", "deductions", "idempotency_key")
+IMAGE_COLUMNS = ("event_id", "event_time", "image_url", "timestamp", "score", "deduction_items")
+
+# 单次批量请求允许的最大事件数
+BATCH_MAX_EVENTS = int(os.environ.get('EVENT_BATCH_MAX', 1000))
+IDEMPOTENCY_KEY_MAX_LENGTH = 200
+
+
+class EventValidationError(ValueError):
+    """事件数据校验失败，message 可以直接返回给客户端"""
+
+
+def is_number(value):
+    """int / float (不包括 bool、NaN 和 Infinity)"""
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value)
+
+
+def parse_event_time(timestamp_str):
+    """
+    解析 AI 脚本发送的时间戳。
+    带时区的时间统一转换为 UTC 并去掉时区信息 (数据库列为不带时区的 timestamp，输出时追加 'Z')
+    """
+    try:
+        event_time = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+             event_time = datetime.strptime(timestamp_str.split('.')[0], "%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            raise EventValidationError("无效的时间戳格式")
+    if event_time.tzinfo is not None:
+        event_time = event_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return event_time
+
+
+def derive_idempotency_key(data, explicit_key=None):
+    """
+    [NEW] 幂等键: Idempotency-Key 请求头 > client_event_id > camera_id:timestamp:sequence；都没有时返回 None
+    唯一索引为 (idempotency_key, event_time)，同一个键必须对应同一个 timestamp (重试时原样重发即可)
+    """
+    key = explicit_key or data.get('client_event_id')
+    if key is None and data.get('sequence') is not None:
+        key = f"{data.get('camera_id', 0)}:{data.get('timestamp')}:{data.get('sequence')}"
+    if key is None:
+        return None
+    key = str(key)
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise EventValidationError(f"无效的幂等键 (最长 {IDEMPOTENCY_KEY_MAX_LENGTH} 个字符)")
+    return key
+
+
+def parse_event_payload(data, idempotency_key=None):
+    """
+    校验 `add_event` 的 JSON 数据并返回标准化后的事件 dict。
+    校验失败时抛出 EventValidationError。
+    idempotency_key 为请求头中的幂等键 (可选)。
+    """
+    if not data or not isinstance(data, dict):
+        raise EventValidationError("未提供输入数据")
+
+    # --- 从 AI 脚本获取数据 ---
+    camera_id = data.get('camera_id', 0)
+    equipment_type = data.get('equipment_type')
+    timestamp_str = data.get('timestamp')
+    risk_type = data.get('risk_type') # "abnormal" 或 "normal"
+    score = data.get('score') # 整个事件的（例如最低）分数
+    image_filename = data.get('image_filename') # 缩略图
+    deductions_list = data.get('deductions') or [] # 整个事件的扣分项
+
+    # [IMPORTANT] AI 脚本必须提供每张图片的详细信息
+    # 这是支持App详情页功能的关键
+    # 计划书 1.1 节提到了 "5枚"，但JSON示例中没有
+    # 我们假设 AI 脚本会发送一个 `images_data` 列表
+    # 格式: [ { "filename": "img_01.jpg", "score": 40, "deductions": ["..."] }, ... ]
+    images_data_list = data.get('images_data', [])
+
+    # 兼容旧格式：如果只提供了 image_filename
+    if image_filename and not images_data_list:
+        images_data_list = [{
+            "filename": image_filename,
+            "score": score,
+            "deductions": deductions_list
+        }]
+
+    if not all([equipment_type, timestamp_str, risk_type, score is not None]):
+        missing = [f for f in ['equipment_type', 'timestamp', 'risk_type', 'score'] if not data.get(f)]
+        raise EventValidationError(f"缺少必需字段: {', '.join(missing)}")
+
+    if risk_type not in ["normal", "abnormal"]:
+        raise EventValidationError("无效的 risk_type 值")
+
+    if not isinstance(equipment_type, str):
+        raise EventValidationError("equipment_type 必须是字符串")
+
+    if image_filename is not None and not isinstance(image_filename, str):
+        raise EventValidationError("image_filename 必须是字符串")
+
+    if camera_id is not None and (isinstance(camera_id, bool) or not isinstance(camera_id, int)):
+        raise EventValidationError("camera_id 必须是整数")
+
+    if not is_number(score):
+        raise EventValidationError("score 必须是数字")
+
+    if not isinstance(timestamp_str, str):
+        raise EventValidationError("无效的时间戳格式")
+
+    if not isinstance(deductions_list, list):
+        raise EventValidationError("无效的 deductions 格式")
+
+    if not isinstance(images_data_list, list) or not all(isinstance(img, dict) for img in images_data_list):
+        raise EventValidationError("无效的 images_data 格式")
+
+    if not all(isinstance(img.get("deductions", []), list) for img in images_data_list):
+        raise EventValidationError("无效的 images_data 格式")
+
+    if not all(img.get("score") is None or is_number(img["score"]) for img in images_data_list):
+        raise EventValidationError("images_data 中的 score 必须是数字")
+
+    if not all(img.get(field) is None or isinstance(img[field], str)
+               for img in images_data_list for field in ("filename", "file", "image")):
+        raise EventValidationError("images_data 中的 filename / file / image 必须是字符串")
+
+    return {
+        "camera_id": camera_id,
+        "equipment_type": equipment_type,
+        "event_time": parse_event_time(timestamp_str),
+        "risk_type": risk_type,
+        "score": score,
+        "image_filename": image_filename,
+        "deductions": deductions_list,
+        "images": images_data_list,
+        "idempotency_key": derive_idempotency_key(data, idempotency_key),
+    }
+
+
+# [PERF] add_event 的 INSERT 使用预编译语句；图片通过 unnest 数组一次写入，图片数量不同也是同一条语句
+# (数组元素以文本传入再在 SQL 中转换，避免 psycopg2 生成的数组字面量类型与参数类型不一致)
+INSERT_EVENT = prepared_statements.prepare("insert_event", """
+    INSERT INTO events (camera_id, equipment_type, event_time, risk_type, score, image_filename, image_count, status, deductions, idempotency_key)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (idempotency_key, event_time) DO NOTHING
+    RETURNING id
+""")
+SELECT_REPLAYED_EVENT = prepared_statements.prepare(
+    "select_replayed_event", "SELECT id FROM events WHERE idempotency_key = %s AND event_time = %s")
+INSERT_EVENT_IMAGES = prepared_statements.prepare("insert_event_images", """
+    INSERT INTO event_images (event_id, event_time, image_url, "timestamp", score, deduction_items)
+    SELECT %s::integer, %s::timestamp, i.image_url, i.ts::timestamp, i.score::numeric, i.deduction_items::jsonb
+    FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[]) AS i(image_url, ts, score, deduction_items)
+""")
+
+
+def _text_array(values):
+    return [None if v is None else (v.isoformat() if isinstance(v, datetime) else str(v)) for v in values]
+
+
+def _event_row(event):
+    return (
+        event["camera_id"], event["equipment_type"], event["event_time"], event["risk_type"],
+        event["score"], event["image_filename"], len(event["images"]), 'new',
+        json.dumps(event["deductions"]), event.get("idempotency_key")
+    )
+
+
+def build_image_records(event_id, event):
+    """
+    生成 event_images 的行 (event_id, event_time, image_url, timestamp, score, deduction_items)
+    event_time 是事件的时间 (分区键)，与事件落在同一个分区
+    """
+    images = event["images"]
+    image_count = len(images)
+    records = []
+    for i, img_data in enumerate(images):
+        img_time = event["event_time"] + timedelta(seconds=i - int(image_count / 2)) # 模拟时间
+        img_url = img_data.get("url") or IMAGE_URL_PREFIX + img_data.get("filename", f"event_{event_id}_{i}.jpg")
+        img_score = img_data.get("score", event["score"]) # 使用单张图片分数，否则回退到事件分数
+        img_deductions = json.dumps(img_data.get("deductions", [])) # 使用单张图片扣分项
+        records.append((event_id, event["event_time"], img_url, img_time, img_score, img_deductions))
+    return records
+
+
+def after_insert(cursor, events, event_ids):
+    """
+    事件写入后、提交前在同一事务中执行的处理:
+    - 增量更新报告汇总表
+    - pg_notify 新事件 (事务提交后才会推送给 SSE 订阅者)
+    """
+    record_events(cursor, events)
+    notify_events(cursor, events, event_ids)
+
+
+def find_replayed(cursor, events):
+    """查询已经写入过的幂等键，返回 {(idempotency_key, event_time): event_id}"""
+    keyed = [(e["idempotency_key"], e["event_time"]) for e in events if e.get("idempotency_key")]
+    if not keyed:
+        return {}
+    cursor.execute("""
+        SELECT e.idempotency_key, e.event_time, e.id
+        FROM events e
+        JOIN unnest(%s::text[], %s::timestamp[]) AS k(idempotency_key, event_time)
+          ON e.idempotency_key = k.idempotency_key AND e.event_time = k.event_time
+    """, ([k for k, _ in keyed], [t for _, t in keyed]))
+    return {(key, event_time): event_id for key, event_time, event_id in cursor.fetchall()}
+
+
+def insert_event(cursor, event):
+    """
+    插入单个事件及其图片 (events 的 INSERT ... RETURNING、event_images 的多行 INSERT，以及 after_insert)
+    返回新的 event_id。
+    [NEW] 幂等键已存在时不再写入，返回原来的 event_id 并设置 event["replayed"] = True
+    """
+    event.pop("replayed", None) # 批量写入失败回退到逐条写入时，清除上一次尝试的标记
+    # 步骤 1: 插入主 event 记录 (幂等键冲突时什么都不做)
+    prepared_statements.execute(cursor, INSERT_EVENT, _event_row(event))
+    row = cursor.fetchone()
+    if row is None:
+        prepared_statements.execute(cursor, SELECT_REPLAYED_EVENT, (event["idempotency_key"], event["event_time"]))
+        event["replayed"] = True
+        return cursor.fetchone()[0]
+    event_id = row[0]
+
+    # 步骤 2: 插入关联的图片 (根据计划书的 `event_images` 表)
+    image_records = build_image_records(event_id, event)
+    if image_records:
+        # [PERF] 一次往返插入所有图片
+        columns = list(zip(*image_records))[2:]
+        prepared_statements.execute(cursor, INSERT_EVENT_IMAGES,
+                                    (event_id, event["event_time"]) + tuple(_text_array(c) for c in columns))
+
+    # 步骤 3: 同一事务中的后续处理 (汇总表、推送通知)
+    after_insert(cursor, [event], [event_id])
+    return event_id
+
+
+# --- 批量写入 (COPY) ---
+
+def _copy_value(value):
+    """转换为 COPY text 格式的字段值"""
+    if value is None:
+        return r'\N'
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN", buf)
+
+
+def insert_events_bulk(cursor, events):
+    """
+    [PERF] 用固定次数的往返写入一批事件：
+    1. 一次性从序列中预分配所有 event id
+    2. COPY events
+    3. COPY event_images
+    4. 累加报告汇总表并发送推送通知
+    返回与 events 顺序一致的 event_id 列表。调用方负责事务 (commit/rollback)。
+    [NEW] COPY 不支持 ON CONFLICT，因此先查询已存在的幂等键；这些事件 (以及同一批中的重复事件)
+    不再写入，返回原来的 event_id。并发写入同一个键导致唯一约束冲突时，由 insert_events_batch 回退到逐条写入。
+    """
+    if not events:
+        return []
+    replayed = find_replayed(cursor, events)
+    event_ids = [None] * len(events)
+    new_positions = []
+    first_position = {}
+    for position, event in enumerate(events):
+        event.pop("replayed", None)
+        key = (event["idempotency_key"], event["event_time"]) if event.get("idempotency_key") else None
+        if key in replayed:
+            event_ids[position] = replayed[key]
+            event["replayed"] = True
+        elif key is not None and key in first_position:
+            event["replayed"] = True
+        else:
+            new_positions.append(position)
+            if key is not None:
+                first_position[key] = position
+
+    if new_positions:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence('events', 'id')) FROM generate_series(1, %s)",
+            (len(new_positions),)
+        )
+        for position, row in zip(new_positions, cursor.fetchall()):
+            event_ids[position] = row[0]
+    for position, event in enumerate(events):
+        if event_ids[position] is None: # 同一批中的重复事件
+            event_ids[position] = event_ids[first_position[(event["idempotency_key"], event["event_time"])]]
+
+    new_events = [events[p] for p in new_positions]
+    new_ids = [event_ids[p] for p in new_positions]
+    event_rows = []
+    image_rows = []
+    for event_id, event in zip(new_ids, new_events):
+        event_rows.append((event_id,) + _event_row(event))
+        image_rows.extend(build_image_records(event_id, event))
+
+    if event_rows:
+        _copy_rows(cursor, "events", EVENT_COLUMNS, event_rows)
+    if image_rows:
+        _copy_rows(cursor, "event_images", IMAGE_COLUMNS, image_rows)
+    after_insert(cursor, new_events, new_ids)
+    return event_ids
+
+
+def insert_events_isolated(cursor, events):
+    """
+    批量写入失败时的回退路径：每个事件在自己的 SAVEPOINT 中插入，
+    单个事件的数据库错误不会影响同一事务中的其他事件。
+    返回 [(event_id, None) 或 (None, error)]，顺序与 events 一致。
+    """
+    results = []
+    for event in events:
+        cursor.execute("SAVEPOINT event_item")
+        try:
+            event_id = insert_event(cursor, event)
+            cursor.execute("RELEASE SAVEPOINT event_item")
+            results.append((event_id, None))
+        except Exception as error:
+            cursor.execute("ROLLBACK TO SAVEPOINT event_item")
+            results.append((None, error))
+    return results
+
+
+def insert_events_batch(cursor, events):
+    """
+    在调用方的事务中写入一批事件：先尝试 COPY 批量写入，
+    失败时回滚到 SAVEPOINT 并逐条隔离写入。
+    """
+    cursor.execute("SAVEPOINT event_batch")
+    try:
+        event_ids = insert_events_bulk(cursor, events)
+        cursor.execute("RELEASE SAVEPOINT event_batch")
+        return [(event_id, None) for event_id in event_ids]
+    except Exception as error:
+        print(f"批量写入失败，改为逐条写入: {error}")
+        cursor.execute("ROLLBACK TO SAVEPOINT event_batch")
+        return insert_events_isolated(cursor, events)
@@ -0,0 +1,344 @@
+"""
+[NEW] 新事件推送 (Server-Sent Events + PostgreSQL LISTEN/NOTIFY)
+
+写入事件时在同一事务中执行 pg_notify，提交后由每个 worker 进程中唯一的
+监听连接接收，再分发给该进程内的所有 SSE 订阅者。
+同一个监听连接还接收 CONTROL_CHANNEL 上的控制消息 (例如所有进程一起清除摄像头缓存)。
+
+pg_notify 的 payload 必须小于 8000 字节，而扣分项等字段长度由客户端决定:
+超过 NOTIFY_MAX_PAYLOAD 的事件只通知 {"id", "truncated"}，由监听线程从数据库读取完整事件，
+不会因为 payload 过大导致写入事务失败。
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+
+NOTIFY_CHANNEL = 'safety_events'
+CONTROL_CHANNEL = 'safety_control' # 进程之间的控制消息 (例如清除缓存): {"kind": ..., ...}
+# 每个 SSE 连接在 gthread worker 中长期占用一个线程: 订阅者上限必须远小于 GUNICORN_THREADS，
+# 否则少量 SSE 客户端就会占满线程，登录、查询和写入请求全部排队。
+# 默认使用线程数的 1/4；显式配置时最多允许 1/2 (SSE_DEDICATED=1 时为线程数 - 1)，
+# 超过时 gunicorn 拒绝启动 (见 max_subscribers_for / check_thread_budget)
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', max(1, GUNICORN_THREADS // 4))) # 每个进程的订阅者上限
+# SSE_DEDICATED=1: 该 gunicorn 实例只处理 /api/events/stream (由反向代理单独路由)，订阅者可以使用除一个线程外的全部线程
+SSE_DEDICATED = os.environ.get('SSE_DEDICATED', '0') in ('1', 'true')
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15.0)) # 无事件时发送心跳注释的间隔秒数
+SSE_BUFFER_SIZE = int(os.environ.get('SSE_BUFFER_SIZE', 1000)) # 用于断线续传的最近事件缓冲
+SSE_SUBSCRIBER_QUEUE = 256 # 单个订阅者未消费事件的上限，超过则断开该订阅者
+SSE_REPLAY_LIMIT = 500 # 断线续传时从数据库补发的最大事件数
+# 监听连接重连后从 最后收到的 id - SSE_REREAD_IDS 开始重新读取: 事件 id 在 INSERT 时分配，
+# 断线期间较小的 id 可能晚于较大的 id 提交。已经在缓冲区中的事件不会重复分发
+SSE_REREAD_IDS = int(os.environ.get('SSE_REREAD_IDS', 200))
+NOTIFY_MAX_PAYLOAD = int(os.environ.get('NOTIFY_MAX_PAYLOAD', 4000)) # 单条通知的最大字节数 (pg_notify 上限 8000)
+INTERNAL_MESSAGE_FIELDS = ("deductions",) # 只在进程之间使用的 payload 字段
+
+
+class TooManySubscribersError(Exception):
+    """订阅者已达上限 (handler 应返回 503)"""
+
+
+def max_subscribers_for(threads):
+    """每个进程在 threads 个线程下允许的最大订阅者数: 普通实例最多使用一半线程，专用实例保留一个线程"""
+    return threads - 1 if SSE_DEDICATED else threads // 2
+
+
+def check_thread_budget(threads):
+    """启动时检查 (gunicorn on_starting): 订阅者上限超过线程预算时拒绝启动"""
+    allowed = max_subscribers_for(threads)
+    if SSE_MAX_SUBSCRIBERS > allowed:
+        raise ValueError(
+            f"SSE_MAX_SUBSCRIBERS={SSE_MAX_SUBSCRIBERS} 超过了 {threads} 个线程的预算 (最多 {allowed})；"
+            f"SSE 连接会占满 worker 线程，请调小 SSE_MAX_SUBSCRIBERS 或调大 GUNICORN_THREADS，"
+            f"或者为 /api/events/stream 部署单独的实例 (SSE_DEDICATED=1)"
+        )
+
+
+# --- 写入端 ---
+
+def event_message(event_id, event):
+    """NOTIFY 的 payload (与 get_events 列表项相同的字段)，附带扣分项"""
+    return {
+        "id": event_id,
+        "camera_id": event["camera_id"],
+        "equipment_type": event["equipment_type"],
+        "event_time": event["event_time"].isoformat() + 'Z',
+        "risk_type": event["risk_type"],
+        "score": event["score"],
+        "thumbnail_url": event["image_filename"],
+        "status": 'new',
+        "deductions": event.get("deductions") or [], # 供其他进程的实时统计使用，不推送给 SSE 客户端
+    }
+
+
+def notify_payload(event_id, event):
+    """编码后的 payload 超过 NOTIFY_MAX_PAYLOAD 时只保留事件 id (json.dumps 默认只输出 ASCII，长度即字节数)"""
+    payload = json.dumps(event_message(event_id, event), separators=(',', ':'))
+    if len(payload) > NOTIFY_MAX_PAYLOAD:
+        payload = json.dumps({"id": event_id, "truncated": True}, separators=(',', ':'))
+    return payload
+
+
+def notify_events(cursor, events, event_ids):
+    """在当前事务中为每个事件执行 pg_notify (事务提交后才会送达监听者)"""
+    payloads = [notify_payload(event_id, event) for event_id, event in zip(event_ids, events)]
+    if payloads:
+        cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                       (NOTIFY_CHANNEL, payloads))
+
+
+def notify_control(cursor, kind, **fields):
+    """发送控制消息 (事务提交后送达所有进程的监听连接，包括当前进程)"""
+    cursor.execute("SELECT pg_notify(%s, %s)", (CONTROL_CHANNEL, json.dumps(dict(fields, kind=kind))))
+
+
+# --- 订阅端 ---
+
+class Subscription:
+    def __init__(self, broadcaster, risk_type, replaying=False):
+        self.broadcaster = broadcaster
+        self.risk_type = risk_type # None 表示接收所有事件
+        self.queue = queue.Queue(maxsize=SSE_SUBSCRIBER_QUEUE)
+        self.closed = False
+        # 断线续传: 补发完成之前到达的实时事件先暂存，保证补发的事件排在前面且不重复
+        self._replaying = replaying
+        self._held = []
+        self._replay_lock = threading.Lock()
+
+    def wants(self, message):
+        return self.risk_type is None or message.get("risk_type") == self.risk_type
+
+    def _put(self, message):
+        if self.closed or not self.wants(message):
+            return
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # 消费过慢的客户端直接断开，由客户端带 Last-Event-ID 重连
+            self.closed = True
+
+    def offer(self, message):
+        """实时事件"""
+        with self._replay_lock:
+            if self._replaying:
+                if len(self._held) >= SSE_SUBSCRIBER_QUEUE:
+                    self.closed = True
+                else:
+                    self._held.append(message)
+                return
+            self._put(message)
+
+    def finish_replay(self, replay):
+        """先放入补发的事件，再放入补发期间暂存的实时事件 (跳过已经补发过的 id，不依赖 id 的大小顺序)"""
+        with self._replay_lock:
+            replayed = set()
+            for message in replay:
+                self._put(message)
+                replayed.add(message["id"])
+            for message in self._held:
+                if message["id"] not in replayed:
+                    self._put(message)
+            self._held = []
+            self._replaying = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self.broadcaster.unsubscribe(self)
+
+
+class EventBroadcaster:
+    """
+    每个进程一个监听连接 (LISTEN safety_events)，由后台线程读取通知并分发给所有订阅者。
+    连接断开后自动重连，并从数据库补发断线期间的事件。
+
+    断线续传按事件到达 (提交) 的顺序: 缓冲区中 Last-Event-ID 之后的所有事件，包括 id 较小但提交较晚的事件。
+    Last-Event-ID 已经不在缓冲区中时只能从数据库按 id 补发 (id > Last-Event-ID)，
+    这种情况下断线前 id 较小但尚未提交的事件不会补发。
+    """
+    def __init__(self, dsn, load_since=None, start=True):
+        self.dsn = dsn
+        self.load_since = load_since # load_since(last_id, limit) -> [message]，用于续传和重连补发
+        self.pid = os.getpid()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._buffer = deque()
+        self._buffered_ids = set()
+        self._last_id = None
+        self._listeners = [] # 进程内的其他消费者，例如实时统计: fn(message)
+        self._control_listeners = {} # kind -> fn(message)；重连时以 None 调用，表示断线期间的消息可能已经丢失
+        self._connected = False
+        self._stats = {"notifications": 0, "reconnects": 0, "dropped_subscribers": 0, "truncated": 0,
+                       "reread_skipped": 0, "control_messages": 0}
+        self._thread = threading.Thread(target=self._run, name="event-notify-listener", daemon=True)
+        if start: # False: 测试中不启动监听线程
+            self._thread.start()
+
+    # --- 订阅管理 ---
+    def subscribe(self, last_event_id=None, risk_type='abnormal'):
+        with self._lock:
+            if len(self._subscribers) >= SSE_MAX_SUBSCRIBERS:
+                raise TooManySubscribersError("订阅者过多")
+            subscription = Subscription(self, risk_type, replaying=last_event_id is not None)
+            self._subscribers.add(subscription)
+            replay = None
+            if last_event_id is not None and last_event_id in self._buffered_ids:
+                # 缓冲区按到达顺序排列: 补发 Last-Event-ID 之后到达的所有事件
+                position = next(i for i, m in enumerate(self._buffer) if m["id"] == last_event_id)
+                replay = list(self._buffer)[position + 1:]
+        if last_event_id is None:
+            return subscription
+        # 缓冲区无法覆盖断线期间的事件时，从数据库补发
+        try:
+            if replay is None:
+                replay = self.load_since(last_event_id, SSE_REPLAY_LIMIT) if self.load_since else []
+        except Exception:
+            self.unsubscribe(subscription) # 补发失败时释放订阅名额
+            raise
+        subscription.finish_replay(replay)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def add_control_listener(self, kind, fn):
+        """每种控制消息一个回调 (重复注册时替换)"""
+        self._control_listeners[kind] = fn
+
+    def _control(self, message):
+        """message 为 None 时通知所有回调 (监听连接重连)"""
+        if message is not None:
+            with self._lock:
+                self._stats["control_messages"] += 1
+            listeners = [self._control_listeners.get(message.get("kind"))]
+        else:
+            listeners = list(self._control_listeners.values())
+        for fn in listeners:
+            if fn is None:
+                continue
+            try:
+                fn(message)
+            except Exception as error:
+                print(f"控制消息回调异常: {error}")
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _dispatch(self, message):
+        with self._lock:
+            if message["id"] in self._buffered_ids:
+                self._stats["reread_skipped"] += 1
+                return
+            if len(self._buffer) >= SSE_BUFFER_SIZE:
+                self._buffered_ids.discard(self._buffer.popleft()["id"])
+            self._buffer.append(message)
+            self._buffered_ids.add(message["id"])
+            self._last_id = max(self._last_id or 0, message["id"])
+            self._stats["notifications"] += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(message)
+            if subscription.closed:
+                with self._lock:
+                    self._stats["dropped_subscribers"] += 1
+                self.unsubscribe(subscription)
+        for fn in self._listeners:
+            try:
+                fn(message)
+            except Exception as error:
+                print(f"事件监听回调异常: {error}")
+
+    # --- 监听线程 ---
+    def _run(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                cursor.execute(f"LISTEN {CONTROL_CHANNEL};")
+                if self._connected:
+                    self._control(None) # 重连: 断线期间的控制消息已经丢失
+                self._connected = True
+                self._reread()
+                backoff = 1.0
+                while True:
+                    if select.select([conn], [], [], SSE_HEARTBEAT) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            message = json.loads(notify.payload)
+                        except ValueError:
+                            continue
+                        if notify.channel == CONTROL_CHANNEL:
+                            self._control(message)
+                            continue
+                        if message.get("truncated"):
+                            message = self._load_truncated(message["id"])
+                            if message is None:
+                                continue
+                        self._dispatch(message)
+            except Exception as error:
+                print(f"事件监听连接中断，{backoff:.0f} 秒后重连: {error}")
+                with self._lock:
+                    self._stats["reconnects"] += 1
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def _reread(self):
+        """(重新) 连接后补发断线期间提交的事件，包括 id 小于最后收到的 id 但较晚提交的事件"""
+        if self._last_id is None or not self.load_since:
+            return
+        for message in self.load_since(max(self._last_id - SSE_REREAD_IDS, 0), SSE_REPLAY_LIMIT):
+            self._dispatch(message)
+
+    def _load_truncated(self, event_id):
+        """payload 过大而只通知了 id 的事件: 从数据库读取完整事件 (通知在提交后送达，事件一定可见)"""
+        if not self.load_since:
+            return None
+        with self._lock:
+            self._stats["truncated"] += 1
+        for message in self.load_since(event_id - 1, 1):
+            if message["id"] == event_id:
+                return message
+        return None
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["subscribers"] = len(self._subscribers)
+            data["max_subscribers"] = SSE_MAX_SUBSCRIBERS
+            data["buffered"] = len(self._buffer)
+        return data
+
+
+def format_sse(message):
+    """编码为一条 SSE 消息 (id 为事件 id，供客户端断线重连时通过 Last-Event-ID 续传)"""
+    public = {k: v for k, v in message.items() if k not in INTERNAL_MESSAGE_FIELDS}
+    data = json.dumps(public, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {message['id']}\nevent: event\ndata: {data}\n\n"
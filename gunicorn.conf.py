@@ -0,0 +1,50 @@
+"""
+gunicorn 配置
+
+    gunicorn -c gunicorn.conf.py api:app
+
+- preload_app: 在 master 中导入一次应用 (api.py 导入时不建立连接、不启动线程)，worker fork 后共享已导入的代码
+- post_fork: 每个 worker 在 fork 之后启动预热 (连接池 + 预编译语句、摄像头缓存、实时统计等)，
+  预热完成前 GET /api/system/ready 返回 503
+- worker_exit: 写入异步队列和心跳状态，关闭连接池
+
+SSE 与线程数: gthread worker 中每个 /api/events/stream 连接在断开之前一直占用一个线程。
+每个进程的订阅者上限 SSE_MAX_SUBSCRIBERS 默认是 GUNICORN_THREADS 的 1/4，超过一半时 on_starting 拒绝启动，
+保证其余线程可以处理登录、查询和写入请求。需要大量 SSE 客户端时，用反向代理把 /api/events/stream
+路由到单独的实例 (SSE_DEDICATED=1，订阅者上限最多为 threads - 1)，而不是调大普通实例的上限:
+
+    SSE_DEDICATED=1 GUNICORN_THREADS=64 SSE_MAX_SUBSCRIBERS=60 gunicorn -c gunicorn.conf.py api:app
+"""
+import os
+import time
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') not in ('0', 'false')
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') # 默认不输出访问日志
+
+
+def on_starting(server):
+    from event_stream import check_thread_budget
+    check_thread_budget(threads)
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import api
+    server.log.info("api 导入耗时 %.2fs (preload=%s)", api.IMPORT_SECONDS, preload_app)
+
+
+def post_fork(server, worker):
+    import api
+    api.init_worker(worker.app.wsgi(), started=time.monotonic())
+
+
+def worker_exit(server, worker):
+    import api
+    api.shutdown_worker()
@@ -0,0 +1,244 @@
+"""
+[NEW] 图片存储 (本地磁盘，按内容 SHA-256 寻址)
+
+- multipart 上传时，werkzeug 解析请求体的同时把文件直接写入存储目录下的临时文件并计算哈希
+  (parse_uploads_to_store)，不在内存中缓冲整张图片，也不需要再复制一次。
+  只在上传接口完成认证之后调用；其他路由使用 werkzeug 默认的解析方式
+- 相同内容的图片只保存一份: objects/ab/cd/<sha256>.<ext>，重复上传时直接丢弃临时文件
+- 缩略图按需生成并缓存 (需要安装 Pillow；未安装时返回原图)
+- 文件内容不会改变，因此可以使用很长的缓存时间，ETag 就是内容哈希
+
+文件名 (image name) 的格式为 "<sha256>.<ext>"，例如 "9f86d0...0a08.jpg"。
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+try:
+    from PIL import Image # 可选依赖: 生成缩略图
+except ImportError:
+    Image = None
+
+
+IMAGE_STORE_DIR = os.environ.get(
+    'IMAGE_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_store'))
+# event_images.image_url 使用的前缀；API 部署在独立域名下时设置为 "https://api.example.com/api/images/"
+IMAGE_URL_PREFIX = os.environ.get('IMAGE_URL_PREFIX', '/api/images/')
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024)) # 单张图片上限
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 320)) # 缩略图最长边像素
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+
+IMAGE_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+_NAME_RE = re.compile(r'^([0-9a-f]{64})\.(jpg|png|webp)$')
+
+
+class ImageStoreError(ValueError):
+    """上传的文件无效 (类型不支持或过大)，message 可以直接返回给客户端"""
+
+
+def detect_type(head):
+    """根据文件头判断图片类型，返回扩展名或 None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def parse_image_name(name):
+    """'<sha256>.<ext>' -> (digest, ext)；格式无效时返回 None"""
+    match = _NAME_RE.match(name) if isinstance(name, str) else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+def image_url(name):
+    return IMAGE_URL_PREFIX + name
+
+
+def thumbnail_url(name):
+    return IMAGE_URL_PREFIX + name + '/thumb'
+
+
+class UploadStream:
+    """写入存储目录临时文件的上传流，写入时同时计算 SHA-256"""
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        # 请求结束时 Flask 会关闭所有上传文件；未被 commit 的临时文件在这里删除
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StoredImage:
+    def __init__(self, digest, ext, size, deduplicated):
+        self.digest = digest
+        self.ext = ext
+        self.size = size
+        self.deduplicated = deduplicated
+
+    @property
+    def name(self):
+        return f"{self.digest}.{self.ext}"
+
+    def to_dict(self):
+        return {
+            "image": self.name,
+            "url": image_url(self.name),
+            "thumbnail_url": thumbnail_url(self.name),
+            "size": self.size,
+            "deduplicated": self.deduplicated,
+        }
+
+
+class ImageStore:
+    def __init__(self, root=IMAGE_STORE_DIR, max_bytes=IMAGE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "deduplicated": 0, "bytes_stored": 0, "rejected": 0, "thumbnails": 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def object_path(self, digest, ext):
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def thumbnail_path(self, digest, size):
+        return os.path.join(self.root, 'thumbs', digest[:2], f"{digest}_{size}.jpg")
+
+    def new_upload(self):
+        return UploadStream(self.tmp_dir)
+
+    def commit(self, upload):
+        """把上传的临时文件移动到内容地址；已存在相同内容时丢弃临时文件"""
+        upload.flush()
+        if upload.size == 0 or upload.size > self.max_bytes:
+            self._count("rejected")
+            raise ImageStoreError(f"图片大小无效 (最大 {self.max_bytes} 字节)")
+        upload.seek(0)
+        ext = detect_type(upload.read(16))
+        if ext is None:
+            self._count("rejected")
+            raise ImageStoreError("不支持的图片格式 (仅支持 JPEG / PNG / WebP)")
+
+        digest = upload.hexdigest()
+        path = self.object_path(digest, ext)
+        if os.path.exists(path):
+            self._count("deduplicated")
+            return StoredImage(digest, ext, upload.size, True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.fsync(upload.fileno())
+        os.chmod(upload.path, 0o644)
+        # 同一文件系统内 rename 是原子的；并发上传同一内容时后者覆盖前者，内容相同
+        os.replace(upload.path, path)
+        upload.committed = True
+        self._count("stored")
+        self._count("bytes_stored", upload.size)
+        return StoredImage(digest, ext, upload.size, False)
+
+    def put_file(self, fileobj):
+        """保存普通文件对象 (非 UploadStream，例如测试或脚本导入)"""
+        upload = self.new_upload()
+        try:
+            for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+                upload.write(chunk)
+            return self.commit(upload)
+        finally:
+            upload.close()
+
+    def find(self, name):
+        """返回图片文件路径和 MIME 类型；不存在时返回 None"""
+        parsed = parse_image_name(name)
+        if not parsed:
+            return None
+        path = self.object_path(*parsed)
+        return (path, IMAGE_TYPES[parsed[1]]) if os.path.exists(path) else None
+
+    def thumbnail(self, name, size=THUMBNAIL_SIZE):
+        """返回缩略图路径和 MIME 类型 (首次请求时生成)；未安装 Pillow 时返回原图"""
+        found = self.find(name)
+        if found is None or Image is None:
+            return found
+        digest, _ = parse_image_name(name)
+        path = self.thumbnail_path(digest, size)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix='thumb-')
+            try:
+                with os.fdopen(fd, 'wb') as f, Image.open(found[0]) as img:
+                    img.thumbnail((size, size))
+                    img.convert('RGB').save(f, 'JPEG', quality=80, optimize=True)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            self._count("thumbnails")
+        return path, 'image/jpeg'
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["thumbnails_enabled"] = Image is not None
+        return data
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_image_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ImageStore()
+    return _store
+
+
+def _store_file_stream(total_content_length, content_type, filename=None, content_length=None):
+    return get_image_store().new_upload()
+
+
+def parse_uploads_to_store(request):
+    """
+    在 view 中 (认证之后) 解析 multipart 请求: 上传的文件直接写入图片存储的临时目录
+    (替代 werkzeug 默认的 SpooledTemporaryFile)，之后 request.form / request.files 为解析结果
+    """
+    if "form" in request.__dict__:
+        return # 已经解析过
+    request._get_file_stream = _store_file_stream # 只对当前请求生效
+    request._load_form_data()
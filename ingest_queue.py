@@ -0,0 +1,202 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from event_ingest import insert_events_batch
+
+
+# --- 异步写入配置 (可通过环境变量覆盖) ---
+INGEST_ASYNC_DEFAULT = os.environ.get('EVENT_INGEST_ASYNC', '0') == '1' # POST /api/events 默认走异步队列
+INGEST_QUEUE_SIZE = int(os.environ.get('EVENT_INGEST_QUEUE_SIZE', 5000)) # 队列容量，满了返回 429
+INGEST_FLUSH_SIZE = int(os.environ.get('EVENT_INGEST_FLUSH_SIZE', 200)) # 每个事务最多提交的事件数
+INGEST_FLUSH_INTERVAL = float(os.environ.get('EVENT_INGEST_FLUSH_INTERVAL', 0.2)) # 凑批的最长等待秒数
+INGEST_RETRY_LIMIT = int(os.environ.get('EVENT_INGEST_RETRY_LIMIT', 3)) # 数据库不可用时一批事件的重试次数
+INGEST_RESULT_CACHE = 10000 # 保留最近多少个临时 id 的写入结果
+QUEUE_KEY_PREFIX = 'queue:' # 队列为没有幂等键的事件生成的幂等键前缀
+
+
+class QueueFullError(Exception):
+    """队列已满 (handler 应返回 429)"""
+
+
+class IngestQueue:
+    """
+    [PERF] 进程内的有界事件写入队列 + 后台写线程 (group commit)。
+    请求线程只做校验和入队，后台线程把多个事件合并到一个事务中写入。
+    """
+    def __init__(self, get_connection, max_size=INGEST_QUEUE_SIZE, flush_size=INGEST_FLUSH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, on_commit=None):
+        self.get_connection = get_connection
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit # 回调: on_commit([(event, event_id), ...])
+        self.pid = os.getpid()
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._results = OrderedDict() # provisional_id -> {"status": ..., "event_id": ...}
+        self._results_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "rejected_full": 0,
+            "committed_events": 0,
+            "failed_events": 0,
+            "commits": 0,
+            "commit_errors": 0,
+            "commit_latency_total": 0.0,
+            "commit_latency_max": 0.0,
+            "commit_latency_last": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="event-ingest-writer", daemon=True)
+        self._thread.start()
+
+    # --- 请求线程 ---
+    def submit(self, event):
+        """
+        入队一个已校验的事件，返回临时 id；队列已满时抛出 QueueFullError。
+        [FIX] 没有幂等键的事件使用 "queue:<临时 id>" 作为幂等键: COMMIT 时出错 (例如连接中断) 无法知道是否已经提交，
+        重试时由唯一索引 + ON CONFLICT 识别已写入的事件，不会重复写入
+        """
+        if self._stop.is_set():
+            raise QueueFullError("写入队列正在关闭")
+        provisional_id = uuid.uuid4().hex
+        if not event.get("idempotency_key"):
+            event = dict(event, idempotency_key=f"{QUEUE_KEY_PREFIX}{provisional_id}")
+        try:
+            self._queue.put_nowait((provisional_id, event))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected_full"] += 1
+            raise QueueFullError("事件写入队列已满")
+        self._set_result(provisional_id, {"status": "pending"})
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+        return provisional_id
+
+    def result(self, provisional_id):
+        with self._results_lock:
+            return self._results.get(provisional_id)
+
+    # --- 后台写线程 ---
+    def _set_result(self, provisional_id, result):
+        with self._results_lock:
+            self._results[provisional_id] = result
+            self._results.move_to_end(provisional_id)
+            while len(self._results) > INGEST_RESULT_CACHE:
+                self._results.popitem(last=False)
+
+    def _next_batch(self):
+        """阻塞直到有事件，然后在 flush_interval 内尽量凑满 flush_size"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self._stop.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        try:
+            self._commit_batch(batch)
+        finally:
+            # 任何未预期的异常 (例如回滚或归还连接时出错) 都不能让这一批的结果一直停留在 pending
+            pending = [pid for pid, _ in batch if (self.result(pid) or {}).get("status") == "pending"]
+            for provisional_id in pending:
+                self._set_result(provisional_id, {"status": "failed", "message": "写入失败"})
+            if pending:
+                with self._stats_lock:
+                    self._stats["failed_events"] += len(pending)
+
+    def _commit_batch(self, batch):
+        events = [event for _, event in batch]
+        for attempt in range(1, INGEST_RETRY_LIMIT + 1):
+            conn = None
+            cursor = None
+            started = time.monotonic()
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+                inserted = insert_events_batch(cursor, events)
+                conn.commit()
+            except Exception as error:
+                if conn:
+                    try:
+                        conn.rollback()
+                    except Exception as rollback_error: # 连接已断开等，归还连接池时会被丢弃
+                        print(f"回滚失败 (Ingest Queue): {rollback_error}")
+                with self._stats_lock:
+                    self._stats["commit_errors"] += 1
+                print(f"数据库错误 (Ingest Queue, 第 {attempt} 次): {error}")
+                time.sleep(min(2 ** attempt * 0.1, 2.0))
+                continue
+            finally:
+                if conn:
+                    try:
+                        if cursor: cursor.close()
+                    except Exception:
+                        pass
+                    conn.close()
+
+            latency = time.monotonic() - started
+            committed = []
+            with self._stats_lock:
+                self._stats["commits"] += 1
+                self._stats["commit_latency_total"] += latency
+                self._stats["commit_latency_last"] = latency
+                self._stats["commit_latency_max"] = max(self._stats["commit_latency_max"], latency)
+            for (provisional_id, event), (event_id, error) in zip(batch, inserted):
+                if error is None:
+                    self._set_result(provisional_id, {"status": "committed", "event_id": event_id})
+                    committed.append((event, event_id))
+                else:
+                    self._set_result(provisional_id, {"status": "failed", "message": str(error)})
+            with self._stats_lock:
+                self._stats["committed_events"] += len(committed)
+                self._stats["failed_events"] += len(batch) - len(committed)
+            if self.on_commit and committed:
+                self.on_commit(committed)
+            return
+
+        # 多次重试后仍然失败，放弃这一批
+        for provisional_id, _ in batch:
+            self._set_result(provisional_id, {"status": "failed", "message": "数据库不可用"})
+        with self._stats_lock:
+            self._stats["failed_events"] += len(batch)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as error:
+                    print(f"写入线程异常 (Ingest Queue): {error}")
+
+    # --- 生命周期 ---
+    def drain(self, timeout=30.0):
+        """停止接收新事件，并等待队列中剩余的事件全部写入"""
+        self._stop.set()
+        self._thread.join(timeout)
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data["queue_depth"] = self._queue.qsize()
+        data["queue_capacity"] = self._queue.maxsize
+        data["flush_size"] = self.flush_size
+        data["flush_interval"] = self.flush_interval
+        return data
@@ -0,0 +1,355 @@
+"""
+[NEW] 实时滑动窗口统计 (最近 5 分钟 / 1 小时 / 24 小时)
+
+- 事件提交后立即累加到内存中的环形时间桶 (默认每桶 10 秒)，按 event_time 归入时间桶
+- 每个窗口维护自己的合计，时间前进时减去移出窗口的桶，查询时直接返回合计，与事件数量无关
+- 统计维度: 全部、每个摄像头、每种 equipment_type；内容为事件数、abnormal 数、分数分布 (与报告相同的 10 分区间) 和扣分项
+- 其他 worker 进程 (包括其他容器 / 主机) 写入的事件通过 LISTEN/NOTIFY 收到；本进程发出的通知也会收到，按事件 id 去重
+- 进程启动后在后台从数据库重建最近 24 小时的统计 (一个 REPEATABLE READ 快照中按 event_time 统计，不按 id 截断)；
+  重建期间收到的事件先缓存，完成后按 id 去重后应用。快照中最近的 LIVE_STATS_REHYDRATE_SEEN_IDS 个 id 记入去重集合，
+  快照之前提交、通知较晚到达的事件不会重复计入；快照之后提交的事件 (包括 id 较小但提交较晚的事件) 都会计入
+- 查询: 每个窗口按 top 维护已渲染的结果，只重新渲染发生变化的维度 (扣分项 top-N 也按维度缓存)，
+  查询的开销与两次查询之间变化的维度数相关
+
+统计保存在各 worker 进程内，事件时间早于最大窗口或晚于当前时间的事件分别丢弃 / 计入当前桶。
+"""
+import heapq
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+
+from report_engine import deduction_label, score_bucket
+
+
+LIVE_STATS_ENABLED = os.environ.get('LIVE_STATS_ENABLED', '1') not in ('0', 'false')
+LIVE_STATS_BUCKET_SECONDS = int(os.environ.get('LIVE_STATS_BUCKET_SECONDS', 10))
+LIVE_STATS_WINDOWS = {"5m": 300, "1h": 3600, "24h": 86400}
+LIVE_STATS_TOP_DEDUCTIONS = 5
+LIVE_STATS_SEEN_IDS = 100000 # 用于去重的最近事件 id 数
+LIVE_STATS_REHYDRATE_SEEN_IDS = 10000 # 重建时记入去重集合的快照中最近的事件 id 数
+
+_EPOCH = datetime(1970, 1, 1)
+
+REHYDRATE_COUNTS_SQL = """
+    SELECT floor(extract(epoch FROM event_time) / %(bucket)s)::bigint AS bucket,
+           COALESCE(camera_id, 0) AS camera_id, equipment_type,
+           (floor(score / 10) * 10)::int AS score_bucket,
+           COUNT(*) AS event_count,
+           COUNT(*) FILTER (WHERE risk_type = 'abnormal') AS abnormal_count
+    FROM events
+    WHERE event_time >= %(since)s
+    GROUP BY 1, 2, 3, 4
+"""
+REHYDRATE_DEDUCTIONS_SQL = """
+    SELECT floor(extract(epoch FROM event_time) / %(bucket)s)::bigint AS bucket,
+           COALESCE(camera_id, 0) AS camera_id, equipment_type,
+           d.value #>> '{}' AS deduction, COUNT(*) AS occurrences
+    FROM events
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(deductions::jsonb) = 'array' THEN deductions::jsonb ELSE '[]'::jsonb END
+    ) AS d(value)
+    WHERE event_time >= %(since)s
+    GROUP BY 1, 2, 3, 4
+"""
+REHYDRATE_SEEN_IDS_SQL = """
+    SELECT id FROM events
+    WHERE event_time >= %(since)s AND id > (SELECT COALESCE(max(id), 0) FROM events) - %(seen)s
+    ORDER BY id
+"""
+
+
+def parse_message_time(value):
+    """NOTIFY payload 中的 event_time ("...Z") -> 不带时区的 UTC datetime"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.rstrip('Z'))
+
+
+class Aggregate:
+    __slots__ = ("count", "abnormal", "scores", "deductions", "_top")
+
+    def __init__(self):
+        self.count = 0
+        self.abnormal = 0
+        self.scores = Counter()
+        self.deductions = Counter()
+        self._top = {} # top -> 扣分项 top-N (合并后失效)
+
+    def merge(self, other, sign=1):
+        self.count += sign * other.count
+        self.abnormal += sign * other.abnormal
+        if other.deductions:
+            self._top = {}
+        if sign > 0:
+            self.scores.update(other.scores)
+            self.deductions.update(other.deductions)
+        else:
+            self.scores.subtract(other.scores)
+            self.deductions.subtract(other.deductions)
+            # 去掉已减为 0 的项，避免长时间运行后 Counter 无限增长
+            self.scores = +self.scores
+            self.deductions = +self.deductions
+
+    def top_deductions(self, top):
+        result = self._top.get(top)
+        if result is None:
+            result = self._top[top] = [
+                {"deduction": name, "occurrences": n}
+                for name, n in heapq.nlargest(top, self.deductions.items(), key=lambda item: (item[1], item[0]))
+            ]
+        return result
+
+    def to_dict(self, top):
+        return {
+            "count": self.count,
+            "abnormal": self.abnormal,
+            "score_histogram": {str(k): v for k, v in sorted(self.scores.items())},
+            "top_deductions": self.top_deductions(top),
+        }
+
+
+def _keys(camera_id, equipment_type):
+    return (("all", None), ("camera", camera_id or 0), ("equipment_type", equipment_type))
+
+
+class LiveStats:
+    """
+    [PERF] 环形时间桶 + 每个窗口的滚动合计。
+    add() 与 query() 都只在一把锁内做与维度数量相关的工作，不访问数据库。
+    """
+    def __init__(self, bucket_seconds=LIVE_STATS_BUCKET_SECONDS, windows=LIVE_STATS_WINDOWS):
+        self.bucket_seconds = bucket_seconds
+        self.windows = dict(windows)
+        self.pid = os.getpid()
+        self.size = max(windows.values()) // bucket_seconds # 环形缓冲的桶数
+        self._ring = [None] * self.size # slot -> (bucket 序号, {key: Aggregate})
+        self._totals = {name: {} for name in self.windows} # 窗口 -> {key: Aggregate}
+        self._low = {name: None for name in self.windows} # 窗口内最早的桶序号
+        self._now_bucket = None
+        self._lock = threading.Lock()
+        # 已渲染的查询结果: (窗口, top) -> {"all": dict, "cameras": {...}, "equipment_types": {...}}；
+        # 合计变化的维度记入 _dirty，查询时只重新渲染这些维度 (渲染结果只替换不修改，可以在锁外序列化)
+        self._views = {}
+        self._dirty = {name: set() for name in self.windows}
+
+        self._seen = OrderedDict() # 最近计入的事件 id (去重)
+        self._pending = [] # 重建期间收到的事件
+        self.ready = False
+        self._stats = {"recorded": 0, "duplicates": 0, "dropped_old": 0, "notifications": 0, "rehydrated": 0}
+
+    # --- 时间桶 ---
+    def _bucket_of(self, event_time):
+        return int((event_time - _EPOCH).total_seconds() // self.bucket_seconds)
+
+    def _window_buckets(self, name):
+        return max(1, self.windows[name] // self.bucket_seconds)
+
+    def _advance(self, now_bucket):
+        """调用方持有 self._lock；把移出各窗口的桶从合计中减去"""
+        if self._now_bucket is not None and now_bucket <= self._now_bucket:
+            return
+        self._now_bucket = now_bucket
+        for name in self.windows:
+            new_low = now_bucket - self._window_buckets(name) + 1
+            low = self._low[name]
+            if low is None or new_low - low >= self._window_buckets(name):
+                self._dirty[name].update(self._totals[name])
+                self._totals[name] = {}
+            else:
+                totals = self._totals[name]
+                for bucket in range(low, new_low):
+                    slot = self._ring[bucket % self.size]
+                    if slot is None or slot[0] != bucket:
+                        continue
+                    for key, agg in slot[1].items():
+                        total = totals.get(key)
+                        if total is not None:
+                            self._dirty[name].add(key)
+                            total.merge(agg, -1)
+                            if total.count <= 0:
+                                del totals[key]
+            self._low[name] = new_low
+
+    def _add_locked(self, bucket, camera_id, equipment_type, abnormal, score, deductions):
+        self._advance(int(time.time() // self.bucket_seconds))
+        if bucket > self._now_bucket:
+            bucket = self._now_bucket # 摄像头时钟超前: 计入当前桶
+        if bucket <= self._now_bucket - self.size:
+            self._stats["dropped_old"] += 1
+            return
+        delta = Aggregate()
+        delta.count = 1
+        delta.abnormal = 1 if abnormal else 0
+        if score is not None:
+            delta.scores[score_bucket(score)] += 1
+        for item in deductions or []:
+            delta.deductions[deduction_label(item)] += 1
+        self._merge_locked(bucket, camera_id, equipment_type, delta)
+        self._stats["recorded"] += 1
+
+    def _merge_locked(self, bucket, camera_id, equipment_type, delta):
+        index = bucket % self.size
+        slot = self._ring[index]
+        if slot is None or slot[0] != bucket:
+            slot = self._ring[index] = (bucket, {})
+        for key in _keys(camera_id, equipment_type):
+            slot[1].setdefault(key, Aggregate()).merge(delta)
+            for name in self.windows:
+                if bucket >= self._low[name]:
+                    self._totals[name].setdefault(key, Aggregate()).merge(delta)
+                    self._dirty[name].add(key)
+
+    def _remember(self, event_id):
+        """调用方持有 self._lock；已计入过该事件时返回 False"""
+        if event_id is None:
+            return True
+        if event_id in self._seen:
+            self._stats["duplicates"] += 1
+            return False
+        self._seen[event_id] = True
+        if len(self._seen) > LIVE_STATS_SEEN_IDS:
+            self._seen.popitem(last=False)
+        return True
+
+    # --- 写入 ---
+    def add(self, event_id, event_time, camera_id, equipment_type, risk_type, score, deductions=None):
+        with self._lock:
+            if not self.ready:
+                self._pending.append((event_id, event_time, camera_id, equipment_type, risk_type, score, deductions))
+                return
+            if not self._remember(event_id):
+                return
+            self._add_locked(self._bucket_of(event_time), camera_id, equipment_type,
+                             risk_type == 'abnormal', score, deductions)
+
+    def record_events(self, events, event_ids):
+        """本进程提交的事件 (add_event / 批量写入 / 异步队列)；幂等重试的事件不计入"""
+        for event, event_id in zip(events, event_ids):
+            if event.get("replayed"):
+                continue
+            self.add(event_id, event["event_time"], event["camera_id"], event["equipment_type"],
+                     event["risk_type"], event["score"], event.get("deductions"))
+
+    def on_notify(self, message):
+        """
+        EventBroadcaster 的监听回调。不按 pid 过滤 (不同容器中的进程 pid 经常相同)，
+        本进程已通过 record_events 计入的事件由 _remember 按 id 去重
+        """
+        with self._lock:
+            self._stats["notifications"] += 1
+        self.add(message.get("id"), parse_message_time(message["event_time"]), message.get("camera_id"),
+                 message.get("equipment_type"), message.get("risk_type"), message.get("score"),
+                 message.get("deductions"))
+
+    # --- 启动时重建 ---
+    def rehydrate(self, cursor):
+        """
+        从数据库重建最大窗口内的统计 (cursor 为普通元组游标，所在连接必须处于空闲状态)，
+        完成后应用重建期间缓存的事件。三条查询在同一个 REPEATABLE READ 快照中执行
+        """
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        params = {
+            "bucket": self.bucket_seconds,
+            "since": datetime.utcnow() - timedelta(seconds=max(self.windows.values())),
+            "seen": LIVE_STATS_REHYDRATE_SEEN_IDS,
+        }
+        deltas = {}
+        cursor.execute(REHYDRATE_COUNTS_SQL, params)
+        for bucket, camera_id, equipment_type, bucket_score, count, abnormal in cursor.fetchall():
+            delta = deltas.setdefault((bucket, camera_id, equipment_type), Aggregate())
+            delta.count += count
+            delta.abnormal += abnormal
+            delta.scores[bucket_score] += count
+        cursor.execute(REHYDRATE_DEDUCTIONS_SQL, params)
+        for bucket, camera_id, equipment_type, deduction, occurrences in cursor.fetchall():
+            delta = deltas.setdefault((bucket, camera_id, equipment_type), Aggregate())
+            delta.deductions[deduction] += occurrences
+        cursor.execute(REHYDRATE_SEEN_IDS_SQL, params)
+        snapshot_ids = [row[0] for row in cursor.fetchall()]
+
+        with self._lock:
+            self._advance(int(time.time() // self.bucket_seconds))
+            for (bucket, camera_id, equipment_type), delta in deltas.items():
+                if self._now_bucket - self.size < bucket <= self._now_bucket:
+                    self._merge_locked(bucket, camera_id, equipment_type, delta)
+                    self._stats["rehydrated"] += delta.count
+            for event_id in snapshot_ids:
+                self._seen[event_id] = True
+            while len(self._seen) > LIVE_STATS_SEEN_IDS:
+                self._seen.popitem(last=False)
+            self.ready = True
+            pending, self._pending = self._pending, []
+        for item in pending:
+            self.add(*item)
+
+    def mark_ready(self):
+        """不重建 (例如数据库不可用) 时直接开始统计"""
+        with self._lock:
+            self.ready = True
+            pending, self._pending = self._pending, []
+        for item in pending:
+            self.add(*item)
+
+    # --- 查询 ---
+    def _render_locked(self, view, name, top, keys):
+        totals = self._totals[name]
+        for kind, value in keys:
+            agg = totals.get((kind, value))
+            if kind == "all":
+                view["all"] = (agg or Aggregate()).to_dict(top)
+                continue
+            group = view["cameras" if kind == "camera" else "equipment_types"]
+            label = str(value) if kind == "camera" else value
+            if agg is None:
+                group.pop(label, None)
+            else:
+                group[label] = agg.to_dict(top)
+
+    def _view_locked(self, name, top):
+        """调用方持有 self._lock；返回 (窗口, top) 的已渲染结果，已有的结果只重新渲染变化的维度"""
+        dirty = self._dirty[name]
+        if dirty:
+            for (view_name, view_top), view in self._views.items():
+                if view_name == name:
+                    self._render_locked(view, name, view_top, dirty)
+            dirty.clear()
+        view = self._views.get((name, top))
+        if view is None:
+            view = self._views[(name, top)] = {"all": Aggregate().to_dict(top), "cameras": {}, "equipment_types": {}}
+            self._render_locked(view, name, top, list(self._totals[name]))
+        return view
+
+    def query(self, camera_id=None, equipment_type=None, top=LIVE_STATS_TOP_DEDUCTIONS):
+        """
+        返回 {窗口: {"all": ..., "cameras": {...}, "equipment_types": {...}}}；
+        指定 camera_id / equipment_type 时只返回该维度
+        """
+        with self._lock:
+            self._advance(int(time.time() // self.bucket_seconds))
+            result = {}
+            for name in self.windows:
+                totals = self._totals[name]
+                if camera_id is not None:
+                    agg = totals.get(("camera", camera_id))
+                    result[name] = agg.to_dict(top) if agg else Aggregate().to_dict(top)
+                    continue
+                if equipment_type is not None:
+                    agg = totals.get(("equipment_type", equipment_type))
+                    result[name] = agg.to_dict(top) if agg else Aggregate().to_dict(top)
+                    continue
+                view = self._view_locked(name, top)
+                # 浅拷贝: 之后的查询只替换其中的条目，不修改已返回的字典
+                result[name] = {"all": view["all"], "cameras": dict(view["cameras"]),
+                                "equipment_types": dict(view["equipment_types"])}
+            return result
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["ready"] = self.ready
+            data["pending"] = len(self._pending)
+            data["bucket_seconds"] = self.bucket_seconds
+            data["tracked_keys"] = sum(len(t) for t in self._totals.values())
+        return data
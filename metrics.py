@@ -0,0 +1,320 @@
+"""
+[NEW] 进程内指标 (Prometheus 文本格式)
+
+- Counter / Gauge / Histogram 均为线程安全，按标签组合分别计数
+- 数据库查询通过 PooledConnection.cursor() 返回的游标自动记录耗时和行数
+- 慢请求日志: 设置 SLOW_REQUEST_MS 后，超过阈值的请求会打印其执行过的 SQL
+
+指标保存在各 worker 进程内，/metrics 返回的是处理该请求的 worker 的数据 (与 /api/system/stats 相同)。
+"""
+import bisect
+import math
+import os
+import re
+import threading
+import time
+
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') not in ('0', 'false')
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0)) # 0 表示关闭慢请求日志
+SLOW_REQUEST_MAX_QUERIES = 50 # 慢请求日志中每个请求最多记录的 SQL 条数
+
+# 秒；覆盖从缓存命中 (<1ms) 到连接池等待超时 (数秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [每个桶的计数 (非累计)..., +Inf 桶], 总和
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.label_names, key, le)} {cumulative}")
+            labels = _labels_text(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = [] # 导出时调用: fn() -> {指标名: (help, 数值或 None)}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn):
+        self._collectors.append(fn)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                values = collector()
+            except Exception as error:
+                print(f"指标采集失败: {error}")
+                continue
+            for name, (help_text, value) in values.items():
+                if value is None:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def flatten_stats(prefix, stats):
+    """把 stats() 返回的字典转换为 collector 格式 (只保留数值字段)"""
+    values = {}
+    for key, value in (stats or {}).items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        values[f"{prefix}_{key}"] = (f"{prefix.replace('_', ' ')}: {key}", value)
+    return values
+
+
+# --- 全局指标 ---
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+http_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the response headers)", ("method", "route")))
+http_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled"))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Database statement execution time", ("statement",)))
+db_query_rows = registry.register(Counter(
+    "db_query_rows_total", "Rows returned or affected by database statements", ("statement",)))
+db_query_errors = registry.register(Counter(
+    "db_query_errors_total", "Database statements that raised an error", ("statement",)))
+db_acquire_duration = registry.register(Histogram(
+    "db_pool_acquire_seconds", "Time spent borrowing a connection from the pool"))
+db_reads = registry.register(Counter(
+    "db_reads_total", "Read-only handler connections by target (primary or replica)", ("target",)))
+db_replica_lag = registry.register(Gauge(
+    "db_replica_lag_seconds", "Replication lag at the last check", ("replica",)))
+
+
+# --- SQL 语句标签 ---
+# 标签取 "语句类型 + 第一个表名" (如 "select events")，避免以完整 SQL 作为标签导致基数爆炸
+_STATEMENT_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+"?([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+_statement_labels = {}
+_STATEMENT_LABEL_CACHE = 1024
+
+
+def _sql_text(sql):
+    if isinstance(sql, bytes):
+        return sql.decode('utf-8', 'replace')
+    return sql if isinstance(sql, str) else str(sql) # psycopg2.sql.Composed 等
+
+
+def statement_label(sql):
+    sql = _sql_text(sql)
+    label = _statement_labels.get(sql)
+    if label is None:
+        text = sql.lstrip()
+        verb = text.split(None, 1)[0].lower() if text else "empty"
+        if verb == "with":
+            # CTE: 以主语句的动词为准
+            match = re.search(r'\)\s*(SELECT|INSERT|UPDATE|DELETE)\b', text, re.IGNORECASE)
+            verb = match.group(1).lower() if match else verb
+        if verb in ("copy", "execute", "prepare"):
+            # COPY 取表名；预编译语句取语句名
+            table = re.match(r'\w+\s+"?([A-Za-z_][A-Za-z0-9_]*)', text, re.IGNORECASE)
+        else:
+            table = _STATEMENT_RE.search(text)
+        label = f"{verb} {table.group(1).lower()}" if table else verb
+        if len(_statement_labels) < _STATEMENT_LABEL_CACHE:
+            _statement_labels[sql] = label
+    return label
+
+
+# --- 请求上下文 (慢请求日志) ---
+_request_context = threading.local()
+
+
+def begin_request():
+    _request_context.started = time.perf_counter()
+    _request_context.queries = [] if SLOW_REQUEST_MS > 0 else None
+    _request_context.db_time = 0.0
+    http_in_flight.inc()
+    return _request_context.started
+
+
+def end_request(method, route, status):
+    started = getattr(_request_context, "started", None)
+    if started is None:
+        return
+    _request_context.started = None
+    elapsed = time.perf_counter() - started
+    http_in_flight.dec()
+    http_requests.inc(method=method, route=route, status=str(status))
+    http_duration.observe(elapsed, method=method, route=route)
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        queries = _request_context.queries or []
+        print(f"慢请求: {method} {route} -> {status}, {elapsed * 1000:.1f}ms "
+              f"(数据库 {_request_context.db_time * 1000:.1f}ms, {len(queries)} 条 SQL)")
+        for sql, seconds, rows in queries:
+            print(f"    {seconds * 1000:8.1f}ms {rows:>7} 行  {sql}")
+
+
+def observe_query(sql, seconds, rows, failed=False):
+    label = statement_label(sql)
+    db_query_duration.observe(seconds, statement=label)
+    if failed:
+        db_query_errors.inc(statement=label)
+    elif rows > 0:
+        db_query_rows.inc(rows, statement=label)
+    if getattr(_request_context, "started", None) is not None:
+        _request_context.db_time += seconds
+        queries = _request_context.queries
+        if queries is not None and len(queries) < SLOW_REQUEST_MAX_QUERIES:
+            queries.append((" ".join(_sql_text(sql).split())[:300], seconds, max(rows, 0)))
+
+
+# --- 游标包装 ---
+
+class InstrumentedCursorMixin:
+    """记录 execute / executemany / copy_expert 的耗时和行数"""
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            observe_query(query, time.perf_counter() - started, 0, failed=True)
+            raise
+        observe_query(query, time.perf_counter() - started, self.rowcount)
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception:
+            observe_query(query, time.perf_counter() - started, 0, failed=True)
+            raise
+        observe_query(query, time.perf_counter() - started, self.rowcount)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            result = super().copy_expert(sql, file, size)
+        except Exception:
+            observe_query(sql, time.perf_counter() - started, 0, failed=True)
+            raise
+        observe_query(sql, time.perf_counter() - started, self.rowcount)
+        return result
+
+
+_instrumented_classes = {}
+_instrumented_lock = threading.Lock()
+
+
+def instrumented_cursor_class(cursor_class):
+    """返回 cursor_class 的带计时子类 (每个游标类型只创建一次)"""
+    cls = _instrumented_classes.get(cursor_class)
+    if cls is None:
+        with _instrumented_lock:
+            cls = _instrumented_classes.get(cursor_class)
+            if cls is None:
+                cls = type("Instrumented" + cursor_class.__name__, (InstrumentedCursorMixin, cursor_class), {})
+                _instrumented_classes[cursor_class] = cls
+    return cls
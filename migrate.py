@@ -0,0 +1,308 @@
+"""
+[NEW] 数据库迁移
+
+migrations/ 目录下按编号排序的 .sql / .py 文件，已执行的版本记录在 schema_migrations 表中。
+部署时 (例如 Render 的 pre-deploy command) 先执行 `python migrate.py up`，再启动 API。
+
+命令行:
+    python migrate.py up              # 执行所有未执行的迁移
+    python migrate.py status          # 列出迁移及执行状态
+    python migrate.py check-indexes   # 对高频查询执行 EXPLAIN，未使用期望的索引时退出码为 1
+
+迁移文件:
+    - NNNN_name.sql: 默认在一个事务中执行；首行为 `-- migrate: no-transaction` 时逐条语句自动提交
+      (CREATE INDEX CONCURRENTLY 不能在事务中执行)
+    - NNNN_name.py: 定义 upgrade(conn)；可以自行分批 commit，执行结束后记录版本并提交
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+
+import psycopg2
+import psycopg2.extensions
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_LOCK_KEY = 7310042 # pg_advisory_lock 的键，防止多个实例同时执行迁移
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+_FILENAME_RE = re.compile(r'^(\d{4})_([a-z0-9_]+)\.(sql|py)$')
+_DOLLAR_QUOTE_RE = re.compile(r'\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$') # $$ 或 $tag$
+
+SCHEMA_MIGRATIONS_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version    TEXT PRIMARY KEY,
+    name       TEXT NOT NULL,
+    checksum   TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+
+class MigrationError(Exception):
+    """迁移文件无效或执行失败"""
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, 'rb') as f:
+            self.source = f.read()
+        self.checksum = hashlib.sha256(self.source).hexdigest()
+
+    @property
+    def kind(self):
+        return os.path.splitext(self.path)[1][1:]
+
+    def apply(self, conn):
+        if self.kind == 'sql':
+            self._apply_sql(conn)
+        else:
+            self._apply_py(conn)
+
+    def _apply_sql(self, conn):
+        text = self.source.decode('utf-8')
+        if text.lstrip().startswith(NO_TRANSACTION_MARKER):
+            conn.autocommit = True
+            try:
+                cursor = conn.cursor()
+                for statement in split_statements(text):
+                    cursor.execute(statement)
+            finally:
+                conn.autocommit = False
+        else:
+            conn.cursor().execute(text)
+
+    def _apply_py(self, conn):
+        spec = importlib.util.spec_from_file_location(f"migration_{self.version}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if not hasattr(module, 'upgrade'):
+            raise MigrationError(f"{self.path} 缺少 upgrade(conn)")
+        module.upgrade(conn)
+
+
+def split_statements(text):
+    """
+    把 SQL 文件按 `;` 结尾的行拆分为语句 (只用于 no-transaction 迁移)。
+    $$ / $tag$ 引用的函数体 (DO 块、CREATE FUNCTION) 中的 `;` 不作为语句结尾
+    """
+    statements = []
+    current = []
+    quote = None # 当前所在的 dollar quote 标签
+    for line in text.splitlines():
+        if line.strip().startswith('--') and not current:
+            continue
+        current.append(line)
+        for match in _DOLLAR_QUOTE_RE.finditer(line):
+            if quote is None:
+                quote = match.group(0)
+            elif match.group(0) == quote:
+                quote = None
+        if quote is None and line.rstrip().endswith(';'):
+            statement = "\n".join(current).strip()
+            if statement.rstrip(';').strip():
+                statements.append(statement)
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    seen = set()
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith(('_', '.')) or filename.endswith('.pyc') or filename == '__pycache__':
+            continue
+        match = _FILENAME_RE.match(filename)
+        if not match:
+            raise MigrationError(f"无效的迁移文件名: {filename}")
+        version, name, _ = match.groups()
+        if version in seen:
+            raise MigrationError(f"重复的迁移编号: {version}")
+        seen.add(version)
+        migrations.append(Migration(version, name, os.path.join(directory, filename)))
+    return migrations
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+def migrate(conn, target=None):
+    """
+    执行所有未执行的迁移 (可指定 target 版本)；返回本次执行的版本列表。
+    使用会话级 advisory lock，多个实例同时部署时只有一个会执行迁移，其余等待后发现已是最新。
+    """
+    cursor = conn.cursor()
+    cursor.execute(SCHEMA_MIGRATIONS_SQL)
+    conn.commit()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    executed = []
+    try:
+        done = applied_versions(cursor)
+        conn.commit()
+        for migration in load_migrations():
+            if target is not None and migration.version > target:
+                break
+            if migration.version in done:
+                if done[migration.version] != migration.checksum:
+                    print(f"警告: 已执行的迁移 {migration.version}_{migration.name} 在执行后被修改过")
+                continue
+            print(f"执行迁移 {migration.version}_{migration.name} ...")
+            try:
+                migration.apply(conn)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                    (migration.version, migration.name, migration.checksum)
+                )
+                conn.commit()
+            except Exception as error:
+                conn.rollback()
+                raise MigrationError(f"迁移 {migration.version}_{migration.name} 失败: {error}") from error
+            executed.append(migration.version)
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+    return executed
+
+
+def pending_migrations(conn):
+    """未执行的迁移 (schema_migrations 不存在时视为全部未执行)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    done = applied_versions(cursor) if cursor.fetchone()[0] else {}
+    conn.rollback()
+    return [m for m in load_migrations() if m.version not in done]
+
+
+# --- 索引检查 ---
+
+def hot_queries():
+    """
+    高频查询及其应使用的索引: [(名称, SQL, 示例参数, {索引名})]
+    SQL 直接取自 api.py / event_ingest.py / event_export.py 中 handler 执行的语句 (预编译语句与 SQL 构造函数)，
+    handler 的查询改变时检查项随之改变。分区表上的索引以父表上的索引名表示。
+    """
+    import api # 只在检查索引时导入应用 (migrate up 不需要 Flask)
+    from event_export import build_export_query
+    from event_ingest import SELECT_REPLAYED_EVENT
+
+    day = ("2024-01-01", "2024-01-01 23:59:59")
+    month = ("2024-01-01", "2024-01-31 23:59:59")
+    unbounded = ("-infinity", "infinity")
+    event_key = (1000, "2024-01-15 12:00:00")
+    export_sql, export_params = build_export_query(*day)
+    return [
+        ("get_events (page)", api.EVENT_LIST_STATEMENTS["page", False].sql, month + (21, 40),
+         {"events_abnormal_time_idx"}),
+        ("get_events (keyset)", api.EVENT_LIST_STATEMENTS["keyset", False].sql, month + event_key[::-1] + (21,),
+         {"events_abnormal_time_idx"}),
+        ("get_events (count)", api.EVENT_LIST_STATEMENTS["count", False].sql, month,
+         {"events_abnormal_time_idx"}),
+        ("get_events (deduction count)", api.EVENT_LIST_STATEMENTS["count", True].sql,
+         unbounded + ('["no helmet"]',), {"events_deductions_gin_idx"}),
+        ("get_event_detail", api.EVENT_DETAIL_STATEMENTS["one", False].sql, event_key[:1],
+         {"events_pkey", "event_images_event_time_idx"}),
+        ("get_event_detail (event_time)", api.EVENT_DETAIL_STATEMENTS["one_at", False].sql, event_key,
+         {"events_pkey", "event_images_event_time_idx"}),
+        ("get_event_details", api.EVENT_DETAIL_STATEMENTS["many", False].sql, ([1, 2, 3],),
+         {"events_pkey", "event_images_event_time_idx"}),
+        ("export_events", export_sql, export_params, {"events_time_id_idx", "event_images_event_time_idx"}),
+        ("add_event (idempotency replay)", SELECT_REPLAYED_EVENT.sql, ("3:2024-01-01T00:00:00Z:17", day[0]),
+         {"events_idempotency_key_idx"}),
+        ("load_events_since", api.SQL_EVENTS_SINCE, (1000, 500), {"events_pkey"}),
+        ("login", api.SELECT_LOGIN_USER.sql, ("admin",), {"users_username_key"}),
+        ("get_cameras", api.SQL_ACTIVE_CAMERAS, (), {"cameras_active_name_idx"}),
+        ("add_feedback (event)", api.SQL_FEEDBACK_EVENT_TIME, event_key[:1], {"events_pkey"}),
+        ("add_feedback (image)", api.SQL_FEEDBACK_MARK_IMAGE, (1,) + event_key, {"event_images_pkey"}),
+        ("get_report (fallback)", api.SQL_LATEST_REPORT, ("monthly",), {"reports_type_period_idx"}),
+    ]
+
+
+def _plan_scans(plan):
+    """[(节点类型, 表名, 索引名)]"""
+    found = []
+    if plan.get("Node Type") in ("Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+        found.append((plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")))
+    for child in plan.get("Plans", []):
+        found.extend(_plan_scans(child))
+    return found
+
+
+def _parent_index(cursor, name):
+    """分区上的索引 -> 父表上的索引名 (非分区索引返回自身)"""
+    cursor.execute("""
+        SELECT COALESCE((SELECT inhparent::regclass::text FROM pg_inherits WHERE inhrelid = to_regclass(%s)), %s)
+    """, (name, name))
+    return cursor.fetchone()[0]
+
+
+def check_indexes(conn, queries=None):
+    """
+    对每个高频查询执行 EXPLAIN，返回 [(名称, 问题)]，空列表表示全部通过。
+    关闭 seqscan (小表上规划器也会选择索引) 后，计划中出现 Seq Scan 或没有使用期望的索引都视为失败:
+    只检查 Seq Scan 无法发现索引缺失后规划器改用其他索引全扫描的情况
+    """
+    failures = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for name, sql, params, expected in (hot_queries() if queries is None else queries):
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scans = _plan_scans(plan[0]["Plan"])
+            used = {_parent_index(cursor, index) for _, _, index in scans if index}
+            problems = [f"Seq Scan: {table}" for node, table, _ in scans if node == "Seq Scan"]
+            problems += [f"未使用 {index}" for index in sorted(expected - used)]
+            print(f"{'FAIL' if problems else 'ok':>4}  {name}  ({', '.join(problems or sorted(used))})")
+            if problems:
+                failures.append((name, problems))
+    finally:
+        conn.rollback()
+    return failures
+
+
+# --- 命令行 ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数据库迁移")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_up = sub.add_parser("up", help="执行未执行的迁移")
+    p_up.add_argument("--target", help="只执行到该版本 (含)")
+    sub.add_parser("status", help="列出迁移及执行状态")
+    sub.add_parser("check-indexes", help="检查高频查询是否使用索引")
+    args = parser.parse_args(argv)
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise SystemExit("DATABASE_URL 环境变量未设置。")
+
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.command == "up":
+            executed = migrate(conn, args.target)
+            print(f"已执行 {len(executed)} 个迁移" if executed else "数据库已是最新")
+        elif args.command == "status":
+            pending = {m.version for m in pending_migrations(conn)}
+            for migration in load_migrations():
+                state = "pending" if migration.version in pending else "applied"
+                print(f"{state:>8}  {migration.version}_{migration.name}.{migration.kind}")
+        elif args.command == "check-indexes":
+            if check_indexes(conn):
+                raise SystemExit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
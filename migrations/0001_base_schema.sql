@@ -0,0 +1,62 @@
+-- 基础表结构 (api.py 中各 handler 使用的表和列)
+-- 已有部署中这些表可能已经存在，因此全部使用 IF NOT EXISTS，并补齐 handler 依赖的列
+
+CREATE TABLE IF NOT EXISTS users (
+    id            SERIAL PRIMARY KEY,
+    username      TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    email         TEXT NOT NULL UNIQUE,
+    full_name     TEXT NOT NULL,
+    role          TEXT NOT NULL DEFAULT 'teacher',
+    created_at    TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS cameras (
+    id         SERIAL PRIMARY KEY,
+    name       TEXT NOT NULL,
+    stream_url TEXT,
+    is_active  BOOLEAN NOT NULL DEFAULT true
+);
+ALTER TABLE cameras ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'unknown';
+
+CREATE TABLE IF NOT EXISTS events (
+    id             SERIAL PRIMARY KEY,
+    camera_id      INTEGER,
+    equipment_type TEXT NOT NULL,
+    event_time     TIMESTAMP NOT NULL,
+    risk_type      TEXT NOT NULL,
+    score          NUMERIC(5, 2) NOT NULL,
+    image_filename TEXT,
+    image_count    INTEGER NOT NULL DEFAULT 0,
+    status         TEXT NOT NULL DEFAULT 'new',
+    deductions     TEXT
+);
+
+CREATE TABLE IF NOT EXISTS event_images (
+    id          SERIAL PRIMARY KEY,
+    event_id    INTEGER NOT NULL REFERENCES events (id),
+    image_url   TEXT NOT NULL,
+    "timestamp" TIMESTAMP NOT NULL
+);
+ALTER TABLE event_images ADD COLUMN IF NOT EXISTS score NUMERIC(5, 2);
+ALTER TABLE event_images ADD COLUMN IF NOT EXISTS deduction_items TEXT;
+ALTER TABLE event_images ADD COLUMN IF NOT EXISTS has_feedback BOOLEAN NOT NULL DEFAULT false;
+
+CREATE TABLE IF NOT EXISTS feedback (
+    id            SERIAL PRIMARY KEY,
+    event_id      INTEGER NOT NULL,
+    image_id      INTEGER NOT NULL,
+    user_id       INTEGER NOT NULL,
+    notes         TEXT,
+    feedback_time TIMESTAMP NOT NULL DEFAULT now()
+);
+ALTER TABLE feedback ADD COLUMN IF NOT EXISTS reason TEXT;
+
+CREATE TABLE IF NOT EXISTS reports (
+    id           SERIAL PRIMARY KEY,
+    report_type  TEXT NOT NULL,
+    "year"       INTEGER NOT NULL,
+    "month"      INTEGER NOT NULL,
+    summary_data JSONB NOT NULL,
+    created_at   TIMESTAMP NOT NULL DEFAULT now()
+);
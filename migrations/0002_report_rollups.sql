@@ -0,0 +1,43 @@
+-- 报告引擎的小时/天两级汇总表 (report_engine.record_events 在写入事件的事务中更新)
+
+CREATE TABLE IF NOT EXISTS event_rollup_hourly (
+    bucket_start   TIMESTAMP NOT NULL,
+    camera_id      INTEGER NOT NULL,
+    equipment_type TEXT NOT NULL,
+    risk_type      TEXT NOT NULL,
+    score_bucket   SMALLINT NOT NULL,
+    event_count    BIGINT NOT NULL DEFAULT 0,
+    score_sum      DOUBLE PRECISION NOT NULL DEFAULT 0,
+    image_count    BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, camera_id, equipment_type, risk_type, score_bucket)
+);
+CREATE TABLE IF NOT EXISTS deduction_rollup_hourly (
+    bucket_start   TIMESTAMP NOT NULL,
+    camera_id      INTEGER NOT NULL,
+    equipment_type TEXT NOT NULL,
+    risk_type      TEXT NOT NULL,
+    deduction      TEXT NOT NULL,
+    occurrences    BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, camera_id, equipment_type, risk_type, deduction)
+);
+
+CREATE TABLE IF NOT EXISTS event_rollup_daily (
+    bucket_start   TIMESTAMP NOT NULL,
+    camera_id      INTEGER NOT NULL,
+    equipment_type TEXT NOT NULL,
+    risk_type      TEXT NOT NULL,
+    score_bucket   SMALLINT NOT NULL,
+    event_count    BIGINT NOT NULL DEFAULT 0,
+    score_sum      DOUBLE PRECISION NOT NULL DEFAULT 0,
+    image_count    BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, camera_id, equipment_type, risk_type, score_bucket)
+);
+CREATE TABLE IF NOT EXISTS deduction_rollup_daily (
+    bucket_start   TIMESTAMP NOT NULL,
+    camera_id      INTEGER NOT NULL,
+    equipment_type TEXT NOT NULL,
+    risk_type      TEXT NOT NULL,
+    deduction      TEXT NOT NULL,
+    occurrences    BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, camera_id, equipment_type, risk_type, deduction)
+);
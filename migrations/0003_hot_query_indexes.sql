@@ -0,0 +1,22 @@
+-- migrate: no-transaction
+-- 与 api.py 中高频查询对应的索引 (CONCURRENTLY: 已有数据的部署在建索引期间不阻塞写入)
+
+-- GET /api/events: risk_type = 'abnormal' + 日期范围，ORDER BY event_time DESC, id DESC (OFFSET 与游标分页)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS events_abnormal_time_idx
+    ON events (event_time DESC, id DESC) WHERE risk_type = 'abnormal';
+
+-- GET /api/events/export 与报告回填: 按 event_time 范围顺序读取 (不限 risk_type)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS events_time_id_idx
+    ON events (event_time, id);
+
+-- GET /api/events/<id>, /api/events/details: 按 event_id 取图片并按 timestamp 排序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS event_images_event_time_idx
+    ON event_images (event_id, "timestamp");
+
+-- GET /api/reports 回退路径: 某类型的最新一份报告
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reports_type_period_idx
+    ON reports (report_type, "year" DESC, "month" DESC, created_at DESC);
+
+-- GET /api/cameras: 启用的摄像头按名称排序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cameras_active_name_idx
+    ON cameras (name) WHERE is_active;
@@ -0,0 +1,13 @@
+-- 扣分项改为 JSONB 存储 (原来是 json.dumps 后的 TEXT)
+-- 读取端原本就通过 ::jsonb 转换，写入端传入的 JSON 字符串可以直接赋值给 jsonb 列
+-- 注意: ALTER COLUMN TYPE 会重写整张表，数据量大时请在低峰期执行
+
+ALTER TABLE events
+    ALTER COLUMN deductions TYPE JSONB
+    USING CASE WHEN deductions IS NULL OR btrim(deductions) = '' THEN '[]'::jsonb ELSE deductions::jsonb END,
+    ALTER COLUMN deductions SET DEFAULT '[]'::jsonb;
+
+ALTER TABLE event_images
+    ALTER COLUMN deduction_items TYPE JSONB
+    USING CASE WHEN deduction_items IS NULL OR btrim(deduction_items) = '' THEN '[]'::jsonb ELSE deduction_items::jsonb END,
+    ALTER COLUMN deduction_items SET DEFAULT '[]'::jsonb;
@@ -0,0 +1,91 @@
+"""
+events 和 event_images 按 event_time 转换为月度范围分区表。
+
+- 新建分区表 (列和默认值与原表相同，id 继续使用原来的序列)，复制数据后替换原表
+- event_images 增加 event_time 列 (所属事件的 event_time)，图片与事件落在同一个月的分区:
+  按 (event_id, event_time) 关联时两边都能裁剪分区，保留策略也按月同时归档事件和图片
+- 分区表的主键必须包含分区键: events (id, event_time)、event_images (id, event_time)
+- event_images.event_id 的外键改为 AFTER INSERT 语句级触发器，检查 (event_id, event_time) 对应的事件存在
+  (外键引用分区表时，默认分区中的行在创建月份分区时无法移动，DETACH 也会被引用检查阻止)
+- 0003 中的索引在分区表上重新创建 (各分区自动继承)
+
+整个迁移在一个事务中执行，期间两张表被锁定；数据量大时请在维护窗口执行。
+"""
+from datetime import datetime
+
+import partitions
+
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    # 恢复的归档分区在 hold 期内不会被保留策略再次归档 (partitions.restore_month)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS partition_holds (
+            partition_name TEXT PRIMARY KEY,
+            hold_until     TIMESTAMP NOT NULL
+        )
+    """)
+    if partitions.is_partitioned(cursor, "events"):
+        return
+
+    cursor.execute("LOCK TABLE events, event_images IN ACCESS EXCLUSIVE MODE")
+    cursor.execute("SELECT pg_get_serial_sequence('events', 'id'), pg_get_serial_sequence('event_images', 'id')")
+    events_seq, images_seq = cursor.fetchone()
+    cursor.execute("SELECT min(event_time) FROM events")
+    oldest = cursor.fetchone()[0] or datetime.utcnow()
+
+    # 原表删除时不要连带删除序列
+    cursor.execute(f"ALTER SEQUENCE {events_seq} OWNED BY NONE")
+    cursor.execute(f"ALTER SEQUENCE {images_seq} OWNED BY NONE")
+
+    cursor.execute("ALTER TABLE event_images RENAME TO event_images_unpartitioned")
+    cursor.execute("ALTER TABLE events RENAME TO events_unpartitioned")
+    cursor.execute("CREATE TABLE events (LIKE events_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (event_time)")
+    cursor.execute("""
+        CREATE TABLE event_images (LIKE event_images_unpartitioned INCLUDING DEFAULTS, event_time TIMESTAMP NOT NULL)
+        PARTITION BY RANGE (event_time)
+    """)
+    for table in partitions.PARTITION_KEYS:
+        partitions.create_default_partition(cursor, table)
+    partitions.ensure_partitions(cursor, since=oldest)
+
+    cursor.execute("INSERT INTO events SELECT * FROM events_unpartitioned")
+    cursor.execute("""
+        INSERT INTO event_images
+        SELECT i.*, e.event_time FROM event_images_unpartitioned i JOIN events_unpartitioned e ON e.id = i.event_id
+    """)
+    cursor.execute("DROP TABLE event_images_unpartitioned")
+    cursor.execute("DROP TABLE events_unpartitioned")
+
+    cursor.execute(f"ALTER SEQUENCE {events_seq} OWNED BY events.id")
+    cursor.execute(f"ALTER SEQUENCE {images_seq} OWNED BY event_images.id")
+
+    # 数据复制完成后再建主键和索引
+    cursor.execute("ALTER TABLE events ADD CONSTRAINT events_pkey PRIMARY KEY (id, event_time)")
+    cursor.execute("ALTER TABLE event_images ADD CONSTRAINT event_images_pkey PRIMARY KEY (id, event_time)")
+    cursor.execute("""
+        CREATE INDEX events_abnormal_time_idx ON events (event_time DESC, id DESC) WHERE risk_type = 'abnormal'
+    """)
+    cursor.execute("CREATE INDEX events_time_id_idx ON events (event_time, id)")
+    cursor.execute('CREATE INDEX event_images_event_time_idx ON event_images (event_id, "timestamp")')
+
+    # 代替外键: 每条 INSERT / COPY 语句检查一次新图片的 (event_id, event_time)
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION event_images_check_event() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM new_images n
+                WHERE NOT EXISTS (SELECT 1 FROM events e WHERE e.id = n.event_id AND e.event_time = n.event_time)
+            ) THEN
+                RAISE EXCEPTION 'event_images 引用了不存在的事件 (event_id, event_time)'
+                    USING ERRCODE = 'foreign_key_violation';
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    cursor.execute("""
+        CREATE TRIGGER event_images_event_exists AFTER INSERT ON event_images
+        REFERENCING NEW TABLE AS new_images
+        FOR EACH STATEMENT EXECUTE FUNCTION event_images_check_event()
+    """)
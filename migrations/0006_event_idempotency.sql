@@ -0,0 +1,8 @@
+-- 事件幂等键: AI 脚本超时重试时不会重复写入 events / event_images
+-- 分区表上的唯一索引必须包含分区键，因此为 (idempotency_key, event_time)；没有幂等键 (NULL) 的事件不受约束
+-- 注意: 分区表不支持 CREATE INDEX CONCURRENTLY，建索引期间会阻塞写入
+
+ALTER TABLE events ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS events_idempotency_key_idx
+    ON events (idempotency_key, event_time);
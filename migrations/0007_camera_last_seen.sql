@@ -0,0 +1,4 @@
+-- 摄像头心跳: 最近一次心跳时间 (camera_status.py 批量写入)
+-- 多个 worker 分别收到心跳时，以 last_seen_at 判断是否可以标记为 offline
+
+ALTER TABLE cameras ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP;
@@ -0,0 +1,37 @@
+"""
+events.deductions 的 GIN 索引 (jsonb_path_ops)，用于扣分项筛选的包含查询: deductions @> '["no helmet"]'
+
+分区表不支持 CREATE INDEX CONCURRENTLY，因此先在父表上 ON ONLY 建索引 (此时无效)，
+再在每个分区上 CONCURRENTLY 建索引并 ATTACH；所有分区挂载后父表索引自动变为有效。
+之后新建的分区会自动创建该索引。
+"""
+import partitions
+
+
+INDEX_NAME = "events_deductions_gin_idx"
+INDEX_METHOD = "USING gin (deductions jsonb_path_ops)"
+
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    if not partitions.is_partitioned(cursor, "events"):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON events {INDEX_METHOD}")
+        return
+
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY events {INDEX_METHOD}")
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'events'::regclass
+        ORDER BY c.relname
+    """)
+    children = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+
+    conn.autocommit = True
+    try:
+        for child in children:
+            child_index = f"{child}_deductions_gin_idx"
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_index} ON {child} {INDEX_METHOD}")
+            cursor.execute(f"ALTER INDEX {INDEX_NAME} ATTACH PARTITION {child_index}")
+    finally:
+        conn.autocommit = False
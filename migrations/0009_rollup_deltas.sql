@@ -0,0 +1,21 @@
+-- 报告汇总表的增量队列: 写入事件的事务只追加行 (没有唯一约束，不与其他写入事务争用行锁)，
+-- report_engine.RollupRefresher 定期把增量合并到小时/天汇总表并删除
+
+CREATE TABLE IF NOT EXISTS event_rollup_delta (
+    bucket_start   TIMESTAMP NOT NULL, -- 整点
+    camera_id      INTEGER NOT NULL,
+    equipment_type TEXT NOT NULL,
+    risk_type      TEXT NOT NULL,
+    score_bucket   SMALLINT NOT NULL,
+    event_count    BIGINT NOT NULL,
+    score_sum      DOUBLE PRECISION NOT NULL,
+    image_count    BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deduction_rollup_delta (
+    bucket_start   TIMESTAMP NOT NULL,
+    camera_id      INTEGER NOT NULL,
+    equipment_type TEXT NOT NULL,
+    risk_type      TEXT NOT NULL,
+    deduction      TEXT NOT NULL,
+    occurrences    BIGINT NOT NULL
+);
@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursorError(ValueError):
+    """客户端提供的分页游标无法解析"""
+
+
+def encode_cursor(event_time, event_id):
+    """
+    [PERF] 生成不透明的分页游标，内容为最后一行的 (event_time, id)。
+    客户端只需原样传回 `after`，不应依赖其内部格式。
+    """
+    return encode_position(event_time, event_id)
+
+
+def decode_cursor(token):
+    """解析 encode_cursor 生成的游标，返回 (event_time, id)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        event_time_str, event_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(event_time_str), int(event_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursorError("无效的分页游标")
+
+
+def estimate_count(cursor, sql_from, params):
+    """
+    用规划器的估算行数代替 COUNT(*) (EXPLAIN 不会真正执行查询)。
+    sql_from 为 "FROM ... WHERE ..." 部分；估算 SELECT 1 而不是 COUNT(*)，
+    这样顶层节点就是扫描本身 (或 Gather)，其 Plan Rows 即为总行数估算。
+    """
+    cursor.execute("EXPLAIN (FORMAT JSON) SELECT 1 " + sql_from, params)
+    row = cursor.fetchone()
+    plan = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan'].get('Plan Rows', 0))
+
+
+def encode_position(*key):
+    """导出接口的续传位置 (排序键的元组)，格式与分页游标相同"""
+    parts = [k.isoformat() if isinstance(k, datetime) else k for k in key]
+    raw = json.dumps(parts, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_position(token):
+    """解析 encode_position 生成的位置，返回 (event_time, event_id, image_id)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        event_time_str, event_id, image_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(event_time_str), int(event_id), int(image_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursorError("无效的导出位置")
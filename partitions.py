@@ -0,0 +1,367 @@
+"""
+[NEW] events / event_images 按月分区的维护
+
+- events 和 event_images 都按 event_time 做月度范围分区 (由 migrations/0005 转换)；
+  图片的 event_time 为所属事件的 event_time，同一个事件的图片与事件在同一个月的分区
+- 提前创建未来几个月的分区；落在已有分区之外的行进入 *_default 分区，创建对应月份分区时再移入
+- 保留策略: 超过保留期的月份分区先 DETACH，再以 gzip 压缩的 COPY 文件归档到本地目录，然后删除
+- 归档的月份可以按需恢复，恢复后在 hold 期内不会被保留策略再次归档
+
+API 进程中的后台线程只负责创建未来分区；保留/归档较重，通过定时任务执行:
+    python partitions.py maintain                      # 创建未来分区 + 执行保留策略
+    python partitions.py list                          # 列出分区和已归档的月份
+    python partitions.py restore 2023-05 [--hold-days 7]
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+
+
+PARTITION_KEYS = {
+    "events": "event_time",
+    "event_images": "event_time",
+}
+PARTITION_PREMAKE_MONTHS = int(os.environ.get('PARTITION_PREMAKE_MONTHS', 3)) # 提前创建的未来月份数
+PARTITION_RETENTION_MONTHS = int(os.environ.get('PARTITION_RETENTION_MONTHS', 0)) # 0 表示永久保留
+PARTITION_ARCHIVE_DIR = os.environ.get(
+    'PARTITION_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+PARTITION_MAINTENANCE_INTERVAL = float(os.environ.get('PARTITION_MAINTENANCE_INTERVAL', 6 * 3600)) # 0 表示不启动后台线程
+PARTITION_LOCK_KEY = 7310043 # 与 migrate.MIGRATION_LOCK_KEY 不同
+
+
+# --- 月份与命名 ---
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def parse_partition_month(table, name):
+    match = re.fullmatch(re.escape(table) + r'_p(\d{4})_(\d{2})', name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def parse_month(text):
+    """'2024-05' -> date(2024, 5, 1)"""
+    return datetime.strptime(text, "%Y-%m").date()
+
+
+# --- 查询辅助 ---
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return bool(row) and _first(row) == 'p'
+
+
+def _first(row):
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return _first(cursor.fetchone())
+
+
+def attached_partitions(cursor, table):
+    """已挂载的月度分区 {month: name} (不含 default 分区)"""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    result = {}
+    for row in cursor.fetchall():
+        name = _first(row)
+        month = parse_partition_month(table, name)
+        if month:
+            result[month] = name
+    return result
+
+
+def detached_partitions(cursor, table):
+    """已 DETACH 但尚未归档删除的分区 (上一次归档中途失败时留下) {month: name}"""
+    cursor.execute("""
+        SELECT relname FROM pg_class
+        WHERE relkind = 'r' AND NOT relispartition AND relnamespace = 'public'::regnamespace
+          AND relname LIKE %s
+    """, (table + "_p%",))
+    result = {}
+    for row in cursor.fetchall():
+        name = _first(row)
+        month = parse_partition_month(table, name)
+        if month:
+            result[month] = name
+    return result
+
+
+def table_columns(cursor, name):
+    cursor.execute("""
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+    """, (name,))
+    return [_first(row) for row in cursor.fetchall()]
+
+
+# --- 创建分区 ---
+
+def create_default_partition(cursor, table):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+
+
+def create_partition(cursor, table, month):
+    """
+    创建某个月的分区 (已存在时返回 False)。
+    default 分区中已有该月的行时，先把这些行移到新表再 ATTACH，否则 PostgreSQL 会拒绝创建分区。
+    """
+    name = partition_name(table, month)
+    if _table_exists(cursor, name):
+        return False
+    column = PARTITION_KEYS[table]
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    default = f"{table}_default"
+
+    in_default = False
+    if _table_exists(cursor, default):
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {column} >= %s AND {column} < %s)",
+                       (start, end))
+        in_default = _first(cursor.fetchone())
+
+    if in_default:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+        cursor.execute(f"""
+            WITH moved AS (DELETE FROM {default} WHERE {column} >= %s AND {column} < %s RETURNING *)
+            INSERT INTO {name} SELECT * FROM moved
+        """, (start, end))
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+    else:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", (start, end))
+    return True
+
+
+def ensure_partitions(cursor, months_ahead=PARTITION_PREMAKE_MONTHS, since=None):
+    """创建 since (默认本月) 到未来 months_ahead 个月的分区；表未分区时不做任何事。返回新建的分区名"""
+    created = []
+    current = month_start(datetime.utcnow())
+    first = month_start(since) if since else current
+    last = add_months(current, months_ahead)
+    for table in PARTITION_KEYS:
+        if not is_partitioned(cursor, table):
+            continue
+        month = first
+        while month <= last:
+            if create_partition(cursor, table, month):
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+    return created
+
+
+# --- 保留策略与归档 ---
+
+def archive_paths(archive_dir, name):
+    return os.path.join(archive_dir, f"{name}.copy.gz"), os.path.join(archive_dir, f"{name}.json")
+
+
+def archive_table(cursor, table, name, month, archive_dir=PARTITION_ARCHIVE_DIR):
+    """把一个已 DETACH 的分区导出为 gzip 压缩的 COPY 文件和清单 (先写临时文件，完成后再改名)"""
+    os.makedirs(archive_dir, exist_ok=True)
+    data_path, manifest_path = archive_paths(archive_dir, name)
+    columns = table_columns(cursor, name)
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    with gzip.open(data_path + ".tmp", "wb") as f:
+        cursor.copy_expert(f"COPY {name} ({column_list}) TO STDOUT", f)
+    rows = cursor.rowcount
+    manifest = {
+        "table": table,
+        "partition": name,
+        "month": month.strftime("%Y-%m"),
+        "columns": columns,
+        "rows": rows,
+        "archived_at": datetime.utcnow().isoformat() + "Z",
+    }
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def held_partitions(cursor):
+    cursor.execute("SELECT partition_name FROM partition_holds WHERE hold_until > now()")
+    return {_first(row) for row in cursor.fetchall()}
+
+
+def apply_retention(conn, retention_months=PARTITION_RETENTION_MONTHS, archive_dir=PARTITION_ARCHIVE_DIR):
+    """
+    DETACH 超过保留期的月度分区，归档后删除。每个分区单独提交，
+    归档中途失败时分区保持 DETACH 状态，下次执行时会继续归档。返回已归档的分区清单。
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(datetime.utcnow()), -retention_months)
+    cursor = conn.cursor()
+    archived = []
+    held = held_partitions(cursor)
+    for table in PARTITION_KEYS:
+        if not is_partitioned(cursor, table):
+            continue
+        for month, name in sorted(attached_partitions(cursor, table).items()):
+            if month < cutoff and name not in held:
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                conn.commit()
+                print(f"已分离分区 {name}")
+        for month, name in sorted(detached_partitions(cursor, table).items()):
+            if month >= cutoff or name in held:
+                continue
+            manifest = archive_table(cursor, table, name, month, archive_dir)
+            cursor.execute(f"DROP TABLE {name}")
+            conn.commit()
+            print(f"已归档分区 {name} ({manifest['rows']} 行)")
+            archived.append(manifest)
+    conn.commit()
+    return archived
+
+
+def restore_month(conn, month, hold_days=7, archive_dir=PARTITION_ARCHIVE_DIR):
+    """从归档文件恢复某个月的 events 和 event_images 分区，并在 hold_days 天内不再被保留策略归档"""
+    cursor = conn.cursor()
+    restored = []
+    for table in PARTITION_KEYS:
+        name = partition_name(table, month)
+        data_path, manifest_path = archive_paths(archive_dir, name)
+        if not os.path.exists(manifest_path):
+            print(f"没有 {name} 的归档，跳过")
+            continue
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        create_partition(cursor, table, month)
+        column_list = ", ".join(f'"{c}"' for c in manifest["columns"])
+        with gzip.open(data_path, "rb") as f:
+            cursor.copy_expert(f"COPY {name} ({column_list}) FROM STDIN", f)
+        cursor.execute("""
+            INSERT INTO partition_holds (partition_name, hold_until) VALUES (%s, now() + %s * interval '1 day')
+            ON CONFLICT (partition_name) DO UPDATE SET hold_until = EXCLUDED.hold_until
+        """, (name, hold_days))
+        restored.append((name, manifest["rows"]))
+    conn.commit()
+    return restored
+
+
+def maintain(conn, months_ahead=PARTITION_PREMAKE_MONTHS, retention_months=PARTITION_RETENTION_MONTHS,
+             archive_dir=PARTITION_ARCHIVE_DIR):
+    """创建未来分区并执行保留策略；其他进程正在维护时直接返回 None"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(%s)", (PARTITION_LOCK_KEY,))
+    if not _first(cursor.fetchone()):
+        conn.rollback()
+        return None
+    try:
+        created = ensure_partitions(cursor, months_ahead)
+        conn.commit()
+        archived = apply_retention(conn, retention_months, archive_dir)
+        return {"created": created, "archived": archived}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (PARTITION_LOCK_KEY,))
+        conn.commit()
+
+
+class PartitionMaintainer:
+    """
+    API 进程内的后台线程: 定期创建未来分区 (不执行保留策略)。
+    与连接池一样按 PID 懒加载，gunicorn fork 之后才启动线程。
+    """
+    def __init__(self, get_connection, interval=PARTITION_MAINTENANCE_INTERVAL):
+        self.get_connection = get_connection
+        self.interval = interval
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="partition-maintainer", daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (PARTITION_LOCK_KEY,))
+            if _first(cursor.fetchone()):
+                created = ensure_partitions(cursor)
+                if created:
+                    print(f"已创建分区: {', '.join(created)}")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as error:
+                print(f"分区维护失败: {error}")
+            time.sleep(self.interval)
+
+
+# --- 命令行 ---
+
+def main(argv=None):
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description="events / event_images 分区维护")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_maintain = sub.add_parser("maintain", help="创建未来分区并执行保留策略")
+    p_maintain.add_argument("--months-ahead", type=int, default=PARTITION_PREMAKE_MONTHS)
+    p_maintain.add_argument("--retention-months", type=int, default=PARTITION_RETENTION_MONTHS)
+    sub.add_parser("list", help="列出分区和已归档的月份")
+    p_restore = sub.add_parser("restore", help="从归档恢复某个月")
+    p_restore.add_argument("month", help="例如 2023-05")
+    p_restore.add_argument("--hold-days", type=int, default=7, help="恢复后在多少天内不再归档")
+    parser.add_argument("--archive-dir", default=PARTITION_ARCHIVE_DIR)
+    args = parser.parse_args(argv)
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise SystemExit("DATABASE_URL 环境变量未设置。")
+
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        if args.command == "maintain":
+            result = maintain(conn, args.months_ahead, args.retention_months, args.archive_dir)
+            if result is None:
+                print("其他进程正在维护分区")
+            else:
+                print(f"新建 {len(result['created'])} 个分区，归档 {len(result['archived'])} 个分区")
+        elif args.command == "list":
+            for table in PARTITION_KEYS:
+                for month, name in sorted(attached_partitions(cursor, table).items()):
+                    print(f"attached  {name}")
+                for month, name in sorted(detached_partitions(cursor, table).items()):
+                    print(f"detached  {name}")
+            if os.path.isdir(args.archive_dir):
+                for filename in sorted(os.listdir(args.archive_dir)):
+                    if filename.endswith(".json"):
+                        print(f"archived  {filename[:-5]}")
+            conn.rollback()
+        elif args.command == "restore":
+            for name, rows in restore_month(conn, parse_month(args.month), args.hold_days, args.archive_dir):
+                print(f"已恢复 {name} ({rows} 行)")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+
+# --- 密码哈希池配置 (可通过环境变量覆盖) ---
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', 2)) # 0 表示在请求线程中计算 (仍受并发上限约束)
+HASH_MAX_CONCURRENCY = int(os.environ.get('HASH_MAX_CONCURRENCY', 8)) # 同时排队/计算的哈希请求上限
+HASH_QUEUE_TIMEOUT = float(os.environ.get('HASH_QUEUE_TIMEOUT', 2.0)) # 等待哈希槽位的最长秒数
+HASH_RESULT_TIMEOUT = float(os.environ.get('HASH_RESULT_TIMEOUT', 10.0)) # 单次哈希计算的最长秒数
+
+
+class HashPoolBusyError(Exception):
+    """哈希槽位已满或计算超时 (handler 应返回 503)"""
+
+
+# --- 在子进程中执行的函数 (与 Flask-Bcrypt 的 generate/check_password_hash 行为一致) ---
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _check_password(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+class PasswordHasher:
+    """
+    [PERF] 把 bcrypt 计算放到独立的进程池中，避免登录高峰占满 gunicorn worker 的 CPU。
+    超过 max_concurrency 的请求最多等待 queue_timeout 秒，之后抛出 HashPoolBusyError。
+    """
+    def __init__(self, workers=HASH_POOL_WORKERS, max_concurrency=HASH_MAX_CONCURRENCY,
+                 queue_timeout=HASH_QUEUE_TIMEOUT, result_timeout=HASH_RESULT_TIMEOUT):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.result_timeout = result_timeout
+        self.max_concurrency = max_concurrency
+        self.pid = os.getpid()
+        self._executor = self._new_executor() if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            "hashes": 0,
+            "checks": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "slot_wait_total": 0.0,
+            "slot_wait_max": 0.0,
+            "compute_time_total": 0.0,
+        }
+
+    def _new_executor(self):
+        # 使用 spawn 启动子进程：不继承 gunicorn worker 的线程和数据库连接
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _release_slot(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _rebuild_executor(self, broken):
+        """子进程异常退出 (例如被 OOM killer 杀死) 后重建进程池；多个线程同时发现时只重建一次"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, kind, fn, *args):
+        wait_start = time.monotonic()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise HashPoolBusyError("密码校验繁忙")
+        waited = time.monotonic() - wait_start
+        with self._lock:
+            self._in_flight += 1
+            self._stats["slot_wait_total"] += waited
+            self._stats["slot_wait_max"] = max(self._stats["slot_wait_max"], waited)
+        started = time.monotonic()
+        if self._executor is None:
+            try:
+                result = fn(*args)
+            finally:
+                self._release_slot()
+        else:
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._release_slot()
+                self._rebuild_executor(executor)
+                raise HashPoolBusyError("密码校验进程池已重建")
+            except Exception:
+                self._release_slot()
+                raise
+            # 槽位在子进程的计算真正结束时才释放: 等待超时后计算仍在进行，不能让新的请求继续排队
+            future.add_done_callback(self._release_slot)
+            try:
+                result = future.result(timeout=self.result_timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise HashPoolBusyError("密码校验超时")
+            except BrokenProcessPool:
+                self._rebuild_executor(executor)
+                raise HashPoolBusyError("密码校验进程池已重建")
+        with self._lock:
+            self._stats[kind] += 1
+            self._stats["compute_time_total"] += time.monotonic() - started
+        return result
+
+    def hash_password(self, password, rounds=12):
+        return self._run("hashes", _hash_password, password, rounds)
+
+    def check_password(self, pw_hash, password):
+        return self._run("checks", _check_password, pw_hash, password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["in_flight"] = self._in_flight
+        data["workers"] = self.workers
+        data["max_concurrency"] = self.max_concurrency
+        return data
+
+
+# --- 进程级哈希池 (gunicorn fork 之后按 PID 懒加载) ---
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None or _hasher.pid != os.getpid():
+            _hasher = PasswordHasher()
+        return _hasher
+
+
+def hasher_stats():
+    hasher = _hasher
+    if hasher is None or hasher.pid != os.getpid():
+        return None
+    return hasher.stats()
@@ -0,0 +1,190 @@
+"""
+[NEW] 服务器端预编译语句 (PREPARE / EXECUTE)
+
+高频查询在模块加载时注册 (SQL 使用与 cursor.execute 相同的 %s 占位符)，
+每个连接第一次执行时 PREPARE，之后只发送 EXECUTE 和参数，省去每次的解析和规划。
+
+- 已预编译的语句名记录在 PooledConnection.prepared_statements 中；新建的连接为空集合
+- 服务器端语句丢失 (连接被 DISCARD ALL 重置等) 时清空记录；出错的语句是事务中的第一条语句时
+  回滚后重新 PREPARE 并重试，否则抛出错误 (下一次使用该连接时重新 PREPARE)
+- 表结构变化 (迁移修改了列类型等) 后执行旧的语句会报 "cached plan must not change result type"
+  (FeatureNotSupported)，语句仍然存在: 同样在事务中的第一条语句时 DEALLOCATE 并重新 PREPARE 后重试，
+  否则记录在 PooledConnection.stale_statements 中，下一次使用该连接时先 DEALLOCATE
+- 启动预热时 prepare_all() 在连接池的连接上预先 PREPARE 所有语句，第一个请求不再承担 PREPARE 的开销
+- 不是连接池创建的连接 (脚本中直接 psycopg2.connect) 或 DB_PREPARED_STATEMENTS=0 时按普通 SQL 执行
+  (例如经过 transaction 模式的 PgBouncer 时需要关闭)
+"""
+import os
+import re
+import threading
+import time
+
+import psycopg2.errors
+import psycopg2.extensions
+
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('DB_PREPARED_STATEMENTS', '1') not in ('0', 'false')
+
+_NAME_RE = re.compile(r'^[a-z_][a-z0-9_]*$')
+_PLACEHOLDER_RE = re.compile(r'%%|%s')
+STALE_PLAN_MESSAGE = "cached plan must not change result type"
+
+
+def is_stale_plan(error):
+    return isinstance(error, psycopg2.errors.FeatureNotSupported) and STALE_PLAN_MESSAGE in str(error)
+
+
+class PreparedStatement:
+    def __init__(self, name, sql):
+        if not _NAME_RE.match(name):
+            raise ValueError(f"无效的语句名: {name}")
+        self.name = name
+        self.sql = sql
+        self.param_count = 0
+
+        def placeholder(match):
+            if match.group(0) == '%%':
+                return '%'
+            self.param_count += 1
+            return f"${self.param_count}"
+
+        body = _PLACEHOLDER_RE.sub(placeholder, sql.strip().rstrip(';'))
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+        self.execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * self.param_count)})" if self.param_count else "")
+
+
+class StatementRegistry:
+    def __init__(self, enabled=PREPARED_STATEMENTS_ENABLED):
+        self.enabled = enabled
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._stats = {} # name -> {"calls", "prepares", "reprepares", "time_total", "time_max"}
+
+    def register(self, name, sql):
+        with self._lock:
+            if name in self._statements:
+                raise ValueError(f"重复的语句名: {name}")
+            statement = self._statements[name] = PreparedStatement(name, sql)
+            self._stats[name] = {"calls": 0, "prepares": 0, "reprepares": 0, "time_total": 0.0, "time_max": 0.0}
+        return statement
+
+    def _count(self, statement, key):
+        with self._lock:
+            self._stats[statement.name][key] += 1
+
+    def _run(self, cursor, statement, params, prepared, stale):
+        if statement.name not in prepared:
+            if statement.name in stale: # 服务器端仍然保留着旧的语句
+                cursor.execute(f"DEALLOCATE {statement.name}")
+                stale.discard(statement.name)
+            cursor.execute(statement.prepare_sql)
+            prepared.add(statement.name)
+            self._count(statement, "prepares")
+        cursor.execute(statement.execute_sql, params)
+
+    def execute(self, cursor, statement, params=()):
+        """在 cursor 上执行已注册的语句，结果通过 cursor.fetch*() 读取"""
+        if len(params) != statement.param_count:
+            raise ValueError(f"{statement.name} 需要 {statement.param_count} 个参数，实际为 {len(params)} 个")
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared_statements', None) if self.enabled else None
+        started = time.perf_counter()
+        if prepared is None:
+            cursor.execute(statement.sql, params)
+        else:
+            stale = getattr(conn, 'stale_statements', set())
+            first_in_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            try:
+                self._run(cursor, statement, params, prepared, stale)
+            except psycopg2.Error as error:
+                if isinstance(error, psycopg2.errors.InvalidSqlStatementName):
+                    # 服务器端的预编译语句已全部失效
+                    prepared.clear()
+                    stale.clear()
+                elif is_stale_plan(error):
+                    # 表结构变化后旧的计划不能再使用，语句本身仍然存在
+                    prepared.discard(statement.name)
+                    stale.add(statement.name)
+                else:
+                    raise
+                self._count(statement, "reprepares")
+                if not first_in_transaction:
+                    raise
+                conn.rollback()
+                self._run(cursor, statement, params, prepared, stale)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[statement.name]
+            stats["calls"] += 1
+            stats["time_total"] += elapsed
+            stats["time_max"] = max(stats["time_max"], elapsed)
+
+    def prepare_all(self, conn):
+        """
+        在空闲的连接上 PREPARE 所有已注册的语句，返回成功的数量。
+        失败的语句 (如迁移尚未执行) 只记录日志，第一次执行时再 PREPARE。
+        """
+        prepared = getattr(conn, 'prepared_statements', None) if self.enabled else None
+        if prepared is None:
+            return 0
+        with self._lock:
+            statements = [s for name, s in self._statements.items() if name not in prepared]
+        count = 0
+        autocommit = conn.autocommit
+        conn.autocommit = True # 每条 PREPARE 单独执行，一条失败不影响其他语句
+        cursor = conn.cursor()
+        try:
+            stale = getattr(conn, 'stale_statements', set())
+            for statement in statements:
+                try:
+                    if statement.name in stale:
+                        cursor.execute(f"DEALLOCATE {statement.name}")
+                        stale.discard(statement.name)
+                    cursor.execute(statement.prepare_sql)
+                except psycopg2.Error as error:
+                    print(f"预编译语句失败 ({statement.name}): {error}")
+                    continue
+                prepared.add(statement.name)
+                self._count(statement, "prepares")
+                count += 1
+        finally:
+            cursor.close()
+            conn.autocommit = autocommit
+        return count
+
+    def stats(self):
+        with self._lock:
+            data = {name: dict(values) for name, values in self._stats.items()}
+        for values in data.values():
+            values["time_avg"] = values["time_total"] / values["calls"] if values["calls"] else 0.0
+        return data
+
+    def totals(self):
+        """所有语句的合计 (用于 /metrics)"""
+        with self._lock:
+            return {
+                key: sum(values[key] for values in self._stats.values())
+                for key in ("calls", "prepares", "reprepares", "time_total")
+            }
+
+
+# --- 进程内的默认注册表 ---
+registry = StatementRegistry()
+
+
+def prepare(name, sql):
+    """注册一个预编译语句 (模块加载时调用)"""
+    return registry.register(name, sql)
+
+
+def execute(cursor, statement, params=()):
+    registry.execute(cursor, statement, params)
+
+
+def prepare_all(conn):
+    return registry.prepare_all(conn)
+
+
+def statement_stats():
+    return {"enabled": registry.enabled, "statements": registry.stats()}
@@ -0,0 +1,215 @@
+"""
+[NEW] 只读副本路由
+
+设置 DATABASE_REPLICA_URLS (逗号分隔的一个或多个 DSN) 后，只读 handler 通过
+get_db_connection(readonly=True) 从副本借连接；写入和需要读到自己刚写入数据的路径仍然使用主库。
+
+- 副本轮询使用；每个副本每 DB_REPLICA_LAG_CHECK_INTERVAL 秒检查一次复制延迟
+  (由碰到检查到期的请求线程执行，其他请求继续使用上一次的结果)
+- 延迟超过 DB_REPLICA_MAX_LAG 秒、WAL receiver 未连接主库、检查失败或借连接失败的副本暂时不用；没有可用副本时回退到主库
+- 连接副本最多等待 DB_REPLICA_CONNECT_TIMEOUT 秒，不可达的副本按检查失败处理
+- 用户写入后 DB_READ_AFTER_WRITE_WINDOW 秒内，该用户的读请求固定走主库: 进程内按用户记录，
+  同时通过响应的 cookie / 请求头带给客户端，由其他 worker 处理的读请求同样走主库 (见 api.py)
+"""
+import itertools
+import os
+import threading
+import time
+
+import psycopg2.extensions
+
+import metrics
+from db_pool import POOL_MAX_SIZE, ConnectionPool, PoolTimeoutError
+from ttl_cache import TTLCache
+
+
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5.0)) # 秒
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK_INTERVAL', 2.0)) # 秒
+REPLICA_POOL_MAX_SIZE = int(os.environ.get('DB_REPLICA_POOL_MAX_SIZE', POOL_MAX_SIZE))
+READ_AFTER_WRITE_WINDOW = float(os.environ.get('DB_READ_AFTER_WRITE_WINDOW', 10.0)) # 秒
+# 连接副本的超时秒数: 延迟检查和借连接都在请求线程中执行，不可达的副本不能让请求一直等到 TCP 超时
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', 2))
+
+# 副本的 WAL receiver 没有在 streaming 时返回 NULL (与主库断开后副本不再前进，按不可用处理)；
+# 正在接收且已回放全部收到的 WAL 时延迟为 0 (主库空闲时 pg_last_xact_replay_timestamp 不会前进)；
+# 不是副本 (pg_is_in_recovery() 为 false) 时同样为 0
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+PRIMARY = "primary"
+
+
+def replica_name(dsn, index):
+    """用于统计和指标标签的副本名称 (host:port/dbname，不包含密码)"""
+    try:
+        params = psycopg2.extensions.parse_dsn(dsn)
+    except psycopg2.ProgrammingError:
+        return f"replica{index}"
+    host = params.get('host') or 'localhost'
+    port = params.get('port') or '5432'
+    return f"{host}:{port}/{params.get('dbname', '')}"
+
+
+class Replica:
+    def __init__(self, dsn, index, max_size=REPLICA_POOL_MAX_SIZE):
+        self.name = replica_name(dsn, index)
+        self.pool = ConnectionPool(dsn, max_size=max_size, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        self.lag = None # 秒；None 表示尚未检查或检查失败
+        self.available = True
+        self.checked_at = None # time.monotonic()
+        self.check_lock = threading.Lock()
+
+
+class ReplicaRouter:
+    """
+    [PERF] 按复制延迟选择只读副本，所有副本不可用时回退到主库。
+    与连接池一样按进程创建 (pid)，副本连接池在 fork 之后建立。
+    """
+    def __init__(self, dsns, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_LAG_CHECK_INTERVAL,
+                 read_after_write_window=READ_AFTER_WRITE_WINDOW):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+        self.replicas = [Replica(dsn, index) for index, dsn in enumerate(dsns)]
+        self._next = itertools.count()
+        self._recent_writers = TTLCache(ttl=read_after_write_window, max_size=10000)
+        self._lock = threading.Lock()
+        self._reads = {PRIMARY: 0}
+        self._reads.update({replica.name: 0 for replica in self.replicas})
+        self._stats = {"fallback_lag": 0, "fallback_error": 0, "sticky_primary": 0, "lag_checks": 0, "lag_check_errors": 0,
+                       "no_wal_receiver": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _record_read(self, target):
+        with self._lock:
+            self._reads[target] += 1
+        metrics.db_reads.inc(target=target)
+
+    # --- 复制延迟 ---
+    def _refresh_lag(self, replica):
+        now = time.monotonic()
+        if replica.checked_at is not None and now - replica.checked_at < self.check_interval:
+            return
+        if not replica.check_lock.acquire(blocking=False):
+            return # 其他线程正在检查
+        conn = None
+        try:
+            self._count("lag_checks")
+            conn = replica.pool.getconn()
+            cursor = conn.cursor()
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+            cursor.close()
+            if lag is None:
+                # WAL receiver 已断开: 副本自身看不到落后了多少，不再使用直到重新连上主库
+                self._count("no_wal_receiver")
+                replica.lag = None
+                replica.available = False
+                print(f"副本没有连接主库 ({replica.name})")
+            else:
+                replica.lag = float(lag)
+                replica.available = True
+                metrics.db_replica_lag.set(replica.lag, replica=replica.name)
+        except Exception as error:
+            self._count("lag_check_errors")
+            replica.lag = None
+            replica.available = False
+            print(f"副本延迟检查失败 ({replica.name}): {error}")
+        finally:
+            if conn: conn.close()
+            replica.checked_at = time.monotonic()
+            replica.check_lock.release()
+
+    def _usable(self, replica):
+        self._refresh_lag(replica)
+        return replica.available and replica.lag is not None and replica.lag <= self.max_lag
+
+    # --- 读写一致性 ---
+    def mark_write(self, key):
+        """记录 key (通常是用户 id) 刚写入过主库，之后一段时间内该 key 的读请求走主库"""
+        if key is not None:
+            self._recent_writers.set(key, True)
+
+    # --- 借连接 ---
+    def getconn(self, sticky_key=None, force_primary=False):
+        """
+        从可用的副本借出连接；应使用主库时返回 None (调用方从主库连接池借连接)。
+        force_primary=True: 客户端带有写入后读主库的标记 (由其他 worker 处理了写入)
+        """
+        if force_primary or (sticky_key is not None and self._recent_writers.get(sticky_key)):
+            self._count("sticky_primary")
+            self._record_read(PRIMARY)
+            return None
+
+        start = next(self._next)
+        lagging = False
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if not self._usable(replica):
+                lagging = lagging or replica.available
+                continue
+            try:
+                conn = replica.pool.getconn()
+            except (psycopg2.OperationalError, PoolTimeoutError) as error:
+                # 副本不可达或连接池已满: 下一次延迟检查之前不再使用该副本
+                print(f"副本连接失败 ({replica.name}): {error}")
+                replica.available = False
+                continue
+            self._record_read(replica.name)
+            return conn
+
+        self._count("fallback_lag" if lagging else "fallback_error")
+        self._record_read(PRIMARY)
+        return None
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["reads"] = dict(self._reads)
+        data["max_lag"] = self.max_lag
+        data["replicas"] = [
+            {
+                "name": replica.name,
+                "lag": replica.lag,
+                "available": replica.available,
+                "pool": replica.pool.stats(),
+            }
+            for replica in self.replicas
+        ]
+        return data
+
+
+# --- 进程级路由 ---
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_replica_router():
+    """未配置副本时返回 None"""
+    global _router
+    if not DATABASE_REPLICA_URLS:
+        return None
+    router = _router
+    if router is not None and router.pid == os.getpid():
+        return router
+    with _router_lock:
+        if _router is None or _router.pid != os.getpid():
+            _router = ReplicaRouter(DATABASE_REPLICA_URLS)
+        return _router
+
+
+def replica_stats():
+    router = _router
+    if router is None or router.pid != os.getpid():
+        return None
+    return router.stats()
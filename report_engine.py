@@ -0,0 +1,426 @@
+"""
+[NEW] 定期报告引擎
+
+小时/天两级汇总表 (rollup)，月报/周报的汇总直接从天级汇总表计算，不再扫描原始 `events`。
+[PERF] 写入事件的事务只把按小时合并的增量追加到增量表 (没有唯一约束，并发写入之间没有行锁争用)；
+后台线程 RollupRefresher 每 REPORT_ROLLUP_INTERVAL 秒把增量合并到汇总表，报告最多延迟一个间隔。
+汇总表由 migrations/0002_report_rollups.sql、增量表由 migrations/0009_rollup_deltas.sql 创建。
+
+命令行:
+    python report_engine.py init                                  # 执行数据库迁移 (创建汇总表)
+    python report_engine.py backfill [--since 2024-01-01] [--until 2024-06-01]
+    python report_engine.py refresh                               # 立即合并增量表
+    python report_engine.py build --type monthly [--date 2024-05-01]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from psycopg2.extras import execute_values
+
+
+ROLLUPS_ENABLED = os.environ.get('REPORT_ROLLUPS_ENABLED', '1') == '1'
+REPORT_ROLLUP_INTERVAL = float(os.environ.get('REPORT_ROLLUP_INTERVAL', 30)) # 0 表示不启动后台线程
+ROLLUP_LOCK_KEY = 7310044 # 与 migrate / partitions 的 advisory lock 不同
+TOP_DEDUCTIONS = 10
+
+# granularity -> (事件汇总表, 扣分项汇总表, date_trunc 单位)
+ROLLUP_TABLES = {
+    "hour": ("event_rollup_hourly", "deduction_rollup_hourly", "hour"),
+    "day": ("event_rollup_daily", "deduction_rollup_daily", "day"),
+}
+DELTA_TABLES = ("event_rollup_delta", "deduction_rollup_delta")
+
+# --- 增量更新 ---
+
+def score_bucket(score):
+    """分数区间: 0-9 -> 0, 10-19 -> 10, ..., 100 -> 100"""
+    return int(float(score) // 10 * 10)
+
+
+def deduction_label(item):
+    return item if isinstance(item, str) else json.dumps(item, ensure_ascii=False)
+
+
+def _truncate(event_time, unit):
+    if unit == "hour":
+        return event_time.replace(minute=0, second=0, microsecond=0)
+    return event_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_events(cursor, events):
+    """
+    [PERF] 把一批刚写入的事件按小时合并后追加到增量表 (与事件写入在同一个事务中)。
+    只有 INSERT，不更新汇总表的行，不同的写入事务之间不会互相等待。
+    """
+    if not ROLLUPS_ENABLED or not events:
+        return
+    events_table, deductions_table = DELTA_TABLES
+    counts = defaultdict(lambda: [0, 0.0, 0])
+    deductions = Counter()
+    for event in events:
+        dims = (_truncate(event["event_time"], "hour"), event["camera_id"] or 0,
+                event["equipment_type"], event["risk_type"])
+        row = counts[dims + (score_bucket(event["score"]),)]
+        row[0] += 1
+        row[1] += float(event["score"])
+        row[2] += len(event["images"])
+        for item in event["deductions"] or []:
+            deductions[dims + (deduction_label(item),)] += 1
+
+    execute_values(cursor, f"""
+        INSERT INTO {events_table}
+            (bucket_start, camera_id, equipment_type, risk_type, score_bucket, event_count, score_sum, image_count)
+        VALUES %s
+    """, [key + tuple(value) for key, value in counts.items()])
+    if deductions:
+        execute_values(cursor, f"""
+            INSERT INTO {deductions_table}
+                (bucket_start, camera_id, equipment_type, risk_type, deduction, occurrences)
+            VALUES %s
+        """, [key + (value,) for key, value in deductions.items()])
+
+
+# --- 合并增量 ---
+
+# 删除增量表中的行 (只包括本事务快照可见的行，之后追加的行留到下一次)，同一条语句中累加到小时和天汇总表
+FOLD_EVENT_DELTAS_SQL = """
+    WITH moved AS (
+        DELETE FROM event_rollup_delta
+        RETURNING bucket_start, camera_id, equipment_type, risk_type, score_bucket, event_count, score_sum, image_count
+    ), hourly AS (
+        INSERT INTO event_rollup_hourly AS r
+            (bucket_start, camera_id, equipment_type, risk_type, score_bucket, event_count, score_sum, image_count)
+        SELECT bucket_start, camera_id, equipment_type, risk_type, score_bucket,
+               SUM(event_count), SUM(score_sum), SUM(image_count)
+        FROM moved
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (bucket_start, camera_id, equipment_type, risk_type, score_bucket) DO UPDATE SET
+            event_count = r.event_count + EXCLUDED.event_count,
+            score_sum = r.score_sum + EXCLUDED.score_sum,
+            image_count = r.image_count + EXCLUDED.image_count
+    )
+    INSERT INTO event_rollup_daily AS r
+        (bucket_start, camera_id, equipment_type, risk_type, score_bucket, event_count, score_sum, image_count)
+    SELECT date_trunc('day', bucket_start), camera_id, equipment_type, risk_type, score_bucket,
+           SUM(event_count), SUM(score_sum), SUM(image_count)
+    FROM moved
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (bucket_start, camera_id, equipment_type, risk_type, score_bucket) DO UPDATE SET
+        event_count = r.event_count + EXCLUDED.event_count,
+        score_sum = r.score_sum + EXCLUDED.score_sum,
+        image_count = r.image_count + EXCLUDED.image_count
+"""
+FOLD_DEDUCTION_DELTAS_SQL = """
+    WITH moved AS (
+        DELETE FROM deduction_rollup_delta
+        RETURNING bucket_start, camera_id, equipment_type, risk_type, deduction, occurrences
+    ), hourly AS (
+        INSERT INTO deduction_rollup_hourly AS r
+            (bucket_start, camera_id, equipment_type, risk_type, deduction, occurrences)
+        SELECT bucket_start, camera_id, equipment_type, risk_type, deduction, SUM(occurrences)
+        FROM moved
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (bucket_start, camera_id, equipment_type, risk_type, deduction) DO UPDATE SET
+            occurrences = r.occurrences + EXCLUDED.occurrences
+    )
+    INSERT INTO deduction_rollup_daily AS r
+        (bucket_start, camera_id, equipment_type, risk_type, deduction, occurrences)
+    SELECT date_trunc('day', bucket_start), camera_id, equipment_type, risk_type, deduction, SUM(occurrences)
+    FROM moved
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (bucket_start, camera_id, equipment_type, risk_type, deduction) DO UPDATE SET
+        occurrences = r.occurrences + EXCLUDED.occurrences
+"""
+
+
+def fold_deltas(cursor):
+    """
+    把增量表合并到汇总表。只有取得 advisory lock 的一个进程执行，汇总表的行只由它更新；
+    返回 False 表示其他进程正在合并。调用方负责提交 (删除增量和累加在同一个事务中)
+    """
+    cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (ROLLUP_LOCK_KEY,))
+    if not _first(cursor.fetchone()):
+        return False
+    cursor.execute(FOLD_EVENT_DELTAS_SQL)
+    cursor.execute(FOLD_DEDUCTION_DELTAS_SQL)
+    return True
+
+
+class RollupRefresher:
+    """
+    API 进程内的后台线程: 定期合并增量表。
+    与连接池一样按 PID 懒加载，gunicorn fork 之后才启动线程
+    """
+    def __init__(self, get_connection, interval=REPORT_ROLLUP_INTERVAL):
+        self.get_connection = get_connection
+        self.interval = interval
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="rollup-refresher", daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        conn = self.get_connection()
+        try:
+            fold_deltas(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as error:
+                print(f"汇总表合并失败: {error}")
+            time.sleep(self.interval)
+
+
+# --- 回填 ---
+
+def backfill(cursor, since=None, until=None):
+    """
+    从原始 `events` 重建指定时间范围 [since, until) 的汇总表 (整点/整天对齐)。
+    在数据库端聚合，适合大量历史数据。
+    必须在新事务中调用: 在同一个 REPEATABLE READ 快照中先合并增量再重建，
+    快照之后提交的事件只通过增量计入一次
+    """
+    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_KEY,))
+    cursor.execute(FOLD_EVENT_DELTAS_SQL)
+    cursor.execute(FOLD_DEDUCTION_DELTAS_SQL)
+    for events_table, deductions_table, unit in ROLLUP_TABLES.values():
+        conditions = []
+        params = []
+        if since:
+            conditions.append("event_time >= date_trunc(%s, %s::timestamp)")
+            params.extend([unit, since])
+        if until:
+            conditions.append("event_time < date_trunc(%s, %s::timestamp)")
+            params.extend([unit, until])
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        bucket_where = where.replace("event_time", "bucket_start")
+
+        cursor.execute(f"DELETE FROM {events_table}{bucket_where}", params)
+        cursor.execute(f"DELETE FROM {deductions_table}{bucket_where}", params)
+        cursor.execute(f"""
+            INSERT INTO {events_table}
+                (bucket_start, camera_id, equipment_type, risk_type, score_bucket, event_count, score_sum, image_count)
+            SELECT date_trunc('{unit}', event_time), COALESCE(camera_id, 0), equipment_type, risk_type,
+                   (floor(score / 10) * 10)::smallint, COUNT(*), SUM(score), SUM(COALESCE(image_count, 0))
+            FROM events{where}
+            GROUP BY 1, 2, 3, 4, 5
+        """, params)
+        cursor.execute(f"""
+            INSERT INTO {deductions_table}
+                (bucket_start, camera_id, equipment_type, risk_type, deduction, occurrences)
+            SELECT date_trunc('{unit}', event_time), COALESCE(camera_id, 0), equipment_type, risk_type,
+                   d.value #>> '{{}}', COUNT(*)
+            FROM events
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(deductions::jsonb) = 'array' THEN deductions::jsonb ELSE '[]'::jsonb END
+            ) AS d(value){where}
+            GROUP BY 1, 2, 3, 4, 5
+        """, params)
+
+
+# --- 报告生成 ---
+
+def report_period(report_type, day=None):
+    """返回包含 day 的报告周期 [start, end)；monthly 为自然月，weekly 为周一开始的自然周"""
+    day = day or datetime.utcnow().date()
+    if report_type == "monthly":
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    elif report_type == "weekly":
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    else:
+        raise ValueError(f"不支持的报告类型: {report_type}")
+    return start, end
+
+
+def build_summary(cursor, report_type, day=None):
+    """
+    从天级汇总表生成 `summary_data`。
+    返回 None 表示该周期内没有任何汇总数据。
+    """
+    start, end = report_period(report_type, day)
+    events_table, deductions_table, _ = ROLLUP_TABLES["day"]
+
+    # 一条 GROUPING SETS 查询得到所有维度的计数
+    cursor.execute(f"""
+        SELECT GROUPING(equipment_type, camera_id, score_bucket, bucket_start) AS grp,
+               equipment_type, camera_id, score_bucket, bucket_start, risk_type,
+               SUM(event_count) AS event_count, SUM(score_sum) AS score_sum, SUM(image_count) AS image_count
+        FROM {events_table}
+        WHERE bucket_start >= %s AND bucket_start < %s
+        GROUP BY GROUPING SETS (
+            (risk_type),
+            (equipment_type, risk_type),
+            (camera_id, risk_type),
+            (score_bucket, risk_type),
+            (bucket_start, risk_type)
+        )
+    """, (start, end))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    # GROUPING() 位: equipment_type=8, camera_id=4, score_bucket=2, bucket_start=1 (1 表示未参与分组)
+    totals = defaultdict(lambda: {"total": 0, "abnormal": 0})
+    by_equipment = defaultdict(lambda: {"total": 0, "abnormal": 0})
+    by_camera = defaultdict(lambda: {"total": 0, "abnormal": 0})
+    by_score = defaultdict(lambda: {"total": 0, "abnormal": 0})
+    by_day = defaultdict(lambda: {"total": 0, "abnormal": 0})
+    risk_counts = {"abnormal": 0, "normal": 0}
+    score_sum = 0.0
+    image_count = 0
+    for row in rows:
+        grp, equipment_type, camera_id, bucket, bucket_start, risk_type, count, s_sum, images = _row_values(row)
+        # 只取出当前分组对应的条目 (defaultdict 取值会创建条目，不能对所有分组都取值)
+        if grp == 0b1111:
+            target = totals["all"]
+        elif grp == 0b0111:
+            target = by_equipment[equipment_type]
+        elif grp == 0b1011:
+            target = by_camera[camera_id]
+        elif grp == 0b1101:
+            target = by_score[bucket]
+        elif grp == 0b1110:
+            target = by_day[bucket_start.date().isoformat()]
+        else:
+            continue
+        target["total"] += int(count)
+        if risk_type == "abnormal":
+            target["abnormal"] += int(count)
+        if grp == 0b1111:
+            risk_counts[risk_type] = risk_counts.get(risk_type, 0) + int(count)
+            score_sum += float(s_sum or 0)
+            image_count += int(images or 0)
+
+    cursor.execute(f"""
+        SELECT deduction, SUM(occurrences) AS occurrences
+        FROM {deductions_table}
+        WHERE bucket_start >= %s AND bucket_start < %s
+        GROUP BY deduction
+        ORDER BY occurrences DESC, deduction ASC
+        LIMIT %s
+    """, (start, end, TOP_DEDUCTIONS))
+    top_deductions = [{"deduction": d, "count": int(c)} for d, c in (_pair(r) for r in cursor.fetchall())]
+
+    total = totals["all"]["total"]
+    return {
+        "period": {
+            "type": report_type,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "year": start.year,
+            "month": start.month,
+        },
+        "total_events": total,
+        "abnormal_events": risk_counts.get("abnormal", 0),
+        "normal_events": risk_counts.get("normal", 0),
+        "average_score": round(score_sum / total, 2) if total else None,
+        "image_count": image_count,
+        "by_equipment_type": _ranked(by_equipment, "equipment_type"),
+        "by_camera": _ranked(by_camera, "camera_id"),
+        "score_distribution": [dict(v, bucket=k) for k, v in sorted(by_score.items())],
+        "daily_trend": [dict(v, date=k) for k, v in sorted(by_day.items())],
+        "top_deductions": top_deductions,
+    }
+
+
+
+def deduction_vocabulary(cursor, since, risk_type=None, limit=100):
+    """
+    [NEW] 扣分项词表及出现次数 (bucket_start >= since)，从天级汇总表读取，不扫描 events。
+    risk_type 为 None 时合计所有类型。
+    """
+    _, deductions_table, _ = ROLLUP_TABLES["day"]
+    risk_where = " AND risk_type = %s" if risk_type else ""
+    params = (since, risk_type, limit) if risk_type else (since, limit)
+    cursor.execute(f"""
+        SELECT deduction, SUM(occurrences) AS occurrences
+        FROM {deductions_table}
+        WHERE bucket_start >= %s{risk_where}
+        GROUP BY deduction
+        ORDER BY occurrences DESC, deduction ASC
+        LIMIT %s
+    """, params)
+    return [{"deduction": d, "count": int(c)} for d, c in (_pair(r) for r in cursor.fetchall())]
+
+def _row_values(row):
+    if isinstance(row, dict):
+        return (row["grp"], row["equipment_type"], row["camera_id"], row["score_bucket"], row["bucket_start"],
+                row["risk_type"], row["event_count"], row["score_sum"], row["image_count"])
+    return tuple(row)
+
+
+def _first(row):
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _pair(row):
+    if isinstance(row, dict):
+        return row["deduction"], row["occurrences"]
+    return row[0], row[1]
+
+
+def _ranked(groups, key_name):
+    items = [dict(v, **{key_name: k}) for k, v in groups.items()]
+    return sorted(items, key=lambda item: (-item["abnormal"], -item["total"], str(item[key_name])))
+
+
+# --- 命令行 ---
+
+def main(argv=None):
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description="定期报告引擎")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init", help="执行数据库迁移 (创建汇总表)")
+    p_backfill = sub.add_parser("backfill", help="从 events 重建汇总表")
+    p_backfill.add_argument("--since", help="开始日期 (含), 例如 2024-01-01")
+    p_backfill.add_argument("--until", help="结束日期 (不含)")
+    sub.add_parser("refresh", help="把增量表合并到汇总表")
+    p_build = sub.add_parser("build", help="生成报告")
+    p_build.add_argument("--type", default="monthly", choices=["monthly", "weekly"])
+    p_build.add_argument("--date", help="报告周期内的任意一天，默认今天")
+    args = parser.parse_args(argv)
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise SystemExit("DATABASE_URL 环境变量未设置。")
+
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        if args.command == "init":
+            import migrate
+            migrate.migrate(conn)
+            print("汇总表已创建")
+        elif args.command == "backfill":
+            backfill(cursor, args.since, args.until)
+            print("汇总表回填完成")
+        elif args.command == "refresh":
+            if not fold_deltas(cursor):
+                raise SystemExit("其他进程正在合并增量表")
+            print("增量表已合并")
+        elif args.command == "build":
+            day = date.fromisoformat(args.date) if args.date else None
+            summary = build_summary(cursor, args.type, day)
+            if summary is None:
+                raise SystemExit("该周期内没有汇总数据")
+            print(json.dumps(summary, ensure_ascii=False, indent=2))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
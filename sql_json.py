@@ -0,0 +1,112 @@
+"""
+在 SQL 中生成与 CustomJSONEncoder 相同格式的 JSON 值的辅助函数。
+
+[PERF] json_*_sql() 在数据库端直接生成 JSON 文本，结果与 jsonify 的输出逐字节一致:
+紧凑分隔符 (',' / ':')、键按字母顺序排列、NULL 输出为 null。
+ensure_ascii 在数据库端无法实现，非 ASCII 字符由 ascii_json() 在 Python 中转义。
+"""
+import json
+import re
+
+
+def iso_z_sql(expr):
+    """
+    与 CustomJSONEncoder 对 datetime 的输出一致: isoformat() + 'Z'
+    (不带时区的 timestamp；微秒为 0 时 Python 不输出小数部分)
+    """
+    return (
+        f"(to_char({expr}, 'YYYY-MM-DD\"T\"HH24:MI:SS')"
+        f" || CASE WHEN mod(date_part('microseconds', {expr})::bigint, 1000000) <> 0"
+        f" THEN to_char({expr}, '.US') ELSE '' END || 'Z')"
+    )
+
+
+# --- JSON 文本 ---
+
+def _or_null(expr, text):
+    return f"CASE WHEN {expr} IS NULL THEN 'null' ELSE {text} END"
+
+
+def json_string_sql(expr):
+    """文本 -> JSON 字符串 (to_json 的转义规则与 json.dumps 相同，非 ASCII 字符见 ascii_json)"""
+    return f"COALESCE(to_json(({expr})::text)::text, 'null')"
+
+
+def json_int_sql(expr):
+    return _or_null(expr, f"({expr})::text")
+
+
+# json_float_sql() 与 repr(float(Decimal)) 一致的 NUMERIC 类型范围:
+# 有效数字不超过 15 位 (转换为 float 再 repr 时数字不变)，小数位不超过 4 位 (Python 对小于 1e-4 的值使用科学计数法)
+FLOAT_SQL_MAX_PRECISION = 15
+FLOAT_SQL_MAX_SCALE = 4
+
+SQL_COLUMN_TYPE = """
+    SELECT data_type, numeric_precision, numeric_scale
+    FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+"""
+
+
+def json_float_sql(expr):
+    """
+    NUMERIC -> 与 float(Decimal) 的 repr 相同的文本 (85.50 -> 85.5, 100.00 -> 100.0)。
+    只适用于 float_sql_supports() 范围内的列类型 (如 NUMERIC(5, 2) 的 score)，启动时用 unsupported_float_columns() 检查
+    """
+    return _or_null(expr, f"CASE WHEN {expr} = trunc({expr}) THEN trunc({expr})::text || '.0' "
+                          f"ELSE rtrim(({expr})::text, '0') END")
+
+
+def float_sql_supports(data_type, precision, scale):
+    """information_schema.columns 中的类型是否在 json_float_sql() 的适用范围内 (不限精度的 numeric 不适用)"""
+    return (data_type == 'numeric' and precision is not None and scale is not None
+            and precision <= FLOAT_SQL_MAX_PRECISION and 0 <= scale <= FLOAT_SQL_MAX_SCALE)
+
+
+def unsupported_float_columns(cursor, columns):
+    """columns: [(表名, 列名)]；返回类型不在 json_float_sql() 适用范围内 (或不存在) 的列，例如 ["events.score double precision"]"""
+    unsupported = []
+    for table, column in columns:
+        cursor.execute(SQL_COLUMN_TYPE, (table, column))
+        row = cursor.fetchone()
+        if row is None:
+            unsupported.append(f"{table}.{column} (不存在)")
+            continue
+        data_type, precision, scale = row.values() if isinstance(row, dict) else row
+        if not float_sql_supports(data_type, precision, scale):
+            type_name = f"{data_type}({precision}, {scale})" if precision is not None else data_type
+            unsupported.append(f"{table}.{column} {type_name}")
+    return unsupported
+
+
+def json_datetime_sql(expr):
+    return _or_null(expr, f"'\"' || {iso_z_sql(expr)} || '\"'")
+
+
+def json_object_sql(fields):
+    """
+    fields: {键: json_*_sql() 生成的值表达式} -> JSON 对象文本 (键按字母顺序，与 sort_keys=True 一致)
+    """
+    parts = []
+    for i, key in enumerate(sorted(fields)):
+        prefix = ("{" if i == 0 else ",") + json.dumps(key) + ":"
+        parts.append("'" + prefix.replace("'", "''") + "' || " + fields[key])
+    return "(" + " || ".join(parts) + " || '}')" if parts else "'{}'"
+
+
+# --- Python 端 ---
+
+_NON_ASCII_RE = re.compile(r'[^\x20-\x7e]')
+
+
+def _escape_non_ascii(match):
+    code = ord(match.group(0))
+    if code < 0x10000:
+        return '\\u%04x' % code
+    code -= 0x10000 # 与 json.dumps 相同，BMP 以外的字符输出为代理对
+    return '\\u%04x\\u%04x' % (0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff))
+
+
+def ascii_json(text):
+    """把数据库生成的 JSON 文本转换为 ensure_ascii=True 的输出 (控制字符已由 to_json 转义)"""
+    return _NON_ASCII_RE.sub(_escape_non_ascii, text)
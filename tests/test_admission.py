@@ -0,0 +1,114 @@
+import math
+
+import pytest
+
+import admission
+from admission import AdmissionController, TokenBucket
+
+
+@pytest.fixture
+def controller(monkeypatch, clock):
+    monkeypatch.setattr(admission, "time", clock)
+    return AdmissionController(camera_rate=1.0, camera_burst=4, key_rate=10.0, key_burst=100,
+                               abnormal_reserve=0.25, shed_load=0.9)
+
+
+def test_token_bucket_refill_is_capped_at_burst():
+    bucket = TokenBucket(rate=2.0, burst=5, now=0.0)
+    bucket.tokens = 0
+    bucket.refill(1.0)
+    assert bucket.tokens == 2.0
+    bucket.refill(100.0)
+    assert bucket.tokens == 5
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(rate=2.0, burst=5, now=0.0)
+    assert bucket.wait_time(5) == 0.0
+    bucket.tokens = 1
+    assert bucket.wait_time(2) == 0.5
+    assert bucket.wait_time(6) == math.inf # 超过突发量，永远取不到
+
+
+def test_camera_bucket_throttles_and_refills(controller, clock):
+    for _ in range(4):
+        assert controller.check(1, "ip:a", "abnormal").admitted
+    decision = controller.check(1, "ip:a", "abnormal")
+    assert not decision.admitted
+    assert decision.reason == "throttled"
+    assert decision.retry_after == pytest.approx(1.0)
+    assert decision.retry_after_header == "1"
+    # 其他摄像头不受影响
+    assert controller.check(2, "ip:a", "abnormal").admitted
+    clock.advance(1.0)
+    assert controller.check(1, "ip:a", "abnormal").admitted
+
+
+def test_rejected_request_consumes_no_tokens(controller):
+    for _ in range(4):
+        controller.check(1, "ip:a", "abnormal")
+    assert not controller.check(1, "ip:a", "abnormal").admitted
+    assert controller._buckets["key"]["ip:a"].tokens == 96
+
+
+def test_normal_events_leave_reserve_for_abnormal(controller):
+    # burst 4，保留 25% (1 个令牌) 给 abnormal
+    for _ in range(3):
+        assert controller.check(1, "ip:a", "normal").admitted
+    assert not controller.check(1, "ip:a", "normal").admitted
+    assert controller.check(1, "ip:a", "abnormal").admitted
+
+
+def test_overload_sheds_normal_events_only(controller):
+    controller.load = lambda: 0.95
+    decision = controller.check(1, "ip:a", "normal")
+    assert (decision.admitted, decision.reason) == (False, "shed")
+    assert controller.check(1, "ip:a", "abnormal").admitted
+    assert controller.stats()["shed"] == 1
+
+
+def test_failing_load_function_does_not_shed(controller):
+    controller.load = lambda: 1 / 0
+    assert controller.check(1, "ip:a", "normal").admitted
+
+
+def test_batch_is_charged_once_per_bucket(controller):
+    events = [(1, "abnormal")] * 50 + [(2, "normal")] * 50
+    decisions = controller.check_batch(events, "ip:a")
+    assert all(d.admitted for d in decisions)
+    assert controller._buckets["camera"][1].tokens == 3
+    assert controller._buckets["camera"][2].tokens == 3
+    assert controller._buckets["key"]["ip:a"].tokens == 99
+
+
+def test_batch_throttled_as_a_whole(controller):
+    for _ in range(4):
+        controller.check(1, "ip:a", "abnormal")
+    decisions = controller.check_batch([(1, "abnormal"), (2, "abnormal")], "ip:a")
+    assert [d.reason for d in decisions] == ["throttled", "throttled"]
+    assert controller._buckets["camera"][2].tokens == 4
+
+
+def test_batch_sheds_normal_events_under_load(controller):
+    controller.load = lambda: 1.0
+    decisions = controller.check_batch([(1, "normal"), (1, "abnormal"), (2, "normal")], "ip:a")
+    assert [d.reason for d in decisions] == ["shed", None, "shed"]
+    assert decisions[1].admitted
+    assert 2 not in controller._buckets["camera"]
+
+
+def test_least_recently_used_buckets_are_evicted(controller, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_BUCKETS", 2)
+    for camera_id in (1, 2, 3):
+        controller.check(camera_id, "ip:a", "abnormal")
+    assert list(controller._buckets["camera"]) == [2, 3]
+
+
+def test_batch_normal_events_do_not_use_the_abnormal_reserve(controller):
+    # camera 1 只剩保留量 (1 个令牌): 同一批中的 abnormal 事件可以使用，normal 事件被限流
+    for _ in range(3):
+        controller.check(1, "ip:a", "normal")
+    decisions = controller.check_batch([(1, "normal"), (1, "abnormal"), (1, "normal")], "ip:a")
+    assert [d.reason for d in decisions] == ["throttled", None, "throttled"]
+    assert controller._buckets["camera"][1].tokens == 0
+    assert controller.stats()["throttled"] == 2
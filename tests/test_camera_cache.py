@@ -0,0 +1,121 @@
+import json
+import time
+
+import jwt
+import pytest
+
+from event_stream import CONTROL_CHANNEL
+from ttl_cache import TTLCache
+
+api = pytest.importorskip("api")
+
+
+class FakeConnection:
+    """role 为 SQL_USER_ROLE 的结果；executed 记录执行的 SQL"""
+    def __init__(self, role=None):
+        self.role = role
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return (self.role,) if self.role else None
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(api, "camera_cache", TTLCache(ttl=300, max_size=16))
+    monkeypatch.setattr(api, "get_camera_status", lambda: None)
+    monkeypatch.setattr(api, "INGEST_API_KEYS", ("secret-key",))
+    return api.create_app()
+
+
+def bearer(app, user_id=1):
+    token = jwt.encode({"user_id": user_id, "exp": int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    calls = []
+
+    def load_active_cameras():
+        calls.append(True)
+        return api.cache_payload({"success": True, "data": [{"id": 1, "name": "gate", "status": "online"}]})
+
+    monkeypatch.setattr(api, "load_active_cameras", load_active_cameras)
+    return calls
+
+
+def test_get_cameras_etag_and_not_modified(app, loads):
+    client = app.test_client()
+    headers = bearer(app)
+    response = client.get('/api/cameras', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    response = client.get('/api/cameras', headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 304 and response.data == b""
+    response = client.get('/api/cameras', headers=dict(headers, **{"If-None-Match": '"stale"'}))
+    assert response.status_code == 200
+    assert len(loads) == 1 # 之后都命中缓存
+
+
+def test_get_cameras_last_modified(app, loads):
+    client = app.test_client()
+    headers = bearer(app)
+    last_modified = client.get('/api/cameras', headers=headers).headers["Last-Modified"]
+    response = client.get('/api/cameras', headers=dict(headers, **{"If-Modified-Since": last_modified}))
+    assert response.status_code == 304
+    response = client.get('/api/cameras', headers=dict(headers, **{"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"}))
+    assert response.status_code == 200
+
+
+def test_invalidate_requires_api_key_or_admin(monkeypatch, app):
+    client = app.test_client()
+    assert client.post('/api/cameras/cache/invalidate').status_code == 401
+    assert client.post('/api/cameras/cache/invalidate', headers={"X-API-Key": "wrong"}).status_code == 401
+    monkeypatch.setattr(api, "get_db_connection", lambda **kwargs: FakeConnection(role="teacher"))
+    assert client.post('/api/cameras/cache/invalidate', headers=bearer(app)).status_code == 403
+
+
+def test_invalidate_notifies_all_workers(monkeypatch, app, loads):
+    conn = FakeConnection(role="admin")
+    monkeypatch.setattr(api, "get_db_connection", lambda **kwargs: conn)
+    client = app.test_client()
+    client.get('/api/cameras', headers=bearer(app))
+
+    response = client.post('/api/cameras/cache/invalidate', json={"camera_id": 3}, headers={"X-API-Key": "secret-key"})
+    assert response.status_code == 200
+    sql, (channel, payload) = conn.executed[-1]
+    assert channel == CONTROL_CHANNEL
+    assert json.loads(payload) == {"kind": api.CAMERA_CACHE_CONTROL, "camera_id": 3}
+    assert conn.commits == 1
+    client.get('/api/cameras', headers=bearer(app))
+    assert len(loads) == 2 # 本进程立即清除
+
+    assert client.post('/api/cameras/cache/invalidate', json={"camera_id": "3"},
+                       headers=bearer(app)).status_code == 400
+
+
+def test_control_message_invalidates_other_workers(app, loads):
+    client = app.test_client()
+    client.get('/api/cameras', headers=bearer(app))
+    api.on_camera_cache_message({"kind": api.CAMERA_CACHE_CONTROL, "camera_id": None})
+    client.get('/api/cameras', headers=bearer(app))
+    assert len(loads) == 2
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import camera_status
+from camera_status import STATUS_DEGRADED, STATUS_OFFLINE, STATUS_ONLINE, CameraStatusTable
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+
+    def fetchall(self):
+        return list(self.conn.shared_rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """cameras 表中的共享状态: shared_rows = [(id, status, last_seen_at)]"""
+    def __init__(self):
+        self.shared_rows = []
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def conn():
+    return FakeConnection()
+
+
+@pytest.fixture
+def table(monkeypatch, clock, conn):
+    monkeypatch.setattr(camera_status, "time", clock)
+    table = CameraStatusTable(lambda: conn, offline_timeout=60, flush_interval=3600)
+    yield table
+    table._stop.set()
+
+
+def utc(clock, offset=0):
+    return datetime.utcfromtimestamp(clock.now + offset)
+
+
+def test_local_heartbeat_goes_offline_after_timeout(table, clock):
+    table.heartbeat(1)
+    table.heartbeat(2, health='error')
+    assert table.statuses() == {1: STATUS_ONLINE, 2: STATUS_DEGRADED}
+    clock.advance(61)
+    assert table.statuses() == {1: STATUS_OFFLINE, 2: STATUS_OFFLINE}
+
+
+def test_newer_shared_state_wins_over_stale_local_heartbeat(table, clock, conn):
+    table.heartbeat(1)
+    clock.advance(50)
+    # 之后的心跳都落在其他 worker 上，由它写入数据库
+    conn.shared_rows = [(1, STATUS_ONLINE, utc(clock))]
+    table.flush()
+    clock.advance(20)
+    assert table.statuses() == {1: STATUS_ONLINE}
+
+
+def test_shared_state_goes_offline_when_nobody_refreshes_it(table, clock, conn):
+    conn.shared_rows = [(3, STATUS_ONLINE, utc(clock))]
+    table.flush()
+    assert table.statuses() == {3: STATUS_ONLINE}
+    clock.advance(61)
+    assert table.statuses() == {3: STATUS_OFFLINE}
+
+
+def test_newer_local_heartbeat_wins_over_shared_state(table, clock, conn):
+    conn.shared_rows = [(1, STATUS_DEGRADED, utc(clock, -10))]
+    table.flush()
+    table.heartbeat(1)
+    assert table.statuses() == {1: STATUS_ONLINE}
+
+
+def test_flush_writes_changes_and_reads_shared_state(table, clock, conn):
+    table.heartbeat(1)
+    assert table.flush() == 1
+    assert len(conn.executed) == 2
+    assert conn.executed[0][1][:2] == ([1], [STATUS_ONLINE])
+    # 没有变化时只读取共享状态
+    conn.executed.clear()
+    assert table.flush() == 0
+    assert conn.executed == [(camera_status.SHARED_STATE_SQL, None)]
+    assert table.stats()["flushes"] == 1
+
+
+def test_camera_list_sql_applies_offline_timeout():
+    api = pytest.importorskip("api")
+    expected = f"interval '{camera_status.CAMERA_OFFLINE_TIMEOUT:g} seconds' THEN 'offline'"
+    assert expected in api.SQL_ACTIVE_CAMERAS
+    assert expected in api.SQL_ACTIVE_CAMERAS_JSON
+
+
+def test_worker_without_heartbeats_overlays_shared_state(monkeypatch, table, clock, conn):
+    api = pytest.importorskip("api")
+    monkeypatch.setattr(api, "get_camera_status", lambda: table)
+    conn.shared_rows = [(1, STATUS_OFFLINE, utc(clock, -120))]
+    table.flush()
+    entry = api.cache_payload({"success": True, "data": [{"id": 1, "name": "gate", "status": STATUS_ONLINE}]})
+    overlaid, _ = api.overlay_live_status(entry, 0)
+    assert overlaid["body"]["data"][0]["status"] == STATUS_OFFLINE
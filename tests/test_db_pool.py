@@ -0,0 +1,97 @@
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    """模拟 PooledConnection: alive=False 表示数据库已重启，下一次查询会失败"""
+    def __init__(self, pool):
+        self._pool = pool
+        self._checked_out = False
+        self._idle_since = 0.0
+        self.closed = 0
+        self.alive = True
+        self.queries = 0
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.queries += 1
+        if not self.alive:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._pool.putconn(self)
+
+    def discard(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def make_pool(monkeypatch, clock):
+    monkeypatch.setattr(db_pool, "time", clock)
+    created = []
+
+    def make(**kwargs):
+        pool = ConnectionPool("dbname=test", **kwargs)
+
+        def connect():
+            conn = FakeConnection(pool)
+            created.append(conn)
+            return conn
+
+        pool._connect = connect
+        return pool
+
+    make.created = created
+    return make
+
+
+def test_recently_used_connection_is_validated_on_borrow(make_pool):
+    pool = make_pool(max_size=2)
+    conn = pool.getconn()
+    conn.close()
+    conn.alive = False # 数据库在归还之后立即重启
+
+    replacement = pool.getconn()
+    assert replacement is not conn and conn.closed
+    assert len(make_pool.created) == 2
+    stats = pool.stats()
+    assert (stats["validation_failures"], stats["size"], stats["in_use"]) == (1, 1, 1)
+
+
+def test_validate_idle_skips_the_check_for_recent_connections(make_pool, clock):
+    pool = make_pool(validate_idle=30)
+    conn = pool.getconn()
+    conn.close()
+    assert pool.getconn() is conn and conn.queries == 0
+    conn.close()
+    clock.advance(30)
+    assert pool.getconn() is conn and conn.queries == 1
+
+
+def test_borrow_times_out_when_pool_is_exhausted(make_pool):
+    pool = make_pool(max_size=1, borrow_timeout=0)
+    pool.getconn()
+    with pytest.raises(PoolTimeoutError):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_connect_timeout_is_passed_to_psycopg2(monkeypatch):
+    calls = []
+    monkeypatch.setattr(db_pool.psycopg2, "connect", lambda dsn, **kwargs: calls.append(kwargs) or FakeConnection(None))
+    ConnectionPool("dbname=replica", connect_timeout=2)._connect()
+    ConnectionPool("dbname=primary")._connect()
+    assert calls[0]["connect_timeout"] == 2
+    assert "connect_timeout" not in calls[1]
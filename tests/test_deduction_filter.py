@@ -0,0 +1,151 @@
+import time
+from datetime import date
+
+import jwt
+import psycopg2.errors
+import pytest
+
+from report_engine import deduction_vocabulary
+from ttl_cache import TTLCache
+
+api = pytest.importorskip("api")
+
+
+class FakeCursor:
+    """results 依次作为 fetchall() / fetchone() 的结果；不是连接池的连接，预编译语句按普通 SQL 执行"""
+    def __init__(self, results=(), error=None):
+        self.results = list(results)
+        self.error = error
+        self.executed = []
+        self.connection = object()
+
+    def execute(self, sql, params=None):
+        if self.error:
+            raise self.error
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+    def fetchone(self):
+        return self.results.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self, cursor_factory=None):
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app = api.create_app()
+    token = jwt.encode({"user_id": 1, "exp": int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm="HS256")
+    monkeypatch.setattr(api, "deduction_vocabulary_cache", TTLCache(ttl=60, max_size=8))
+    test_client = app.test_client()
+
+    def get(url, cursor=None):
+        connections = []
+        monkeypatch.setattr(api, "get_db_connection",
+                            lambda readonly=False: connections.append(cursor) or FakeConnection(cursor))
+        response = test_client.get(url, headers={"Authorization": f"Bearer {token}"})
+        response.connections = connections
+        return response
+
+    return get
+
+
+def test_filtered_statements_add_jsonb_containment():
+    for kind in ("page", "keyset", "count"):
+        plain = api.EVENT_LIST_STATEMENTS[kind, False].sql
+        filtered = api.EVENT_LIST_STATEMENTS[kind, True].sql
+        assert "@>" not in plain
+        assert filtered == plain.replace(api.SQL_EVENT_LIST_FROM,
+                                         api.SQL_EVENT_LIST_FROM + " AND deductions @> %s::jsonb")
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("", None),
+    ("?deduction=%20", None),
+    ("?deduction=no%20helmet", '["no helmet"]'),
+    ("?deduction=no%20vest&deduction=%20no%20helmet%20&deduction=no%20vest", '["no helmet", "no vest"]'),
+    ("?deduction=" + "未戴安全帽", '["未戴安全帽"]'),
+])
+def test_parse_deduction_filter(query, expected):
+    with api.create_app().test_request_context('/api/events' + query):
+        assert api.parse_deduction_filter() == expected
+
+
+def test_get_events_passes_filter_after_the_date_range(client):
+    cursor = FakeCursor([[]])
+    response = client('/api/events?count=none&start_date=2024-05-01&end_date=2024-05-31'
+                      '&deduction=no%20helmet&deduction=no%20vest', cursor)
+    assert response.status_code == 200
+    sql, params = cursor.executed[0]
+    assert sql == api.EVENT_LIST_STATEMENTS["page", True].sql
+    assert params == ("2024-05-01", "2024-05-31 23:59:59", '["no helmet", "no vest"]', 21, 0)
+
+
+def test_get_events_without_filter_uses_plain_statement(client):
+    cursor = FakeCursor([[], {"count": 0}])
+    response = client('/api/events?deduction=', cursor)
+    assert response.status_code == 200
+    assert [sql for sql, _ in cursor.executed] == [api.EVENT_LIST_STATEMENTS["page", False].sql,
+                                                   api.EVENT_LIST_STATEMENTS["count", False].sql]
+    assert cursor.executed[1][1] == ("-infinity", "infinity")
+
+
+@pytest.mark.parametrize("query", [
+    "&".join(f"deduction=item{i}" for i in range(api.DEDUCTION_FILTER_MAX + 1)),
+    "deduction=" + "x" * 201,
+])
+def test_invalid_deduction_filter_is_rejected(client, query):
+    response = client('/api/events?' + query)
+    assert response.status_code == 400
+    assert response.connections == []
+
+
+def test_deduction_vocabulary_query():
+    cursor = FakeCursor([[("no helmet", 7), ("no vest", 2)]])
+    assert deduction_vocabulary(cursor, date(2024, 5, 1), limit=10) == [
+        {"deduction": "no helmet", "count": 7}, {"deduction": "no vest", "count": 2}]
+    sql, params = cursor.executed[0]
+    assert "FROM deduction_rollup_daily" in sql and "risk_type" not in sql
+    assert params == (date(2024, 5, 1), 10)
+
+    cursor = FakeCursor([[{"deduction": "no helmet", "occurrences": 5}]])
+    assert deduction_vocabulary(cursor, date(2024, 5, 1), "abnormal") == [{"deduction": "no helmet", "count": 5}]
+    sql, params = cursor.executed[0]
+    assert "AND risk_type = %s" in sql
+    assert params == (date(2024, 5, 1), "abnormal", 100)
+
+
+def test_vocabulary_endpoint_is_cached(client):
+    cursor = FakeCursor([[("no helmet", 7)]])
+    response = client('/api/deductions?days=7&risk_type=abnormal', cursor)
+    assert response.get_json() == {"success": True, "days": 7, "deductions": [{"deduction": "no helmet", "count": 7}]}
+    assert cursor.executed[0][1][1:] == ("abnormal", 100)
+
+    response = client('/api/deductions?days=7&risk_type=abnormal', FakeCursor())
+    assert response.get_json()["deductions"] == [{"deduction": "no helmet", "count": 7}]
+    assert response.connections == [] # 命中缓存，不访问数据库
+
+
+@pytest.mark.parametrize("query", ["risk_type=all", "days=0", "days=367", "limit=1001", "limit=ten"])
+def test_vocabulary_endpoint_rejects_invalid_parameters(client, query):
+    response = client('/api/deductions?' + query)
+    assert response.status_code == 400
+    assert response.connections == []
+
+
+def test_vocabulary_endpoint_without_rollup_tables(client):
+    cursor = FakeCursor(error=psycopg2.errors.UndefinedTable('relation "deduction_rollup_daily" does not exist'))
+    assert client('/api/deductions', cursor).status_code == 404
@@ -0,0 +1,119 @@
+import time
+from datetime import datetime
+
+import jwt
+import pytest
+
+api = pytest.importorskip("api")
+
+
+def event(event_id, image_count=2):
+    return {"id": event_id, "camera_id": 3, "category": "helmet", "score": 45.0,
+            "timestamp": datetime(2024, 5, 1, 8, 0, event_id % 60), "status": "new",
+            "images": [{"image_id": event_id * 10 + i, "deduction_items": []} for i in range(image_count)]}
+
+
+class DetailCursor:
+    """按 id 返回 events 中存在的事件 (顺序与请求不同，模拟 ANY() 的返回顺序)；不是连接池的连接"""
+    def __init__(self, events):
+        self.events = {e["id"]: e for e in events}
+        self.executed = []
+        self.rows = []
+        self.connection = object()
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        ids = params[-1] if isinstance(params[-1], list) else [p for p in params if isinstance(p, int)]
+        self.rows = [dict(self.events[i]) for i in sorted(set(ids), reverse=True) if i in self.events]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class DetailConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.closed = False
+
+    def cursor(self, cursor_factory=None):
+        return self._cursor
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app = api.create_app()
+    token = jwt.encode({"user_id": 1, "exp": int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm="HS256")
+    test_client = app.test_client()
+    cursor = DetailCursor([event(1), event(2, image_count=0), event(5)])
+    connections = []
+
+    def connect(readonly=False):
+        connections.append(DetailConnection(cursor))
+        return connections[-1]
+
+    monkeypatch.setattr(api, "get_db_connection", connect)
+
+    def get(url):
+        return test_client.get(url, headers={"Authorization": f"Bearer {token}"})
+
+    get.cursor = cursor
+    get.connections = connections
+    return get
+
+
+def test_details_are_fetched_in_one_statement_in_request_order(client):
+    response = client('/api/events/details?ids=5,1,2')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [e["id"] for e in body["data"]] == [5, 1, 2]
+    assert [e["image_count"] for e in body["data"]] == [2, 2, 0]
+    assert body["missing"] == []
+    assert client.cursor.executed == [(api.EVENT_DETAIL_STATEMENTS["many", False].sql, ([5, 1, 2],))]
+    assert len(client.connections) == 1 and client.connections[0].closed
+
+
+def test_missing_and_duplicate_ids(client):
+    body = client('/api/events/details?ids=7,1,%201,9,5,7').get_json()
+    assert [e["id"] for e in body["data"]] == [1, 5]
+    assert body["missing"] == [7, 9]
+
+
+def test_all_ids_missing(client):
+    body = client('/api/events/details?ids=8,9').get_json()
+    assert body == {"success": True, "data": [], "missing": [8, 9]}
+
+
+def test_details_with_deduction_filter(client):
+    client('/api/events/details?ids=1&deduction=no%20helmet')
+    assert client.cursor.executed == [(api.EVENT_DETAIL_STATEMENTS["many", True].sql, ('["no helmet"]', [1]))]
+
+
+@pytest.mark.parametrize("query", ["", "?ids=", "?ids=,%20,", "?ids=1,a", "?ids=1.5",
+                                   "?ids=" + ",".join(str(i) for i in range(api.EVENT_DETAILS_MAX_IDS + 1))])
+def test_invalid_or_empty_id_lists_are_rejected(client, query):
+    response = client('/api/events/details' + query)
+    assert response.status_code == 400
+    assert client.connections == []
+
+
+def test_single_detail_uses_partition_key_when_given(client):
+    response = client('/api/events/5?timestamp=2024-05-01T08:00:05Z')
+    assert response.get_json()["data"]["image_count"] == 2
+    assert client.cursor.executed == [(api.EVENT_DETAIL_STATEMENTS["one_at", False].sql,
+                                       (5, datetime(2024, 5, 1, 8, 0, 5)))]
+    assert client('/api/events/5').status_code == 200
+    assert client.cursor.executed[-1] == (api.EVENT_DETAIL_STATEMENTS["one", False].sql, (5,))
+
+
+def test_single_detail_not_found_or_invalid_timestamp(client):
+    assert client('/api/events/9').status_code == 404
+    assert client('/api/events/5?timestamp=yesterday').status_code == 400
@@ -0,0 +1,155 @@
+import csv
+import decimal
+import gzip
+import io
+import json
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+import event_export
+from event_export import EXPORT_COLUMNS, build_export_query, stream_export
+from pagination import decode_position
+
+
+class Encoder(json.JSONEncoder):
+    """与 api.CustomJSONEncoder 的格式相同"""
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat() + 'Z'
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        return super().default(obj)
+
+
+def row(event_id, image_id=None, **fields):
+    data = {"event_id": event_id, "camera_id": 3, "equipment_type": "helmet",
+            "event_time": datetime(2024, 5, 1, 8) + timedelta(seconds=event_id), "risk_type": "abnormal",
+            "event_score": decimal.Decimal("45.5"), "event_status": "new", "event_deductions": ["no helmet"],
+            "image_id": image_id, "image_url": f"/images/{image_id}.jpg" if image_id else None,
+            "image_timestamp": None, "image_score": None, "deduction_items": None}
+    data.update(fields)
+    return data
+
+
+def export(rows, export_format, use_gzip=False):
+    body = b"".join(stream_export(iter(rows), export_format, Encoder(ensure_ascii=False), use_gzip))
+    return (gzip.decompress(body) if use_gzip else body).decode('utf-8')
+
+
+def test_ndjson_has_one_line_per_row_with_position():
+    lines = export([row(1, 10), row(1, 11), row(2)], 'ndjson').splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [(r["event_id"], r["image_id"]) for r in records] == [(1, 10), (1, 11), (2, None)]
+    assert records[0]["event_time"] == "2024-05-01T08:00:01Z" and records[0]["event_score"] == 45.5
+    assert decode_position(records[2]["position"]) == (datetime(2024, 5, 1, 8, 0, 2), 2, 0)
+
+
+def test_csv_header_and_values():
+    text = export([row(1, 10, deduction_items=[{"item": "无安全帽", "score": 5}])], 'csv')
+    header, values = list(csv.reader(io.StringIO(text)))
+    assert tuple(header) == EXPORT_COLUMNS
+    record = dict(zip(header, values))
+    assert record["event_time"] == "2024-05-01T08:00:01Z" and record["event_score"] == "45.5"
+    assert json.loads(record["deduction_items"]) == [{"item": "无安全帽", "score": 5}]
+    assert record["image_timestamp"] == "" # None 输出为空字段
+
+
+def test_csv_quotes_separators_quotes_and_newlines():
+    equipment_type = 'helmet, "red"\nsize L'
+    text = export([row(1, equipment_type=equipment_type, event_deductions=['a,b', 'c"d'])], 'csv')
+    records = list(csv.DictReader(io.StringIO(text)))
+    assert len(records) == 1
+    assert records[0]["equipment_type"] == equipment_type
+    assert json.loads(records[0]["event_deductions"]) == ['a,b', 'c"d']
+
+
+@pytest.mark.parametrize("export_format", ['ndjson', 'csv'])
+def test_gzip_output_matches_plain_output(monkeypatch, export_format):
+    monkeypatch.setattr(event_export, "EXPORT_CHUNK_BYTES", 64) # 多个压缩块
+    rows = [row(i, i * 10) for i in range(1, 30)]
+    assert export(rows, export_format, use_gzip=True) == export(rows, export_format)
+
+
+def test_time_range_is_applied_to_both_tables():
+    sql, params = build_export_query("2024-05-01", "2024-05-02", "abnormal", 3,
+                                     (datetime(2024, 5, 1, 8), 1, 10))
+    assert "i.event_time >= %s AND i.event_time <= %s" in sql
+    assert "e.event_time >= %s AND e.event_time <= %s" in sql
+    assert params == ["2024-05-01", "2024-05-02 23:59:59", "2024-05-01", "2024-05-02 23:59:59",
+                      "abnormal", 3, datetime(2024, 5, 1, 8), 1, 10]
+
+
+class FakeNamedCursor:
+    """服务器端游标: 迭代时逐行返回，记录是否已关闭"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = False
+        self.fetched = 0
+
+    def execute(self, sql, params=None):
+        pass
+
+    def __iter__(self):
+        for r in self.rows:
+            self.fetched += 1
+            yield r
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.named_cursor = FakeNamedCursor(rows)
+        self.cursor_name = None
+        self.released = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        self.cursor_name = name
+        return self.named_cursor
+
+    def close(self):
+        self.released += 1
+
+
+@pytest.fixture
+def export_client(monkeypatch):
+    api = pytest.importorskip("api")
+    monkeypatch.setattr(event_export, "EXPORT_CHUNK_BYTES", 1) # 每行一个响应块
+    conn = FakeConnection([row(i, i * 10) for i in range(1, 101)])
+    monkeypatch.setattr(api, "get_db_connection", lambda readonly=False: conn)
+    app = api.create_app()
+    token = jwt.encode({"user_id": 1, "exp": int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm="HS256")
+    return app.test_client(), {"Authorization": f"Bearer {token}"}, conn
+
+
+def test_export_endpoint_uses_named_cursor_and_releases_connection(export_client):
+    client, headers, conn = export_client
+    response = client.get('/api/events/export?format=csv', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert len(response.data.decode('utf-8').splitlines()) == 101
+    assert conn.cursor_name.startswith("export_")
+    response.close()
+    assert conn.named_cursor.closed and conn.released == 1
+
+
+def test_export_endpoint_releases_connection_when_client_disconnects(export_client):
+    client, headers, conn = export_client
+    response = client.get('/api/events/export', headers=headers, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    assert conn.released == 0 # 导出期间一直占用连接
+    response.close() # WSGI 服务器在客户端断开时关闭响应
+    assert conn.named_cursor.closed and conn.released == 1
+    assert conn.named_cursor.fetched < 100
+
+
+def test_export_endpoint_rejects_invalid_parameters(export_client):
+    client, headers, conn = export_client
+    for query in ("format=xml", "risk_type=warning", "start_date=2024-13-01", "after=not-a-position"):
+        assert client.get(f'/api/events/export?{query}', headers=headers).status_code == 400
+    assert conn.cursor_name is None
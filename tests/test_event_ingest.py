@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pytest
+
+import event_ingest
+from event_ingest import IDEMPOTENCY_KEY_MAX_LENGTH, EventValidationError, derive_idempotency_key, insert_event, \
+    parse_event_payload
+
+
+def payload(**fields):
+    data = {"camera_id": 3, "equipment_type": "helmet", "timestamp": "2024-05-01T08:00:00+09:00",
+            "risk_type": "abnormal", "score": 45, "deductions": ["no helmet"]}
+    data.update(fields)
+    return data
+
+
+def test_valid_payload_is_normalized():
+    event = parse_event_payload(payload(image_filename="a.jpg"))
+    assert event["event_time"] == datetime(2024, 4, 30, 23, 0)
+    assert event["images"] == [{"filename": "a.jpg", "score": 45, "deductions": ["no helmet"]}]
+    assert event["idempotency_key"] is None
+
+
+def test_missing_fields_are_listed():
+    data = payload()
+    del data["risk_type"]
+    with pytest.raises(EventValidationError, match="risk_type"):
+        parse_event_payload(data)
+
+
+@pytest.mark.parametrize("camera_id", ["3", 3.5, True, [3]])
+def test_camera_id_must_be_an_integer(camera_id):
+    with pytest.raises(EventValidationError, match="camera_id"):
+        parse_event_payload(payload(camera_id=camera_id))
+
+
+def test_camera_id_may_be_null():
+    assert parse_event_payload(payload(camera_id=None))["camera_id"] is None
+
+
+@pytest.mark.parametrize("score", ["45", "high", False, float("nan"), {"value": 45}])
+def test_score_must_be_a_number(score):
+    with pytest.raises(EventValidationError, match="score"):
+        parse_event_payload(payload(score=score))
+
+
+def test_image_score_must_be_a_number():
+    images = [{"filename": "a.jpg", "score": 40}, {"filename": "b.jpg", "score": "40"}]
+    with pytest.raises(EventValidationError, match="score"):
+        parse_event_payload(payload(images_data=images))
+    assert parse_event_payload(payload(images_data=[{"filename": "a.jpg"}]))["images"] == [{"filename": "a.jpg"}]
+
+
+@pytest.mark.parametrize("fields", [
+    {"equipment_type": ["helmet"]},
+    {"image_filename": 7},
+    {"images_data": [{"filename": 7}]},
+    {"images_data": [{"image": ["a" * 64 + ".jpg"]}]},
+    {"timestamp": 1714518000},
+    {"timestamp": "yesterday"},
+    {"deductions": "no helmet"},
+    {"images_data": [{"filename": "a.jpg", "deductions": "no helmet"}]},
+    {"risk_type": "warning"},
+])
+def test_invalid_fields_are_rejected(fields):
+    with pytest.raises(EventValidationError):
+        parse_event_payload(payload(**fields))
+
+
+def test_idempotency_key_precedence():
+    data = payload(client_event_id="box-1/42", sequence=7)
+    assert derive_idempotency_key(data, "header-key") == "header-key"
+    assert derive_idempotency_key(data) == "box-1/42"
+    del data["client_event_id"]
+    assert derive_idempotency_key(data) == "3:2024-05-01T08:00:00+09:00:7"
+    del data["sequence"]
+    assert derive_idempotency_key(data) is None
+
+
+def test_idempotency_key_is_stringified_and_bounded():
+    assert derive_idempotency_key({"client_event_id": 42}) == "42"
+    with pytest.raises(EventValidationError):
+        derive_idempotency_key({"client_event_id": "x" * (IDEMPOTENCY_KEY_MAX_LENGTH + 1)})
+    with pytest.raises(EventValidationError):
+        derive_idempotency_key({"client_event_id": ""})
+    assert parse_event_payload(payload(), "retry-1")["idempotency_key"] == "retry-1"
+
+
+class FakeCursor:
+    """不是连接池的连接 (没有 prepared_statements)，预编译语句按普通 SQL 执行"""
+    def __init__(self, rows):
+        self.rows = list(rows) # 依次作为 fetchone() 的结果
+        self.executed = []
+        self.connection = object()
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+
+def test_insert_event_replays_existing_idempotency_key(monkeypatch):
+    after = []
+    monkeypatch.setattr(event_ingest, "after_insert", lambda cursor, events, ids: after.append(ids))
+    event = parse_event_payload(payload(image_filename="a.jpg"), "retry-1")
+    cursor = FakeCursor([None, (42,)]) # ON CONFLICT DO NOTHING 没有返回行，再查询原来的 id
+
+    assert insert_event(cursor, event) == 42
+    assert event["replayed"] is True
+    assert cursor.executed[1] == (event_ingest.SELECT_REPLAYED_EVENT.sql, ("retry-1", event["event_time"]))
+    assert len(cursor.executed) == 2 # 不写入图片
+    assert after == [] # 不重复累加汇总表、不重复推送
+
+
+def test_insert_event_clears_previous_replay_mark(monkeypatch):
+    after = []
+    monkeypatch.setattr(event_ingest, "after_insert", lambda cursor, events, ids: after.append(ids))
+    event = parse_event_payload(payload(image_filename="a.jpg"), "retry-1")
+    event["replayed"] = True
+    cursor = FakeCursor([(43,)])
+
+    assert insert_event(cursor, event) == 43
+    assert "replayed" not in event
+    assert cursor.executed[1][0] == event_ingest.INSERT_EVENT_IMAGES.sql
+    assert after == [[43]]
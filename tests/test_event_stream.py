@@ -0,0 +1,140 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import event_stream
+from event_stream import EventBroadcaster, TooManySubscribersError, format_sse, notify_payload
+
+
+def message(event_id, risk_type="abnormal"):
+    return {"id": event_id, "risk_type": risk_type, "deductions": ["no helmet"]}
+
+
+class FakeDatabase:
+    """load_since(last_id, limit): 按 id 顺序返回 id > last_id 的事件"""
+    def __init__(self, messages=()):
+        self.messages = sorted(messages, key=lambda m: m["id"])
+        self.calls = []
+
+    def load_since(self, last_id, limit):
+        self.calls.append((last_id, limit))
+        return [m for m in self.messages if m["id"] > last_id][:limit]
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def broadcaster(database):
+    return EventBroadcaster("dbname=test", load_since=database.load_since, start=False)
+
+
+def drain(subscription):
+    ids = []
+    while not subscription.queue.empty():
+        ids.append(subscription.queue.get_nowait()["id"])
+    return ids
+
+
+def test_live_events_are_filtered_by_risk_type(broadcaster):
+    abnormal = broadcaster.subscribe(risk_type="abnormal")
+    everything = broadcaster.subscribe(risk_type=None)
+    broadcaster._dispatch(message(1))
+    broadcaster._dispatch(message(2, "normal"))
+    assert drain(abnormal) == [1]
+    assert drain(everything) == [1, 2]
+
+
+def test_subscriber_limit(monkeypatch, broadcaster):
+    monkeypatch.setattr(event_stream, "SSE_MAX_SUBSCRIBERS", 1)
+    subscription = broadcaster.subscribe()
+    with pytest.raises(TooManySubscribersError):
+        broadcaster.subscribe()
+    subscription.close()
+    broadcaster.subscribe()
+
+
+def test_replay_from_buffer_follows_commit_order(broadcaster, database):
+    # 7 在 8 之后提交: 客户端最后收到的是 8，重连后仍然要收到 7
+    for event_id in (5, 6, 8, 7, 9):
+        broadcaster._dispatch(message(event_id))
+    subscription = broadcaster.subscribe(last_event_id=8)
+    assert drain(subscription) == [7, 9]
+    assert database.calls == []
+
+
+def test_replay_falls_back_to_database_when_not_buffered(broadcaster, database):
+    database.messages = [message(i) for i in range(1, 5)]
+    broadcaster._dispatch(message(10))
+    subscription = broadcaster.subscribe(last_event_id=2)
+    assert drain(subscription) == [3, 4]
+    assert database.calls == [(2, event_stream.SSE_REPLAY_LIMIT)]
+
+
+def test_events_held_during_replay_are_deduplicated_by_id(broadcaster):
+    broadcaster._dispatch(message(1))
+    subscription = event_stream.Subscription(broadcaster, None, replaying=True)
+    subscription.offer(message(3)) # 补发期间到达的实时事件
+    subscription.offer(message(2))
+    subscription.finish_replay([message(3)])
+    assert drain(subscription) == [3, 2]
+
+
+def test_reconnect_rereads_a_window_and_skips_buffered_events(monkeypatch, broadcaster, database):
+    monkeypatch.setattr(event_stream, "SSE_REREAD_IDS", 3)
+    for event_id in (8, 10):
+        broadcaster._dispatch(message(event_id))
+    database.messages = [message(i) for i in (8, 9, 10, 11)]
+    subscription = broadcaster.subscribe(risk_type=None)
+    broadcaster._reread()
+    assert database.calls == [(7, event_stream.SSE_REPLAY_LIMIT)]
+    assert drain(subscription) == [9, 11]
+    assert broadcaster.stats()["reread_skipped"] == 2
+
+
+def test_buffer_evicts_oldest_ids(monkeypatch, broadcaster):
+    monkeypatch.setattr(event_stream, "SSE_BUFFER_SIZE", 2)
+    for event_id in (1, 2, 3):
+        broadcaster._dispatch(message(event_id))
+    assert broadcaster._buffered_ids == {2, 3}
+    broadcaster._dispatch(message(1)) # 已经移出缓冲区的 id 不再视为重复
+    assert [m["id"] for m in broadcaster._buffer] == [3, 1]
+
+
+def test_control_messages_are_routed_by_kind(broadcaster):
+    received = []
+    broadcaster.add_control_listener("camera_cache", received.append)
+    broadcaster.add_control_listener("broken", lambda message: 1 / 0)
+    broadcaster._control({"kind": "camera_cache", "camera_id": 3})
+    broadcaster._control({"kind": "unknown"})
+    broadcaster._control(None) # 重连: 通知所有回调，回调异常不影响其他回调
+    assert received == [{"kind": "camera_cache", "camera_id": 3}, None]
+    assert broadcaster.stats()["control_messages"] == 2
+
+
+def event(deductions):
+    return {"camera_id": 1, "equipment_type": "helmet", "event_time": datetime(2024, 5, 1, 8, 0),
+            "risk_type": "abnormal", "score": 45, "image_filename": "a.jpg", "deductions": deductions}
+
+
+def test_oversized_payload_is_truncated_to_the_id():
+    assert json.loads(notify_payload(7, event(["no helmet"])))["deductions"] == ["no helmet"]
+    payload = notify_payload(7, event(["x" * event_stream.NOTIFY_MAX_PAYLOAD]))
+    assert json.loads(payload) == {"id": 7, "truncated": True}
+
+
+def test_truncated_notification_is_loaded_from_the_database(broadcaster, database):
+    database.messages = [message(6), message(7)]
+    assert broadcaster._load_truncated(7) == message(7)
+    assert database.calls == [(6, 1)]
+    assert broadcaster._load_truncated(8) is None
+    assert broadcaster.stats()["truncated"] == 2
+
+
+def test_format_sse_hides_internal_fields():
+    text = format_sse(message(3))
+    assert text.startswith("id: 3\nevent: event\ndata: ")
+    assert "deductions" not in text
@@ -0,0 +1,89 @@
+import pytest
+
+from admission import AdmissionController
+from ttl_cache import TTLCache
+
+api = pytest.importorskip("api")
+
+
+def event(**fields):
+    data = {"camera_id": 3, "equipment_type": "helmet", "timestamp": "2024-05-01T08:00:00Z",
+            "risk_type": "abnormal", "score": 45, "deductions": ["no helmet"]}
+    data.update(fields)
+    return data
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch, clock):
+    import admission
+    monkeypatch.setattr(admission, "time", clock)
+    monkeypatch.setattr(api, "INGEST_API_KEYS", ())
+    monkeypatch.setattr(api, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(api, "admission", AdmissionController(camera_rate=0, camera_burst=2, key_rate=0, key_burst=100))
+    monkeypatch.setattr(api, "idempotency_cache", TTLCache(ttl=60, max_size=100))
+    monkeypatch.setattr(api, "record_live_events", lambda events, ids: None)
+    conn = FakeConnection()
+    monkeypatch.setattr(api, "get_db_connection", lambda **kwargs: conn)
+    inserted = []
+
+    def insert_events_batch(cursor, events):
+        inserted.extend(events)
+        return [(100 + i, None) for i in range(len(events))]
+
+    monkeypatch.setattr(api, "insert_events_batch", insert_events_batch)
+    client = api.create_app().test_client()
+    client.inserted = inserted
+    client.conn = conn
+    return client
+
+
+def test_all_events_accepted(client):
+    response = client.post('/api/events/batch', json=[event(), event(risk_type="normal", score=90)])
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body["accepted"], body["rejected"]) == (2, 0)
+    assert [r["event_id"] for r in body["results"]] == [100, 101]
+    assert client.conn.commits == 1
+
+
+def test_invalid_events_are_reported_per_index(client):
+    response = client.post('/api/events/batch', json=[event(), event(images_data=[{"filename": 7}])])
+    assert response.status_code == 207
+    results = response.get_json()["results"]
+    assert results[0]["success"] and not results[1]["success"]
+    assert "filename" in results[1]["message"]
+    assert len(client.inserted) == 1
+
+
+@pytest.mark.parametrize("payload", [[], {"events": "x"}, [event(equipment_type=["helmet"])]])
+def test_bad_request(client, payload):
+    assert client.post('/api/events/batch', json=payload).status_code == 400
+    assert client.inserted == []
+
+
+def test_throttled_batch_returns_429(client):
+    # camera_burst 2，速率 0: 前两个批量请求之后摄像头 3 的令牌用完
+    for _ in range(2):
+        assert client.post('/api/events/batch', json=[event()]).status_code == 201
+    response = client.post('/api/events/batch', json=[event(), event()])
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+    assert response.get_json()["throttled"] == 2
+    assert len(client.inserted) == 2
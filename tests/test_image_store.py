@@ -0,0 +1,71 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from image_store import ImageStore, ImageStoreError, detect_type, parse_image_name
+
+
+JPEG = b'\xff\xd8\xff\xe0' + b'jpeg body' * 100
+PNG = b'\x89PNG\r\n\x1a\n' + b'png body'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(root=str(tmp_path), max_bytes=4096)
+
+
+def test_identical_content_is_stored_once(store):
+    first = store.put_file(io.BytesIO(JPEG))
+    second = store.put_file(io.BytesIO(JPEG))
+
+    assert first.digest == hashlib.sha256(JPEG).hexdigest()
+    assert second.name == first.name
+    assert (first.deduplicated, second.deduplicated) == (False, True)
+    path, mimetype = store.find(first.name)
+    assert mimetype == 'image/jpeg'
+    with open(path, 'rb') as f:
+        assert f.read() == JPEG
+    assert store.stats()["stored"] == 1 and store.stats()["deduplicated"] == 1
+    assert os.listdir(store.tmp_dir) == [] # 重复上传的临时文件已删除
+
+
+def test_different_content_gets_different_names(store):
+    assert store.put_file(io.BytesIO(JPEG)).name != store.put_file(io.BytesIO(JPEG + b'x')).name
+
+
+def test_upload_stream_hashes_while_writing(store):
+    upload = store.new_upload()
+    for i in range(0, len(PNG), 3):
+        upload.write(PNG[i:i + 3])
+    stored = store.commit(upload)
+    upload.close()
+    assert stored.name == hashlib.sha256(PNG).hexdigest() + ".png"
+    assert os.path.exists(store.object_path(stored.digest, "png"))
+
+
+@pytest.mark.parametrize("content, message", [
+    (b'', "大小"),
+    (b'\xff\xd8\xff' + b'x' * 5000, "大小"),
+    (b'GIF89a' + b'x' * 10, "格式"),
+])
+def test_invalid_uploads_are_rejected_and_cleaned_up(store, content, message):
+    with pytest.raises(ImageStoreError, match=message):
+        store.put_file(io.BytesIO(content))
+    assert os.listdir(store.tmp_dir) == []
+    assert store.stats()["rejected"] == 1
+
+
+def test_detect_type():
+    assert detect_type(JPEG[:16]) == 'jpg'
+    assert detect_type(PNG[:16]) == 'png'
+    assert detect_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'webp'
+    assert detect_type(b'<svg') is None
+
+
+def test_find_rejects_invalid_names(store):
+    assert parse_image_name("../etc/passwd") is None
+    assert parse_image_name("a" * 64 + ".gif") is None
+    assert store.find("../../secret.jpg") is None
+    assert store.find("0" * 64 + ".jpg") is None
@@ -0,0 +1,161 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ingest_queue
+from ingest_queue import INGEST_RETRY_LIMIT, IngestQueue, QueueFullError
+
+
+class FakeConnection:
+    """commit / rollback / close 可以按次数失败: fail_commits=2 表示前两次 commit 抛出异常"""
+    def __init__(self, fail_commits=0, fail_rollback=False, fail_close=0):
+        self.fail_commits = fail_commits
+        self.fail_rollback = fail_rollback
+        self.fail_close = fail_close
+        self.commits = 0
+        self.rollbacks = 0
+        self.closes = 0
+
+    def cursor(self):
+        return SimpleNamespace(close=lambda: None)
+
+    def commit(self):
+        if self.fail_commits:
+            self.fail_commits -= 1
+            raise RuntimeError("server closed the connection unexpectedly")
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.fail_rollback:
+            raise RuntimeError("connection already closed")
+
+    def close(self):
+        self.closes += 1
+        if self.fail_close:
+            self.fail_close -= 1
+            raise RuntimeError("pool is closed")
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    """替换 insert_events_batch: 按顺序分配 id，score 为负数的事件单独失败"""
+    calls = []
+
+    def fake_insert(cursor, events):
+        calls.append(list(events))
+        return [(None, ValueError("无效的 score")) if e["score"] < 0 else (100 + i, None)
+                for i, e in enumerate(events)]
+
+    monkeypatch.setattr(ingest_queue, "insert_events_batch", fake_insert)
+    monkeypatch.setattr(ingest_queue, "time", SimpleNamespace(monotonic=time.monotonic, sleep=lambda seconds: None))
+    return calls
+
+
+def make_queue(conn, **kwargs):
+    kwargs.setdefault("flush_interval", 0.01)
+    return IngestQueue(lambda: conn, **kwargs)
+
+
+def event(score=40):
+    return {"camera_id": 1, "score": score}
+
+
+def test_events_are_committed_together(inserted):
+    committed = []
+    conn = FakeConnection()
+    writer = make_queue(conn, flush_interval=0.2, on_commit=committed.extend)
+    ids = [writer.submit(event()) for _ in range(3)]
+    assert writer.drain() == 0
+    assert [writer.result(pid)["status"] for pid in ids] == ["committed"] * 3
+    assert sorted(event_id for _, event_id in committed) == sorted(writer.result(pid)["event_id"] for pid in ids)
+    stats = writer.stats()
+    assert (stats["committed_events"], stats["failed_events"], stats["commit_errors"]) == (3, 0, 0)
+
+
+def test_failed_event_does_not_fail_the_batch(inserted):
+    writer = make_queue(FakeConnection())
+    good, bad = writer.submit(event()), writer.submit(event(score=-1))
+    writer.drain()
+    assert writer.result(good)["status"] == "committed"
+    assert writer.result(bad) == {"status": "failed", "message": "无效的 score"}
+
+
+def test_commit_is_retried_after_rollback(inserted):
+    conn = FakeConnection(fail_commits=INGEST_RETRY_LIMIT - 1)
+    writer = make_queue(conn)
+    pid = writer.submit(event())
+    writer.drain()
+    assert writer.result(pid)["status"] == "committed"
+    assert conn.rollbacks == INGEST_RETRY_LIMIT - 1
+    assert conn.closes == INGEST_RETRY_LIMIT # 每次尝试都归还连接
+    assert writer.stats()["commit_errors"] == INGEST_RETRY_LIMIT - 1
+
+
+def test_events_without_key_are_retried_with_a_queue_key(inserted):
+    # COMMIT 出错时事务可能已经提交: 重试必须使用同一个幂等键，由 ON CONFLICT 识别已写入的事件
+    conn = FakeConnection(fail_commits=1)
+    writer = make_queue(conn)
+    submitted = event()
+    pid = writer.submit(submitted)
+    keyed = writer.submit(dict(event(), idempotency_key="box-1/42"))
+    writer.drain()
+    first, retry = inserted
+    assert [e["idempotency_key"] for e in first] == [ingest_queue.QUEUE_KEY_PREFIX + pid, "box-1/42"]
+    assert [e["idempotency_key"] for e in retry] == [e["idempotency_key"] for e in first]
+    assert "idempotency_key" not in submitted # 不修改调用方的事件
+    assert writer.result(keyed)["status"] == "committed"
+
+
+def test_batch_fails_after_retry_limit_even_if_rollback_fails(inserted):
+    conn = FakeConnection(fail_commits=INGEST_RETRY_LIMIT, fail_rollback=True)
+    writer = make_queue(conn)
+    pid = writer.submit(event())
+    writer.drain()
+    assert writer.result(pid) == {"status": "failed", "message": "数据库不可用"}
+    assert len(inserted) == INGEST_RETRY_LIMIT
+    assert conn.rollbacks == INGEST_RETRY_LIMIT
+    stats = writer.stats()
+    assert (stats["commit_errors"], stats["failed_events"]) == (INGEST_RETRY_LIMIT, 1)
+
+
+def test_unexpected_error_marks_pending_events_failed(inserted):
+    # 归还连接时出错会跳出重试循环: finally 保证这一批不会一直停留在 pending，写线程继续处理后续事件
+    conn = FakeConnection(fail_close=1)
+    writer = make_queue(conn)
+    first = writer.submit(event())
+    deadline = time.monotonic() + 5
+    while writer.result(first)["status"] == "pending" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    second = writer.submit(event())
+    writer.drain()
+    assert writer.result(first) == {"status": "failed", "message": "写入失败"}
+    assert writer.stats()["failed_events"] == 1
+    assert writer.result(second)["status"] == "committed"
+
+
+def test_full_queue_rejects_and_drain_flushes_remaining(inserted):
+    release = threading.Event()
+    conn = FakeConnection()
+
+    def blocked_connection():
+        release.wait(5)
+        return conn
+
+    writer = IngestQueue(blocked_connection, max_size=1, flush_size=1, flush_interval=0.01)
+    first = writer.submit(event())
+    deadline = time.monotonic() + 5
+    while writer.stats()["queue_depth"] and time.monotonic() < deadline:
+        time.sleep(0.01) # 等待写线程取走第一个事件并阻塞在 get_connection
+    second = writer.submit(event())
+    with pytest.raises(QueueFullError):
+        writer.submit(event())
+    assert writer.stats()["rejected_full"] == 1
+
+    release.set()
+    assert writer.drain() == 0
+    assert [writer.result(pid)["status"] for pid in (first, second)] == ["committed", "committed"]
+    with pytest.raises(QueueFullError):
+        writer.submit(event()) # 关闭后不再接收新事件
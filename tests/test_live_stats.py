@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import live_stats
+from live_stats import LiveStats
+
+
+WINDOWS = {"1m": 60, "5m": 300}
+EPOCH = datetime(1970, 1, 1)
+
+
+@pytest.fixture
+def stats(monkeypatch, clock):
+    monkeypatch.setattr(live_stats, "time", clock)
+    stats = LiveStats(bucket_seconds=10, windows=WINDOWS)
+    stats.mark_ready()
+    return stats
+
+
+def at(clock, offset=0):
+    """FakeClock 时刻 (加上 offset 秒) 对应的 UTC event_time"""
+    return EPOCH + timedelta(seconds=clock.now + offset)
+
+
+def event(clock, offset=0, camera_id=1, risk_type="abnormal", score=45, deductions=None):
+    return {"event_time": at(clock, offset), "camera_id": camera_id, "equipment_type": "helmet",
+            "risk_type": risk_type, "score": score, "deductions": deductions or []}
+
+
+def counts(stats, **filters):
+    windows = stats.query(**filters)
+    return {name: (window if filters else window["all"])["count"] for name, window in windows.items()}
+
+
+def message(clock, event_id, offset=0, **fields):
+    data = event(clock, offset, **fields)
+    data["id"] = event_id
+    data["event_time"] = data["event_time"].isoformat() + 'Z'
+    return data
+
+
+class FakeCursor:
+    """依次返回 rehydrate() 的三条查询结果: 计数、扣分项、快照中最近的事件 id"""
+    def __init__(self, count_rows, deduction_rows, snapshot_ids):
+        self.results = [count_rows, deduction_rows, [(i,) for i in snapshot_ids]]
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+def test_events_leave_each_window_as_time_advances(stats, clock):
+    stats.record_events([event(clock), event(clock, risk_type="normal", score=95)], [1, 2])
+    window = stats.query()["1m"]["all"]
+    assert (window["count"], window["abnormal"]) == (2, 1)
+    assert window["score_histogram"] == {"40": 1, "90": 1}
+
+    clock.advance(60)
+    assert counts(stats) == {"1m": 0, "5m": 2}
+    clock.advance(240)
+    assert counts(stats) == {"1m": 0, "5m": 0}
+    assert stats.stats()["tracked_keys"] == 0
+
+
+def test_window_totals_cover_only_their_buckets(stats, clock):
+    stats.record_events([event(clock, offset=-120)], [1])
+    stats.record_events([event(clock, offset=-5)], [2])
+    assert counts(stats) == {"1m": 1, "5m": 2}
+
+
+def test_ring_slot_is_reused_after_a_full_rotation(stats, clock):
+    stats.record_events([event(clock)], [1])
+    clock.advance(300) # 环形缓冲一整圈后同一个槽位对应新的桶
+    stats.record_events([event(clock, camera_id=2)], [2])
+    assert counts(stats) == {"1m": 1, "5m": 1}
+    assert counts(stats, camera_id=1) == {"1m": 0, "5m": 0}
+    assert counts(stats, camera_id=2) == {"1m": 1, "5m": 1}
+
+
+def test_too_old_events_are_dropped_and_future_events_count_now(stats, clock):
+    stats.record_events([event(clock, offset=-301), event(clock, offset=3600)], [1, 2])
+    assert stats.stats()["dropped_old"] == 1
+    assert counts(stats) == {"1m": 1, "5m": 1}
+    clock.advance(60)
+    assert counts(stats) == {"1m": 0, "5m": 1}
+
+
+def test_local_record_and_notify_of_same_event_count_once(stats, clock):
+    stats.record_events([event(clock, deductions=["no helmet"])], [7])
+    stats.on_notify(message(clock, 7, deductions=["no helmet"]))
+    stats.on_notify(message(clock, 7, deductions=["no helmet"]))
+    assert counts(stats) == {"1m": 1, "5m": 1}
+    assert stats.query()["1m"]["all"]["top_deductions"] == [{"deduction": "no helmet", "occurrences": 1}]
+    assert stats.stats()["duplicates"] == 2
+
+
+def test_notify_from_other_process_is_merged_by_dimension(stats, clock):
+    stats.record_events([event(clock, camera_id=1, deductions=["no helmet"])], [1])
+    stats.on_notify(message(clock, 2, camera_id=3, deductions=["no helmet", "no vest"]))
+    top = stats.query()["1m"]["all"]["top_deductions"]
+    assert top == [{"deduction": "no helmet", "occurrences": 2}, {"deduction": "no vest", "occurrences": 1}]
+    assert counts(stats, camera_id=3) == {"1m": 1, "5m": 1}
+    assert counts(stats, equipment_type="helmet") == {"1m": 2, "5m": 2}
+    assert stats.stats()["notifications"] == 1
+
+
+def test_replayed_events_are_not_counted(stats, clock):
+    replayed = event(clock)
+    replayed["replayed"] = True
+    stats.record_events([replayed], [1])
+    assert counts(stats) == {"1m": 0, "5m": 0}
+
+
+def test_rehydrate_then_notify_overlap(monkeypatch, clock):
+    monkeypatch.setattr(live_stats, "time", clock)
+    stats = LiveStats(bucket_seconds=10, windows=WINDOWS)
+    now_bucket = int(clock.now // 10)
+
+    # 重建期间收到的事件先缓存: id 9 已包含在快照中，id 11 在快照之后
+    stats.on_notify(message(clock, 9))
+    stats.on_notify(message(clock, 11, camera_id=2))
+    assert counts(stats) == {"1m": 0, "5m": 0}
+    assert stats.stats()["pending"] == 2
+
+    cursor = FakeCursor(
+        count_rows=[(now_bucket, 1, "helmet", 40, 3, 2), (now_bucket - 12, 1, "helmet", 90, 1, 0)],
+        deduction_rows=[(now_bucket, 1, "helmet", "no helmet", 2)],
+        snapshot_ids=[7, 9, 10],
+    )
+    stats.rehydrate(cursor)
+    assert cursor.executed[0][0] == "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+    assert all("max_id" not in sql for sql, _ in cursor.executed) # 按 event_time 窗口统计，不按 id 截断
+    assert stats.ready
+    assert stats.stats()["rehydrated"] == 4
+    # id 9 已包含在快照中，只计入缓存的 id 11
+    assert counts(stats) == {"1m": 4, "5m": 5}
+    assert stats.query()["1m"]["all"]["abnormal"] == 3
+    assert stats.query()["1m"]["all"]["top_deductions"] == [{"deduction": "no helmet", "occurrences": 2}]
+
+    # 快照中的 id 不再计入；id 8 在快照之后才提交 (比快照中的 id 小)，仍然计入
+    stats.on_notify(message(clock, 10))
+    stats.on_notify(message(clock, 11, camera_id=2))
+    stats.on_notify(message(clock, 12))
+    stats.on_notify(message(clock, 8))
+    assert counts(stats) == {"1m": 6, "5m": 7}
+    assert counts(stats, camera_id=2) == {"1m": 1, "5m": 1}
+
+
+def test_query_rerenders_only_changed_dimensions(stats, clock):
+    stats.record_events([event(clock, camera_id=1), event(clock, camera_id=2)], [1, 2])
+    first = stats.query()["1m"]
+    stats.record_events([event(clock, camera_id=2, deductions=["no helmet"])], [3])
+    second = stats.query()["1m"]
+    assert second["cameras"]["1"] is first["cameras"]["1"] # 未变化的维度沿用已渲染的结果
+    assert second["cameras"]["2"]["count"] == 2 and first["cameras"]["2"]["count"] == 1
+    assert second["all"]["top_deductions"] == [{"deduction": "no helmet", "occurrences": 1}]
+    assert stats.query(top=0)["1m"]["all"]["top_deductions"] == []
+
+    clock.advance(60)
+    assert stats.query()["1m"] == {"all": {"count": 0, "abnormal": 0, "score_histogram": {}, "top_deductions": []},
+                                  "cameras": {}, "equipment_types": {}}
+    assert stats.query()["5m"]["cameras"]["2"]["count"] == 2
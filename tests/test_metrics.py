@@ -0,0 +1,79 @@
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry, flatten_stats, statement_label
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0, 0.5))
+    for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+        histogram.observe(value, route="/a")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP latency_seconds Latency", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2', # 上界包含等于边界的值
+        'latency_seconds_bucket{route="/a",le="0.5"} 3',
+        'latency_seconds_bucket{route="/a",le="1"} 4',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 5',
+        'latency_seconds_sum{route="/a"} 3.15',
+        'latency_seconds_count{route="/a"} 5',
+    ]
+
+
+def test_histogram_without_labels():
+    histogram = Histogram("acquire_seconds", "Acquire", buckets=(1.0,))
+    histogram.observe(3)
+    assert histogram.render()[2:] == [
+        'acquire_seconds_bucket{le="1"} 0', 'acquire_seconds_bucket{le="+Inf"} 1',
+        'acquire_seconds_sum 3', 'acquire_seconds_count 1']
+
+
+def test_label_values_are_escaped():
+    counter = Counter("requests_total", "Requests", ("route",))
+    counter.inc(route='/a"b\\c\nd')
+    assert counter.render()[2] == 'requests_total{route="/a\\"b\\\\c\\nd"} 1'
+
+
+def test_counter_and_gauge_render_sorted_series():
+    counter = Counter("requests_total", "Requests", ("method", "status"))
+    counter.inc(method="POST", status="201")
+    counter.inc(2, method="GET", status="200")
+    assert counter.render()[2:] == ['requests_total{method="GET",status="200"} 2',
+                                    'requests_total{method="POST",status="201"} 1']
+    gauge = Gauge("in_flight", "In flight")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.render()[2:] == ["in_flight 1"]
+
+
+def test_registry_renders_metrics_and_collectors():
+    registry = Registry()
+    registry.register(Gauge("in_flight", "In flight")).set(2.5)
+    registry.add_collector(lambda: flatten_stats("db_pool", {"size": 4, "ready": True, "dsn": "x", "lag": None}))
+    registry.add_collector(lambda: 1 / 0) # 采集失败不影响其他指标
+    text = registry.render()
+    assert text.endswith("\n")
+    assert text.splitlines() == [
+        "# HELP in_flight In flight", "# TYPE in_flight gauge", "in_flight 2.5",
+        "# HELP db_pool_size db pool: size", "# TYPE db_pool_size gauge", "db_pool_size 4"]
+
+
+def test_statement_labels():
+    assert statement_label("SELECT * FROM events e JOIN cameras c ON c.id = e.camera_id") == "select events"
+    assert statement_label('  insert into "event_images" (id) values (1)') == "insert event_images"
+    assert statement_label("WITH recent AS (SELECT now() - interval '1 hour' AS since) "
+                           "UPDATE cameras SET status = 'offline'") == "update cameras"
+    assert statement_label("EXECUTE find_event (%s)") == "execute find_event"
+    assert statement_label(b"COPY events FROM STDIN") == "copy events"
+    assert statement_label("SELECT 1") == "select"
+    assert statement_label("") == "empty"
+
+
+def test_statement_label_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(metrics, "_statement_labels", {})
+    monkeypatch.setattr(metrics, "_STATEMENT_LABEL_CACHE", 2)
+    for i in range(5):
+        assert statement_label(f"SELECT * FROM events WHERE id = {i}") == "select events"
+    assert list(metrics._statement_labels) == ["SELECT * FROM events WHERE id = 0",
+                                               "SELECT * FROM events WHERE id = 1"]
+    metrics._statement_labels["SELECT * FROM events WHERE id = 0"] = "cached"
+    assert statement_label("SELECT * FROM events WHERE id = 0") == "cached"
@@ -0,0 +1,119 @@
+import pytest
+
+import migrate
+from migrate import NO_TRANSACTION_MARKER, Migration, MigrationError, load_migrations, split_statements
+
+
+def test_statements_are_split_on_line_ending_semicolons():
+    text = f"""{NO_TRANSACTION_MARKER}
+-- 分区上的索引
+CREATE INDEX CONCURRENTLY IF NOT EXISTS events_time_idx
+    ON events (event_time DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS images_event_idx ON event_images (event_id, "timestamp");
+;
+ANALYZE events"""
+    assert split_statements(text) == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS events_time_idx\n    ON events (event_time DESC);",
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS images_event_idx ON event_images (event_id, "timestamp");',
+        "ANALYZE events",
+    ]
+
+
+def test_semicolons_inside_dollar_quotes_do_not_end_the_statement():
+    body = """DO $$
+BEGIN
+    PERFORM 1;
+    RAISE NOTICE 'done $tag$';
+END
+$$;"""
+    function = """CREATE FUNCTION touch() RETURNS trigger AS $fn$
+BEGIN
+    NEW.updated_at := now(); RETURN NEW;
+END;
+$fn$ LANGUAGE plpgsql;"""
+    assert split_statements("\n".join([body, function, "SELECT 1;"])) == [body, function, "SELECT 1;"]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit = False
+        self.executed = [] # (sql, autocommit)
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, self.autocommit))
+
+
+def write(directory, filename, text):
+    path = directory / filename
+    path.write_text(text)
+    return path
+
+
+def test_concurrently_migration_runs_each_statement_outside_a_transaction(tmp_path):
+    text = f"{NO_TRANSACTION_MARKER}\nCREATE INDEX CONCURRENTLY a_idx ON a (x);\nCREATE INDEX CONCURRENTLY b_idx ON b (y);\n"
+    conn = FakeConnection()
+    Migration("0003", "indexes", str(write(tmp_path, "0003_indexes.sql", text))).apply(conn)
+    assert conn.executed == [("CREATE INDEX CONCURRENTLY a_idx ON a (x);", True),
+                             ("CREATE INDEX CONCURRENTLY b_idx ON b (y);", True)]
+    assert conn.autocommit is False
+
+
+def test_sql_migration_runs_in_one_transaction(tmp_path):
+    text = "CREATE TABLE a (x int);\nCREATE TABLE b (y int);\n"
+    conn = FakeConnection()
+    Migration("0001", "base", str(write(tmp_path, "0001_base.sql", text))).apply(conn)
+    assert conn.executed == [(text, False)]
+
+
+def test_migrations_are_loaded_in_version_order(tmp_path):
+    for filename in ("0010_later.sql", "0002_second.py", "0001_first.sql", "_helpers.py", ".keep"):
+        write(tmp_path, filename, "")
+    (tmp_path / "__pycache__").mkdir()
+    assert [(m.version, m.name, m.kind) for m in load_migrations(str(tmp_path))] == [
+        ("0001", "first", "sql"), ("0002", "second", "py"), ("0010", "later", "sql")]
+
+
+@pytest.mark.parametrize("filenames", [("0001_a.sql", "0001_b.sql"), ("1_base.sql",), ("0001_Base.sql",)])
+def test_invalid_migration_directories_are_rejected(tmp_path, filenames):
+    for filename in filenames:
+        write(tmp_path, filename, "")
+    with pytest.raises(MigrationError):
+        load_migrations(str(tmp_path))
+
+
+class MigrateConnection(FakeConnection):
+    """schema_migrations 中已有 applied 中的版本"""
+    def __init__(self, applied):
+        super().__init__()
+        self.applied = dict(applied)
+        self.recorded = []
+
+    def execute(self, sql, params=None):
+        super().execute(sql, params)
+        if sql.startswith("INSERT INTO schema_migrations"):
+            self.recorded.append(params[0])
+
+    def fetchall(self):
+        return list(self.applied.items())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_migrate_applies_pending_versions_up_to_target(tmp_path, monkeypatch):
+    for filename in ("0001_first.sql", "0002_second.sql", "0003_third.sql", "0004_fourth.sql"):
+        write(tmp_path, filename, f"SELECT '{filename}';")
+    migrations = load_migrations(str(tmp_path))
+    monkeypatch.setattr(migrate, "load_migrations", lambda: migrations)
+    conn = MigrateConnection({"0001": migrations[0].checksum})
+
+    assert migrate.migrate(conn, target="0003") == ["0002", "0003"]
+    assert conn.recorded == ["0002", "0003"]
+    assert conn.executed[-1][0] == "SELECT pg_advisory_unlock(%s)"
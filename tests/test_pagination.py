@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+
+from pagination import (
+    InvalidCursorError, decode_cursor, decode_position, encode_cursor, encode_position, estimate_count
+)
+
+
+def test_cursor_round_trip():
+    event_time = datetime(2024, 5, 1, 12, 30, 0, 123456)
+    token = encode_cursor(event_time, 42)
+    assert "=" not in token
+    assert decode_cursor(token) == (event_time, 42)
+
+
+def test_cursor_is_url_safe():
+    token = encode_cursor(datetime(2024, 5, 1), 2 ** 40)
+    assert all(c.isalnum() or c in "-_" for c in token)
+
+
+@pytest.mark.parametrize("token", ["", "not-base64!", "bnVsbA", encode_position("x", 1), encode_position(1, 2, 3)])
+def test_invalid_cursor(token):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token)
+
+
+def test_position_round_trip():
+    event_time = datetime(2024, 1, 31, 23, 59, 59)
+    assert decode_position(encode_position(event_time, 7, 0)) == (event_time, 7, 0)
+    with pytest.raises(InvalidCursorError):
+        decode_position(encode_cursor(event_time, 7))
+
+
+class _ExplainCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def execute(self, sql, params):
+        self.sql = sql
+
+    def fetchone(self):
+        return self.row
+
+
+@pytest.mark.parametrize("row", [
+    ([{"Plan": {"Plan Rows": 1234}}],),
+    {"QUERY PLAN": '[{"Plan": {"Plan Rows": 1234}}]'},
+])
+def test_estimate_count_reads_plan_rows(row):
+    cursor = _ExplainCursor(row)
+    assert estimate_count(cursor, "FROM events WHERE risk_type = %s", ("abnormal",)) == 1234
+    assert cursor.sql.startswith("EXPLAIN (FORMAT JSON) SELECT 1 FROM events")
@@ -0,0 +1,79 @@
+from datetime import date, datetime
+
+import pytest
+
+import partitions
+from partitions import add_months, month_start, parse_month, parse_partition_month, partition_name
+
+
+@pytest.mark.parametrize("month, n, expected", [
+    (date(2024, 1, 1), 1, date(2024, 2, 1)),
+    (date(2024, 11, 1), 2, date(2025, 1, 1)),
+    (date(2024, 12, 1), 1, date(2025, 1, 1)),
+    (date(2024, 1, 1), -1, date(2023, 12, 1)),
+    (date(2024, 3, 1), -15, date(2022, 12, 1)),
+    (date(2024, 5, 1), 0, date(2024, 5, 1)),
+])
+def test_add_months(month, n, expected):
+    assert add_months(month, n) == expected
+
+
+def test_month_start():
+    assert month_start(datetime(2024, 2, 29, 23, 59, 59)) == date(2024, 2, 1)
+
+
+def test_partition_name_round_trip():
+    name = partition_name("event_images", date(2024, 3, 1))
+    assert name == "event_images_p2024_03"
+    assert parse_partition_month("event_images", name) == date(2024, 3, 1)
+    # events 的前缀不能匹配 event_images 的分区，default 分区不是月度分区
+    assert parse_partition_month("events", "events_default") is None
+    assert parse_partition_month("events", "event_images_p2024_03") is None
+
+
+def test_parse_month():
+    assert parse_month("2023-05") == date(2023, 5, 1)
+    with pytest.raises(ValueError):
+        parse_month("2023-13")
+
+
+class CatalogCursor:
+    """模拟 ensure_partitions 使用的系统目录查询: 两张表都已分区，default 分区中没有数据"""
+    def __init__(self, existing=()):
+        self.tables = set(existing)
+        self.created = []
+        self._result = None
+
+    def execute(self, sql, params=None):
+        if "relkind" in sql:
+            self._result = ("p",)
+        elif "to_regclass(%s) IS NOT NULL" in sql:
+            self._result = (params[0] in self.tables,)
+        elif sql.startswith("SELECT EXISTS"):
+            self._result = (False,)
+        elif sql.startswith("CREATE TABLE"):
+            self.created.append((sql.split()[2], params))
+            self.tables.add(sql.split()[2])
+
+    def fetchone(self):
+        return self._result
+
+
+def test_ensure_partitions_creates_month_ranges(monkeypatch):
+    monkeypatch.setattr(partitions, "datetime", type("FixedDatetime", (datetime,), {
+        "utcnow": classmethod(lambda cls: datetime(2024, 11, 20)),
+    }))
+    cursor = CatalogCursor(existing={"events_p2024_11"})
+    created = partitions.ensure_partitions(cursor, months_ahead=2, since=datetime(2024, 10, 3))
+
+    assert created == [
+        "events_p2024_10", "events_p2024_12", "events_p2025_01",
+        "event_images_p2024_10", "event_images_p2024_11", "event_images_p2024_12", "event_images_p2025_01",
+    ]
+    assert ("event_images_p2024_12", ("2024-12-01", "2025-01-01")) in cursor.created
+    assert ("events_p2025_01", ("2025-01-01", "2025-02-01")) in cursor.created
+
+
+def test_images_are_partitioned_like_events():
+    # 图片与所属事件落在同一个月的分区 (按 event_id, event_time 关联时两边都能裁剪)
+    assert partitions.PARTITION_KEYS == {"events": "event_time", "event_images": "event_time"}
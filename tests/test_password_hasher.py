@@ -0,0 +1,76 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from password_hasher import HashPoolBusyError, PasswordHasher
+
+
+def failing(*args):
+    raise RuntimeError("bcrypt failed")
+
+
+def test_slot_is_released_when_hashing_raises():
+    hasher = PasswordHasher(workers=0, max_concurrency=1, queue_timeout=0)
+    for _ in range(2): # 第二次调用能取得槽位，说明第一次的槽位已释放
+        with pytest.raises(RuntimeError):
+            hasher._run("checks", failing)
+    assert hasher.stats()["in_flight"] == 0
+
+
+def test_busy_when_no_slot_is_free():
+    hasher = PasswordHasher(workers=0, max_concurrency=1, queue_timeout=0)
+    hasher._slots.acquire()
+    with pytest.raises(HashPoolBusyError):
+        hasher._run("checks", abs, -1)
+    assert hasher.stats()["rejected"] == 1
+
+
+class BrokenExecutor:
+    """模拟子进程被杀死后的进程池: submit 或 result 抛出 BrokenProcessPool"""
+    def __init__(self, broken_on_submit=True):
+        self.broken_on_submit = broken_on_submit
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        if self.broken_on_submit:
+            raise BrokenProcessPool("A child process terminated abruptly")
+        future = Future()
+        future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.mark.parametrize("broken_on_submit", [True, False])
+def test_broken_pool_is_rebuilt(monkeypatch, broken_on_submit):
+    monkeypatch.setattr(PasswordHasher, "_new_executor", lambda self: InlineExecutor())
+    hasher = PasswordHasher(workers=1, max_concurrency=1, queue_timeout=0)
+    broken = hasher._executor = BrokenExecutor(broken_on_submit)
+
+    with pytest.raises(HashPoolBusyError):
+        hasher._run("checks", abs, -3)
+    assert broken.shut_down and isinstance(hasher._executor, InlineExecutor)
+    assert hasher.stats()["in_flight"] == 0
+    assert hasher._run("checks", abs, -3) == 3
+
+
+def test_pool_uses_spawned_processes():
+    # 使用内置函数作为子进程中执行的函数 (spawn 需要能在子进程中按名称导入)
+    hasher = PasswordHasher(workers=1, max_concurrency=2, result_timeout=30)
+    try:
+        assert hasher._executor._mp_context.get_start_method() == "spawn"
+        assert hasher._run("checks", abs, -3) == 3
+        with pytest.raises(ValueError):
+            hasher._run("checks", int, "not a number")
+        assert hasher.stats()["in_flight"] == 0
+    finally:
+        hasher.shutdown()
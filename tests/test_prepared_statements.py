@@ -0,0 +1,168 @@
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+
+from prepared_statements import PreparedStatement, StatementRegistry
+
+
+class FakeConnection:
+    def __init__(self, in_transaction=False):
+        self.prepared_statements = set()
+        self.status = (psycopg2.extensions.TRANSACTION_STATUS_INTRANS if in_transaction
+                       else psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.stale_statements = set()
+        self.rollbacks = 0
+        self.lost = False # True: 服务器端的预编译语句已失效 (例如 DISCARD ALL)
+        self.plan_changed = False # True: 表结构已变化，服务器端的旧语句仍然存在但不能再执行
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        conn = self.connection
+        if sql.startswith("DEALLOCATE"):
+            conn.plan_changed = False
+        elif sql.startswith("PREPARE"):
+            if conn.plan_changed:
+                raise psycopg2.errors.DuplicatePreparedStatement("prepared statement already exists")
+            conn.lost = False
+        elif sql.startswith("EXECUTE") and conn.lost:
+            raise psycopg2.errors.InvalidSqlStatementName("prepared statement does not exist")
+        elif sql.startswith("EXECUTE") and conn.plan_changed:
+            raise psycopg2.errors.FeatureNotSupported("cached plan must not change result type")
+
+
+def test_placeholders_are_numbered():
+    statement = PreparedStatement("find_event", "SELECT * FROM events WHERE id = %s AND score > %s::numeric;\n")
+    assert statement.param_count == 2
+    assert statement.prepare_sql == "PREPARE find_event AS SELECT * FROM events WHERE id = $1 AND score > $2::numeric"
+    assert statement.execute_sql == "EXECUTE find_event (%s, %s)"
+
+
+def test_escaped_percent_is_not_a_placeholder():
+    statement = PreparedStatement("like_name", "SELECT id FROM cameras WHERE name LIKE 'cam%%' AND id > %s")
+    assert statement.param_count == 1
+    assert statement.prepare_sql == "PREPARE like_name AS SELECT id FROM cameras WHERE name LIKE 'cam%' AND id > $1"
+
+
+def test_statement_without_parameters():
+    statement = PreparedStatement("count_events", "SELECT count(*) FROM events")
+    assert statement.execute_sql == "EXECUTE count_events"
+
+
+def test_invalid_statement_name_is_rejected():
+    with pytest.raises(ValueError):
+        PreparedStatement("Drop Table", "SELECT 1")
+
+
+def test_statement_is_prepared_once_per_connection():
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    conn = FakeConnection()
+    cursor = FakeCursor(conn)
+    registry.execute(cursor, statement, (1,))
+    registry.execute(cursor, statement, (2,))
+    assert [sql for sql, _ in cursor.executed] == [statement.prepare_sql, statement.execute_sql, statement.execute_sql]
+    assert cursor.executed[2][1] == (2,)
+    assert registry.stats()["find_event"]["prepares"] == 1
+    assert registry.stats()["find_event"]["calls"] == 2
+
+
+def test_wrong_parameter_count_is_rejected():
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    with pytest.raises(ValueError):
+        registry.execute(FakeCursor(FakeConnection()), statement, (1, 2))
+
+
+def test_lost_statement_is_reprepared_at_start_of_transaction():
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    conn = FakeConnection()
+    conn.prepared_statements.add("find_event")
+    conn.lost = True
+    cursor = FakeCursor(conn)
+    registry.execute(cursor, statement, (1,))
+    assert [sql for sql, _ in cursor.executed] == [statement.execute_sql, statement.prepare_sql, statement.execute_sql]
+    assert conn.rollbacks == 1
+    assert conn.prepared_statements == {"find_event"}
+    assert registry.stats()["find_event"]["reprepares"] == 1
+
+
+def test_lost_statement_inside_transaction_is_raised():
+    # 事务中已经执行过其他语句时不能回滚重试: 抛出错误，下一次使用该连接时重新 PREPARE
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    conn = FakeConnection(in_transaction=True)
+    conn.prepared_statements.add("find_event")
+    conn.lost = True
+    with pytest.raises(psycopg2.errors.InvalidSqlStatementName):
+        registry.execute(FakeCursor(conn), statement, (1,))
+    assert conn.rollbacks == 0
+    assert conn.prepared_statements == set()
+
+
+def test_stale_plan_is_deallocated_and_reprepared_at_start_of_transaction():
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    conn = FakeConnection()
+    conn.prepared_statements.add("find_event")
+    conn.plan_changed = True
+    cursor = FakeCursor(conn)
+    registry.execute(cursor, statement, (1,))
+    assert [sql for sql, _ in cursor.executed] == [
+        statement.execute_sql, "DEALLOCATE find_event", statement.prepare_sql, statement.execute_sql]
+    assert conn.rollbacks == 1
+    assert (conn.prepared_statements, conn.stale_statements) == ({"find_event"}, set())
+
+
+def test_stale_plan_inside_transaction_is_deallocated_on_next_use():
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    conn = FakeConnection(in_transaction=True)
+    conn.prepared_statements.add("find_event")
+    conn.plan_changed = True
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        registry.execute(FakeCursor(conn), statement, (1,))
+    assert (conn.prepared_statements, conn.stale_statements) == (set(), {"find_event"})
+
+    conn.rollback() # 归还连接池时回滚
+    cursor = FakeCursor(conn)
+    registry.execute(cursor, statement, (2,))
+    assert [sql for sql, _ in cursor.executed] == ["DEALLOCATE find_event", statement.prepare_sql, statement.execute_sql]
+    assert conn.stale_statements == set()
+
+
+def test_other_feature_not_supported_errors_are_raised():
+    registry = StatementRegistry(enabled=True)
+    statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+    conn = FakeConnection()
+    cursor = FakeCursor(conn)
+
+    def execute(sql, params=None):
+        raise psycopg2.errors.FeatureNotSupported("unsupported feature")
+
+    cursor.execute = execute
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        registry.execute(cursor, statement, (1,))
+    assert conn.rollbacks == 0 and conn.stale_statements == set()
+
+
+def test_plain_sql_when_disabled_or_not_pooled():
+    for registry, conn in ((StatementRegistry(enabled=False), FakeConnection()),
+                           (StatementRegistry(enabled=True), object())):
+        statement = registry.register("find_event", "SELECT * FROM events WHERE id = %s")
+        cursor = FakeCursor(conn)
+        registry.execute(cursor, statement, (1,))
+        assert cursor.executed == [(statement.sql, (1,))]
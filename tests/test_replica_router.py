@@ -0,0 +1,117 @@
+import time
+
+import jwt
+import psycopg2
+import pytest
+
+import replica_router
+from replica_router import ReplicaRouter
+
+
+class FakeConnection:
+    def __init__(self, replica):
+        self.replica = replica
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return (self.replica.lag_value,)
+
+    def close(self):
+        self.replica.returned += 1
+
+
+class FakePool:
+    """副本的连接池: lag_value 为 LAG_SQL 的结果 (None 表示 WAL receiver 未连接)，reachable=False 时连接失败"""
+    def __init__(self, lag_value=0.0):
+        self.lag_value = lag_value
+        self.reachable = True
+        self.returned = 0
+
+    def getconn(self):
+        if not self.reachable:
+            raise psycopg2.OperationalError("could not connect to server: Connection timed out")
+        return FakeConnection(self)
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def router(monkeypatch, clock):
+    monkeypatch.setattr(replica_router, "time", clock)
+    router = ReplicaRouter(["host=replica1 dbname=app"], max_lag=5.0, check_interval=2.0, read_after_write_window=10)
+    router.replicas[0].pool = FakePool()
+    return router
+
+
+def test_replica_within_max_lag_serves_reads(router):
+    router.replicas[0].pool.lag_value = 4.9
+    conn = router.getconn()
+    assert isinstance(conn, FakeConnection)
+    assert router.stats()["reads"] == {"primary": 0, "replica1:5432/app": 1}
+
+
+def test_lagging_replica_falls_back_to_primary(router, clock):
+    router.replicas[0].pool.lag_value = 5.1
+    assert router.getconn() is None
+    assert router.stats()["fallback_lag"] == 1
+    # 下一次检查之前沿用上一次的结果
+    router.replicas[0].pool.lag_value = 0.0
+    assert router.getconn() is None
+    clock.advance(2.0)
+    assert router.getconn() is not None
+
+
+def test_replica_without_wal_receiver_is_unhealthy(router):
+    router.replicas[0].pool.lag_value = None
+    assert router.getconn() is None
+    stats = router.stats()
+    assert (stats["no_wal_receiver"], stats["fallback_error"]) == (1, 1)
+    assert stats["replicas"][0]["available"] is False
+
+
+def test_unreachable_replica_falls_back_to_primary(router, clock):
+    router.replicas[0].pool.reachable = False
+    assert router.getconn() is None
+    stats = router.stats()
+    assert (stats["lag_check_errors"], stats["fallback_error"]) == (1, 1)
+    assert stats["replicas"][0]["lag"] is None
+    router.replicas[0].pool.reachable = True
+    clock.advance(2.0)
+    assert router.getconn() is not None
+
+
+def test_recent_writer_and_forced_reads_use_primary(router):
+    router.mark_write(7)
+    assert router.getconn(sticky_key=7) is None
+    assert router.getconn(sticky_key=8) is not None
+    assert router.getconn(force_primary=True) is None
+    assert router.stats()["sticky_primary"] == 2
+
+
+def test_write_marks_client_to_read_primary_in_every_worker(monkeypatch):
+    api = pytest.importorskip("api")
+    marked = []
+    monkeypatch.setattr(api, "get_replica_router", lambda: object())
+    monkeypatch.setattr(api, "mark_user_write", marked.append)
+    app = api.create_app()
+    client = app.test_client()
+    token = jwt.encode({"user_id": 7, "exp": int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm="HS256")
+
+    response = client.post('/api/auth/logout', headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert marked == [7]
+    until = response.headers[api.READ_PRIMARY_HEADER]
+    assert float(until) > time.time()
+    assert f"{api.READ_PRIMARY_COOKIE}={until}" in response.headers["Set-Cookie"]
+
+    with app.test_request_context(headers={api.READ_PRIMARY_HEADER: until}):
+        assert api.read_primary_requested()
+    with app.test_request_context(headers={api.READ_PRIMARY_HEADER: str(int(time.time()) - 1)}):
+        assert not api.read_primary_requested()
+    assert client.get('/').headers.get(api.READ_PRIMARY_HEADER) is None
@@ -0,0 +1,219 @@
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+import jwt
+import pytest
+
+import report_engine
+from report_engine import build_summary, report_period, score_bucket
+
+
+# GROUPING(equipment_type, camera_id, score_bucket, bucket_start) 中各列的位
+GROUPING_BITS = {"equipment_type": 8, "camera_id": 4, "score_bucket": 2, "bucket_start": 1}
+GROUPING_SETS = [(), ("equipment_type",), ("camera_id",), ("score_bucket",), ("bucket_start",)]
+
+# 天级汇总表的行: (bucket_start, camera_id, equipment_type, risk_type, score_bucket, event_count, score_sum, image_count)
+DAILY_ROWS = [
+    (datetime(2024, 5, 1), 1, "helmet", "abnormal", 40, 3, 120.0, 9),
+    (datetime(2024, 5, 1), 1, "helmet", "normal", 90, 2, 190.0, 2),
+    (datetime(2024, 5, 2), 2, "harness", "abnormal", 40, 1, 45.0, 5),
+    (datetime(2024, 5, 2), 2, "helmet", "normal", 100, 4, 400.0, 4),
+]
+
+
+def grouping_sets_rows(rows):
+    """模拟 build_summary 中的 GROUPING SETS 查询 (每个分组集合都包含 risk_type)"""
+    columns = ("bucket_start", "camera_id", "equipment_type", "risk_type", "score_bucket")
+    result = []
+    for grouping_set in GROUPING_SETS:
+        grp = sum(bit for column, bit in GROUPING_BITS.items() if column not in grouping_set)
+        groups = defaultdict(lambda: [0, 0.0, 0])
+        for row in rows:
+            values = dict(zip(columns, row))
+            key = tuple(values[c] if c in grouping_set else None for c in GROUPING_BITS) + (values["risk_type"],)
+            groups[key][0] += row[5]
+            groups[key][1] += row[6]
+            groups[key][2] += row[7]
+        result.extend((grp,) + key + tuple(totals) for key, totals in groups.items())
+    return result
+
+
+class FakeCursor:
+    def __init__(self, event_rows, deduction_rows):
+        self.results = [event_rows, deduction_rows]
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+def test_build_summary_decodes_grouping_bits():
+    cursor = FakeCursor(grouping_sets_rows(DAILY_ROWS), [("no helmet", 5), ("no harness", 1)])
+    summary = build_summary(cursor, "monthly", date(2024, 5, 15))
+
+    assert summary["period"] == {"type": "monthly", "start": "2024-05-01", "end": "2024-06-01",
+                                 "year": 2024, "month": 5}
+    assert (summary["total_events"], summary["abnormal_events"], summary["normal_events"]) == (10, 4, 6)
+    assert summary["average_score"] == 75.5
+    assert summary["image_count"] == 20
+    assert summary["by_equipment_type"] == [
+        {"equipment_type": "helmet", "total": 9, "abnormal": 3},
+        {"equipment_type": "harness", "total": 1, "abnormal": 1},
+    ]
+    assert summary["by_camera"] == [
+        {"camera_id": 1, "total": 5, "abnormal": 3},
+        {"camera_id": 2, "total": 5, "abnormal": 1},
+    ]
+    assert summary["score_distribution"] == [
+        {"bucket": 40, "total": 4, "abnormal": 4},
+        {"bucket": 90, "total": 2, "abnormal": 0},
+        {"bucket": 100, "total": 4, "abnormal": 0},
+    ]
+    assert summary["daily_trend"] == [
+        {"date": "2024-05-01", "total": 5, "abnormal": 3},
+        {"date": "2024-05-02", "total": 5, "abnormal": 1},
+    ]
+    assert summary["top_deductions"] == [{"deduction": "no helmet", "count": 5},
+                                         {"deduction": "no harness", "count": 1}]
+    assert cursor.executed[0][1] == (date(2024, 5, 1), date(2024, 6, 1))
+
+
+def test_build_summary_accepts_dict_rows():
+    names = ("grp", "equipment_type", "camera_id", "score_bucket", "bucket_start", "risk_type",
+             "event_count", "score_sum", "image_count")
+    rows = [dict(zip(names, row)) for row in grouping_sets_rows(DAILY_ROWS)]
+    cursor = FakeCursor(rows, [{"deduction": "no helmet", "occurrences": 5}])
+    summary = build_summary(cursor, "weekly", date(2024, 5, 1))
+    assert summary["total_events"] == 10
+    assert summary["top_deductions"] == [{"deduction": "no helmet", "count": 5}]
+
+
+def test_build_summary_without_rollups():
+    assert build_summary(FakeCursor([], []), "monthly", date(2024, 5, 1)) is None
+
+
+@pytest.mark.parametrize("report_type, day, expected", [
+    ("monthly", date(2024, 2, 29), (date(2024, 2, 1), date(2024, 3, 1))),
+    ("monthly", date(2024, 12, 31), (date(2024, 12, 1), date(2025, 1, 1))),
+    ("weekly", date(2024, 5, 1), (date(2024, 4, 29), date(2024, 5, 6))), # 周三 -> 周一开始
+])
+def test_report_period(report_type, day, expected):
+    assert report_period(report_type, day) == expected
+
+
+def test_report_period_rejects_unknown_type():
+    with pytest.raises(ValueError):
+        report_period("yearly", date(2024, 1, 1))
+
+
+@pytest.mark.parametrize("score, bucket", [(0, 0), (9.99, 0), (10, 10), (85.5, 80), (100, 100)])
+def test_score_bucket(score, bucket):
+    assert score_bucket(score) == bucket
+
+
+def test_record_events_appends_hourly_deltas(monkeypatch):
+    calls = []
+    monkeypatch.setattr(report_engine, "execute_values", lambda cursor, sql, rows: calls.append((sql, rows)))
+    monkeypatch.setattr(report_engine, "ROLLUPS_ENABLED", True)
+    event = {"event_time": datetime(2024, 5, 1, 10, 30), "camera_id": None, "equipment_type": "helmet",
+             "risk_type": "abnormal", "score": 45, "images": [{}, {}], "deductions": ["no helmet"]}
+    report_engine.record_events(None, [event, dict(event, score=47), dict(event, event_time=datetime(2024, 5, 1, 11, 5))])
+
+    (events_sql, event_rows), (deductions_sql, deduction_rows) = calls
+    assert "INSERT INTO event_rollup_delta" in events_sql and "ON CONFLICT" not in events_sql
+    assert "INSERT INTO deduction_rollup_delta" in deductions_sql and "ON CONFLICT" not in deductions_sql
+    assert sorted(event_rows) == [
+        (datetime(2024, 5, 1, 10), 0, "helmet", "abnormal", 40, 2, 92.0, 4),
+        (datetime(2024, 5, 1, 11), 0, "helmet", "abnormal", 40, 1, 45.0, 2),
+    ]
+    assert sorted(deduction_rows) == [
+        (datetime(2024, 5, 1, 10), 0, "helmet", "abnormal", "no helmet", 2),
+        (datetime(2024, 5, 1, 11), 0, "helmet", "abnormal", "no helmet", 1),
+    ]
+
+
+class LockCursor:
+    def __init__(self, locked):
+        self.locked = locked
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+    def fetchone(self):
+        return (self.locked,)
+
+
+def test_fold_deltas_runs_only_with_the_advisory_lock():
+    cursor = LockCursor(locked=False)
+    assert report_engine.fold_deltas(cursor) is False
+    assert len(cursor.executed) == 1
+
+    cursor = LockCursor(locked=True)
+    assert report_engine.fold_deltas(cursor) is True
+    assert cursor.executed[1:] == [report_engine.FOLD_EVENT_DELTAS_SQL, report_engine.FOLD_DEDUCTION_DELTAS_SQL]
+
+
+def test_fold_sql_moves_deltas_into_both_rollups():
+    for sql, table in ((report_engine.FOLD_EVENT_DELTAS_SQL, "event"),
+                       (report_engine.FOLD_DEDUCTION_DELTAS_SQL, "deduction")):
+        assert f"DELETE FROM {table}_rollup_delta" in sql
+        assert f"INSERT INTO {table}_rollup_hourly" in sql
+        assert f"INSERT INTO {table}_rollup_daily" in sql
+        assert "date_trunc('day', bucket_start)" in sql
+
+
+STORED_SUMMARY = {"total_events": 3, "by_category": [{"name": "helmet", "count": 3}]}
+
+
+class ReportConnection:
+    def __init__(self, stored):
+        self.stored = stored
+
+    def cursor(self, cursor_factory=None):
+        return self
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return {"summary_data": dict(self.stored)} if self.stored else None
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def report_client(monkeypatch):
+    api = pytest.importorskip("api")
+    app = api.create_app()
+
+    def client(stored, rollup):
+        monkeypatch.setattr(api, "get_db_connection", lambda **kwargs: ReportConnection(stored))
+        monkeypatch.setattr(api, "build_summary", lambda cursor, report_type, day: rollup)
+        return app.test_client()
+
+    client.token = jwt.encode({"user_id": 1, "exp": int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm="HS256")
+    return client
+
+
+def test_report_keeps_stored_summary_and_adds_rollup(report_client):
+    client = report_client(STORED_SUMMARY, {"total_events": 5})
+    response = client.get('/api/reports?type=monthly', headers={"Authorization": f"Bearer {report_client.token}"})
+    assert response.status_code == 200
+    assert response.get_json() == dict(STORED_SUMMARY, success=True, report_type="monthly",
+                                       rollup_summary={"total_events": 5})
+
+
+def test_report_without_stored_summary(report_client):
+    headers = {"Authorization": f"Bearer {report_client.token}"}
+    response = report_client(None, {"total_events": 5}).get('/api/reports?type=weekly', headers=headers)
+    assert response.get_json() == {"success": True, "report_type": "weekly", "rollup_summary": {"total_events": 5}}
+    assert report_client(None, None).get('/api/reports', headers=headers).status_code == 404
@@ -0,0 +1,118 @@
+import decimal
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import api
+from sql_json import ascii_json, float_sql_supports, json_datetime_sql, json_float_sql, json_int_sql, json_object_sql, \
+    json_string_sql, unsupported_float_columns
+
+
+STRINGS = ["helmet", "", 'quote " and \\ backslash', "tab\tnewline\n\x01\x7f", "ヘルメット未着用", "安全帯", "emoji 🦺"]
+
+
+@pytest.mark.parametrize("text", STRINGS)
+def test_ascii_json_matches_ensure_ascii(text):
+    assert ascii_json(json.dumps(text, ensure_ascii=False)) == json.dumps(text)
+
+
+def test_object_keys_are_sorted_and_quoted():
+    sql = json_object_sql({"b": "'1'", "a'": "'2'"})
+    assert sql.index('"a\'\'"') < sql.index('"b"')
+    assert json_object_sql({}) == "'{}'"
+
+
+def test_raw_json_body_matches_jsonify():
+    rows = [{"id": 1, "name": "カメラ 1", "status": "online"}, {"id": 2, "name": "gate", "status": None}]
+    body = {"success": True, "data": rows}
+    raw = ascii_json(json.dumps(rows, ensure_ascii=False, sort_keys=True, separators=(',', ':')))
+    with api.app.test_request_context("/"):
+        expected = api.jsonify(body).get_data()
+        assert api.raw_json_body(dict(body, data=api.RAW_JSON_MARKER), raw) == expected
+
+
+def test_float_sql_text():
+    assert json_float_sql("score") == (
+        "CASE WHEN score IS NULL THEN 'null' ELSE "
+        "CASE WHEN score = trunc(score) THEN trunc(score)::text || '.0' ELSE rtrim((score)::text, '0') END END"
+    )
+
+
+@pytest.mark.parametrize("column_type, supported", [
+    (("numeric", 5, 2), True),
+    (("numeric", 15, 4), True),
+    (("numeric", 16, 2), False), # float 无法精确表示 16 位有效数字
+    (("numeric", 10, 6), False), # 0.000001 在 Python 中为 1e-06
+    (("numeric", None, None), False), # 不限精度
+    (("double precision", 53, None), False),
+])
+def test_float_sql_supported_column_types(column_type, supported):
+    assert float_sql_supports(*column_type) is supported
+
+
+class ColumnTypeCursor:
+    def __init__(self, types):
+        self.types = types # {(表名, 列名): (data_type, precision, scale)}
+        self.row = None
+
+    def execute(self, sql, params=None):
+        self.row = self.types.get(params)
+
+    def fetchone(self):
+        return self.row
+
+
+def test_unsupported_float_columns_are_reported():
+    cursor = ColumnTypeCursor({("events", "score"): ("numeric", 5, 2), ("events", "ratio"): ("numeric", None, None)})
+    assert unsupported_float_columns(cursor, [("events", "score")]) == []
+    assert unsupported_float_columns(cursor, [("events", "ratio"), ("events", "missing")]) == [
+        "events.ratio numeric", "events.missing (不存在)"]
+
+
+def test_db_rendering_requires_checked_column_types(monkeypatch):
+    monkeypatch.setattr(api, "DB_JSON_RENDERING", True)
+    with api.app.test_request_context("/"):
+        monkeypatch.setattr(api, "_db_json_types_ok", False)
+        assert not api.use_db_json()
+        monkeypatch.setattr(api, "_db_json_types_ok", True)
+        assert api.use_db_json()
+
+
+# --- 数据库端渲染与 jsonify 逐字节一致 (需要 PostgreSQL: TEST_DATABASE_URL) ---
+
+ROWS = [
+    (1, "helmet", decimal.Decimal("85.50"), datetime(2024, 5, 1, 12, 0, 0)),
+    (2, 'ヘルメット "未着用"\n', decimal.Decimal("100.00"), datetime(2024, 5, 1, 12, 0, 0, 5)),
+    (3, None, decimal.Decimal("0.05"), datetime(2024, 12, 31, 23, 59, 59, 999999)),
+    (None, "🦺", None, None),
+]
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="需要 TEST_DATABASE_URL")
+def test_database_rendering_matches_jsonify():
+    import psycopg2
+
+    row_sql = json_object_sql({
+        "id": json_int_sql("id"),
+        "name": json_string_sql("name"),
+        "score": json_float_sql("score"),
+        "time": json_datetime_sql("t"),
+    })
+    conn = psycopg2.connect(os.environ["TEST_DATABASE_URL"])
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT '[' || string_agg({row_sql}, ',' ORDER BY n) || ']'
+            FROM unnest(%s::int[], %s::text[], %s::numeric(5, 2)[], %s::timestamp[]) WITH ORDINALITY
+                AS r(id, name, score, t, n)
+        """, [list(column) for column in zip(*ROWS)])
+        rendered = ascii_json(cursor.fetchone()[0])
+    finally:
+        conn.close()
+
+    rows = [{"id": i, "name": name, "score": score, "time": t} for i, name, score, t in ROWS]
+    with api.app.test_request_context("/"):
+        expected = api.jsonify(rows).get_data()
+    assert rendered.encode("ascii") == expected.rstrip(b"\n")
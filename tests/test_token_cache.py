@@ -0,0 +1,69 @@
+import pytest
+
+import token_cache
+from token_cache import VerifiedTokenCache
+
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(token_cache, "time", clock)
+    return VerifiedTokenCache(max_size=2, max_token_age=100)
+
+
+def claims(clock, user_id=1, ttl=60, issued_offset=0):
+    return {"user_id": user_id, "iat": clock.now + issued_offset, "exp": clock.now + ttl}
+
+
+def test_hit_until_token_expires(cache, clock):
+    cache.put("t1", claims(clock, ttl=60))
+    assert cache.get("t1")["user_id"] == 1
+    clock.advance(60)
+    assert cache.get("t1") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_claims_without_exp_are_not_cached(cache, clock):
+    cache.put("t1", {"user_id": 1})
+    assert cache.get("t1") is None
+
+
+def test_least_recently_used_token_is_evicted(cache, clock):
+    cache.put("t1", claims(clock, user_id=1))
+    cache.put("t2", claims(clock, user_id=2))
+    cache.get("t1")
+    cache.put("t3", claims(clock, user_id=3))
+    assert cache.get("t2") is None
+    assert cache.get("t1") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_revoke_user_drops_cached_and_older_tokens(cache, clock):
+    old = claims(clock, user_id=1)
+    cache.put("t1", old)
+    cache.put("t2", claims(clock, user_id=2))
+    clock.advance(1)
+    cache.revoke_user(1)
+    assert cache.get("t1") is None
+    assert cache.get("t2") is not None
+    assert cache.is_revoked(old)
+    cache.put("t1", old) # 吊销之前签发的 token 不会重新进入缓存
+    assert cache.get("t1") is None
+    clock.advance(1)
+    assert not cache.is_revoked(claims(clock, user_id=1))
+
+
+def test_tokens_without_iat_are_revoked(cache, clock):
+    cache.revoke_user(1)
+    assert cache.is_revoked({"user_id": 1, "exp": clock.now + 60})
+
+
+def test_old_revocations_are_pruned(cache, clock):
+    cache.revoke_user(1)
+    clock.advance(101)
+    cache.revoke_user(2)
+    assert cache.stats()["revoked_users"] == 1
+
+
+def test_raw_token_is_not_kept_in_memory(cache, clock):
+    cache.put("secret-token", claims(clock))
+    assert all(isinstance(key, bytes) and key != b"secret-token" for key in cache._entries)
@@ -0,0 +1,55 @@
+import pytest
+
+import ttl_cache
+from ttl_cache import TTLCache
+
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(ttl_cache, "time", clock)
+    return TTLCache(ttl=10, max_size=2)
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    stored_at = cache.set("a", 1)
+    assert cache.get_entry("a") == (1, stored_at)
+    clock.advance(9.9)
+    assert cache.get("a") == 1
+    clock.advance(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_per_entry_ttl(cache, clock):
+    cache.set("a", 1, ttl=1)
+    clock.advance(1)
+    assert cache.get("a", "missing") == "missing"
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a") # a 变为最近使用
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_get_or_load_calls_loader_only_on_miss(cache):
+    calls = []
+    loader = lambda: calls.append(1) or "value"
+    assert cache.get_or_load("k", loader)[0] == "value"
+    assert cache.get_or_load("k", loader)[0] == "value"
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_invalidate(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is None and cache.get("b") == 2
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
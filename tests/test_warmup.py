@@ -0,0 +1,76 @@
+import pytest
+
+from warmup import STATE_PENDING, STATE_READY, Warmup, WarmupStep
+
+
+class FlakyStep:
+    """前 failures 次调用抛出异常"""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("database is starting up")
+
+
+def test_steps_run_in_order_and_report_ready():
+    calls = []
+    warmup = Warmup([WarmupStep("a", lambda: calls.append("a")), WarmupStep("b", lambda: calls.append("b"))])
+    assert warmup.state == STATE_PENDING and not warmup.ready
+    warmup.run()
+    assert calls == ["a", "b"]
+    stats = warmup.stats()
+    assert stats["ready"] and stats["state"] == STATE_READY
+    assert list(stats["steps"]) == ["a", "b"]
+    assert stats["cold_start_seconds"] >= stats["warmup_seconds"] >= 0
+
+
+def test_required_step_is_retried_until_it_succeeds():
+    step = FlakyStep(failures=2)
+    after = []
+    warmup = Warmup([WarmupStep("db_pool", step), WarmupStep("cache", lambda: after.append(True))], retry_interval=0)
+    warmup.run()
+    assert warmup.ready
+    assert step.calls == 3
+    result = warmup.stats()["steps"]["db_pool"]
+    assert (result["attempts"], result["ok"], result["error"]) == (3, True, None)
+    assert after == [True]
+
+
+def test_optional_step_failure_does_not_block_readiness():
+    warmup = Warmup([WarmupStep("replicas", FlakyStep(failures=1), required=False)], retry_interval=0)
+    warmup.run()
+    assert warmup.ready
+    result = warmup.stats()["steps"]["replicas"]
+    assert (result["attempts"], result["ok"]) == (1, False)
+    assert result["error"] == "ConnectionError: database is starting up"
+
+
+def test_stop_ends_retries_without_becoming_ready():
+    warmup = Warmup([WarmupStep("db_pool", FlakyStep(failures=10 ** 6))], retry_interval=10)
+    warmup.start()
+    assert not warmup.wait(0.05)
+    warmup.stop()
+    warmup._thread.join(1)
+    assert not warmup._thread.is_alive()
+    stats = warmup.stats()
+    assert not stats["ready"] and stats["cold_start_seconds"] is None
+
+
+def test_readiness_endpoint_follows_warmup(monkeypatch):
+    api = pytest.importorskip("api")
+    step = FlakyStep(failures=1)
+    warmup = Warmup([WarmupStep("db_pool", step)], retry_interval=0)
+    monkeypatch.setattr(api, "_warmup", warmup)
+    client = api.create_app().test_client()
+
+    response = client.get('/api/system/ready')
+    assert response.status_code == 503
+    assert response.get_json()["startup"]["state"] == STATE_PENDING
+
+    warmup.run()
+    response = client.get('/api/system/ready')
+    assert response.status_code == 200
+    assert response.get_json()["startup"]["steps"]["db_pool"]["attempts"] == 2
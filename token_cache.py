@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """
+    [PERF] 已验证 JWT 的 LRU 缓存。
+    key 为 token 的 SHA-256 摘要 (不在内存中保留原始 token)，value 为解码后的 claims。
+    命中时跳过 HMAC 签名验证；过期的条目在读取时被丢弃。
+    同时维护按用户的吊销时间：在吊销时间之前签发的 token 一律视为无效。
+    """
+    def __init__(self, max_size=10000, max_token_age=24 * 3600):
+        self.max_size = max_size
+        self.max_token_age = max_token_age # token 有效期；超过该时间的吊销记录可以删除
+        self._entries = OrderedDict() # digest -> claims
+        self._by_user = {} # user_id -> set(digest)
+        self._revoked = {} # user_id -> 吊销时间 (time.time())
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "revocations": 0}
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def _remove(self, digest):
+        """删除一个条目 (需持有锁)"""
+        claims = self._entries.pop(digest, None)
+        if claims is not None:
+            digests = self._by_user.get(claims.get('user_id'))
+            if digests is not None:
+                digests.discard(digest)
+                if not digests:
+                    del self._by_user[claims.get('user_id')]
+
+    def get(self, token):
+        """返回缓存的 claims；未命中或已过期返回 None"""
+        digest = self._digest(token)
+        with self._lock:
+            claims = self._entries.get(digest)
+            if claims is not None and claims.get('exp', 0) <= time.time():
+                self._remove(digest)
+                claims = None
+            if claims is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._stats["hits"] += 1
+            return claims
+
+    def put(self, token, claims):
+        if 'exp' not in claims or self.is_revoked(claims):
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = claims
+            self._entries.move_to_end(digest)
+            self._by_user.setdefault(claims.get('user_id'), set()).add(digest)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def revoke_user(self, user_id):
+        """吊销该用户当前所有的 token (例如登出或修改密码)，并从缓存中删除"""
+        now = time.time()
+        with self._lock:
+            # 吊销之前签发的 token 最迟在 max_token_age 后过期，届时吊销记录已无意义
+            for uid, revoked_at in list(self._revoked.items()):
+                if now - revoked_at > self.max_token_age:
+                    del self._revoked[uid]
+            self._revoked[user_id] = now
+            for digest in list(self._by_user.get(user_id, ())):
+                self._remove(digest)
+            self._stats["revocations"] += 1
+
+    def is_revoked(self, claims):
+        revoked_at = self._revoked.get(claims.get('user_id'))
+        if revoked_at is None:
+            return False
+        # 旧 token 没有 iat，只要该用户有吊销记录就视为无效
+        return claims.get('iat', 0) <= revoked_at
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["size"] = len(self._entries)
+            data["max_size"] = self.max_size
+            data["revoked_users"] = len(self._revoked)
+        return data
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    [PERF] 线程安全的进程内缓存：条目在 ttl 秒后过期，超过 max_size 时淘汰最久未使用的条目。
+    """
+    _MISSING = object()
+
+    def __init__(self, ttl, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict() # key -> (expires_at, stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        """返回 (value, stored_at)；未命中或已过期返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[1]
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，返回写入时间 (time.time())"""
+        now = time.monotonic()
+        stored_at = time.time()
+        with self._lock:
+            self._data[key] = (now + (self.ttl if ttl is None else ttl), stored_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return stored_at
+
+    def get_or_load(self, key, loader):
+        """读穿透：未命中时调用 loader() 并缓存结果，返回 (value, stored_at)"""
+        entry = self.get_entry(key)
+        if entry is not None:
+            return entry
+        value = loader()
+        return value, self.set(key, value)
+
+    def invalidate(self, key=_MISSING):
+        """删除一个 key；不传 key 时清空整个缓存"""
+        with self._lock:
+            if key is self._MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,107 @@
+"""
+[NEW] worker 启动预热与就绪状态
+
+gunicorn 在 master 中 preload 应用后 fork 出 worker；每个 worker 在 post_fork 钩子中
+(或没有钩子时在第一个请求时) 启动后台预热线程，依次执行预热步骤，全部完成后才报告就绪。
+
+- 必需的步骤 (如建立数据库连接) 失败时，等待 WARMUP_RETRY_INTERVAL 秒后从该步骤重试，期间保持未就绪
+- 可选的步骤失败只记录错误，不影响就绪
+- 冷启动时间 = 从进程开始 (fork 或导入应用) 到预热完成的时间
+"""
+import os
+import threading
+import time
+
+
+WARMUP_RETRY_INTERVAL = float(os.environ.get('WARMUP_RETRY_INTERVAL', 5.0))
+
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_READY = "ready"
+
+
+class WarmupStep:
+    def __init__(self, name, fn, required=True):
+        self.name = name
+        self.fn = fn
+        self.required = required
+
+
+class Warmup:
+    def __init__(self, steps, started=None, retry_interval=WARMUP_RETRY_INTERVAL):
+        self.pid = os.getpid()
+        self.steps = list(steps)
+        self.started = started if started is not None else time.monotonic() # 冷启动计时的起点
+        self.retry_interval = retry_interval
+        self.state = STATE_PENDING
+        self.run_started = None
+        self.ready_at = None
+        self._results = {} # name -> {"seconds", "ok", "error", "attempts"}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """在后台线程中执行预热 (只执行一次)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = STATE_RUNNING
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_step(self, step):
+        started = time.perf_counter()
+        error = None
+        try:
+            step.fn()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        with self._lock:
+            result = self._results.setdefault(step.name, {"attempts": 0})
+            result["attempts"] += 1
+            result["seconds"] = round(time.perf_counter() - started, 4)
+            result["ok"] = error is None
+            result["error"] = error
+        if error:
+            print(f"预热步骤失败 ({step.name}): {error}")
+        return error is None
+
+    def run(self):
+        self.state = STATE_RUNNING
+        self.run_started = time.monotonic()
+        for step in self.steps:
+            while not self._run_step(step) and step.required:
+                if self._stop.wait(self.retry_interval):
+                    return
+        self.ready_at = time.monotonic()
+        self.state = STATE_READY
+        self._ready.set()
+        stats = self.stats()
+        steps = ", ".join(f"{name} {result['seconds']:.2f}s" for name, result in stats["steps"].items())
+        print(f"worker {self.pid} 就绪: 冷启动 {stats['cold_start_seconds']:.2f}s, "
+              f"预热 {stats['warmup_seconds']:.2f}s ({steps})")
+
+    def stats(self):
+        with self._lock:
+            steps = {name: dict(result) for name, result in self._results.items()}
+        ready_at = self.ready_at
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "pid": self.pid,
+            "cold_start_seconds": round(ready_at - self.started, 4) if ready_at is not None else None,
+            "warmup_seconds": round(ready_at - self.run_started, 4) if ready_at is not None else None,
+            "steps": steps,
+        }